@@ -0,0 +1,285 @@
+import os
+import sys
+import json
+import timeit
+import fnmatch
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+from pathlib import Path
+from typing import Callable
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.environ.setdefault("MEDIA_FOLDER", tempfile.mkdtemp(prefix="ai_chat_bench_media_"))
+
+from synthetic import (  # noqa: E402
+    synthetic_history, synthetic_tools, openai_response, genai_response, stub_openai_client, stub_genai_client,
+)
+
+"""
+Микробенчмарки горячих путей на синтетических данных, без сети.
+
+Что замеряется:
+    convert.*  - _convert_history_from_umf моделей OpenAI (DeepseekChat, KimiK2p6) и Gemini на историях
+                 из 10/100/1000 сообщений, только текст и со смесью медиа, а также ветки (utils.branching),
+                 начало которых уже сконвертировано;
+    parse.*    - разбор ответа провайдера (_parse_response) и generate целиком с заглушкой клиента;
+    tools.*    - схемы ToolsParser для 10/100/1000 инструментов: cold - с пустым кэшем схем, warm - из кэша;
+    umf.*      - JSON УФС туда и обратно (model_dump_json / model_validate_json) и load_chat из файла;
+    ids.*, b64.* - MessageHelper.generate_id и base64-хелперы.
+
+Каждый замер - timeit.autorange (не меньше 0.2 с на повтор), затем несколько повторов, в отчёт идут минимум и медиана
+времени одного вызова. Результаты сохраняются в benchmarks/results/<коммит>.json, чтобы сравнивать коммиты.
+Замеры зависят от машины, поэтому папка results в .gitignore и в репозиторий не попадает.
+
+Запуск из корня репозитория:
+    python benchmarks/hot_paths.py                          # все замеры, результат в benchmarks/results/
+    python benchmarks/hot_paths.py -k 'convert.*' --quick   # часть замеров, меньше повторов и размеров
+    python benchmarks/hot_paths.py --compare benchmarks/results/abc1234.json --threshold 1.2
+                                                            # код возврата 1, если что-то стало медленнее в 1.2 раза
+"""
+
+RESULTS_DIR = ROOT / "benchmarks" / "results"
+
+SIZES = (10, 100, 1000)
+QUICK_SIZES = (10, 100)
+
+# Имя замера -> функция, которая готовит данные и возвращает замеряемый вызов
+Case = Callable[[], Callable[[], object]]
+
+
+def _openai_model(name: str):
+    from models.openai.deepseek import DeepseekChat
+    from models.openai.kimi import KimiK2p6
+
+    model = {"deepseek": DeepseekChat, "kimi": KimiK2p6}[name](api_key="bench")
+    model.client = stub_openai_client(openai_response())
+    model.coalesce_requests = False
+    return model
+
+
+def _genai_model():
+    from models.genai.gemini import Gemini3_1FlashLite
+
+    model = Gemini3_1FlashLite(api_key="bench")
+    model.client = stub_genai_client(genai_response())
+    model.coalesce_requests = False
+    return model
+
+
+def _generate(model, history) -> Callable[[], object]:
+    length = len(history.messages)
+
+    def run():
+        model.generate(history, None, {})
+        del history.messages[length:]  # Ответ и результаты инструментов не копятся между вызовами
+
+    return run
+
+
+def build_cases(sizes: tuple[int, ...]) -> dict[str, Case]:
+    cases: dict[str, Case] = {}
+
+    for size in sizes:
+        for media in ("text", "mixed"):
+            for name in ("deepseek", "kimi"):
+                # DeepSeek не принимает медиа, поэтому смесь имеет смысл только для Kimi
+                if name == "deepseek" and media == "mixed":
+                    continue
+                cases[f"convert.openai.{name}.{media}.{size}"] = (
+                    lambda name=name, media=media, size=size: (
+                        lambda model=_openai_model(name), history=synthetic_history(size, media):
+                        model._convert_history_from_umf(history)
+                    )
+                )
+            cases[f"convert.genai.{media}.{size}"] = (
+                lambda media=media, size=size: (
+                    lambda model=_genai_model(), history=synthetic_history(size, media):
+                    model._convert_history_from_umf(history)
+                )
+            )
+
+    for size in sizes:
+        def branched(provider, size=size):
+            from utils.branching import ConversationTree
+
+            # Ветка от уже сконвертированного чата: общее начало берётся из кэша конвертации дерева
+            tree = ConversationTree.from_chat(synthetic_history(size))
+            model = _openai_model("deepseek") if provider == "openai" else _genai_model()
+            model._convert_history_from_umf(tree["main"].history())
+            branch = tree["main"].fork("bench")
+            return lambda: model._convert_history_from_umf(branch.history())
+
+        cases[f"convert.openai.deepseek.branch.{size}"] = lambda branched=branched: branched("openai")
+        cases[f"convert.genai.branch.{size}"] = lambda branched=branched: branched("genai")
+
+    cases["parse.openai"] = lambda: (
+        lambda model=_openai_model("deepseek"), response=openai_response(): model._parse_response(response, 0)
+    )
+    cases["parse.genai"] = lambda: (
+        lambda model=_genai_model(), response=genai_response(): model._parse_response(response)
+    )
+    cases["parse.openai.generate.10"] = lambda: _generate(_openai_model("deepseek"), synthetic_history(10))
+    cases["parse.genai.generate.10"] = lambda: _generate(_genai_model(), synthetic_history(10))
+
+    for count in sizes:
+        for provider in ("openai", "genai"):
+            def schema(provider=provider, count=count, cold=True):
+                from utils.tools_parser import ToolsParser
+
+                tools = synthetic_tools(count)
+                get = (ToolsParser.get_json_schema_openai if provider == "openai"
+                       else ToolsParser.get_types_schema_genai)
+
+                def run():
+                    if cold:
+                        ToolsParser._schema_cache.clear()
+                    return get(tools=tools)
+
+                run()
+                return run
+
+            cases[f"tools.schema.{provider}.cold.{count}"] = schema
+            cases[f"tools.schema.{provider}.warm.{count}"] = lambda schema=schema: schema(cold=False)
+
+    for size in sizes:
+        for media in ("text", "mixed"):
+            def dump(size=size, media=media):
+                history = synthetic_history(size, media)
+                return history.model_dump_json
+
+            def roundtrip(size=size, media=media):
+                import utils.types as t
+
+                data = synthetic_history(size, media).model_dump_json()
+                return lambda: t.ChatData.model_validate_json(data)
+
+            def load(size=size, media=media):
+                from utils.umf_loader import load_chat
+
+                path = Path(tempfile.mkdtemp(prefix="ai_chat_bench_")) / "chat.json"
+                path.write_text(synthetic_history(size, media).model_dump_json(), encoding="utf-8")
+                return lambda: load_chat(str(path))
+
+            cases[f"umf.dump.{media}.{size}"] = dump
+            cases[f"umf.validate.{media}.{size}"] = roundtrip
+            cases[f"umf.load_chat.{media}.{size}"] = load
+
+    def generate_id():
+        from config import settings
+        from utils.small_utils.messages_helper import MessageHelper
+
+        # Отдельный экземпляр: общий message_helper не должен распухать от замера
+        helper = MessageHelper()
+        return lambda: helper.generate_id(settings.MESSAGE_ID_LEN)
+
+    cases["ids.generate_id"] = generate_id
+
+    def b64(direction: str):
+        from utils.small_utils import bytes_to_string, string_to_bytes
+
+        data = os.urandom(1024 * 1024)
+        if direction == "encode":
+            return lambda: bytes_to_string(data)
+        encoded = bytes_to_string(data)
+        return lambda: string_to_bytes(encoded)
+
+    cases["b64.encode.1mb"] = lambda: b64("encode")
+    cases["b64.decode.1mb"] = lambda: b64("decode")
+    return cases
+
+
+def measure(run: Callable[[], object], repeats: int) -> dict:
+    """
+    Время одного вызова: число вызовов подбирается timeit.autorange, затем repeats повторов
+    :return: {"min_us", "median_us", "loops"}
+    """
+    timer = timeit.Timer(run)
+    loops, _ = timer.autorange()
+    times = [timer.timeit(loops) / loops for _ in range(repeats)]
+    return {"min_us": min(times) * 1e6, "median_us": statistics.median(times) * 1e6, "loops": loops}
+
+
+def _git_commit() -> str | None:
+    result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                           capture_output=True, text=True).stdout.strip()
+    return result.stdout.strip() + ("-dirty" if dirty else "")
+
+
+def compare(results: dict, baseline_path: Path, threshold: float) -> bool:
+    """
+    Печатает отношение к сохранённому прогону
+    :return: True, если какой-то замер медленнее базового больше чем в threshold раз
+    """
+    baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+    print(f"\nСравнение с {baseline_path.name} (коммит {baseline.get('commit')}):")
+    regressed = False
+    for name, result in results["cases"].items():
+        base = baseline["cases"].get(name)
+        if base is None:
+            continue
+        ratio = result["min_us"] / base["min_us"]
+        slower = ratio > threshold
+        regressed |= slower
+        mark = "  РЕГРЕССИЯ" if slower else ""
+        print(f"{name:<44} {base['min_us']:12.1f} -> {result['min_us']:12.1f} мкс  x{ratio:5.2f}{mark}")
+    return regressed
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Микробенчмарки горячих путей")
+    parser.add_argument("-k", dest="patterns", action="append", default=[],
+                        help="Маска имён замеров (fnmatch), можно несколько")
+    parser.add_argument("--quick", action="store_true", help="Без размера 1000 и с меньшим числом повторов")
+    parser.add_argument("--repeats", type=int, default=None)
+    parser.add_argument("--list", action="store_true", help="Только перечислить замеры")
+    parser.add_argument("--output", type=Path, default=None,
+                        help="Файл результата (по умолчанию benchmarks/results/<коммит>.json)")
+    parser.add_argument("--no-save", action="store_true")
+    parser.add_argument("--compare", type=Path, default=None, help="Сравнить с сохранённым результатом")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="Во сколько раз замер может замедлиться относительно --compare")
+    args = parser.parse_args(argv)
+
+    cases = build_cases(QUICK_SIZES if args.quick else SIZES)
+    if args.patterns:
+        cases = {name: case for name, case in cases.items()
+                 if any(fnmatch.fnmatch(name, pattern) for pattern in args.patterns)}
+    if args.list:
+        print("\n".join(cases))
+        return 0
+    repeats = args.repeats or (3 if args.quick else 7)
+
+    commit = _git_commit()
+    results = {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "quick": args.quick,
+        "repeats": repeats,
+        "cases": {},
+    }
+    for name, case in cases.items():
+        result = measure(case(), repeats)
+        results["cases"][name] = result
+        print(f"{name:<44} {result['min_us']:12.1f} мкс  (медиана {result['median_us']:.1f}, x{result['loops']})")
+
+    if not args.no_save:
+        output = args.output or RESULTS_DIR / f"{commit or 'unknown'}.json"
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(results, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"\nРезультат: {output}")
+
+    if args.compare is not None and compare(results, args.compare, args.threshold):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
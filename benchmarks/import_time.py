@@ -0,0 +1,103 @@
+import os
+import re
+import sys
+import argparse
+import subprocess
+from pathlib import Path
+
+"""
+Замер времени импорта основных модулей и проверка бюджета.
+
+Каждая цель импортируется в отдельном процессе с python -X importtime несколько раз, берётся минимум
+(он меньше всего зависит от шума). Из результата вычитаются модули, которые интерпретатор грузит и без нас
+(python -c pass). Кроме времени проверяется, что модуль не тянет чужой SDK: модель DeepSeek не должна
+загружать google-genai, модель Gemini - openai, а парсер инструментов и веб-обёртка - ни один из них.
+
+Запуск из корня репозитория:
+    python benchmarks/import_time.py            # таблица и код возврата 1, если бюджет превышен
+    python benchmarks/import_time.py --top 15   # плюс самые дорогие модули каждой цели
+"""
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Цель: (бюджет в мс, модули, которые не должны загружаться)
+TARGETS: dict[str, tuple[float, tuple[str, ...]]] = {
+    "config": (50, ("pydantic_settings",)),
+    "utils.types": (400, ("openai", "google.genai")),
+    "models": (500, ("openai", "google.genai")),
+    "utils.tools_parser": (600, ("openai", "google.genai")),
+    "web_api_wrapper": (800, ("openai", "google.genai")),
+    "models.openai.deepseek": (1500, ("google.genai",)),
+    "models.genai.gemini": (1500, ("openai",)),
+}
+
+_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$")
+
+
+def _import_times(code: str) -> dict[str, tuple[int, int]]:
+    """
+    Один запуск интерпретатора с -X importtime
+    :return: {модуль: (собственное время мкс, накопленное время мкс)}
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(ROOT), os.environ.get("PYTHONPATH")])))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"python -c {code!r} завершился с ошибкой:\n{result.stderr[-2000:]}")
+    times = {}
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            times[match.group(4)] = (int(match.group(1)), int(match.group(2)))
+    return times
+
+
+def measure(target: str, repeats: int = 5) -> tuple[float, dict[str, tuple[int, int]]]:
+    """
+    Время импорта цели без учёта модулей, загружаемых самим интерпретатором
+    :return: (минимальное время мс, модули лучшего запуска)
+    """
+    baseline = set(_import_times("pass"))
+    best_ms, best_modules = float("inf"), {}
+    for _ in range(repeats):
+        modules = {name: value for name, value in _import_times(f"import {target}").items() if name not in baseline}
+        total_ms = sum(self_us for self_us, _ in modules.values()) / 1000
+        if total_ms < best_ms:
+            best_ms, best_modules = total_ms, modules
+    return best_ms, best_modules
+
+
+def _loaded(modules: dict, package: str) -> bool:
+    return any(name == package or name.startswith(package + ".") for name in modules)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Бюджет времени импорта")
+    parser.add_argument("targets", nargs="*", help="Модули для замера (по умолчанию все из TARGETS)")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--top", type=int, default=0, help="Показать N самых дорогих модулей каждой цели")
+    parser.add_argument("--budget-scale", type=float, default=1.0, help="Множитель бюджета для медленных машин")
+    args = parser.parse_args(argv)
+
+    failed = False
+    for target in args.targets or TARGETS:
+        budget_ms, forbidden = TARGETS.get(target, (float("inf"), ()))
+        budget_ms *= args.budget_scale
+        total_ms, modules = measure(target, args.repeats)
+        problems = [f"загружен {package}" for package in forbidden if _loaded(modules, package)]
+        if total_ms > budget_ms:
+            problems.append(f"бюджет {budget_ms:.0f} мс")
+        failed |= bool(problems)
+        status = "FAIL: " + ", ".join(problems) if problems else "ok"
+        print(f"{target:<28} {total_ms:8.1f} мс  {len(modules):5d} модулей  {status}")
+        if args.top:
+            heaviest = sorted(modules.items(), key=lambda item: item[1][1], reverse=True)[:args.top]
+            for name, (_, cumulative_us) in heaviest:
+                print(f"    {name:<60} {cumulative_us / 1000:8.1f} мс")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,227 @@
+import json
+import random
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Literal
+
+import utils.types as t
+from utils.small_utils import bytes_to_string
+
+"""
+Синтетические данные для бенчмарков: истории УФС заданной длины и состава, ответы провайдеров и заглушки клиентов.
+
+Всё детерминировано (random.Random(seed)), поэтому замеры разных коммитов сравнимы. Заглушки не ходят в сеть:
+загрузки в Google Files API и Kimi возвращают готовые объекты, а загруженные ранее ассеты имеют свежий expires_at.
+"""
+
+MediaMix = Literal["text", "mixed"]
+
+_WORDS = (
+    "модель история сообщение инструмент результат запрос ответ файл изображение документ кэш токен "
+    "provider request response schema tool call argument image video audio summary context window"
+).split()
+
+_UPLOADED_VIDEO_BYTES = 30 * 1024 * 1024  # Больше лимита inline, поэтому идёт ссылкой на загрузку
+
+
+def _text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(words))
+
+
+def _timestamp(index: int) -> datetime:
+    return datetime(2026, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=index)
+
+
+def _image_asset(rng: random.Random, index: int) -> t.Asset:
+    # Не настоящий PNG: нормализатор не сможет его перекодировать и отправит как есть, без Pillow в замере
+    data = rng.randbytes(rng.randint(2_000, 40_000))
+    return t.Asset(id=f"img{index}", type="image", local_path=f"/nonexistent/img{index}.png", mime_type="image/png",
+                   size_bytes=len(data), data_base64=bytes_to_string(data))
+
+
+def _document_asset(rng: random.Random, index: int) -> t.Asset:
+    # Текст уже извлечён (Asset.ocr_text), как у документа, который отправлялся раньше: модели OpenAI берут его,
+    # Gemini получает сам файл
+    data = b"%PDF-1.4\n" + rng.randbytes(rng.randint(5_000, 50_000))
+    return t.Asset(id=f"doc{index}", type="document", local_path=f"/nonexistent/doc{index}.pdf",
+                   mime_type="application/pdf", size_bytes=len(data), data_base64=bytes_to_string(data),
+                   ocr_text=_text(rng, 600))
+
+
+def _uploaded_video_asset(index: int) -> t.Asset:
+    expires_at = datetime.now(timezone.utc) + timedelta(hours=40)
+    return t.Asset(
+        id=f"vid{index}", type="video", local_path=f"/nonexistent/vid{index}.mp4", mime_type="video/mp4",
+        size_bytes=_UPLOADED_VIDEO_BYTES,
+        cloud_refs=t.CloudRefs(genai=t.CloudRef(
+            filename=f"files/vid{index}", uri=f"https://generativelanguage.googleapis.com/v1beta/files/vid{index}",
+            expires_at=expires_at,
+        )),
+    )
+
+
+def _media(rng: random.Random, index: int) -> t.MediaContent:
+    roll = rng.random()
+    if roll < 0.6:
+        asset = _image_asset(rng, index)
+    elif roll < 0.9:
+        asset = _document_asset(rng, index)
+    else:
+        asset = _uploaded_video_asset(index)
+    return t.MediaContent(assets=[asset])
+
+
+def synthetic_history(messages: int, media: MediaMix = "text", seed: int = 0) -> t.ChatData:
+    """
+    История из повторяющихся ходов: пользователь, ассистент с мыслями и вызовом инструмента,
+    результат инструмента, ответ ассистента
+    :param messages: число сообщений (без системного)
+    :param media: "text" - только текст, "mixed" - каждое третье сообщение пользователя с изображением,
+        документом или загруженным видео
+    :param seed: зерно генератора
+    """
+    rng = random.Random(seed)
+    history = t.ChatData(
+        chat_metadata=t.ChatMetadata(config=t.ChatConfig(thinking_mode="preserved")),
+        messages=[t.Message(id="sys", timestamp=_timestamp(0), role="system",
+                            content=[t.TextContent(text=_text(rng, 80))])],
+    )
+    index = 0
+    while len(history.messages) <= messages:
+        turn = index // 4
+        kind = index % 4
+        index += 1
+        message_id = f"m{index}"
+        if kind == 0:
+            content = [t.TextContent(text=_text(rng, rng.randint(10, 120)))]
+            if media == "mixed" and turn % 3 == 0:
+                content.append(_media(rng, turn))
+            message = t.Message(id=message_id, timestamp=_timestamp(index), role="user", content=content)
+        elif kind == 1:
+            call = t.ToolCall(id=f"call{turn}", name="search_docs",
+                              args={"query": _text(rng, 6), "limit": rng.randint(1, 20), "filters": {"lang": "ru"}})
+            message = t.Message(id=message_id, timestamp=_timestamp(index), role="assistant", content=[
+                t.ThoughtContent(text=_text(rng, rng.randint(20, 200)), signature=bytes_to_string(rng.randbytes(64))),
+                t.TextContent(text=_text(rng, 20)),
+                t.ToolCallContent(tool_call=call),
+            ])
+        elif kind == 2:
+            result = t.ToolResult(id=f"call{turn}", name="search_docs", text_content=json.dumps(
+                [{"title": _text(rng, 5), "snippet": _text(rng, 40)} for _ in range(5)], ensure_ascii=False))
+            message = t.Message(id=message_id, timestamp=_timestamp(index), role="tool",
+                                content=[t.ToolResultContent(tool_result=result)])
+        else:
+            message = t.Message(id=message_id, timestamp=_timestamp(index), role="assistant", content=[
+                t.TextContent(text=_text(rng, rng.randint(40, 400))),
+            ])
+        history.messages.append(message)
+    return history
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Ответы провайдеров
+# ══════════════════════════════════════════════════════════════════════════════
+
+
+def openai_response(tool_calls: int = 3, seed: int = 0):
+    """ChatCompletion с рассуждением, текстом и вызовами инструментов"""
+    from openai.types.chat import ChatCompletion
+
+    rng = random.Random(seed)
+    return ChatCompletion.model_validate({
+        "id": "chatcmpl-bench", "object": "chat.completion", "created": 0, "model": "bench",
+        "choices": [{
+            "index": 0, "finish_reason": "tool_calls" if tool_calls else "stop",
+            "message": {
+                "role": "assistant", "content": _text(rng, 200), "reasoning_content": _text(rng, 300),
+                "tool_calls": [
+                    {"id": f"call{i}", "type": "function", "function": {
+                        "name": "search_docs",
+                        "arguments": json.dumps({"query": _text(rng, 6), "limit": 5}, ensure_ascii=False),
+                    }}
+                    for i in range(tool_calls)
+                ] or None,
+            },
+        }],
+        "usage": {"prompt_tokens": 12000, "completion_tokens": 800, "total_tokens": 12800,
+                  "prompt_cache_hit_tokens": 11000, "prompt_cache_miss_tokens": 1000},
+    })
+
+
+def genai_response(tool_calls: int = 3, seed: int = 0):
+    """GenerateContentResponse с подписанной мыслью, текстом и вызовами функций"""
+    from google.genai import types
+
+    rng = random.Random(seed)
+    parts = [
+        types.Part(text=_text(rng, 300), thought=True, thought_signature=rng.randbytes(64)),
+        types.Part(text=_text(rng, 200)),
+    ]
+    parts += [
+        types.Part(function_call=types.FunctionCall(id=f"call{i}", name="search_docs",
+                                                    args={"query": _text(rng, 6), "limit": 5}))
+        for i in range(tool_calls)
+    ]
+    return types.GenerateContentResponse(
+        candidates=[types.Candidate(content=types.Content(role="model", parts=parts))],
+        usage_metadata=types.GenerateContentResponseUsageMetadata(
+            prompt_token_count=12000, candidates_token_count=800, total_token_count=12800,
+        ),
+    )
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Заглушки клиентов
+# ══════════════════════════════════════════════════════════════════════════════
+
+
+def stub_genai_client(response=None):
+    """
+    Клиент Google GenAI без сети: список файлов пуст, загрузка не требуется (у ассетов свежий expires_at)
+    :param response: ответ models.generate_content
+    """
+    def unavailable(**kwargs):
+        raise RuntimeError("Бенчмарк не должен обращаться к Google Files API")
+
+    return SimpleNamespace(
+        files=SimpleNamespace(list=lambda: [], get=unavailable, upload=unavailable),
+        models=SimpleNamespace(generate_content=lambda **kwargs: response),
+    )
+
+
+def stub_openai_client(response=None):
+    """
+    Клиент OpenAI без сети: files.create возвращает готовый объект
+    :param response: ответ chat.completions.create
+    """
+    return SimpleNamespace(
+        base_url="https://bench.invalid/v1",
+        files=SimpleNamespace(create=lambda **kwargs: SimpleNamespace(id="file-bench")),
+        chat=SimpleNamespace(completions=SimpleNamespace(create=lambda **kwargs: response)),
+    )
+
+
+def synthetic_tools(count: int) -> list:
+    """
+    Функции-инструменты с docstring и аннотациями, как у зарегистрированных через register_tool,
+    но без регистрации (передаются в ToolsParser через tools=)
+    """
+    tools = []
+    for index in range(count):
+        namespace = {"Literal": Literal}
+        exec(
+            f"def tool_{index}(query: str, limit: int = 10, mode: Literal['fast', 'full'] = 'fast',\n"
+            f"           tags: list[str] | None = None, weights: dict[str, float] | None = None) -> str:\n"
+            f"    '''Synthetic tool number {index} that searches something.\n\n"
+            f"    :param query: Search query.\n"
+            f"    :param limit: Maximum number of results.\n"
+            f"    :param mode: Search mode.\n"
+            f"    :param tags: Optional tags.\n"
+            f"    :param weights: Optional field weights.\n"
+            f"    :return: Results.\n"
+            f"    '''\n"
+            f"    return query\n",
+            namespace,
+        )
+        tools.append(namespace[f"tool_{index}"])
+    return tools
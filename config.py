@@ -1,41 +1,92 @@
 # --- AI generated file ---
 
-from pydantic_settings import BaseSettings, SettingsConfigDict
+from functools import lru_cache
+from typing import Literal
 
+"""
+Настройки создаются лениво: pydantic_settings импортируется, а .env читается при первом обращении к settings.
+Ключи API необязательны, каждая модель проверяет только свой ключ (settings.require), поэтому для работы
+с одним провайдером достаточно задать один ключ.
+"""
 
-class Settings(BaseSettings):
-    """
-    Класс настроек приложения.
-    Pydantic автоматически подтянет значения из переменных окружения
-    или из .env файла, если они там определены.
-    """
 
-    # Ключи API для различных сервисов
-    GEMINI_API_KEY: str
-    OPENAI_API_KEY: str
-    DEEPSEEK_API_KEY: str
-    GLM_API_KEY: str
-    KIMI_API_KEY: str
+@lru_cache(maxsize=None)
+def _settings_class():
+    from pydantic_settings import BaseSettings, SettingsConfigDict
 
-    # Настройки OpenRouter
-    OPENROUTER_API_KEY: str
-    OPENROUTER_API_SECRET: str
-    OPENROUTER_MODEL: str = "xiaomi/mimo-v2-flash:free"
+    class Settings(BaseSettings):
+        """
+        Класс настроек приложения.
+        Pydantic автоматически подтянет значения из переменных окружения
+        или из .env файла, если они там определены.
+        """
 
-    # Настройки системы
-    SYSTEM_PROMPT: str
-    MEDIA_FOLDER: str = "media"
-    MESSAGE_ID_LEN: int = 10
-    ASSET_ID_LEN: int = 10
+        # Ключи API для различных сервисов
+        GEMINI_API_KEY: str | None = None
+        OPENAI_API_KEY: str | None = None
+        DEEPSEEK_API_KEY: str | None = None
+        GLM_API_KEY: str | None = None
+        KIMI_API_KEY: str | None = None
 
+        # Настройки OpenRouter
+        OPENROUTER_API_KEY: str | None = None
+        OPENROUTER_API_SECRET: str | None = None
+        OPENROUTER_MODEL: str = "xiaomi/mimo-v2-flash:free"
 
-    # Конфигурация Pydantic Settings
-    model_config = SettingsConfigDict(
-        env_file=".env",  # Путь к файлу с переменными окружения
-        env_file_encoding="utf-8",
-        extra="ignore",  # Игнорировать лишние переменные в .env
-    )
+        # Настройки системы
+        SYSTEM_PROMPT: str = ""
+        MEDIA_FOLDER: str = "media"
+        MESSAGE_ID_LEN: int = 10
+        ASSET_ID_LEN: int = 10
+
+        # Фоновая запись медиафайлов (utils.media.media_writer)
+        MEDIA_WRITE_WORKERS: int = 4
+        MEDIA_FSYNC: Literal["never", "file", "always"] = "file"
+
+        # Пул процессов для инструментов с executor="process"
+        TOOL_PROCESS_WORKERS: int | None = None  # None - по числу ядер
+        TOOL_PROCESS_MAX_CALLS: int = 100  # Перезапуск воркера после N вызовов
+        TOOL_PROCESS_MAX_MEMORY_MB: int = 1024  # Пересоздание пула, если воркер превысил порог памяти
+
+
+        # Конфигурация Pydantic Settings
+        model_config = SettingsConfigDict(
+            env_file=".env",  # Путь к файлу с переменными окружения
+            env_file_encoding="utf-8",
+            extra="ignore",  # Игнорировать лишние переменные в .env
+        )
+
+        def require(self, name: str) -> str:
+            """Возвращает обязательную для конкретной модели настройку или объясняет, какой переменной не хватает"""
+            value = getattr(self, name)
+            if not value:
+                raise RuntimeError(f"Не задана переменная окружения {name} (в окружении или в .env)")
+            return value
+
+    return Settings
+
+
+@lru_cache(maxsize=None)
+def get_settings():
+    """Возвращает экземпляр настроек, создавая его при первом вызове"""
+    return _settings_class()()
+
+
+class _LazySettings:
+    """Прокси для глобальных настроек: все обращения передаются экземпляру из get_settings()"""
+
+    def __getattr__(self, name):
+        return getattr(get_settings(), name)
+
+    def __setattr__(self, name, value):
+        setattr(get_settings(), name, value)
+
+
+def __getattr__(name):
+    if name == "Settings":
+        return _settings_class()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 # Создаем глобальный экземпляр настроек
-settings = Settings()
+settings = _LazySettings()
@@ -1,5 +1,22 @@
+import importlib
+
 from .base_model import BaseModel
-from .genai_base_model import GenaiBaseModel
-from .openai_base_model import OpenAiBaseModel
 
-__all__ = ['BaseModel', 'GenaiBaseModel', 'OpenAiBaseModel']
\ No newline at end of file
+# Базовые классы провайдеров тянут за собой свои SDK (google-genai, openai), поэтому импортируются
+# только при первом обращении: from models import OpenAiBaseModel не загружает google-genai
+_LAZY_ATTRS = {
+    'GenaiBaseModel': '.genai_base_model',
+    'OpenAiBaseModel': '.openai_base_model',
+}
+
+
+def __getattr__(name):
+    module_name = _LAZY_ATTRS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
+
+
+__all__ = ['BaseModel', 'GenaiBaseModel', 'OpenAiBaseModel']
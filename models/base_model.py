@@ -1,7 +1,53 @@
+import asyncio
 from abc import ABC, abstractmethod
+from typing import Callable, Awaitable
 import utils.types as t
+from utils.small_utils import single_flight, canonical_hash
 
 class BaseModel(ABC):
+    provider = "openai"  # Формат API ("openai" или "genai"), см. ChatConfig.provider
+    vendor: str | None = None  # Кто обслуживает API (общие лимиты запросов), по умолчанию совпадает с provider
+    # Одинаковые одновременные запросы (та же нативная история, инструменты и параметры) выполняются один раз,
+    # и все ожидающие получают разобранный ответ. Отключите для моделей с сэмплированием, где нужны разные ответы
+    coalesce_requests = True
+
     @abstractmethod
-    def generate(self, history: t.ChatData, tools_definition, tools_executable, extra_body: dict) -> tuple[t.ChatData, list[t.Message]]:
-        pass
\ No newline at end of file
+    def generate(self, history: t.ChatData, tools_definition, tools_executable, extra_body: dict = None) -> tuple[t.ChatData, list[t.Message]]:
+        pass
+
+    async def agenerate(self, history: t.ChatData, tools_definition, tools_executable, extra_body: dict = None) -> tuple[t.ChatData, list[t.Message]]:
+        """
+        Асинхронная версия generate. Наследники переопределяют её нативной реализацией,
+        по умолчанию синхронный generate выполняется в отдельном потоке
+        """
+        return await asyncio.to_thread(self.generate, history, tools_definition, tools_executable, extra_body)
+
+    def _request_key(self, *request_parts) -> str:
+        """Ключ объединения запросов: класс и имя модели плюс всё, что уходит к провайдеру"""
+        return canonical_hash((type(self).__module__, type(self).__qualname__, getattr(self, "model_name", None),
+                               *request_parts))
+
+    @staticmethod
+    def _copy_parsed(parsed: tuple[t.Message, list[tuple[t.ToolCall, str | None]]]):
+        """Копия разобранного ответа для ведомого запроса: сообщение попадёт в другую историю"""
+        message, tool_calls = parsed
+        message = message.model_copy(deep=True)
+        copied_calls = [content.tool_call for content in message.content if content.type == "tool_call"]
+        return message, [(tool_call, args_error) for tool_call, (_, args_error) in zip(copied_calls, tool_calls)]
+
+    def _coalesced(self, request: Callable[[], tuple], *request_parts) -> tuple[t.Message, list]:
+        """
+        Выполняет запрос с разбором ответа или ждёт такой же, уже выполняющийся (см. coalesce_requests)
+        :param request: запрос и разбор ответа -> (сообщение ассистента, вызовы инструментов)
+        :param request_parts: всё, что уходит к провайдеру (для ключа объединения)
+        """
+        if not self.coalesce_requests:
+            return request()
+        parsed, leader = single_flight.do(self._request_key(*request_parts), request)
+        return parsed if leader else self._copy_parsed(parsed)
+
+    async def _acoalesced(self, request: Callable[[], Awaitable[tuple]], *request_parts) -> tuple[t.Message, list]:
+        if not self.coalesce_requests:
+            return await request()
+        parsed, leader = await single_flight.ado(self._request_key(*request_parts), request)
+        return parsed if leader else self._copy_parsed(parsed)
@@ -1,8 +1,7 @@
-import os
 import time
-import mimetypes
+import asyncio
+from datetime import datetime, timezone
 from typing import Dict, Callable, List
-import filetype
 
 from google import genai
 from google.genai import types, errors
@@ -11,10 +10,16 @@ from config import settings
 from utils.small_utils import (
     message_helper,
     generate_timestamp,
-    string_to_bytes,
     bytes_to_string,
-    file_to_bytes
 )
+from utils.converters import umf_to_genai
+from utils.summarizer import summarized_view
+from utils.tracing import tracer
+from utils.tool_runner import run_tool, arun_tool, save_media_asset, INLINE_MEDIA_LIMIT
+from utils.media import asset_bytes, media_writer, genai_uploads, GenaiUpload, GENAI_IMAGE_PROFILE
+from utils.media.genai_uploads import account_key as genai_upload_account, content_hash
+from utils.small_utils import single_flight
+from utils.umf_loader import iter_message_assets
 from .base_model import BaseModel
 import utils.types as t
 
@@ -25,11 +30,17 @@ class GenaiBaseModel(BaseModel):
     Все модели принимают историю в УФС, затем конвертируют его в нужный для себя формат, делают запрос, конвертируют обратно и возвращают.
     """
 
+    provider = "genai"
+    image_profile = GENAI_IMAGE_PROFILE  # Под этот профиль приводятся изображения перед отправкой
+
     def __init__(
-            self, model_name, is_reasoning=False, include_thoughts=True, reasoning_effort="medium", system_prompt=""
+            self, model_name, is_reasoning=False, include_thoughts=True, reasoning_effort="medium", system_prompt="",
+            api_key=None,
     ):
         self.model_name = model_name
-        self.client = genai.Client(api_key=settings.GEMINI_API_KEY)
+        api_key = api_key or settings.require("GEMINI_API_KEY")
+        self.client = genai.Client(api_key=api_key)
+        self.uploads_account = genai_upload_account(api_key)  # Загрузки в genai_uploads общие для моделей проекта
         self.system_prompt = system_prompt
         self.thinking_config = (
             types.ThinkingConfig(
@@ -54,220 +65,228 @@ class GenaiBaseModel(BaseModel):
         Загружает ассет в Google Files API (или берёт уже загруженный) и возвращает
         Asset с заполненными cloud_refs.genai. Для видео/аудио дожидается ACTIVE.
 
+        Сохранённой ссылке доверяем без запроса к API, пока она не скоро истечёт (genai_uploads).
+        Файл с тем же содержимым, уже загруженный из другого ассета, загружается повторно только после истечения.
+
         TODO: если ассет был загружен в GCS, то обновлять его в УФС, чтобы избежать повторной загрузки
         """
         if asset.cloud_refs is None:
             asset.cloud_refs = t.CloudRefs(genai=t.CloudRef())
         elif asset.cloud_refs.genai is None:
             asset.cloud_refs.genai = t.CloudRef()
+        ref = asset.cloud_refs.genai
+        genai_uploads.maybe_reconcile(self.uploads_account, self.client)
+
+        if ref.filename and genai_uploads.is_usable(self.uploads_account, ref.filename, ref.expires_at):
+            ref.last_used_at = datetime.now(timezone.utc)
+            return asset
 
-        filename = asset.cloud_refs.genai.filename
-        try:
-            if filename:
-                file = self.client.files.get(name=filename)
-                asset.cloud_refs.genai.file_object = file
-                return asset
-        except errors.APIError as e:
-            if e.code != 404:
-                raise
-
-        file = self.client.files.upload(file=asset.local_path)
-
-        while file.state.name == "PROCESSING":
-            time.sleep(5)
-            file = self.client.files.get(name=file.name)
-        if file.state.name == "FAILED":
-            raise RuntimeError(f"Обработка файла в Google Files API завершилась ошибкой: {file.error}")
-
-        asset.cloud_refs.genai.filename = file.name
-        asset.cloud_refs.genai.file_object = file
-        asset.cloud_refs.genai.uri = file.uri
-        asset.cloud_refs.genai.expires_at = file.expiration_time
+        if ref.filename and ref.expires_at is None and not genai_uploads.is_missing(ref.filename):
+            # Ссылки, сохранённые без срока жизни, проверяются один раз
+            try:
+                file = self.client.files.get(name=ref.filename)
+            except errors.APIError as e:
+                if e.code != 404:
+                    raise
+                genai_uploads.forget(ref.filename)
+            else:
+                genai_uploads.remember(self.uploads_account, None, file)
+                if genai_uploads.is_fresh(file.expiration_time):
+                    self._set_upload(asset, file)
+                    ref.last_used_at = datetime.now(timezone.utc)
+                    return asset
+
+        digest = content_hash(asset)
+
+        def upload():
+            # Пока ждали, файл с тем же содержимым мог загрузить другой поток
+            return genai_uploads.lookup(self.uploads_account, digest) or self._upload_file(asset, digest)
+
+        uploaded, _ = single_flight.do(f"genai-upload:{self.uploads_account}:{digest}", upload)
+        self._set_upload(asset, uploaded)
+        ref.last_used_at = datetime.now(timezone.utc)
         return asset
 
-    def _convert_history_from_umf(self, history: t.ChatData) -> List[types.Content]:
+    def _upload_file(self, asset: t.Asset, digest: str | None = None):
         """
-        Конвертирует из УФС в нативный для genai формат
-        :param history:
-        :return:
+        Загружает файл ассета в Google Files API, дожидается окончания обработки и запоминает загрузку в genai_uploads
+        :param digest: SHA-256 содержимого, если уже посчитан
         """
-        native_history = []
-
+        with tracer.span("model.process_asset", model=self.model_name, bytes=asset.size_bytes) as span:
+            media_writer.wait(asset.local_path)
+            file = self.client.files.upload(file=asset.local_path)
+
+            polls = 0
+            while file.state.name == "PROCESSING":
+                time.sleep(5)
+                polls += 1
+                file = self.client.files.get(name=file.name)
+            span.set(polls=polls)
+            if file.state.name == "FAILED":
+                raise RuntimeError(f"Обработка файла в Google Files API завершилась ошибкой: {file.error}")
+        genai_uploads.remember(self.uploads_account, digest or content_hash(asset), file)
+        return file
+
+    @staticmethod
+    def _set_upload(asset: t.Asset, file) -> None:
+        """Заполняет cloud_refs.genai из объекта File или записи genai_uploads"""
+        ref = asset.cloud_refs.genai
+        if isinstance(file, GenaiUpload):
+            ref.filename, ref.uri, ref.expires_at, ref.file_object = file.filename, file.uri, file.expires_at, None
+            return
+        ref.filename = file.name
+        ref.file_object = file
+        ref.uri = file.uri
+        ref.expires_at = file.expiration_time
+
+    def _forget_missing_uploads(self, error: errors.APIError, history: t.ChatData) -> bool:
+        """
+        Запрос упал из-за файла, которого нет: проверяет загрузки истории через files.get и забывает те,
+        на которые API ответил 404, чтобы при повторе они загрузились заново
+        :return: нашлись ли пропавшие файлы (есть смысл повторить запрос)
+        """
+        # Gemini сообщает об удалённом файле в запросе кодом 404 или 403 (нет доступа к файлу)
+        if error.code not in (403, 404):
+            return False
+        checked: dict[str, bool] = {}
         for message in history.messages:
-            native_parts = []
-            if message.role == "system":
-                self.system_prompt = message.content[0].text
-            elif message.role == "assistant":
-                preserved_thought_signature = None
-                for content in message.content:
-                    if self.thinking_config and content.type == "thought":
-                        if content.signature:  # Если ответ от модели genai, то есть подпись, и эту CoT можно подать на вход.
-                            # Если мысли не подписаны, то API вернет ошибку
-                            # --- ПРОБЛЕМА --- Начиная с Gemini 3 если не вернуть мысли в цикле ReAct, то API вернёт ошибку 400
-                            # https://ai.google.dev/gemini-api/docs/thought-signatures?hl=ru#model-behavior
-                            preserved_thought_signature = string_to_bytes(content.signature)
-                            native_parts.append(
-                                types.Part(
-                                    thought=True,
-                                    thought_signature=preserved_thought_signature,
-                                    text=content.text,
-                                )
-                            )
-                    elif content.type == "text":
-                        native_parts.append(types.Part(text=content.text))
-                    elif content.type == "tool_call":
-                        native_parts.append(
-                            types.Part(
-                                function_call=types.FunctionCall(
-                                    id=content.tool_call.id,
-                                    args=content.tool_call.args,
-                                    name=content.tool_call.name,
-                                ),
-                                thought_signature=preserved_thought_signature,
-                            )
-                        )
-                        # Забыл, зачем эта строка:preserved_thought_signature = None
-                    elif content.type == "media":
-                        for asset in content.assets:
-                            if asset.size_bytes < 20 * 1024 * 1024:  # Файлы меньше 20 Мб посылаем как строки
-                                if asset.data_base64:
-                                    raw_bytes = string_to_bytes(asset.data_base64)
-                                else:
-                                    raw_bytes = file_to_bytes(asset.local_path)
-                                media_part = types.Part(
-                                    inline_data=types.Blob(
-                                        data=raw_bytes,
-                                        mime_type=asset.mime_type
-                                    )
-                                )
-                            else:  # Файлы больше 20 МБ добавляем как URI, ведущий на google cloud
-                                media_asset = self._process_asset(asset)
-                                media_part = types.Part(
-                                    file_data=types.FileData(
-                                        file_uri=media_asset.cloud_refs.genai.uri,
-                                        mime_type=asset.mime_type
-                                    )
-                                )
-                            native_parts.append(media_part)
-
-                native_history.append(types.Content(role="model", parts=native_parts))
-
-            elif message.role == "tool":
-                for content in message.content:
-                    media_parts = []
-                    tool_part = types.Part(
-                        function_response=types.FunctionResponse(
-                            id=content.tool_result.id,
-                            name=content.tool_result.name,
-                            response={
-                                "output": content.tool_result.text_content,
-                                "error": str(content.tool_result.is_error),
-                            },
-                        )
-                    )
-                    for asset in content.assets or []:
-                        if asset.size_bytes < 20 * 1024 * 1024:  # Файлы меньше 20 Мб посылаем как строки
-                            if asset.data_base64:
-                                raw_bytes = string_to_bytes(asset.data_base64)
-                            else:
-                                raw_bytes = file_to_bytes(asset.local_path)
-                            function_response_part = types.FunctionResponsePart(
-                                inline_data=types.FunctionResponseBlob(
-                                    data=raw_bytes,
-                                    mime_type=asset.mime_type,
-                                )
-                            )
-                        else:  # Файлы больше 20 МБ добавляем как URI, ведущий на google cloud
-                            media_asset = self._process_asset(asset)
-                            function_response_part = types.FunctionResponsePart(
-                                file_data=types.FunctionResponseFileData(
-                                    file_uri=media_asset.cloud_refs.genai.uri,
-                                    mime_type=asset.mime_type,
-                                )
-                            )
-                        media_parts.append(function_response_part)
-                    tool_part.function_response.parts = media_parts
-                    native_parts.append(tool_part)
-
-                native_history.append(
-                    types.Content(
-                        role="user",
-                        parts=native_parts,
-                    )
-                )
-
-            elif message.role == "user":
-                for content in message.content:
-                    if content.type == "text":
-                        native_parts.append(
-                            types.Part(
-                                text=content.text
-                            )
-                        )
-                    elif content.type == "media":  # Если пользователь приложил медиафайл к своему сообщению
-                        media_parts = []
-                        for asset in content.assets:
-                            if asset.size_bytes < 20 * 1024 * 1024:  # Файлы меньше 20 Мб посылаем как строки
-                                if asset.data_base64:
-                                    raw_bytes = string_to_bytes(asset.data_base64)
-                                else:
-                                    raw_bytes = file_to_bytes(asset.local_path)
-                                media_part = types.Part(
-                                    inline_data=types.Blob(
-                                        data=raw_bytes,
-                                        mime_type=asset.mime_type
-                                    )
-                                )
-                            else:  # Файлы больше 20 МБ добавляем как URI, ведущий на google cloud
-                                media_asset = self._process_asset(asset)
-                                media_part = types.Part(
-                                    file_data=types.FileData(
-                                        file_uri=media_asset.cloud_refs.genai.uri,
-                                        mime_type=asset.mime_type
-                                    )
-                                )
-                            media_parts.append(media_part)
-                        native_parts.extend(media_parts)
-                native_history.append(
-                    types.Content(
-                        role="user",
-                        parts=native_parts,
-                    )
-                )
+            for asset in iter_message_assets(message):
+                ref = asset.cloud_refs.genai if asset.cloud_refs else None
+                if ref is None or not ref.filename:
+                    continue
+                if ref.filename not in checked:
+                    try:
+                        self.client.files.get(name=ref.filename)
+                        checked[ref.filename] = False
+                    except errors.APIError as e:
+                        if e.code != 404:
+                            raise
+                        genai_uploads.forget(ref.filename)
+                        checked[ref.filename] = True
+                if checked[ref.filename]:
+                    ref.filename = ref.uri = ref.expires_at = ref.file_object = None
+        return any(checked.values())
+
+    def refresh_upload(self, asset: t.Asset) -> t.Asset:
+        """
+        Загружает ассет заново до истечения срока старой загрузки (см. utils.media.media_gc).
+        Старая загрузка не удаляется: её ещё может использовать запрос, который уже выполняется
+        """
+        if asset.cloud_refs is None:
+            asset.cloud_refs = t.CloudRefs(genai=t.CloudRef())
+        elif asset.cloud_refs.genai is None:
+            asset.cloud_refs.genai = t.CloudRef()
+        digest = content_hash(asset)
+        # Другой чат с тем же файлом мог уже обновить загрузку в этом проходе
+        upload = genai_uploads.lookup(self.uploads_account, digest)
+        if upload is None or upload.filename == asset.cloud_refs.genai.filename:
+            upload = self._upload_file(asset, digest)
+        self._set_upload(asset, upload)
+        return asset
 
-        return native_history
-
-    def _do_request(self, native_history, tools_definition):
-        response = self.client.models.generate_content(
-            model=self.model_name,
-            contents=native_history,
-            config=types.GenerateContentConfig(
-                tools=tools_definition,
-                system_instruction=self.system_prompt,
-                automatic_function_calling=types.AutomaticFunctionCallingConfig(
-                    disable=True
-                ),
-                thinking_config=self.thinking_config,
+    def _get_inline_payload(self, asset: t.Asset) -> tuple[bytes, str] | None:
+        """
+        Возвращает (байты, mime_type) для отправки ассета inline,
+        или None, если ассет слишком большой и его нужно загружать в Google Files API.
+        Изображения предварительно приводятся к профилю провайдера (image_profile).
+        """
+        if asset.type == "image":
+            raw_bytes, mime_type = asset_bytes.get_bytes(asset, self.image_profile)
+            if len(raw_bytes) < INLINE_MEDIA_LIMIT:
+                return raw_bytes, mime_type
+            return None
+        if asset.size_bytes < INLINE_MEDIA_LIMIT:
+            return asset_bytes.get_bytes(asset)
+        return None
+
+    def _upload_asset(self, asset: t.Asset) -> str:
+        """Загружает ассет в Google Files API и возвращает его uri"""
+        return self._process_asset(asset).cloud_refs.genai.uri
+
+    def _convert_history_from_umf(self, history: t.ChatData) -> tuple[List[types.Content], str | None]:
+        """
+        Конвертирует из УФС в нативный для genai формат
+        :param history:
+        :return: (история, системный промпт из истории или None)
+        """
+        history, summary = summarized_view(history)
+        with tracer.span("model.convert_history", model=self.model_name, messages=len(history.messages)) as span:
+            native_history, system_prompt = umf_to_genai(
+                history,
+                send_thoughts=self.thinking_config is not None,
+                inline_payload=self._get_inline_payload,
+                upload=self._upload_asset,
+                system_prompt=self.system_prompt if summary else None,
+                summary=summary,
+                cache=history._conversion_cache,
+            )
+            if span.recording:
+                span.set(payload_bytes=self._payload_bytes(native_history))
+            return native_history, system_prompt
+
+    @staticmethod
+    def _payload_bytes(native_history: List[types.Content]) -> int:
+        """Примерный размер запроса: текст и inline-данные"""
+        size = 0
+        for content in native_history:
+            for part in content.parts or []:
+                if part.text:
+                    size += len(part.text.encode())
+                if part.inline_data and part.inline_data.data:
+                    size += len(part.inline_data.data)
+        return size
+
+    @staticmethod
+    def _usage_attributes(response) -> dict:
+        """Токены из ответа для спана запроса"""
+        usage = getattr(response, "usage_metadata", None)
+        if usage is None:
+            return {}
+        return {
+            "input_tokens": usage.prompt_token_count or 0,
+            "output_tokens": usage.candidates_token_count or 0,
+            "thought_tokens": usage.thoughts_token_count or 0,
+        }
+
+    def _request_config(self, tools_definition, system_prompt=None) -> types.GenerateContentConfig:
+        return types.GenerateContentConfig(
+            tools=tools_definition,
+            system_instruction=system_prompt if system_prompt is not None else self.system_prompt,
+            automatic_function_calling=types.AutomaticFunctionCallingConfig(
+                disable=True
             ),
+            thinking_config=self.thinking_config,
         )
-        return response
-
-    def generate(
-            self,
-            history: t.ChatData,
-            tools_definition,
-            tools_executable: Dict[str, Callable],
-            extra_body: dict,
-    ) -> tuple[t.ChatData, list[t.Message]]:
-        native_history = self._convert_history_from_umf(history)
 
-        response = self._do_request(native_history, tools_definition)
+    def _do_request(self, native_history, tools_definition, system_prompt=None):
+        with tracer.span("model.request", model=self.model_name) as span:
+            response = self.client.models.generate_content(
+                model=self.model_name,
+                contents=native_history,
+                config=self._request_config(tools_definition, system_prompt),
+            )
+            if span.recording:
+                span.set(**self._usage_attributes(response))
+        return response
 
-        new_delta = []
+    async def _ado_request(self, native_history, tools_definition, system_prompt=None):
+        with tracer.span("model.request", model=self.model_name) as span:
+            response = await self.client.aio.models.generate_content(
+                model=self.model_name,
+                contents=native_history,
+                config=self._request_config(tools_definition, system_prompt),
+            )
+            if span.recording:
+                span.set(**self._usage_attributes(response))
+        return response
 
+    def _parse_response(self, response) -> tuple[t.Message, list[tuple[t.ToolCall, str | None]]]:
+        """
+        Конвертирует ответ модели в сообщение ассистента в УФС
+        :return: (сообщение ассистента, вызовы инструментов с ошибкой разбора аргументов или None)
+        """
         tool_calls = []
         content = []
-        # Сначала добавляем в историю ответ модели
         for part in response.candidates[0].content.parts:
             if part.thought:
                 content.append(
@@ -301,26 +320,26 @@ class GenaiBaseModel(BaseModel):
                         tool_call=t.ToolCall(
                             id=part.function_call.id or tool_call_id_fallback,
                             name=part.function_call.name,
-                            args=part.function_call.args,
+                            args=part.function_call.args or {},
                         ),
                     )
                 )
-                tool_calls.append([part.function_call, tool_call_id_fallback])
+                tool_calls.append((content[-1].tool_call, None))  # genai возвращает уже разобранные аргументы
             elif part.inline_data:  # Текущие модели Gemini генерируют только изображение.
                 image = part.as_image()  # Может содержать либо gcs_uri, либо image_bytes
                 if image:
-                    image_id = message_helper.generate_id(settings.ASSET_ID_LEN)
-                    os.makedirs(settings.MEDIA_FOLDER, exist_ok=True)
-                    image_path = f"{settings.MEDIA_FOLDER}/{image_id}.png"  # В доках указано .png
-                    media_asset = t.Asset(
-                        id=image_id,
-                        type="image",
-                        local_path=image_path,
-                        mime_type=image.mime_type or "image/png",
-                    )
+                    mime_type = image.mime_type or "image/png"  # В доках указано .png
                     if image.image_bytes:
-                        image.save(image_path)
-                        media_asset.size_bytes = len(image.image_bytes)
+                        # Файл пишется в фоне, ассет возвращается сразу
+                        media_asset = save_media_asset(image.image_bytes, mime_type)
+                    else:
+                        image_id = message_helper.generate_id(settings.ASSET_ID_LEN)
+                        media_asset = t.Asset(
+                            id=image_id,
+                            type="image",
+                            local_path=media_writer.path_for(image_id, mime_type),
+                            mime_type=mime_type,
+                        )
                     # Код ниже закомментирован, так как в документации нет слов о том,
                     # что сгенерированное nano banana изображение может НЕ содержаться в виде байтов и его надо скачивать
                     # elif image.gcs_uri:
@@ -337,104 +356,103 @@ class GenaiBaseModel(BaseModel):
                 else:  # Непонятно, что ещё кроме изображения может вернуть модель
                     pass
 
-        new_delta.append(
-            t.Message(
-                id=message_helper.generate_id(settings.MESSAGE_ID_LEN),
-                role="assistant",
-                content=content,
-                timestamp=generate_timestamp(),
-            )
+        assistant_message = t.Message(
+            id=message_helper.generate_id(settings.MESSAGE_ID_LEN),
+            role="assistant",
+            content=content,
+            timestamp=generate_timestamp(),
+        )
+        return assistant_message, tool_calls
+
+
+    def _build_tool_message(self, results: list[t.ToolResultContent]) -> t.Message:
+        """
+        Добавляется один message с ролью tool, и в контенте содержатся все результаты текущего раунда вызовов
+        """
+        return t.Message(
+            id=message_helper.generate_id(settings.MESSAGE_ID_LEN),
+            role="tool",
+            content=results,
+            timestamp=generate_timestamp(),
         )
 
-        # Затем цикл вызова инструментов с добавлением в историю.
-        # Добавляется один message с ролью tool, и в контенте содержатся все результаты текущего раунда вызовов
-        results = []
-        for tool_call, tool_call_id_fallback in tool_calls:
-            is_error = False
-            tool_result_asset = None
+    def generate(
+            self,
+            history: t.ChatData,
+            tools_definition,
+            tools_executable: Dict[str, Callable],
+            extra_body: dict = None,
+    ) -> tuple[t.ChatData, list[t.Message]]:
+        with tracer.span("model.generate", model=self.model_name):
+            def respond():
+                # Системный промпт из истории передаётся в запрос, а не сохраняется в модели: один экземпляр обслуживает много чатов
+                native_history, system_prompt = self._convert_history_from_umf(history)
+
+                def request():
+                    response = self._do_request(native_history, tools_definition, system_prompt)
+                    with tracer.span("model.parse_response", model=self.model_name):
+                        return self._parse_response(response)
+
+                return self._coalesced(request, native_history, self._request_config(tools_definition, system_prompt))
+
+            # Сначала добавляем в историю ответ модели. Ссылкам на загрузки доверяем без проверки,
+            # поэтому если файл всё-таки пропал, пропавшие загружаются заново и запрос повторяется один раз
             try:
-                current_tool = tools_executable[tool_call.name]
-                # Если функция возвращает медиа
-                if getattr(current_tool, "returns_media", False):
-                    tool_result = tools_executable[tool_call.name](**tool_call.args)
-
-                    # Распаковка результатов функции
-                    tool_result_str = "Медиафайл успешно сгенерирован"
-                    media_bytes = b""
-                    mime_type_str = None
-                    if isinstance(tool_result, tuple):
-                        if len(tool_result) == 3:
-                            tool_result_str, media_bytes, mime_type_str = tool_result
-                        elif len(tool_result) == 2:
-                            # Предположим, вернули (bytes, mime_type) или (text, bytes)
-                            if isinstance(tool_result[0], bytes):
-                                media_bytes, mime_type_str = tool_result
-                            else:
-                                tool_result_str, media_bytes = tool_result
-                    elif isinstance(tool_result, bytes):
-                        media_bytes = tool_result
-
-                    asset_id = message_helper.generate_id(settings.ASSET_ID_LEN)
-
-                    # Угадываем MIME тип
-                    kind = filetype.guess(media_bytes)
-                    mime_type = getattr(current_tool, "mime_type", None) or mime_type_str or (
-                        kind.mime if kind else "application/octet-stream")
-                    if mime_type.startswith("image/"):
-                        asset_type = "image"
-                    elif mime_type.startswith("video/"):
-                        asset_type = "video"
-                    elif mime_type.startswith("audio/"):
-                        asset_type = "audio"
-                    elif mime_type.startswith("text/") or mime_type.startswith("application/"):
-                        asset_type = "document"
-                    else:
-                        raise TypeError(f"Функция {tool_call.name} сгенерировала файл неподдерживаемого типа")
-
-                    # Сохраняем медиа файл
-                    asset_extension = mimetypes.guess_extension(mime_type) or ".bin"
-                    asset_local_path = f"{settings.MEDIA_FOLDER}/{asset_id}{mimetypes.guess_extension(mime_type)}"
-                    with open(asset_local_path, "wb") as f:
-                        f.write(media_bytes)
-
-                    # Добавляем ассет
-                    tool_result_asset = [t.Asset(
-                        id=asset_id,
-                        type=asset_type,
-                        local_path=asset_local_path,
-                        mime_type=mime_type,
-                        size_bytes=len(media_bytes),
-                        data_base64=bytes_to_string(media_bytes) if len(media_bytes) < 20 * 1024 * 1024 else None
-                    )]
-                else:
-                    tool_result_str = tools_executable[tool_call.name](**tool_call.args)
-
-            except Exception as e:
-                is_error = True
-                tool_result_str = str(e)
-
-            results.append(
-                t.ToolResultContent(
-                    type="tool_result",
-                    tool_result=t.ToolResult(
-                        id=tool_call.id or tool_call_id_fallback,
-                        name=tool_call.name,
-                        text_content=str(tool_result_str),
-                        is_error=is_error,
-                    ),
-                    assets=tool_result_asset
-                )
-            )
-        if tool_calls:
-            new_delta.append(
-                t.Message(
-                    id=message_helper.generate_id(settings.MESSAGE_ID_LEN),
-                    role="tool",
-                    content=results,
-                    timestamp=generate_timestamp(),
-                )
-            )
+                assistant_message, tool_calls = respond()
+            except errors.APIError as e:
+                if not self._forget_missing_uploads(e, history):
+                    raise
+                assistant_message, tool_calls = respond()
+            new_delta = [assistant_message]
+
+            # Затем цикл вызова инструментов с добавлением в историю.
+            if tool_calls:
+                results = [
+                    run_tool(tools_executable, tool_call.name, tool_call.args, tool_call.id, args_error)
+                    for tool_call, args_error in tool_calls
+                ]
+                new_delta.append(self._build_tool_message(results))
 
         # Медиафайлы и метаданные не обрабатываются
         history.messages.extend(new_delta)
         return history, new_delta
+
+    async def agenerate(
+            self,
+            history: t.ChatData,
+            tools_definition,
+            tools_executable: Dict[str, Callable],
+            extra_body: dict = None,
+    ) -> tuple[t.ChatData, list[t.Message]]:
+        with tracer.span("model.generate", model=self.model_name):
+            async def respond():
+                # Конвертация может загружать файлы в Google Files API, поэтому выполняется в потоке
+                native_history, system_prompt = await asyncio.to_thread(self._convert_history_from_umf, history)
+
+                async def request():
+                    response = await self._ado_request(native_history, tools_definition, system_prompt)
+                    with tracer.span("model.parse_response", model=self.model_name):
+                        return self._parse_response(response)
+
+                return await self._acoalesced(
+                    request, native_history, self._request_config(tools_definition, system_prompt)
+                )
+
+            try:
+                assistant_message, tool_calls = await respond()
+            except errors.APIError as e:
+                if not await asyncio.to_thread(self._forget_missing_uploads, e, history):
+                    raise
+                assistant_message, tool_calls = await respond()
+            new_delta = [assistant_message]
+
+            # Инструменты одного раунда выполняются конкурентно
+            if tool_calls:
+                results = await asyncio.gather(*(
+                    arun_tool(tools_executable, tool_call.name, tool_call.args, tool_call.id, args_error)
+                    for tool_call, args_error in tool_calls
+                ))
+                new_delta.append(self._build_tool_message(list(results)))
+
+        history.messages.extend(new_delta)
+        return history, new_delta
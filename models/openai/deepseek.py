@@ -3,19 +3,23 @@ from config import settings
 
 
 class DeepseekReasoner(OpenAiBaseModel):
+    vendor = "deepseek"
+
     def __init__(self,
                  model_name="deepseek-v4-pro",
                  system_prompt="Ты полезный ИИ ассистент",
                  base_url="https://api.deepseek.com",
-                 api_key=settings.DEEPSEEK_API_KEY):
-        super().__init__(model_name, system_prompt, base_url, api_key, True)
+                 api_key=None):
+        super().__init__(model_name, system_prompt, base_url, api_key or settings.require("DEEPSEEK_API_KEY"), True)
 
 
 class DeepseekChat(OpenAiBaseModel):
+    vendor = "deepseek"
+
     def __init__(self,
                  model_name="deepseek-v4-flash",
                  system_prompt="Ты полезный ИИ ассистент",
                  base_url="https://api.deepseek.com",
-                 api_key=settings.DEEPSEEK_API_KEY):
-        super().__init__(model_name, system_prompt, base_url, api_key, False)
+                 api_key=None):
+        super().__init__(model_name, system_prompt, base_url, api_key or settings.require("DEEPSEEK_API_KEY"), False)
 
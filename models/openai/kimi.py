@@ -1,28 +1,39 @@
+import os
+
+from openai import APIError
+
 from models import OpenAiBaseModel
 from config import settings
 from utils import types as t
-
-from pathlib import Path
+from utils.media import asset_bytes, media_writer
+from utils.documents import document_extractor, DocumentExtractionError
+from utils.tool_runner import INLINE_MEDIA_LIMIT
+from utils.tracing import tracer
 
 class KimiK2p6(OpenAiBaseModel):
+    vendor = "moonshot"
+
     def __init__(self,
                  model_name="kimi-k2.6",
                  system_prompt="Ты полезный ИИ ассистент",
                  base_url="https://api.moonshot.ai/v1",
-                 api_key=settings.KIMI_API_KEY):
-        super().__init__(model_name, system_prompt, base_url, api_key, True)
+                 api_key=None):
+        super().__init__(model_name, system_prompt, base_url, api_key or settings.require("KIMI_API_KEY"), True)
 
     def _process_asset(self, asset: t.Asset) -> None | dict:
         if asset.type == "image":
-            if asset.size_bytes < 20 * 1024 * 1024: # В доках нет точного указания на размер файла, но допустим 20 Мб, как в genai
+            raw_bytes, _ = asset_bytes.get_bytes(asset, self.image_profile)
+            if len(raw_bytes) < INLINE_MEDIA_LIMIT: # В доках нет точного указания на размер файла, но допустим 20 Мб, как в genai
                 return {
                     "type": "image_url",
                     "image_url": {
-                        "url": f"data:{asset.mime_type};base64,{asset.data_base64}",
+                        "url": asset_bytes.get_data_url(asset, self.image_profile),
                     },
                 }
             else:
-                file_object = self.client.files.create(file=asset.local_path, purpose="image")
+                with tracer.span("model.process_asset", model=self.model_name, bytes=asset.size_bytes):
+                    media_writer.wait(asset.local_path)
+                    file_object = self.client.files.create(file=asset.local_path, purpose="image")
                 return {
                     "type": "image_url",
                     "image_url": {
@@ -34,21 +45,35 @@ class KimiK2p6(OpenAiBaseModel):
                 return {
                     "type": "video_url",
                     "video_url": {
-                        "url": f"data:{asset.mime_type};base64,{asset.data_base64}",
+                        "url": asset_bytes.get_data_url(asset),
                     },
                 }
             else:
-                file_object = self.client.files.create(file=asset.local_path, purpose="video")
+                with tracer.span("model.process_asset", model=self.model_name, bytes=asset.size_bytes):
+                    media_writer.wait(asset.local_path)
+                    file_object = self.client.files.create(file=asset.local_path, purpose="video")
                 return {
                     "type": "video_url",
                     "video_url": {
                         "url": f"ms://{file_object.id}"
                     }
                 }
-        elif asset.type == "document":
-            pass
-            # В kimi api документ принимается от имени системы. То есть обработкой должен заниматься _convert_history_from_umf
-            # if not asset.ocr_text:
-            #     file_object = self.client.files.create(file=asset.local_path, purpose="file-extract")
-            #     file_text = self.client.files.content(file_id=file_object.id).text
-            #     asset.ocr_text = file_text # Вот эта строка должна влиять на сам ассет, как если бы была передана ссылка на объект, а не копия
\ No newline at end of file
+        # Документы передаются текстом, см. _document_text
+        return None
+
+    def _extract_with_provider(self, asset: t.Asset) -> str:
+        """Извлечение текста силами Kimi: файл загружается с purpose="file-extract", текст забирается из files.content"""
+        with tracer.span("model.process_asset", model=self.model_name, bytes=asset.size_bytes):
+            try:
+                file_object = self.client.files.create(
+                    file=(os.path.basename(asset.local_path), asset_bytes.read(asset)), purpose="file-extract"
+                )
+                return self.client.files.content(file_id=file_object.id).text
+            except APIError as e:
+                raise DocumentExtractionError(f"Kimi не смог извлечь текст: {e}") from e
+
+    def _document_text(self, asset: t.Asset) -> str | None:
+        try:
+            return document_extractor.extract(asset, self._extract_with_provider)
+        except DocumentExtractionError as e:
+            return self._document_failure(asset, e)
@@ -1,17 +1,22 @@
 # OpenAI Base Model
-import mimetypes
 import json
-from openai import OpenAI
+import time
+import asyncio
+from openai import OpenAI, AsyncOpenAI
 from typing import Dict, Callable
-import filetype
 import utils.types as t
 from .base_model import BaseModel
 from config import settings
 from utils.small_utils import (
     message_helper,
     generate_timestamp,
-    bytes_to_string,
 )
+from utils.tool_runner import run_tool, arun_tool
+from utils.converters import umf_to_openai, parse_openai_tool_arguments, build_openai_request
+from utils.summarizer import summarized_view
+from utils.tracing import tracer
+from utils.media import OPENAI_IMAGE_PROFILE
+from utils.documents import document_extractor, DocumentExtractionError
 
 
 class OpenAiBaseModel(BaseModel):
@@ -19,6 +24,9 @@ class OpenAiBaseModel(BaseModel):
     Все модели принимают историю в УФС, затем конвертируют его в нужный для себя формат, делают запрос, конвертируют обратно и возвращают.
     """
 
+    provider = "openai"
+    image_profile = OPENAI_IMAGE_PROFILE  # Под этот профиль приводятся изображения перед отправкой
+
     def __init__(
             self,
             model_name,
@@ -29,6 +37,7 @@ class OpenAiBaseModel(BaseModel):
     ):
         self.model_name = model_name
         self.client = self._create_client(base_url, api_key)
+        self.async_client = self._create_async_client(base_url, api_key)
         self.system_prompt = system_prompt
         self.is_thinking = is_thinking
 
@@ -38,6 +47,12 @@ class OpenAiBaseModel(BaseModel):
             client.base_url = base_url
         return client
 
+    def _create_async_client(self, base_url, api_key) -> AsyncOpenAI:
+        client = AsyncOpenAI(api_key=api_key)
+        if base_url:
+            client.base_url = base_url
+        return client
+
     def _process_asset(self, asset: t.Asset) -> None | dict:
         # Этот метод переопределяется наследником, потому что не все модели мультимодальные
         """
@@ -46,114 +61,124 @@ class OpenAiBaseModel(BaseModel):
         """
         pass
 
-    def _convert_history_from_umf(self, history: t.ChatData):
-        native_history = []
+    def _document_text(self, asset: t.Asset) -> str | None:
+        """
+        Текст документа, который передаётся вместо файла (по умолчанию - локальное извлечение, см. utils.documents).
+        Наследники, которые принимают документы файлом, возвращают None
+        """
+        try:
+            return document_extractor.extract(asset)
+        except DocumentExtractionError as e:
+            return self._document_failure(asset, e)
 
-        for message in history.messages:
-            if message.role == "system":
-                native_history.append(
-                    {"role": "system", "content": message.content[0].text}
-                )
-                self.system_prompt = message.content[0].text
-            elif message.role == "assistant":
-                thought = ""
-                tool_calls = []
-                native_content = []
-                for content in message.content:
-                    if self.is_thinking and content.type == "thought":
-                        thought = content.text
-                    elif content.type == "text":
-                        native_content.append(
-                            {
-                                "type": "text",
-                                "text": content.text
-                            }
-                        )
-                    elif content.type == "tool_call":
-                        tool_calls.append(
-                            {
-                                "id": content.tool_call.id,
-                                "type": "function",
-                                "function": {
-                                    "name": content.tool_call.name,
-                                    "arguments": json.dumps(content.tool_call.args),
-                                },
-                            }
-                        )
-                    elif content.type == "media":
-                        for asset in content.assets:
-                            media_asset = self._process_asset(asset)
-                            if media_asset:
-                                native_content.append(media_asset)
+    @staticmethod
+    def _document_failure(asset: t.Asset, error: DocumentExtractionError) -> str:
+        """
+        Пометка вместо текста документа, который не удалось извлечь. Записывается в asset.ocr_text,
+        чтобы на следующих ходах документ не разбирался (и не загружался к провайдеру) заново
+        """
+        asset.ocr_text = f"(System: the text of this document could not be extracted: {error})"
+        return asset.ocr_text
 
-                native_history.append(
-                    {
-                        "role": "assistant",
-                        "content": native_content,
-                        "reasoning_content": thought if thought else None,
-                        "tool_calls": tool_calls if tool_calls else None,
-                    }
-                )
-            elif message.role == "user":
-                native_content = []
-                for content in message.content:
-                    if content.type == "text":
-                        native_content.append(
-                            {
-                                "type": "text",
-                                "text": content.text
-                            }
-                        )
-                    elif content.type == "media":
-                        for asset in content.assets:
-                            media_asset = self._process_asset(asset)
-                            if media_asset:
-                                native_content.append(media_asset)
-                native_history.append(
-                    {
-                        "role": "user",
-                        "content": native_content
-                    }
-                )
+    def _convert_history_from_umf(self, history: t.ChatData):
+        history, summary = summarized_view(history)
+        with tracer.span("model.convert_history", model=self.model_name, messages=len(history.messages)) as span:
+            native_history = umf_to_openai(
+                history,
+                is_thinking=self.is_thinking,
+                process_asset=self._process_asset,
+                # self.system_prompt не отправляется: системный промпт OpenAI-моделей задаётся system-сообщением истории
+                document_text=self._document_text,
+                summary=summary,
+                cache=history._conversion_cache,
+            )
+            if span.recording:
+                span.set(payload_bytes=len(json.dumps(native_history, ensure_ascii=False, default=str).encode()))
+            return native_history
 
+    def build_request(self, history: t.ChatData, tools_definition, extra_body: dict = None) -> dict:
+        """
+        Канонический запрос для истории, тот же, что отправит generate. Два запроса соседних ходов можно
+        сравнить utils.converters.find_prefix_divergence, чтобы найти, почему не попадает кэш префиксов
+        """
+        return self._build_request(self._convert_history_from_umf(history), tools_definition, extra_body)
 
-            elif message.role == "tool":
-                for content in message.content:
-                    native_history.append(
-                        {
-                            "role": "tool",
-                            "content": f"Function response: ```{content.tool_result.text_content}```\nError: {content.tool_result.is_error}",
-                            "tool_call_id": content.tool_result.id,
-                        }
-                    )
-        return native_history
+    def _build_request(self, native_history, tools_definition, extra_body=None) -> dict:
+        return build_openai_request(self.model_name, native_history, tools_definition, extra_body)
 
-    def _do_request(self, native_history, tools_definition, extra_body=None):
-        if extra_body is None:
-            extra_body = {}
-        response = self.client.chat.completions.create(
-            model=self.model_name,
-            messages=native_history,
-            tools=tools_definition,
-            extra_body=extra_body
+    @staticmethod
+    def _usage_stats(response) -> t.UsageStats | None:
+        """
+        Токены из ответа, включая кэш префиксов: DeepSeek возвращает prompt_cache_hit_tokens/prompt_cache_miss_tokens,
+        Kimi - cached_tokens, OpenAI - prompt_tokens_details.cached_tokens
+        """
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return None
+        input_tokens = usage.prompt_tokens or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        cache_hit = getattr(usage, "prompt_cache_hit_tokens", None)
+        if cache_hit is None:
+            cache_hit = getattr(usage, "cached_tokens", None)
+        if cache_hit is None and details is not None:
+            cache_hit = getattr(details, "cached_tokens", None)
+        cache_miss = getattr(usage, "prompt_cache_miss_tokens", None)
+        if cache_miss is None and cache_hit is not None:
+            cache_miss = max(input_tokens - cache_hit, 0)
+        return t.UsageStats(
+            input_tokens=input_tokens,
+            output_tokens=usage.completion_tokens or 0,
+            total_tokens=usage.total_tokens or 0,
+            cache_hit_tokens=cache_hit,
+            cache_miss_tokens=cache_miss,
         )
+
+    @classmethod
+    def _usage_attributes(cls, response) -> dict:
+        """Токены из ответа для спана запроса"""
+        usage = cls._usage_stats(response)
+        if usage is None:
+            return {}
+        attributes = {"input_tokens": usage.input_tokens, "output_tokens": usage.output_tokens}
+        if usage.cache_hit_tokens is not None:
+            attributes["cache_hit_tokens"] = usage.cache_hit_tokens
+        return attributes
+
+    def _do_request(self, request: dict):
+        with tracer.span("model.request", model=self.model_name) as span:
+            response = self.client.chat.completions.create(**request)
+            if span.recording:
+                span.set(**self._usage_attributes(response))
         return response
 
-    def generate(
-            self,
-            history: t.ChatData,
-            tools_definition,
-            tools_executable: Dict[str, Callable],
-            extra_body: dict
-    ) -> tuple[t.ChatData, list[t.Message]]:
-        native_history = self._convert_history_from_umf(history)
+    async def _ado_request(self, request: dict):
+        with tracer.span("model.request", model=self.model_name) as span:
+            response = await self.async_client.chat.completions.create(**request)
+            if span.recording:
+                span.set(**self._usage_attributes(response))
+        return response
+
+    def _message_metadata(self, response, latency_ms: int | None = None) -> t.MessageMetadata:
+        finish_reason = response.choices[0].finish_reason
+        if finish_reason == "function_call":
+            finish_reason = "tool_calls"
+        return t.MessageMetadata(
+            model=getattr(response, "model", None) or self.model_name,
+            model_class="openai",
+            usage=self._usage_stats(response),
+            finish_reason=finish_reason if finish_reason in ("stop", "tool_calls", "length", "content_filter") else None,
+            latency_ms=latency_ms,
+        )
 
-        response = self._do_request(native_history, tools_definition, extra_body)
+    def _parse_response(self, response, latency_ms: int | None = None) -> tuple[t.Message, list[tuple[t.ToolCall, str | None]]]:
+        """
+        Конвертирует ответ модели в сообщение ассистента в УФС
+        :param latency_ms: время запроса для метаданных
+        :return: (сообщение ассистента, вызовы инструментов с ошибкой разбора аргументов или None)
+        """
         message = response.choices[0].message
 
-        new_delta = []
         tool_calls = []
-
         content = []
         if self.is_thinking and message.reasoning_content:
             content.append(t.ThoughtContent(type="thought", text=message.reasoning_content))
@@ -162,110 +187,102 @@ class OpenAiBaseModel(BaseModel):
         if message.tool_calls:
             for tool_call in message.tool_calls:
                 tool_call_id_fallback = message_helper.generate_id(9)
-                tool_calls.append([tool_call, tool_call_id_fallback])
+                # Аргументы разбираются один раз, дальше используется только ToolCall.args
+                args, args_error = parse_openai_tool_arguments(tool_call.function.name, tool_call.function.arguments)
                 content.append(
                     t.ToolCallContent(
                         type="tool_call",
                         tool_call=t.ToolCall(
                             id=tool_call.id or tool_call_id_fallback,
                             name=tool_call.function.name,
-                            args=json.loads(tool_call.function.arguments)
+                            args=args
                         )
                     )
                 )
-        # Добавляем сообщение ассистента в историю
-        new_delta.append(t.Message(
+                tool_calls.append((content[-1].tool_call, args_error))
+
+        assistant_message = t.Message(
             id=message_helper.generate_id(settings.MESSAGE_ID_LEN),
             role="assistant",
             content=content,
-            timestamp=generate_timestamp()
-        ))
+            timestamp=generate_timestamp(),
+            metadata=self._message_metadata(response, latency_ms),
+        )
+        return assistant_message, tool_calls
+
+    def _build_tool_message(self, results: list[t.ToolResultContent]) -> t.Message:
+        return t.Message(
+            id=message_helper.generate_id(settings.MESSAGE_ID_LEN),
+            role="tool",
+            content=results,
+            timestamp=generate_timestamp(),
+        )
 
-        # Выполняем функции и добавляем их в историю
-        results = []
-        for tool_call, tool_call_id_fallback in tool_calls:
-            is_error = False
-            tool_result_asset = None
-            try:
-                current_tool = tools_executable[tool_call.function.name]
-                # Если функция возвращает медиа
-                if getattr(current_tool, "returns_media", False):
-                    tool_result = tools_executable[tool_call.function.name](**json.loads(tool_call.function.arguments))
+    def generate(
+            self,
+            history: t.ChatData,
+            tools_definition,
+            tools_executable: Dict[str, Callable],
+            extra_body: dict = None
+    ) -> tuple[t.ChatData, list[t.Message]]:
+        with tracer.span("model.generate", model=self.model_name):
+            request_body = self._build_request(self._convert_history_from_umf(history), tools_definition, extra_body)
 
-                    # Распаковка результатов функции
-                    tool_result_str = "Медиафайл успешно сгенерирован"
-                    media_bytes = b""
-                    mime_type_str = None
-                    if isinstance(tool_result, tuple):
-                        if len(tool_result) == 3:
-                            tool_result_str, media_bytes, mime_type_str = tool_result
-                        elif len(tool_result) == 2:
-                            # Предположим, вернули (bytes, mime_type) или (text, bytes)
-                            if isinstance(tool_result[0], bytes):
-                                media_bytes, mime_type_str = tool_result
-                            else:
-                                tool_result_str, media_bytes = tool_result
-                    elif isinstance(tool_result, bytes):
-                        media_bytes = tool_result
+            def request():
+                start = time.perf_counter()
+                response = self._do_request(request_body)
+                latency_ms = int((time.perf_counter() - start) * 1000)
+                with tracer.span("model.parse_response", model=self.model_name):
+                    return self._parse_response(response, latency_ms)
 
-                    asset_id = message_helper.generate_id(settings.ASSET_ID_LEN)
+            # Добавляем сообщение ассистента в историю
+            assistant_message, tool_calls = self._coalesced(
+                request, str(self.client.base_url), self.is_thinking, request_body
+            )
+            new_delta = [assistant_message]
 
-                    # Угадываем MIME тип
-                    kind = filetype.guess(media_bytes)
-                    mime_type = getattr(current_tool, "mime_type", None) or mime_type_str or (
-                        kind.mime if kind else "application/octet-stream")
-                    if mime_type.startswith("image/"):
-                        asset_type = "image"
-                    elif mime_type.startswith("video/"):
-                        asset_type = "video"
-                    elif mime_type.startswith("audio/"):
-                        asset_type = "audio"
-                    else:
-                        asset_type = "document"
+            # Выполняем функции и добавляем их в историю
+            if tool_calls:
+                results = [
+                    run_tool(tools_executable, tool_call.name, tool_call.args, tool_call.id, args_error)
+                    for tool_call, args_error in tool_calls
+                ]
+                new_delta.append(self._build_tool_message(results))
 
-                    # Сохраняем медиа файл
-                    ext = mimetypes.guess_extension(mime_type) or ".bin"
-                    asset_local_path = f"{settings.MEDIA_FOLDER}/{asset_id}{ext}"
-                    with open(asset_local_path, "wb") as f:
-                        f.write(media_bytes)
+        history.messages.extend(new_delta)
+        return history, new_delta
 
-                    # Добавляем ассет
-                    tool_result_asset = [t.Asset(
-                        id=asset_id,
-                        type=asset_type,
-                        local_path=asset_local_path,
-                        mime_type=mime_type,
-                        size_bytes=len(media_bytes),
-                        data_base64=bytes_to_string(media_bytes) if len(media_bytes) < 20 * 1024 * 1024 else None
-                    )]
-                else:
-                    tool_result_str = tools_executable[tool_call.function.name](**json.loads(tool_call.function.arguments))
+    async def agenerate(
+            self,
+            history: t.ChatData,
+            tools_definition,
+            tools_executable: Dict[str, Callable],
+            extra_body: dict = None
+    ) -> tuple[t.ChatData, list[t.Message]]:
+        with tracer.span("model.generate", model=self.model_name):
+            # Конвертация может загружать файлы к провайдеру, поэтому выполняется в потоке
+            native_history = await asyncio.to_thread(self._convert_history_from_umf, history)
+            request_body = self._build_request(native_history, tools_definition, extra_body)
 
-            except Exception as e:
-                is_error = True
-                tool_result_str = str(e)
+            async def request():
+                start = time.perf_counter()
+                response = await self._ado_request(request_body)
+                latency_ms = int((time.perf_counter() - start) * 1000)
+                with tracer.span("model.parse_response", model=self.model_name):
+                    return self._parse_response(response, latency_ms)
 
-            results.append(
-                t.ToolResultContent(
-                    type="tool_result",
-                    tool_result=t.ToolResult(
-                        id=tool_call.id or tool_call_id_fallback,
-                        name=tool_call.function.name,
-                        text_content=str(tool_result_str),
-                        is_error=is_error,
-                    ),
-                    assets=tool_result_asset
-                )
-            )
-        if tool_calls:
-            new_delta.append(
-                t.Message(
-                    id=message_helper.generate_id(settings.MESSAGE_ID_LEN),
-                    role="tool",
-                    content=results,
-                    timestamp=generate_timestamp(),
-                )
+            assistant_message, tool_calls = await self._acoalesced(
+                request, str(self.client.base_url), self.is_thinking, request_body
             )
+            new_delta = [assistant_message]
+
+            # Инструменты одного раунда выполняются конкурентно
+            if tool_calls:
+                results = await asyncio.gather(*(
+                    arun_tool(tools_executable, tool_call.name, tool_call.args, tool_call.id, args_error)
+                    for tool_call, args_error in tool_calls
+                ))
+                new_delta.append(self._build_tool_message(list(results)))
 
         history.messages.extend(new_delta)
         return history, new_delta
@@ -1,12 +1,36 @@
+import asyncio
+
 from models.genai.gemini import Gemini3_1FlashLite
 from models.openai.deepseek import DeepseekChat, DeepseekReasoner
 from models import BaseModel
 import utils.types as t
 from utils.small_utils import generate_timestamp
 from utils.tools_parser.tools_parser import ToolsParser
+from utils.scheduler import ReactScheduler
 import utils.tools # noqa: F401
 
 
+def run_react(model: BaseModel, history: t.ChatData, tools_def, tools_exec, on_step):
+    """Цикл ReAct до финального ответа модели - тот же run_turn, что и в веб-сервисе"""
+    async def turn():
+        scheduler = ReactScheduler(max_workers=1)
+        return await scheduler.run_turn("cli", model, history, tools_definition=tools_def,
+                                        tools_executable=tools_exec, on_step=on_step)
+    return asyncio.run(turn())
+
+
+async def print_react_step(delta: list[t.Message]) -> None:
+    for msg in delta:
+        print(f"  Роль: {msg.role}")
+        for c in msg.content:
+            if c.type == "tool_call":
+                print(f"    Вызов инструмента: {c.tool_call.name}({c.tool_call.args})")
+            elif c.type == "tool_result":
+                print(f"    Результат: {c.tool_result.text_content}")
+            elif c.type == "text":
+                print(f"    Текст: {c.text}")
+
+
 def create_initial_history() -> t.ChatData:
     return t.ChatData(
         chat_metadata=t.ChatMetadata(config=t.ChatConfig(provider="genai")),
@@ -99,15 +123,7 @@ def chat_mode(model: BaseModel, tools_def, tools_exec, provider: str = "genai"):
             )
         )
 
-        while True:
-            # Вызываем генерацию
-            history, delta = model.generate(
-                history=history, tools_definition=tools_def, tools_executable=tools_exec
-            )
-
-            has_tool_calls_or_results = False
-
-            # Выводим последнюю дельту
+        async def print_step(delta: list[t.Message]) -> None:
             for msg in delta:
                 for c in msg.content:
                     if c.type == "thought":
@@ -115,20 +131,12 @@ def chat_mode(model: BaseModel, tools_def, tools_exec, provider: str = "genai"):
                     elif c.type == "text":
                         print(f"[Ассистент]: {c.text}")
                     elif c.type == "tool_call":
-                        has_tool_calls_or_results = True
-                        print(
-                            f"[Вызов инструмента]: {c.tool_call.name}({c.tool_call.args})"
-                        )
+                        print(f"[Вызов инструмента]: {c.tool_call.name}({c.tool_call.args})")
                     elif c.type == "tool_result":
-                        has_tool_calls_or_results = True
                         print(f"[Результат инструмента]: {c.tool_result.text_content}")
 
-            # Если были вызовы инструментов (последним добавилось сообщение tool),
-            # нужно снова вызвать модель, чтобы она ответила на основе результата
-            if has_tool_calls_or_results and delta[-1].role == "tool":
-                continue
-            else:
-                break
+        # Модель вызывается снова, пока последним сообщением идёт результат инструмента
+        run_react(model, history, tools_def, tools_exec, print_step)
 def test_model_switching():
     print("\n--- Запуск теста переключения моделей на лету (GenAI <-> OpenAI) ---")
     
@@ -255,27 +263,7 @@ def test_react_switching():
     )
     
     print("Запуск цикла ReAct для DeepSeek...")
-    while True:
-        history_a, delta = deepseek_model.generate(
-            history=history_a,
-            tools_definition=tools_def_openai,
-            tools_executable=tools_exec
-        )
-        
-        for msg in delta:
-            print(f"  Роль: {msg.role}")
-            for c in msg.content:
-                if c.type == "tool_call":
-                    print(f"    Вызов инструмента: {c.tool_call.name}({c.tool_call.args})")
-                elif c.type == "tool_result":
-                    print(f"    Результат: {c.tool_result.text_content}")
-                elif c.type == "text":
-                    print(f"    Текст: {c.text}")
-                    
-        if delta[-1].role == "tool":
-            continue
-        else:
-            break
+    run_react(deepseek_model, history_a, tools_def_openai, tools_exec, print_react_step)
             
     # Переключаемся на Gemini после завершения цикла
     print("\nПереключаемся на Gemini после полного ReAct цикла...")
@@ -400,27 +388,7 @@ def test_react_switching():
     history_c.chat_metadata.config.provider = "openai"
     
     # Запускаем цикл DeepSeek до финального ответа
-    while True:
-        history_c, delta_c2 = deepseek_model.generate(
-            history=history_c,
-            tools_definition=tools_def_openai,
-            tools_executable=tools_exec
-        )
-        
-        for msg in delta_c2:
-            print(f"  Роль: {msg.role}")
-            for c in msg.content:
-                if c.type == "tool_call":
-                    print(f"    Вызов инструмента: {c.tool_call.name}({c.tool_call.args})")
-                elif c.type == "tool_result":
-                    print(f"    Результат: {c.tool_result.text_content}")
-                elif c.type == "text":
-                    print(f"    Текст: {c.text}")
-                    
-        if delta_c2[-1].role == "tool":
-            continue
-        else:
-            break
+    run_react(deepseek_model, history_c, tools_def_openai, tools_exec, print_react_step)
 
     print("\n--- Тест ReAct завершен ---")
 
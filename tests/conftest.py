@@ -0,0 +1,15 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# Медиафайлы тестов пишутся во временную папку, ключи API не нужны: модели в тестах не ходят в сеть
+os.environ.setdefault("MEDIA_FOLDER", tempfile.mkdtemp(prefix="ai_chat_tests_media_"))
+
+"""
+Общие настройки тестов. Запуск из корня репозитория:
+    python -m pytest -q tests
+"""
@@ -0,0 +1,105 @@
+import copy
+import json
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import utils.types as t
+from web_api_wrapper import SessionStore
+
+"""Заглушки моделей, хранилищ и ASGI-клиента для тестов"""
+
+
+def timestamp(index: int = 0) -> datetime:
+    return datetime(2026, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=index)
+
+
+def text_message(message_id: str, role: str, text: str, index: int = 0) -> t.Message:
+    return t.Message(id=message_id, timestamp=timestamp(index), role=role, content=[t.TextContent(text=text)])
+
+
+def chat_with(*messages: t.Message) -> t.ChatData:
+    return t.ChatData(messages=list(messages))
+
+
+class FakeModel:
+    """
+    Модель без сети: на каждый вызов добавляет в историю ответ ассистента с текстом reply.
+    Если задан gate, agenerate ждёт его перед ответом
+    """
+
+    provider = "openai"
+    vendor = "fake"
+
+    def __init__(self, reply: str = "ok", model_name: str = "fake-model", gate: asyncio.Event | None = None):
+        self.reply = reply
+        self.model_name = model_name
+        self.gate = gate
+        self.calls: list[t.ChatData] = []
+
+    def _answer(self, history: t.ChatData) -> tuple[t.ChatData, list[t.Message]]:
+        self.calls.append(history)
+        message = t.Message(
+            id=f"a{len(self.calls)}-{len(history.messages)}", timestamp=timestamp(len(history.messages)),
+            role="assistant", content=[t.TextContent(text=self.reply)],
+            metadata=t.MessageMetadata(model=self.model_name, model_class="openai"),
+        )
+        history.messages.append(message)
+        return history, [message]
+
+    def generate(self, history, tools_definition=None, tools_executable=None, extra_body=None):
+        return self._answer(history)
+
+    async def agenerate(self, history, tools_definition=None, tools_executable=None, extra_body=None):
+        if self.gate is not None:
+            await self.gate.wait()
+        return self._answer(history)
+
+
+class CopyingSessionStore(SessionStore):
+    """Хранилище, которое, как хранилища поверх БД, отдаёт и сохраняет копии чатов"""
+
+    def __init__(self):
+        self._chats: dict[str, t.ChatData] = {}
+
+    async def get(self, chat_id: str) -> t.ChatData | None:
+        chat = self._chats.get(chat_id)
+        return copy.deepcopy(chat) if chat is not None else None
+
+    async def save(self, chat_id: str, chat: t.ChatData) -> None:
+        self._chats[chat_id] = copy.deepcopy(chat)
+
+    async def delete(self, chat_id: str) -> bool:
+        return self._chats.pop(chat_id, None) is not None
+
+    async def list_ids(self) -> list[str]:
+        return list(self._chats)
+
+
+async def asgi_request(app, method: str, path: str, body: dict | None = None,
+                       query_string: bytes = b"") -> tuple[int | None, bytes]:
+    """
+    Один HTTP-запрос к ASGI-приложению
+    :return: (статус или None, если ответ не начат; тело ответа)
+    """
+    payload = json.dumps(body).encode("utf-8") if body is not None else b""
+    received = False
+    status = None
+    chunks = []
+
+    async def receive():
+        nonlocal received
+        if received:
+            await asyncio.Event().wait()
+        received = True
+        return {"type": "http.request", "body": payload, "more_body": False}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    scope = {"type": "http", "method": method, "path": path, "query_string": query_string}
+    await app(scope, receive, send)
+    return status, b"".join(chunks)
@@ -0,0 +1,22 @@
+import os
+
+from utils.tools_parser import register_tool
+
+"""
+Инструменты для тестов пула процессов. Воркеры запускаются через spawn и импортируют функции по имени модуля,
+поэтому они объявлены здесь, на верхнем уровне, а не в модуле теста
+"""
+
+
+def worker_pid() -> int:
+    return os.getpid()
+
+
+@register_tool(executor="process", returns_media=True, mime_type="application/octet-stream")
+def render_bytes(size: int) -> tuple[str, bytes]:
+    """
+    Возвращает size байт.
+
+    :param size: Размер результата.
+    """
+    return f"rendered {size}", bytes(range(256)) * (size // 256)
@@ -0,0 +1,93 @@
+from typing import Literal
+
+import pytest
+
+from utils.tool_runner import run_tool
+from utils.tools_parser import ArgsValidator, ToolArgumentsError
+
+
+def search(query: str, limit: int = 5, mode: Literal["fast", "full"] = "fast") -> dict:
+    """
+    Поиск.
+
+    :param query: Запрос.
+    :param limit: Количество результатов.
+    :param mode: Режим.
+    """
+    return {"query": query, "limit": limit, "mode": mode}
+
+
+def weighted(query: str, **kwargs: float) -> dict:
+    """
+    Поиск с весами.
+
+    :param query: Запрос.
+    :param kwargs: Веса.
+    """
+    return {"query": query, **kwargs}
+
+
+def joined(sep: str, *words: str) -> str:
+    """
+    Склеивает слова.
+
+    :param sep: Разделитель.
+    :param words: Слова.
+    """
+    return sep.join(words)
+
+
+TOOLS = {"search": search, "weighted": weighted, "joined": joined}
+
+
+def _error(args: dict, name: str = "search") -> str:
+    result = run_tool(TOOLS, name, args, "c1").tool_result
+    assert result.is_error and result.id == "c1"
+    assert "Fix the arguments and call the tool again." in result.text_content
+    return result.text_content
+
+
+def test_values_are_coerced_to_annotations():
+    expected = ((), {"query": "q", "limit": 3, "mode": "fast"})
+    assert ArgsValidator(search).validate({"query": "q", "limit": "3"}) == expected
+    result = run_tool(TOOLS, "search", {"query": "q", "limit": "7"}, "c1").tool_result
+    assert not result.is_error and '"limit":7' in result.text_content
+
+
+@pytest.mark.parametrize("args, fragment", [
+    ({"query": "q", "limit": "many"}, "limit: "),
+    ({"query": "q", "mode": "slow"}, "mode: "),
+    ({"query": "q", "unknown": 1}, "unknown: "),
+    ({"limit": 1}, "query: "),
+])
+def test_bad_arguments_become_error_results(args, fragment):
+    text = _error(args)
+    assert text.startswith("Invalid arguments for search: ") and fragment in text
+
+
+def test_null_for_defaulted_parameter_uses_default():
+    assert ArgsValidator(search).validate({"query": "q", "limit": None, "mode": None}) == (
+        (), {"query": "q", "limit": 5, "mode": "fast"}
+    )
+    # Для обязательного параметра null остаётся ошибкой
+    assert "query: " in _error({"query": None})
+
+
+def test_kwargs_accept_flat_and_nested_forms():
+    validator = ArgsValidator(weighted)
+    expected = ((), {"query": "q", "title": 2.0, "body": 0.5})
+    assert validator.validate({"query": "q", "title": 2.0, "body": 0.5}) == expected  # openai
+    assert validator.validate({"query": "q", "kwargs": {"title": 2.0, "body": 0.5}}) == expected  # genai
+    assert not run_tool(TOOLS, "weighted", {"query": "q", "kwargs": {"title": 1}}, "c1").tool_result.is_error
+
+
+def test_var_positional_is_passed_positionally():
+    assert ArgsValidator(joined).validate({"sep": "-", "words": ["a", "b"]}) == (("-", "a", "b"), {})
+    assert run_tool(TOOLS, "joined", {"sep": "-", "words": ["a", "b"]}, "c1").tool_result.text_content == "a-b"
+    with pytest.raises(ToolArgumentsError):
+        ArgsValidator(joined).validate({"sep": "-", "words": "ab"})
+
+
+def test_parse_error_is_reported_without_calling_the_tool():
+    result = run_tool(TOOLS, "search", {}, "c1", args_error="Invalid JSON in arguments").tool_result
+    assert result.is_error and "Invalid JSON in arguments" in result.text_content
@@ -0,0 +1,54 @@
+import os
+import base64
+import hashlib
+
+import pytest
+
+import utils.types as t
+from utils.media import AssetBytesProvider
+
+
+def _asset(tmp_path, name: str, data: bytes) -> t.Asset:
+    path = tmp_path / name
+    path.write_bytes(data)
+    return t.Asset(id=name, type="document", local_path=str(path), mime_type="text/plain")
+
+
+def _open_fds() -> int:
+    return len(os.listdir("/proc/self/fd"))
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="нужен /proc")
+def test_open_releases_mapping_and_descriptor(tmp_path):
+    provider = AssetBytesProvider()
+    asset = _asset(tmp_path, "a.txt", b"content")
+    before = _open_fds()
+    for _ in range(50):
+        with provider.open(asset) as data:
+            assert hashlib.sha256(data).hexdigest() == hashlib.sha256(b"content").hexdigest()
+    assert _open_fds() == before
+    with pytest.raises(ValueError):
+        data.tobytes()  # view освобождён вместе с отображением
+
+
+def test_open_inline_and_empty_assets(tmp_path):
+    provider = AssetBytesProvider()
+    inline = t.Asset(id="i", type="document", local_path=str(tmp_path / "missing.txt"), mime_type="text/plain",
+                     data_base64=base64.b64encode(b"inline").decode())
+    with provider.open(inline) as data:
+        assert data.tobytes() == b"inline"
+    with provider.open(_asset(tmp_path, "empty.txt", b"")) as data:
+        assert data.tobytes() == b""
+
+
+def test_get_bytes_and_base64_are_cached(tmp_path):
+    provider = AssetBytesProvider()
+    asset = _asset(tmp_path, "a.txt", b"payload")
+    first = provider.get_bytes(asset)
+    assert first == (b"payload", "text/plain") and type(first[0]) is bytes
+    assert provider.get_bytes(asset)[0] is first[0]
+    assert provider.get_base64(asset) == (base64.b64encode(b"payload").decode(), "text/plain")
+    assert provider.read(asset) == b"payload"
+
+    (tmp_path / "a.txt").write_bytes(b"changed!")  # Другой размер - другой ключ кэша
+    assert provider.get_bytes(asset)[0] == b"changed!"
@@ -0,0 +1,187 @@
+import sys
+import threading
+
+import pytest
+
+import utils.types as t
+from utils.branching import ConversationTree, ConversationTreeData
+from utils.converters import ConversionCache, umf_to_genai, umf_to_openai
+
+from fakes import FakeModel, chat_with, text_message, timestamp
+
+
+def _tree(count: int = 4) -> ConversationTree:
+    roles = ("user", "assistant")
+    chat = chat_with(*(text_message(f"m{i}", roles[i % 2], f"text {i}", i) for i in range(count)))
+    return ConversationTree.from_chat(chat)
+
+
+def _ids(branch) -> list[str]:
+    return [message.id for message in branch]
+
+
+def test_fork_shares_prefix_and_branches_do_not_see_each_other():
+    tree = _tree()
+    main = tree["main"]
+    other = main.fork("other")
+    assert other.tip is main.tip
+
+    other.append(text_message("o1", "user", "other question", 10))
+    main.append(text_message("x1", "user", "main question", 10))
+    assert _ids(main) == ["m0", "m1", "m2", "m3", "x1"]
+    assert _ids(other) == ["m0", "m1", "m2", "m3", "o1"]
+    assert other.tip.parent is main.tip.parent
+
+    assert _ids(main.fork(at=2)) == ["m0", "m1"]
+    assert _ids(main.fork(at=-1)) == ["m0", "m1", "m2", "m3"]
+    assert _ids(main.fork(at="m1")) == ["m0", "m1"]
+    assert _ids(main.fork(at=0)) == []
+    assert set(tree.branches) == {"main", "other", "main-2", "main-3", "main-4", "main-5"}
+    with pytest.raises(ValueError):
+        main.fork("other")
+    with pytest.raises(IndexError):
+        main.fork(at=10)
+    with pytest.raises(KeyError):
+        main.fork(at="missing")
+
+
+def test_edit_replaces_message_in_new_branch():
+    tree = _tree()
+    main = tree["main"]
+    edited = main.edit("m2", text_message("m2b", "user", "fixed question", 2), name="edited")
+    assert _ids(edited) == ["m0", "m1", "m2b"]
+    assert _ids(main) == ["m0", "m1", "m2", "m3"]
+    assert edited.nodes[1] is main.nodes[1]
+
+
+def test_fork_drops_summaries_past_the_fork_point():
+    tree = _tree(6)
+    main = tree["main"]
+    main.summaries = [
+        t.SummaryCheckpoint(id="s1", timestamp=timestamp(), until_message_id="m1", messages_count=2, text="a"),
+        t.SummaryCheckpoint(id="s2", timestamp=timestamp(), until_message_id="m3", messages_count=4, text="b"),
+    ]
+    assert [summary.id for summary in main.fork(at=3).summaries] == ["s1"]
+    assert [summary.id for summary in main.fork().summaries] == ["s1", "s2"]
+
+
+def test_generate_commits_delta_and_commit_rejects_foreign_history():
+    tree = _tree()
+    main = tree["main"]
+    other = main.fork("other")
+
+    delta = main.generate(FakeModel(reply="answer"), None, {})
+    assert [message.role for message in delta] == ["assistant"]
+    assert len(main) == 5 and len(other) == 4
+
+    stale = other.history()
+    other.append(text_message("o1", "user", "newer", 10))
+    stale.messages.append(text_message("o2", "assistant", "late", 11))
+    with pytest.raises(ValueError):
+        other.commit(stale)
+
+    rewritten = other.history()
+    rewritten.messages[-1] = text_message("o1", "user", "rewritten", 10)
+    with pytest.raises(ValueError):
+        other.commit(rewritten)
+    assert _ids(other) == ["m0", "m1", "m2", "m3", "o1"]
+
+
+def test_save_stores_shared_nodes_once(tmp_path):
+    tree = _tree()
+    tree["main"].fork("a").append(text_message("a1", "user", "a", 10))
+    tree["main"].fork("b", at=2).append(text_message("b1", "user", "b", 10))
+    tree.fork("main", "empty", at=0)
+
+    data = tree.to_data()
+    assert len(data.nodes) == 6
+    path = tmp_path / "tree.json"
+    tree.save(path)
+    loaded = ConversationTree.load(path)
+    for name in ("main", "a", "b", "empty"):
+        assert _ids(loaded[name]) == _ids(tree[name])
+    assert loaded["a"].nodes[3] is loaded["main"].nodes[3]
+
+    broken = ConversationTreeData.model_validate({"nodes": [{"parent": 1, "message": data.nodes[0].message}]})
+    with pytest.raises(ValueError):
+        ConversationTree.from_data(broken)
+
+
+def test_branch_conversion_is_cached_and_identical():
+    tree = _tree(6)
+    main = tree["main"]
+    uncached = umf_to_openai(main.to_chat(), is_thinking=True)
+    cached = umf_to_openai(main.history(), is_thinking=True, cache=tree.conversion_cache)
+    assert cached == uncached
+    assert len(tree.conversion_cache) == 6
+
+    branch = main.fork("branch")
+    branch.append(text_message("b1", "user", "more", 10))
+    umf_to_openai(branch.history(), is_thinking=True, cache=tree.conversion_cache)
+    assert len(tree.conversion_cache) == 7
+
+    genai_uncached, _ = umf_to_genai(main.to_chat())
+    genai_cached, _ = umf_to_genai(main.history(), cache=tree.conversion_cache)
+    assert genai_cached == genai_uncached
+
+    tree.delete_branch("branch")
+    assert len(tree.conversion_cache) == 12  # Записи общего начала остаются для обоих форматов
+
+
+def test_conversion_cache_is_bounded_lru():
+    cache = ConversionCache(max_entries=3)
+    messages = [text_message(f"m{i}", "user", str(i), i) for i in range(4)]
+    for message in messages[:3]:
+        cache.put(("ns",), message, message.id)
+    assert cache.get(("ns",), messages[0]) == "m0"  # m0 теперь использован недавно
+    cache.put(("ns",), messages[3], "m3")
+
+    assert len(cache) == 3
+    assert cache.get(("ns",), messages[1]) is None
+    assert [cache.get(("ns",), message) for message in (messages[0], messages[2], messages[3])] == ["m0", "m2", "m3"]
+    # Другой объект с тем же id сообщения - другое сообщение
+    assert cache.get(("ns",), text_message("m0", "user", "0", 0)) is None
+    with pytest.raises(ValueError):
+        ConversionCache(max_entries=0)
+
+
+def test_conversion_cache_is_thread_safe():
+    cache = ConversionCache(max_entries=50)
+    messages = [text_message(f"m{i}", "user", str(i), i) for i in range(200)]
+    errors = []
+
+    def convert(offset: int):
+        try:
+            for round_ in range(20):
+                for message in messages[offset::4]:
+                    cache.convert(("ns", round_ % 3), message, lambda m: m.id)
+        except Exception as e:
+            errors.append(e)
+
+    def retain():
+        try:
+            for _ in range(500):
+                cache.retain(messages[::2])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=convert, args=(offset,)) for offset in range(4)]
+    threads.append(threading.Thread(target=retain))
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # Потоки переключаются посреди операций со словарём
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert errors == [] and len(cache) <= 50
+
+
+def test_media_and_system_messages_are_not_cached():
+    asset = t.Asset(id="img", type="image", local_path="img.png", mime_type="image/png")
+    media = t.Message(id="u", timestamp=timestamp(), role="user", content=[t.MediaContent(assets=[asset])])
+    assert not ConversionCache.cacheable(media)
+    assert not ConversionCache.cacheable(text_message("s", "system", "prompt"))
+    assert ConversionCache.cacheable(text_message("u", "user", "hi"))
@@ -0,0 +1,230 @@
+import json
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+import utils.types as t
+from models.base_model import BaseModel
+from models.openai.deepseek import DeepseekChat
+from utils.small_utils import single_flight
+from utils.tools_parser import register_tool
+
+from fakes import chat_with, text_message
+
+TIMEOUT = 10
+
+executions = {"impure": 0, "pure": 0}
+
+
+class JoinWatcher:
+    """Считает вызовы, которые присоединились к уже выполняющемуся запросу (ведомые single_flight)"""
+
+    def __init__(self, monkeypatch):
+        self.followers = 0
+        self._condition = threading.Condition()
+        join = single_flight._join
+
+        def watched_join(key):
+            future, leader = join(key)
+            if not leader:
+                with self._condition:
+                    self.followers += 1
+                    self._condition.notify_all()
+            return future, leader
+
+        monkeypatch.setattr(single_flight, "_join", watched_join)
+
+    def wait_for(self, count: int) -> None:
+        with self._condition:
+            assert self._condition.wait_for(lambda: self.followers >= count, TIMEOUT)
+
+
+@pytest.fixture
+def watcher(monkeypatch):
+    executions.update(impure=0, pure=0)
+    return JoinWatcher(monkeypatch)
+
+
+@register_tool
+def impure_tool(value: int) -> int:
+    """
+    Инструмент с побочным эффектом.
+
+    :param value: Значение.
+    """
+    executions["impure"] += 1
+    return value
+
+
+@register_tool(pure=True)
+def pure_tool(value: int) -> int:
+    """
+    Чистый инструмент: ждёт, пока второй чат присоединится к его вызову.
+
+    :param value: Значение.
+    """
+    executions["pure"] += 1
+    pure_tool.watcher.wait_for(2)  # Первый ведомый - запрос к модели, второй - этот вызов
+    return value * 2
+
+
+TOOLS = {"impure_tool": impure_tool, "pure_tool": pure_tool}
+
+
+def _response():
+    tool_calls = [
+        SimpleNamespace(id="call1", function=SimpleNamespace(name="impure_tool", arguments=json.dumps({"value": 1}))),
+        SimpleNamespace(id="call2", function=SimpleNamespace(name="pure_tool", arguments=json.dumps({"value": 2}))),
+    ]
+    message = SimpleNamespace(content="calling", reasoning_content=None, tool_calls=tool_calls)
+    return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="tool_calls")],
+                           usage=None, model="deepseek-chat")
+
+
+def _model(watcher: JoinWatcher) -> tuple[DeepseekChat, list]:
+    """Модель без сети: запрос к провайдеру ждёт, пока к нему присоединится второй чат"""
+    model = DeepseekChat(api_key="test")
+    calls = []
+
+    def create(**request):
+        calls.append(request)
+        watcher.wait_for(1)
+        return _response()
+
+    async def acreate(**request):
+        calls.append(request)
+        await asyncio.to_thread(watcher.wait_for, 1)
+        return _response()
+
+    model.client = SimpleNamespace(base_url="https://fake", chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    model.async_client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=acreate)))
+    return model, calls
+
+
+def _check_sessions(deltas: list[list[t.Message]], calls: list) -> None:
+    assert len(calls) == 1
+    (first, first_results), (second, second_results) = deltas
+    assert first is not second and first.content is not second.content
+    assert first.model_dump() == second.model_dump()
+    for delta in (first_results, second_results):
+        results = [content.tool_result for content in delta.content]
+        assert [(result.id, result.text_content, result.is_error) for result in results] == [
+            ("call1", "1", False), ("call2", "4", False),
+        ]
+    assert executions == {"impure": 2, "pure": 1}
+
+
+def test_concurrent_generate_makes_one_request(watcher):
+    model, calls = _model(watcher)
+    pure_tool.watcher = watcher
+    with ThreadPoolExecutor(2) as pool:
+        futures = [pool.submit(model.generate, chat_with(text_message("u", "user", "sync")), None, TOOLS)
+                   for _ in range(2)]
+        deltas = [future.result(TIMEOUT)[1] for future in futures]
+    _check_sessions(deltas, calls)
+
+
+def test_concurrent_agenerate_makes_one_request(watcher):
+    model, calls = _model(watcher)
+    pure_tool.watcher = watcher
+
+    async def scenario():
+        return await asyncio.gather(*(
+            model.agenerate(chat_with(text_message("u", "user", "async")), None, TOOLS) for _ in range(2)
+        ))
+
+    deltas = [delta for _, delta in asyncio.run(scenario())]
+    _check_sessions(deltas, calls)
+
+
+class DirectModel(BaseModel):
+    """Модель, у которой запрос - переданная функция: проверяется только объединение"""
+
+    model_name = "direct"
+
+    def generate(self, history, tools_definition, tools_executable, extra_body=None):
+        raise NotImplementedError
+
+
+def _parsed() -> tuple[t.Message, list]:
+    call = t.ToolCall(id="c1", name="impure_tool", args={"value": 1})
+    message = t.Message(id="a", timestamp=text_message("x", "user", "").timestamp, role="assistant",
+                        content=[t.TextContent(text="hi"), t.ToolCallContent(tool_call=call)])
+    return message, [(call, None)]
+
+
+def test_followers_get_copies_with_relinked_tool_calls(watcher):
+    model = DirectModel()
+    shared = _parsed()
+
+    def request():
+        watcher.wait_for(1)
+        return shared
+
+    with ThreadPoolExecutor(2) as pool:
+        results = list(pool.map(lambda _: model._coalesced(request, "copies"), range(2)))
+
+    leader = next(result for result in results if result is shared)
+    follower = next(result for result in results if result is not shared)
+    message, tool_calls = follower
+    assert message is not leader[0] and message.model_dump() == leader[0].model_dump()
+    assert tool_calls[0][0] is message.content[1].tool_call
+    assert tool_calls[0][0] is not leader[1][0][0]
+
+
+def test_leader_error_reaches_every_waiter(watcher):
+    model = DirectModel()
+
+    def request():
+        watcher.wait_for(1)
+        raise ConnectionError("provider is down")
+
+    def call():
+        with pytest.raises(ConnectionError, match="provider is down"):
+            model._coalesced(request, "error")
+
+    with ThreadPoolExecutor(2) as pool:
+        for future in [pool.submit(call) for _ in range(2)]:
+            future.result(TIMEOUT)
+    assert single_flight.in_flight() == 0
+
+
+def test_cancelled_leader_does_not_cancel_followers(watcher):
+    model = DirectModel()
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def request():
+            await release.wait()
+            return _parsed()
+
+        leader = asyncio.create_task(model._acoalesced(request, "cancel"))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(model._acoalesced(request, "cancel"))
+        await asyncio.to_thread(watcher.wait_for, 1)
+
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        release.set()
+        message, tool_calls = await asyncio.wait_for(follower, TIMEOUT)
+        assert message.content[0].text == "hi" and tool_calls[0][0] is message.content[1].tool_call
+
+    asyncio.run(scenario())
+
+
+def test_coalescing_can_be_disabled():
+    model = DirectModel()
+    model.coalesce_requests = False
+    calls = []
+
+    def request():
+        calls.append(1)
+        return _parsed()
+
+    assert model._coalesced(request, "off") is not model._coalesced(request, "off")
+    assert len(calls) == 2
@@ -0,0 +1,137 @@
+from datetime import datetime, timezone
+
+import pytest
+
+import utils.types as t
+from utils.analytics import ColumnarExporter, TABLES, export_chats
+
+from fakes import timestamp
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+
+def _chat() -> t.ChatData:
+    image = t.Asset(id="img", type="image", local_path="media/img.png", mime_type="image/png", size_bytes=100)
+    document = t.Asset(
+        id="doc", type="document", local_path="media/doc.pdf", mime_type="application/pdf", size_bytes=2000,
+        ocr_text="extracted", cloud_refs=t.CloudRefs(genai=t.CloudRef(
+            filename="files/doc", expires_at=datetime(2026, 1, 3, tzinfo=timezone.utc),
+        )),
+    )
+    overflow = t.Asset(id="spill", type="document", local_path="media/spill.txt", mime_type="text/plain")
+    return t.ChatData(
+        chat_metadata=t.ChatMetadata(config=t.ChatConfig(provider="openai", model="deepseek-chat")),
+        messages=[
+            t.Message(id="u1", timestamp=timestamp(0), role="user", content=[
+                t.TextContent(text="hello"), t.MediaContent(assets=[image, document]),
+            ]),
+            t.Message(id="a1", timestamp=timestamp(1), role="assistant", content=[
+                t.ThoughtContent(text="think", signature="c2ln"),
+                t.ToolCallContent(tool_call=t.ToolCall(id="c1", name="search", args={"q": "x", "n": 2})),
+            ], metadata=t.MessageMetadata(
+                model="deepseek-chat", model_class="openai", finish_reason="tool_calls", latency_ms=120,
+                usage=t.UsageStats(input_tokens=10, output_tokens=5, total_tokens=15, cache_hit_tokens=8),
+            )),
+            # Время без часового пояса экспортируется как UTC
+            t.Message(id="r1", timestamp=datetime(2026, 1, 1, 0, 0, 2), role="tool", content=[
+                t.ToolResultContent(tool_result=t.ToolResult(
+                    id="c1", name="search", text_content="found it", overflow_asset=overflow,
+                )),
+            ]),
+        ],
+        summaries=[t.SummaryCheckpoint(id="s1", timestamp=timestamp(3), until_message_id="r1", messages_count=3,
+                                       text="summary", usage=t.UsageStats(input_tokens=50, output_tokens=7))],
+    )
+
+
+def _read(output_dir, table: str, export_format: str) -> "pa.Table":
+    path = output_dir / f"{table}.{export_format}"
+    if export_format == "parquet":
+        return pq.read_table(path)
+    with pa.memory_map(str(path)) as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+@pytest.mark.parametrize("export_format", ["parquet", "arrow"])
+def test_export_tables_and_join_keys(tmp_path, export_format):
+    rows = export_chats([("c1", _chat())], tmp_path, export_format=export_format)
+    assert rows == {"chats": 1, "messages": 3, "contents": 5, "tool_calls": 1, "tool_results": 1, "assets": 3,
+                    "summaries": 1}
+    tables = {table: _read(tmp_path, table, export_format) for table in TABLES}
+    assert {table: tables[table].num_rows for table in TABLES} == rows
+
+    chat = tables["chats"].to_pylist()[0]
+    assert (chat["provider"], chat["model"], chat["messages"], chat["summaries"]) == ("openai", "deepseek-chat", 3, 1)
+    assert chat["first_timestamp"] == timestamp(0)
+    assert chat["last_timestamp"] == timestamp(2)
+
+    messages = {row["message_id"]: row for row in tables["messages"].to_pylist()}
+    assert [messages[key]["message_position"] for key in ("u1", "a1", "r1")] == [0, 1, 2]
+    assert messages["a1"]["cache_hit_tokens"] == 8 and messages["a1"]["latency_ms"] == 120
+    assert messages["u1"]["input_tokens"] is None and messages["u1"]["text_chars"] == 5
+    assert messages["r1"]["timestamp"] == timestamp(2)
+
+    contents = tables["contents"].to_pylist()
+    assert [(row["message_id"], row["content_position"], row["type"]) for row in contents] == [
+        ("u1", 0, "text"), ("u1", 1, "media"), ("a1", 0, "thought"), ("a1", 1, "tool_call"), ("r1", 0, "tool_result"),
+    ]
+    assert contents[2]["has_signature"] is True and contents[1]["assets"] == 2
+
+    call = tables["tool_calls"].to_pylist()[0]
+    result = tables["tool_results"].to_pylist()[0]
+    assert (call["chat_id"], call["call_id"]) == (result["chat_id"], result["call_id"]) == ("c1", "c1")
+    assert call["args_json"] == '{"q": "x", "n": 2}'
+    assert result["overflow_asset_id"] == "spill" and result["text_chars"] == 8
+
+    assets = {row["asset_id"]: row for row in tables["assets"].to_pylist()}
+    assert {key: row["origin"] for key, row in assets.items()} == {"img": "media", "doc": "media", "spill": "overflow"}
+    assert assets["doc"]["has_ocr_text"] and assets["doc"]["genai_filename"] == "files/doc"
+    assert assets["doc"]["genai_expires_at"] == datetime(2026, 1, 3, tzinfo=timezone.utc)
+
+    summary = tables["summaries"].to_pylist()[0]
+    assert (summary["until_message_id"], summary["messages_count"], summary["output_tokens"]) == ("r1", 3, 7)
+
+
+def test_schema_is_stable_for_empty_and_textless_export(tmp_path):
+    with ColumnarExporter(tmp_path / "full") as exporter:
+        exporter.add_chat("c1", _chat())
+    with ColumnarExporter(tmp_path / "empty"):
+        pass
+    with ColumnarExporter(tmp_path / "textless", include_text=False) as exporter:
+        exporter.add_chat("c1", _chat())
+
+    for table in TABLES:
+        schema = pq.read_schema(tmp_path / "full" / f"{table}.parquet")
+        assert pq.read_schema(tmp_path / "empty" / f"{table}.parquet") == schema
+        assert pq.read_schema(tmp_path / "textless" / f"{table}.parquet") == schema
+    assert pq.read_schema(tmp_path / "full" / "messages.parquet").field("timestamp").type == pa.timestamp("us", "UTC")
+
+    contents = pq.read_table(tmp_path / "textless" / "contents.parquet").to_pylist()
+    assert all(row["text"] is None for row in contents)
+    assert contents[0]["text_chars"] == 5
+
+
+def test_add_file_streams_and_matches_add_chat(tmp_path):
+    path = tmp_path / "c1.json"
+    path.write_text(_chat().model_dump_json(), encoding="utf-8")
+    with ColumnarExporter(tmp_path / "from_file", row_group_size=2) as exporter:
+        assert exporter.add_file(path) == 3
+    export_chats([("c1", _chat())], tmp_path / "from_chat")
+
+    for table in TABLES:
+        from_file = pq.read_table(tmp_path / "from_file" / f"{table}.parquet").drop_columns(
+            ["source"] if table == "chats" else [])
+        from_chat = pq.read_table(tmp_path / "from_chat" / f"{table}.parquet").drop_columns(
+            ["source"] if table == "chats" else [])
+        assert from_file.equals(from_chat)
+    assert pq.ParquetFile(tmp_path / "from_file" / "contents.parquet").num_row_groups == 3
+
+
+def test_closed_exporter_rejects_chats(tmp_path):
+    exporter = ColumnarExporter(tmp_path)
+    exporter.close()
+    with pytest.raises(RuntimeError):
+        exporter.add_chat("c1", _chat())
+    with pytest.raises(ValueError):
+        ColumnarExporter(tmp_path, export_format="csv")
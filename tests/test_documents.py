@@ -0,0 +1,59 @@
+import sys
+import subprocess
+from types import SimpleNamespace
+
+import httpx
+from openai import APIError
+
+import utils.types as t
+from models.openai.kimi import KimiK2p6
+from models.openai.deepseek import DeepseekChat
+from utils.documents import DocumentExtractor
+
+from conftest import ROOT
+
+
+def _asset(tmp_path, name: str, data: bytes, mime_type: str) -> t.Asset:
+    path = tmp_path / name
+    path.write_bytes(data)
+    return t.Asset(id=name, type="document", local_path=str(path), mime_type=mime_type, size_bytes=len(data))
+
+
+def test_models_import_without_pypdf():
+    code = "import sys, models.openai_base_model; print('pypdf' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "False"
+
+
+def test_local_extraction_is_cached(tmp_path):
+    extractor = DocumentExtractor(cache_folder=str(tmp_path / "cache"))
+    asset = _asset(tmp_path, "a.txt", "привет".encode("cp1251"), "text/plain")
+    assert extractor.extract(asset) == "привет"
+    assert asset.ocr_text == "привет"
+
+    again = _asset(tmp_path, "b.txt", "привет".encode("cp1251"), "text/plain")
+    assert extractor.extract(again, provider_extract=lambda asset: "не вызывается") == "привет"
+
+
+def test_failed_local_extraction_is_recorded_on_asset(tmp_path):
+    model = DeepseekChat(api_key="test")
+    asset = _asset(tmp_path, "a.bin", b"\x00binary", "application/octet-stream")
+    text = model._document_text(asset)
+    assert text.startswith("(System: the text of this document could not be extracted")
+    assert asset.ocr_text == text
+
+
+def test_failed_provider_extraction_is_not_retried(tmp_path):
+    model = KimiK2p6(api_key="test")
+    uploads = []
+
+    def create(file, purpose):
+        uploads.append(purpose)
+        raise APIError("upload failed", httpx.Request("POST", "https://files.invalid"), body=None)
+
+    model.client = SimpleNamespace(files=SimpleNamespace(create=create))
+    asset = _asset(tmp_path, "a.pdf", b"%PDF-1.4 broken", "application/pdf")
+    first = model._document_text(asset)
+    assert "Kimi" in first
+    assert model._document_text(asset) == first
+    assert uploads == ["file-extract"]
@@ -0,0 +1,128 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import utils.types as t
+from models.genai.gemini import Gemini3_1FlashLite
+from utils.media import GenaiUploadRegistry, genai_uploads
+
+
+def _file(name: str, expires_in: timedelta, sha256_hash: str | None = None):
+    return SimpleNamespace(
+        name=name, uri=f"https://files.invalid/{name}", expiration_time=datetime.now(timezone.utc) + expires_in,
+        state=SimpleNamespace(name="ACTIVE"), sha256_hash=sha256_hash, size_bytes=10, error=None,
+    )
+
+
+class FakeFilesApi:
+    """Google Files API в памяти: считает загрузки и запросы files.get"""
+
+    def __init__(self):
+        self.files: dict[str, SimpleNamespace] = {}
+        self.uploads = 0
+        self.gets = 0
+
+    def upload(self, file):
+        self.uploads += 1
+        uploaded = _file(f"files/u{self.uploads}", timedelta(hours=48))
+        self.files[uploaded.name] = uploaded
+        return uploaded
+
+    def get(self, name):
+        self.gets += 1
+        return self.files[name]
+
+    def list(self):
+        return list(self.files.values())
+
+
+def _model() -> tuple[Gemini3_1FlashLite, FakeFilesApi]:
+    # Свой ключ - свой раздел общего реестра genai_uploads, тесты не видят загрузок друг друга
+    model = Gemini3_1FlashLite(api_key=f"test-{uuid.uuid4()}")
+    files = FakeFilesApi()
+    model.client = SimpleNamespace(files=files)
+    return model, files
+
+
+def _asset(tmp_path, name: str, data: bytes, ref: t.CloudRef | None = None) -> t.Asset:
+    path = tmp_path / name
+    path.write_bytes(data)
+    return t.Asset(id=name, type="video", local_path=str(path), mime_type="video/mp4", size_bytes=len(data),
+                   cloud_refs=t.CloudRefs(genai=ref) if ref else None)
+
+
+def test_registry_safety_margin():
+    registry = GenaiUploadRegistry(safety_margin=timedelta(hours=1))
+    now = datetime.now(timezone.utc)
+    assert not registry.is_fresh(None)
+    assert not registry.is_fresh(now + timedelta(minutes=59))
+    assert registry.is_fresh(now + timedelta(minutes=61))
+    # Время без часового пояса считается местным, а не UTC
+    assert registry.is_fresh((now + timedelta(hours=2)).astimezone().replace(tzinfo=None))
+
+    assert registry.is_usable("acc", "files/a", now + timedelta(hours=2))
+    assert not registry.is_usable("acc", "files/a", now + timedelta(minutes=30))
+    registry.forget("files/a")
+    assert not registry.is_usable("acc", "files/a", now + timedelta(hours=2))
+
+
+def test_registry_lookup_by_content_and_account():
+    registry = GenaiUploadRegistry(safety_margin=timedelta(hours=1))
+    registry.remember("acc", "d1", _file("files/a", timedelta(hours=40)))
+    registry.remember("acc", "d2", _file("files/b", timedelta(minutes=10)))
+
+    assert registry.lookup("acc", "d1").filename == "files/a"
+    assert registry.lookup("other", "d1") is None
+    assert registry.lookup("acc", "d2") is None  # Истекает раньше safety_margin
+    registry.forget("files/a")
+    assert registry.lookup("acc", "d1") is None
+
+
+def test_reconcile_forgets_deleted_and_adopts_listed_files():
+    registry = GenaiUploadRegistry()
+    expires = datetime.now(timezone.utc) + timedelta(hours=40)
+    assert registry.is_usable("acc", "files/gone", expires)
+    listed = _file("files/listed", timedelta(hours=40), sha256_hash="ab" * 32)
+    client = SimpleNamespace(files=SimpleNamespace(list=lambda: [listed]))
+
+    assert registry.reconcile("acc", client) == 1
+    assert registry.is_missing("files/gone")
+    assert registry.lookup("acc", "ab" * 32).filename == "files/listed"
+
+
+def test_model_trusts_fresh_reference_without_requests(tmp_path):
+    model, files = _model()
+    fresh = t.CloudRef(filename="files/known", uri="https://files.invalid/files/known",
+                       expires_at=datetime.now(timezone.utc) + timedelta(hours=30))
+    asset = _asset(tmp_path, "a.mp4", b"video", fresh)
+
+    model._process_asset(asset)
+    assert files.uploads == 0 and files.gets == 0
+    assert asset.cloud_refs.genai.filename == "files/known"
+    assert asset.cloud_refs.genai.last_used_at is not None
+
+
+def test_model_reuploads_reference_inside_margin_once_per_content(tmp_path):
+    model, files = _model()
+    expiring = t.CloudRef(filename="files/old", uri="https://files.invalid/files/old",
+                          expires_at=datetime.now(timezone.utc) + timedelta(minutes=20))
+    first = _asset(tmp_path, "a.mp4", b"same video", expiring)
+    second = _asset(tmp_path, "b.mp4", b"same video")
+
+    model._process_asset(first)
+    model._process_asset(second)
+    assert files.uploads == 1
+    assert first.cloud_refs.genai.filename == second.cloud_refs.genai.filename == "files/u1"
+    assert genai_uploads.is_fresh(first.cloud_refs.genai.expires_at)
+
+
+def test_model_checks_reference_without_expiry_once(tmp_path):
+    model, files = _model()
+    files.files["files/legacy"] = _file("files/legacy", timedelta(hours=30))
+    asset = _asset(tmp_path, "a.mp4", b"legacy", t.CloudRef(filename="files/legacy"))
+
+    model._process_asset(asset)
+    assert files.gets == 1 and files.uploads == 0
+    assert asset.cloud_refs.genai.expires_at is not None
+    model._process_asset(asset)
+    assert files.gets == 1
@@ -0,0 +1,60 @@
+import io
+import os
+
+import pytest
+
+import utils.types as t
+from utils.media import ImageProfile, normalize_image, image_normalizer
+
+Image = pytest.importorskip("PIL.Image")
+
+PROFILE = ImageProfile(name="test", max_side=64)
+
+
+def _noise(width: int, height: int) -> "Image.Image":
+    return Image.frombytes("RGB", (width, height), os.urandom(width * height * 3))
+
+
+def _asset(tmp_path, name: str, image: "Image.Image", image_format: str, **save_options) -> tuple[t.Asset, bytes]:
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, **save_options)
+    path = tmp_path / name
+    path.write_bytes(buffer.getvalue())
+    mime_type = f"image/{image_format.lower()}"
+    return t.Asset(id=name, type="image", local_path=str(path), mime_type=mime_type), buffer.getvalue()
+
+
+def _size(data: bytes) -> tuple[int, int]:
+    with Image.open(io.BytesIO(data)) as image:
+        return image.size
+
+
+def test_small_png_is_sent_losslessly(tmp_path):
+    # Шум в PNG весит больше, чем в JPEG q85, но скриншот всё равно не перекодируется
+    asset, original = _asset(tmp_path, "screen.png", _noise(48, 32), "PNG")
+    assert normalize_image(asset, PROFILE) == (original, "image/png")
+
+
+def test_large_png_is_downscaled(tmp_path):
+    asset, original = _asset(tmp_path, "big.png", _noise(200, 100), "PNG")
+    data, mime_type = normalize_image(asset, PROFILE)
+    assert _size(data) == (64, 32) and len(data) < len(original)
+
+
+def test_exif_orientation_is_applied(tmp_path):
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Повернуть на 90° по часовой стрелке
+    image = Image.new("RGB", (40, 20), "white")
+    asset, _ = _asset(tmp_path, "photo.jpg", image, "JPEG", exif=exif, quality=10)
+    data, mime_type = normalize_image(asset, PROFILE)
+    assert mime_type == "image/jpeg"
+    assert _size(data) == (20, 40)
+
+
+def test_variants_cache_is_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(image_normalizer, "_variants_cache", type(image_normalizer._variants_cache)())
+    monkeypatch.setattr(image_normalizer, "_MAX_VARIANTS", 2)
+    for index in range(3):
+        asset, _ = _asset(tmp_path, f"{index}.png", _noise(8, 8), "PNG")
+        normalize_image(asset, PROFILE)
+    assert len(image_normalizer._variants_cache) == 2
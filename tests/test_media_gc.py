@@ -0,0 +1,147 @@
+import os
+import time
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+import utils.types as t
+from utils.media import MediaGarbageCollector, collect_references
+from utils.scheduler import ReactScheduler
+from web_api_wrapper import ChatService, SessionStore, InMemorySessionStore
+
+from fakes import FakeModel
+
+HOUR = 3600
+
+
+def _file(path, age_seconds: float = 2 * HOUR, size: int = 10) -> str:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    stamp = time.time() - age_seconds
+    os.utime(path, (stamp, stamp))
+    return str(path)
+
+
+def _asset(path: str, genai: t.CloudRef | None = None) -> t.Asset:
+    return t.Asset(id=os.path.basename(path), type="image", local_path=path, mime_type="image/png",
+                   cloud_refs=t.CloudRefs(genai=genai) if genai else None)
+
+
+def _chat(*assets: t.Asset, last_message_at: datetime | None = None) -> t.ChatData:
+    return t.ChatData(messages=[t.Message(
+        id="m", timestamp=last_message_at or datetime.now(timezone.utc), role="user",
+        content=[t.MediaContent(assets=list(assets))],
+    )])
+
+
+def test_sweep_local_deletes_only_unreferenced_old_files(tmp_path):
+    used = _file(tmp_path / "a" / "used.png")
+    orphan = _file(tmp_path / "a" / "orphan.png")
+    young = _file(tmp_path / "a" / "young.png", age_seconds=60)
+    kept_variant = _file(tmp_path / "a" / f"{'0' * 32}.genai.jpg")
+    lonely = _file(tmp_path / "b" / "lonely.png")
+    lonely_variant = _file(tmp_path / "b" / f"{'1' * 32}.openai.jpg")
+    stale_tmp = _file(tmp_path / ".tmp" / "worker.bin")
+    document_cache = _file(tmp_path / ".documents" / "cache.txt")
+
+    gc = MediaGarbageCollector(root=str(tmp_path))
+    references = collect_references([_chat(_asset(used))])
+
+    deleted, freed = gc.sweep_local(references, dry_run=True)
+    assert sorted(deleted) == sorted([orphan, lonely, lonely_variant, stale_tmp])
+    assert freed == 40 and os.path.exists(orphan)
+
+    deleted, _ = gc.sweep_local(references)
+    assert sorted(deleted) == sorted([orphan, lonely, lonely_variant, stale_tmp])
+    for path in (used, young, kept_variant, document_cache):
+        assert os.path.exists(path)
+    for path in deleted:
+        assert not os.path.exists(path)
+
+
+def _remote_file(name: str, size: int, created_hours_ago: float):
+    return SimpleNamespace(name=name, size_bytes=size,
+                           create_time=datetime.now(timezone.utc) - timedelta(hours=created_hours_ago))
+
+
+def test_evict_remote_between_watermarks():
+    files = [
+        _remote_file("files/recent", 30, 10),
+        _remote_file("files/orphan", 20, 1),
+        _remote_file("files/stale", 30, 5),
+        _remote_file("files/other", 15, 3),
+    ]
+    deleted = []
+    client = SimpleNamespace(files=SimpleNamespace(list=lambda: files, delete=lambda name: deleted.append(name)))
+    now = datetime.now(timezone.utc)
+    chats = [_chat(
+        _asset("/m/recent.png", t.CloudRef(filename="files/recent", last_used_at=now)),
+        _asset("/m/stale.png", t.CloudRef(filename="files/stale", last_used_at=now - timedelta(hours=4))),
+        _asset("/m/other.png", t.CloudRef(filename="files/other", last_used_at=now - timedelta(hours=2))),
+    )]
+    gc = MediaGarbageCollector(remote_quota_bytes=100, remote_high_watermark=0.9, remote_low_watermark=0.5)
+
+    # 95 из 100 байт занято: освобождаем до 50, сначала загрузку без ссылок, затем давно не использованные
+    assert gc.evict_remote(client, collect_references(chats)) == ["files/orphan", "files/stale"]
+    assert deleted == ["files/orphan", "files/stale"]
+
+    files[:] = files[:1]
+    assert gc.evict_remote(client, collect_references(chats)) == []
+
+
+def test_refresh_expiring_uploads_shared_asset_once():
+    now = datetime.now(timezone.utc)
+    expiring = t.CloudRef(filename="files/old", expires_at=now + timedelta(hours=1))
+    fresh = t.CloudRef(filename="files/fresh", expires_at=now + timedelta(hours=30))
+    uploads = []
+
+    def refresh_upload(asset):
+        uploads.append(asset.id)
+        asset.cloud_refs.genai = t.CloudRef(filename="files/new", expires_at=now + timedelta(hours=48))
+        return asset
+
+    model = SimpleNamespace(refresh_upload=refresh_upload)
+    path = __file__  # Файл ассета должен существовать
+    active = _chat(_asset(path, expiring.model_copy()), _asset(path, fresh))
+    other = _chat(_asset(path, expiring.model_copy()))
+    inactive = _chat(_asset(path, expiring.model_copy()), last_message_at=now - timedelta(days=5))
+
+    count, changed = MediaGarbageCollector().refresh_expiring(model, [active, other, inactive])
+    assert count == 1 and len(uploads) == 1
+    assert changed == [active, other]
+    assert other.messages[0].content[0].assets[0].cloud_refs.genai.filename == "files/new"
+    assert inactive.messages[0].content[0].assets[0].cloud_refs.genai.filename == "files/old"
+
+
+def test_session_store_requires_list_ids():
+    class NoListing(SessionStore):
+        async def get(self, chat_id):
+            return None
+
+        async def save(self, chat_id, chat):
+            pass
+
+        async def delete(self, chat_id):
+            return False
+
+    with pytest.raises(TypeError):
+        NoListing()
+
+
+def test_service_collects_garbage_of_all_stored_chats(tmp_path):
+    used = _file(tmp_path / "used.png")
+    orphan = _file(tmp_path / "orphan.png")
+
+    async def scenario():
+        store = InMemorySessionStore()
+        await store.save("c1", _chat(_asset(used)))
+        service = ChatService({"fake": FakeModel()}, store=store, media_gc=MediaGarbageCollector(root=str(tmp_path)),
+                              scheduler=ReactScheduler(tools_definition=lambda model, history: None))
+        return await service.collect_garbage()
+
+    report = asyncio.run(scenario())
+    assert report.deleted_files == [orphan]
+    assert os.path.exists(used) and not os.path.exists(orphan)
@@ -0,0 +1,45 @@
+import os
+
+import pytest
+
+from utils.media import MediaWriter, media_writer
+from utils.tool_runner import adopt_media_file
+
+
+@pytest.mark.parametrize("fsync", ["never", "always"])
+def test_save_and_move_land_at_path(tmp_path, fsync):
+    writer = MediaWriter(root=str(tmp_path / "media"), workers=2, fsync=fsync)
+    saved = writer.path_for("saved", "image/png")
+    writer.save(saved, b"png bytes")
+
+    src = tmp_path / "worker.bin"
+    src.write_bytes(b"moved bytes")
+    moved = writer.path_for("moved", "video/mp4")
+    future = writer.move(str(src), moved)
+    assert writer.is_pending(moved) or future.done()
+
+    writer.wait(saved)
+    writer.wait(moved)
+    with open(saved, "rb") as f:
+        assert f.read() == b"png bytes"
+    with open(moved, "rb") as f:
+        assert f.read() == b"moved bytes"
+    assert not src.exists()
+    assert moved.startswith(str(tmp_path / "media"))
+
+
+def test_failed_move_is_reported_to_waiters(tmp_path):
+    writer = MediaWriter(root=str(tmp_path), workers=1, fsync="never")
+    path = writer.path_for("missing", "text/plain")
+    writer.move(str(tmp_path / "does-not-exist"), path)
+    with pytest.raises(FileNotFoundError):
+        writer.wait(path)
+
+
+def test_adopt_media_file_moves_into_media_folder(tmp_path):
+    src = tmp_path / "result.bin"
+    src.write_bytes(b"\x00" * 100)
+    asset = adopt_media_file(str(src), "application/octet-stream")
+    media_writer.wait(asset.local_path)
+    assert os.path.getsize(asset.local_path) == 100 == asset.size_bytes
+    assert asset.type == "document" and not src.exists()
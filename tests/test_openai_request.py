@@ -0,0 +1,29 @@
+import utils.types as t
+from models.openai.kimi import KimiK2p6
+
+from fakes import chat_with, text_message, timestamp
+
+
+def _messages(model: KimiK2p6, chat: t.ChatData) -> list[dict]:
+    return model.build_request(chat, None)["messages"]
+
+
+def test_model_system_prompt_is_not_sent():
+    model = KimiK2p6(api_key="test")
+    assert model.system_prompt
+    chat = chat_with(text_message("u1", "user", "hi", 0))
+    assert [message["role"] for message in _messages(model, chat)] == ["user"]
+
+    with_system = chat_with(text_message("s", "system", "be brief", 0), text_message("u1", "user", "hi", 1))
+    assert _messages(model, with_system)[0] == {"role": "system", "content": "be brief"}
+
+
+def test_summary_goes_into_system_message():
+    model = KimiK2p6(api_key="test")
+    chat = chat_with(*(text_message(f"m{i}", ("user", "assistant")[i % 2], f"text {i}", i) for i in range(3)))
+    chat.summaries.append(t.SummaryCheckpoint(id="s1", timestamp=timestamp(5), until_message_id="m1",
+                                              messages_count=2, text="earlier"))
+    messages = _messages(model, chat)
+    assert [message["role"] for message in messages] == ["system", "user"]
+    assert "earlier" in messages[0]["content"]
+    assert model.system_prompt not in messages[0]["content"]
@@ -0,0 +1,60 @@
+import os
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from utils.media import media_writer
+from utils.tool_runner import ToolProcessPool, run_tool, arun_tool, process_pool
+
+from process_tools import render_bytes, worker_pid
+
+
+@pytest.fixture
+def pool():
+    pool = ToolProcessPool(max_workers=1, max_calls_per_worker=2, max_worker_memory_mb=10 ** 6)
+    yield pool
+    pool.shutdown()
+
+
+def test_worker_restarts_after_max_calls(pool):
+    pids = [pool.call(worker_pid, (), {}) for _ in range(4)]
+    assert pids[0] == pids[1] and pids[2] == pids[3]
+    assert pids[1] != pids[2] and os.getpid() not in pids
+
+
+def test_pool_recycles_after_memory_threshold(pool):
+    pool.call(worker_pid, (), {})
+    executor = pool._executor
+    assert executor is not None
+
+    pool._max_worker_memory_mb = 1  # Любой воркер занимает больше мегабайта
+    first = pool.call(worker_pid, (), {})
+    assert pool._executor is None
+    assert pool.call(worker_pid, (), {}) != first
+
+
+@pytest.mark.parametrize("platform, max_rss, expected", [("linux", 2048, 2.0), ("darwin", 2 * 1024 * 1024, 2.0)])
+def test_peak_rss_units(monkeypatch, platform, max_rss, expected):
+    monkeypatch.setattr(process_pool.sys, "platform", platform)
+    monkeypatch.setattr(process_pool, "resource", SimpleNamespace(
+        RUSAGE_SELF=0, getrusage=lambda who: SimpleNamespace(ru_maxrss=max_rss),
+    ))
+    assert process_pool._peak_rss_mb() == expected
+
+
+def _check_media_result(content) -> None:
+    assert not content.tool_result.is_error, content.tool_result.text_content
+    assert content.tool_result.text_content == "rendered 1024"
+    asset = content.assets[0]
+    media_writer.wait(asset.local_path)
+    with open(asset.local_path, "rb") as f:
+        assert f.read() == bytes(range(256)) * 4
+    assert asset.size_bytes == 1024 and asset.mime_type == "application/octet-stream"
+
+
+def test_media_tool_round_trip():
+    tools = {"render_bytes": render_bytes}
+    _check_media_result(run_tool(tools, "render_bytes", {"size": 1024}, "c1"))
+
+    _check_media_result(asyncio.run(arun_tool(tools, "render_bytes", {"size": 1024}, "c2")))
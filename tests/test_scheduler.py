@@ -0,0 +1,152 @@
+import asyncio
+
+import pytest
+
+import utils.types as t
+from utils.scheduler import ReactScheduler, SchedulerOverloaded
+
+from fakes import chat_with, text_message, timestamp
+
+
+class LoopModel:
+    """
+    Модель без сети: первые tool_steps шагов заканчиваются результатом инструмента, следующий - ответом.
+    Каждый шаг записывается в общий журнал, пока он выполняется, модель считается занятой у своего vendor
+    """
+
+    provider = "openai"
+
+    def __init__(self, name: str, journal: list[str], tool_steps: int = 0, vendor: str = "fake",
+                 busy: dict[str, list[int]] | None = None, gate: asyncio.Event | None = None):
+        self.name = name
+        self.journal = journal
+        self.tool_steps = tool_steps
+        self.vendor = vendor
+        self.busy = busy if busy is not None else {}
+        self.gate = gate
+        self.steps = 0
+
+    async def agenerate(self, history, tools_definition=None, tools_executable=None, extra_body=None):
+        self.journal.append(self.name)
+        current, peak = self.busy.setdefault(self.vendor, [0, 0])
+        self.busy[self.vendor] = [current + 1, max(peak, current + 1)]
+        try:
+            if self.gate is not None:
+                await self.gate.wait()
+            await asyncio.sleep(0)
+        finally:
+            self.busy[self.vendor][0] -= 1
+        self.steps += 1
+        role = "tool" if self.steps <= self.tool_steps else "assistant"
+        message = t.Message(id=f"{self.name}{self.steps}", timestamp=timestamp(self.steps), role=role,
+                            content=[t.TextContent(text=self.name)])
+        history.messages.append(message)
+        return history, [message]
+
+
+def _scheduler(**kwargs) -> ReactScheduler:
+    return ReactScheduler(tools_definition=lambda model, history: None, **kwargs)
+
+
+def _turn(scheduler: ReactScheduler, model: LoopModel, lane: str = "interactive", **kwargs):
+    chat = chat_with(text_message("u", "user", model.name))
+    return scheduler.run_turn(model.name, model, chat, lane=lane, tools_executable={}, **kwargs)
+
+
+def test_long_session_does_not_starve_others():
+    async def scenario():
+        journal, gate = [], asyncio.Event()
+        scheduler = _scheduler(max_workers=1, max_steps=50)
+        greedy = asyncio.create_task(_turn(scheduler, LoopModel("A", journal, tool_steps=20, gate=gate)))
+        others = [asyncio.create_task(_turn(scheduler, LoopModel(name, journal, tool_steps=1)))
+                  for name in ("B", "C")]
+        while scheduler.waiting < 2:  # A занял единственный воркер, B и C ждут
+            await asyncio.sleep(0)
+        gate.set()
+        results = await asyncio.gather(greedy, *others)
+        return journal, results
+
+    journal, results = asyncio.run(scenario())
+    assert journal[:7] == ["A", "B", "C", "A", "B", "C", "A"]
+    assert [(result.steps, result.finished) for result in results] == [(21, True), (2, True), (2, True)]
+
+
+def test_batch_progresses_under_interactive_weight():
+    async def scenario():
+        journal = []
+        scheduler = _scheduler(max_workers=1, max_steps=100, interactive_weight=2)
+        turns = [_turn(scheduler, LoopModel(name, journal, tool_steps=10)) for name in ("I1", "I2")]
+        turns.append(_turn(scheduler, LoopModel("B", journal, tool_steps=10), lane="batch"))
+        await asyncio.gather(*turns)
+        return journal
+
+    journal = asyncio.run(scenario())
+    window = journal[:18]  # Пока обе полосы заняты
+    assert window.count("B") == 6
+    streak = longest = 0
+    for name in window:
+        streak = 0 if name == "B" else streak + 1
+        longest = max(longest, streak)
+    assert longest <= 2
+
+
+def test_provider_limits_hold():
+    async def scenario():
+        journal, busy = [], {}
+        scheduler = _scheduler(max_workers=10, provider_limits={"slow": 1})
+        models = [LoopModel(f"s{i}", journal, tool_steps=2, vendor="slow", busy=busy) for i in range(3)]
+        models += [LoopModel(f"f{i}", journal, tool_steps=2, vendor="fast", busy=busy) for i in range(3)]
+        await asyncio.gather(*(_turn(scheduler, model) for model in models))
+        return busy, scheduler
+
+    busy, scheduler = asyncio.run(scenario())
+    assert busy["slow"][1] == 1
+    assert busy["fast"][1] == 3
+    assert scheduler.stats()["in_flight"] == {} and scheduler.active == 0
+
+
+def test_overload_and_cancelled_waiter():
+    async def scenario():
+        journal, gate = [], asyncio.Event()
+        scheduler = _scheduler(max_workers=1, max_waiting=1)
+        running = asyncio.create_task(_turn(scheduler, LoopModel("A", journal, gate=gate)))
+        waiting = asyncio.create_task(_turn(scheduler, LoopModel("B", journal)))
+        while scheduler.waiting < 1:
+            await asyncio.sleep(0)
+        assert scheduler.active == 1 and scheduler.is_overloaded()
+        with pytest.raises(SchedulerOverloaded):
+            await _turn(scheduler, LoopModel("C", journal))
+
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert scheduler.waiting == 0 and not scheduler.is_overloaded()
+
+        gate.set()
+        await running
+        assert scheduler.active == 0
+        result = await _turn(scheduler, LoopModel("D", journal))
+        return journal, result
+
+    journal, result = asyncio.run(scenario())
+    assert journal == ["A", "D"] and result.finished
+
+
+def test_max_steps_and_on_step_stop_the_turn():
+    async def scenario():
+        journal = []
+        scheduler = _scheduler(max_workers=2, max_steps=3)
+        limited = await _turn(scheduler, LoopModel("A", journal, tool_steps=10))
+
+        seen = []
+
+        async def on_step(delta):
+            seen.append(delta[-1].id)
+            return len(seen) < 2
+
+        stopped = await _turn(scheduler, LoopModel("B", journal, tool_steps=10), max_steps=10, on_step=on_step)
+        return limited, stopped, seen
+
+    limited, stopped, seen = asyncio.run(scenario())
+    assert (limited.steps, limited.finished, len(limited.messages)) == (3, False, 3)
+    assert (stopped.steps, stopped.finished) == (2, False) and seen == ["B1", "B2"]
@@ -0,0 +1,88 @@
+from datetime import timedelta
+
+import utils.types as t
+from utils.search import ChatSearchIndex, fts_query
+
+from fakes import chat_with, text_message, timestamp
+
+
+def _chat(count: int) -> t.ChatData:
+    roles = ("user", "assistant")
+    return chat_with(*(text_message(f"m{i}", roles[i % 2], f"word{i} common", i) for i in range(count)))
+
+
+def _ids(hits) -> list[str]:
+    return sorted(hit.message_id for hit in hits)
+
+
+def test_fts_query_quotes_terms():
+    assert fts_query('счёт "фактура" OR') == '"счёт" """фактура""" "OR"'
+    assert fts_query("док*  *") == '"док"* "*"'
+
+
+def test_index_file_backfills_history_before_live_deltas(tmp_path):
+    chat = _chat(6)
+    path = tmp_path / "chat.json"
+    path.write_text(chat.model_dump_json(), encoding="utf-8")
+    index = ChatSearchIndex(tmp_path / "search.sqlite")
+
+    # Живые дельты пришли раньше, чем файл с началом истории
+    index.submit("c1", chat.messages[4:])
+    index.index_file(path, "c1")
+    index.index_file(path, "c1")
+    assert index.flush(10)
+
+    assert _ids(index.search("common", limit=100)) == [f"m{i}" for i in range(6)]
+    assert len(index.search("word0")) == 1
+    index.close()
+
+
+def test_submit_deduplicates_and_delete_removes(tmp_path):
+    chat = _chat(4)
+    index = ChatSearchIndex(tmp_path / "search.sqlite")
+    index.submit("c1", chat.messages)
+    index.submit("c1", chat.messages[2:])
+    index.submit("c2", chat.messages[:1])
+    assert index.flush(10)
+    assert len(index.search("common", limit=100)) == 5
+
+    index.delete_chat("c1")
+    assert index.flush(10)
+    hits = index.search("common", limit=100)
+    assert [(hit.chat_id, hit.message_id) for hit in hits] == [("c2", "m0")]
+    index.close()
+
+
+def test_search_filters_and_kinds(tmp_path):
+    document = t.Asset(id="doc1", type="document", local_path="doc.pdf", mime_type="application/pdf",
+                       ocr_text="invoice number 42")
+    chat = chat_with(
+        t.Message(id="u", timestamp=timestamp(0), role="user", content=[
+            t.TextContent(text="please read the invoice"), t.MediaContent(assets=[document]),
+        ]),
+        t.Message(id="a", timestamp=timestamp(10), role="assistant", content=[
+            t.ThoughtContent(text="secret invoice reasoning"), t.TextContent(text="the invoice total"),
+        ], metadata=t.MessageMetadata(model="deepseek-chat", model_class="openai")),
+        t.Message(id="r", timestamp=timestamp(20), role="tool", content=[t.ToolResultContent(
+            tool_result=t.ToolResult(id="call", name="lookup", text_content="invoice found"),
+        )]),
+    )
+    index = ChatSearchIndex(tmp_path / "search.sqlite")
+    index.submit("c1", chat.messages, model="chat-model")
+    assert index.flush(10)
+
+    hits = index.search("invoice", limit=100)
+    assert sorted((hit.message_id, hit.kind) for hit in hits) == [
+        ("a", "text"), ("r", "tool_result"), ("u", "document"), ("u", "text"),
+    ]
+    assert _ids(index.search("invoice", roles=["user"])) == ["u", "u"]
+    assert _ids(index.search("invoice", kinds=["document"])) == ["u"]
+    assert _ids(index.search("invoice", model="deepseek-chat")) == ["a"]
+    assert _ids(index.search("invoice", model="chat-model", kinds=["tool_result"])) == ["r"]
+    assert _ids(index.search("invoice", since=timestamp(5), until=timestamp(15))) == ["a"]
+    assert index.search("invoice", since=timestamp(0) + timedelta(days=1)) == []
+    assert index.search("secret") == []
+
+    snippet = index.search("total")[0].snippet
+    assert "[total]" in snippet
+    index.close()
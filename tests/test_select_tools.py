@@ -0,0 +1,112 @@
+import pytest
+
+import utils.types as t
+from utils.tool_runner import read_tool_result
+from utils.tools_parser import ToolsParser
+from utils.tools_parser.tool_index import ToolIndex, tokenize
+
+from fakes import chat_with, text_message, timestamp
+
+
+def get_weather(city: str) -> str:
+    """
+    Текущая погода в городе.
+
+    :param city: Название города.
+    """
+    return ""
+
+
+def convert_currency(amount: float, currency: str) -> float:
+    """
+    Конвертирует сумму в другую валюту по текущему курсу.
+
+    :param amount: Сумма.
+    :param currency: Код валюты.
+    """
+    return 0.0
+
+
+def send_email(address: str, body: str) -> None:
+    """
+    Отправляет письмо.
+
+    :param address: Адрес получателя.
+    :param body: Текст письма.
+    """
+
+
+def translate_text(text: str, language: str) -> str:
+    """
+    Переводит текст на другой язык.
+
+    :param text: Исходный текст.
+    :param language: Язык перевода.
+    """
+    return ""
+
+
+TOOLS = [get_weather, convert_currency, send_email, translate_text, read_tool_result]
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """Отдельный реестр, чтобы инструменты других тестов не влияли на ранжирование"""
+    index = ToolIndex()
+    for tool in TOOLS:
+        index.add(tool)
+    monkeypatch.setattr(ToolsParser, "_registry", list(TOOLS))
+    monkeypatch.setattr(ToolsParser, "_index", index)
+
+
+def _tool_step(index: int, name: str, overflow: bool = False) -> list[t.Message]:
+    call = t.ToolCall(id=f"c{index}", name=name, args={})
+    asset = t.Asset(id="spill", type="document", local_path="/tmp/spill.txt", mime_type="text/plain") if overflow else None
+    return [
+        t.Message(id=f"a{index}", timestamp=timestamp(index), role="assistant",
+                  content=[t.ToolCallContent(tool_call=call)]),
+        t.Message(id=f"t{index}", timestamp=timestamp(index), role="tool",
+                  content=[t.ToolResultContent(tool_result=t.ToolResult(id=call.id, name=name, text_content="...",
+                                                                        overflow_asset=asset))]),
+    ]
+
+
+def test_stems_match_word_forms():
+    assert tokenize("конвертирует") == tokenize("конвертация") == tokenize("конвертер")
+    assert tokenize("getWeather get_weather") == ["get", "weathe", "get", "weathe"]
+
+
+def test_bm25_ranks_relevant_tools_first():
+    index = ToolIndex()
+    for tool in TOOLS:
+        index.add(tool)
+    ranked = [tool for tool, _ in index.search("какая погода в городе Казань", 5)]
+    assert ranked[0] is get_weather
+    assert [tool for tool, _ in index.search("переведи текст на английский язык", 1)] == [translate_text]
+    assert index.search("жираф", 5) == []
+
+
+def test_select_tools_picks_by_current_query(registry):
+    chat = chat_with(text_message("u1", "user", "переведи письмо на другой язык", 0),
+                     text_message("a1", "assistant", "готово", 1),
+                     text_message("u2", "user", "какая погода в городе?", 2))
+    assert ToolsParser.select_tools(chat, k=1) == [get_weather]
+    assert ToolsParser.select_tools(chat, k=len(TOOLS)) == TOOLS
+
+
+def test_tools_called_in_current_loop_are_pinned(registry):
+    chat = chat_with(text_message("u1", "user", "какая погода в городе?", 0), *_tool_step(1, "send_email"))
+    assert ToolsParser.select_tools(chat, k=1) == [get_weather, send_email]
+
+    # Вызовы до последнего сообщения пользователя не закрепляются
+    chat.messages.append(text_message("u2", "user", "а в другом городе?", 3))
+    assert ToolsParser.select_tools(chat, k=1) == [get_weather]
+
+
+def test_read_tool_result_is_pinned_after_overflow(registry):
+    chat = chat_with(text_message("u1", "user", "какая погода в городе?", 0), *_tool_step(1, "get_weather"))
+    assert read_tool_result not in ToolsParser.select_tools(chat, k=1)
+
+    chat = chat_with(text_message("u1", "user", "какая погода в городе?", 0),
+                     *_tool_step(1, "get_weather", overflow=True))
+    assert ToolsParser.select_tools(chat, k=1) == [get_weather, read_tool_result]
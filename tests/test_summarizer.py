@@ -0,0 +1,141 @@
+import json
+import asyncio
+
+import utils.types as t
+from utils.scheduler import ReactScheduler
+from utils.summarizer import HistorySummarizer, estimate_tokens, summarized_view
+from web_api_wrapper import ChatService
+
+from fakes import FakeModel, CopyingSessionStore, asgi_request, chat_with, text_message, timestamp
+
+
+def _turns(count: int, chars: int = 400) -> list[t.Message]:
+    """count ходов пользователь - ассистент, каждое сообщение ~chars / 4 токенов"""
+    messages = []
+    for turn in range(count):
+        messages.append(text_message(f"u{turn}", "user", "u" * chars, 2 * turn))
+        messages.append(text_message(f"a{turn}", "assistant", "a" * chars, 2 * turn + 1))
+    return messages
+
+
+def _checkpoint(until: str, count: int, text: str = "summary") -> t.SummaryCheckpoint:
+    return t.SummaryCheckpoint(id=f"s-{until}", timestamp=timestamp(), until_message_id=until,
+                               messages_count=count, text=text)
+
+
+def test_estimate_tokens_counts_text_and_assets():
+    message = t.Message(id="m", timestamp=timestamp(), role="user", content=[
+        t.TextContent(text="x" * 400),
+        t.MediaContent(assets=[t.Asset(id="a", type="image", local_path="a.png", mime_type="image/png")]),
+    ])
+    assert estimate_tokens(message) == 100 + 300
+
+
+def test_find_cut_below_trigger():
+    summarizer = HistorySummarizer(FakeModel(), trigger_tokens=10_000, keep_recent_tokens=1000)
+    assert summarizer.find_cut(chat_with(*_turns(5))) is None
+
+
+def test_find_cut_keeps_recent_turns_and_cuts_before_user():
+    # 10 ходов по 200 токенов, хвост не больше 450 токенов - это два последних хода
+    history = chat_with(*_turns(10))
+    summarizer = HistorySummarizer(FakeModel(), trigger_tokens=1000, keep_recent_tokens=450, min_messages=2)
+    assert summarizer.find_cut(history) == (0, 16)
+    assert history.messages[16].role == "user"
+
+
+def test_find_cut_huge_last_turn_is_not_summarized():
+    # Последний ход сам больше keep_recent_tokens: граница проходит прямо перед ним
+    history = chat_with(*_turns(6), *_turns(1, chars=20_000))
+    history.messages[-2].id, history.messages[-1].id = "u-last", "a-last"
+    summarizer = HistorySummarizer(FakeModel(), trigger_tokens=1000, keep_recent_tokens=450, min_messages=2)
+    assert summarizer.find_cut(history) == (0, 12)
+
+
+def test_find_cut_respects_min_messages_and_previous_checkpoint():
+    history = chat_with(*_turns(10))
+    summarizer = HistorySummarizer(FakeModel(), trigger_tokens=1000, keep_recent_tokens=450, min_messages=17)
+    assert summarizer.find_cut(history) is None
+
+    history.summaries.append(_checkpoint("a3", 8))
+    summarizer = HistorySummarizer(FakeModel(), trigger_tokens=1000, keep_recent_tokens=450, min_messages=2)
+    assert summarizer.find_cut(history) == (8, 16)
+    summarizer = HistorySummarizer(FakeModel(), trigger_tokens=3000, keep_recent_tokens=450, min_messages=2)
+    assert summarizer.find_cut(history) is None
+
+
+def test_summarize_and_view():
+    history = chat_with(text_message("sys", "system", "prompt"), *_turns(10))
+    summarizer = HistorySummarizer(FakeModel(reply="short summary"), trigger_tokens=1000, keep_recent_tokens=450)
+    checkpoint = summarizer.summarize(history)
+    assert checkpoint is not None and history.summaries == [checkpoint]
+    assert checkpoint.until_message_id == "a7" and checkpoint.messages_count == 17
+
+    view, text = summarized_view(history)
+    assert text == "short summary"
+    assert [message.id for message in view.messages] == ["sys", "u8", "a8", "u9", "a9"]
+
+
+def test_apply_checkpoint_rejects_foreign_and_superseded():
+    history = chat_with(*_turns(4))
+    assert not HistorySummarizer.apply_checkpoint(history, _checkpoint("missing", 2))
+    assert HistorySummarizer.apply_checkpoint(history, _checkpoint("a2", 6))
+    assert not HistorySummarizer.apply_checkpoint(history, _checkpoint("a1", 4))
+    assert [checkpoint.until_message_id for checkpoint in history.summaries] == ["a2"]
+
+
+def _service(store, summary_gate: asyncio.Event) -> ChatService:
+    summarizer = HistorySummarizer(FakeModel(reply="summary", gate=summary_gate),
+                                   trigger_tokens=2, keep_recent_tokens=1, min_messages=1)
+    scheduler = ReactScheduler(max_workers=4, tools_definition=lambda model, history: None)
+    return ChatService({"fake": FakeModel(reply="x" * 40)}, store=store, scheduler=scheduler, summarizer=summarizer)
+
+
+async def _create_chat(service: ChatService) -> str:
+    status, body = await asgi_request(service, "POST", "/chats", {})
+    assert status == 201
+    return json.loads(body)["chat_id"]
+
+
+def test_checkpoint_does_not_overwrite_turn_posted_during_summary():
+    async def scenario():
+        gate = asyncio.Event()
+        store = CopyingSessionStore()
+        service = _service(store, gate)
+        chat_id = await _create_chat(service)
+
+        for text in ("first " * 20, "second " * 20):
+            status, _ = await asgi_request(service, "POST", f"/chats/{chat_id}/messages", {"text": text})
+            assert status == 200
+        task = service.summarizer._tasks[chat_id]
+        # Пока сводка первого хода составляется, приходит третий ход
+        status, _ = await asgi_request(service, "POST", f"/chats/{chat_id}/messages", {"text": "third " * 20})
+        assert status == 200
+        gate.set()
+        await task
+
+        chat = await store.get(chat_id)
+        assert [message.role for message in chat.messages] == ["user", "assistant"] * 3
+        assert len(chat.summaries) == 1
+        assert chat.summaries[0].text == "summary" and chat.summaries[0].messages_count == 2
+
+    asyncio.run(scenario())
+
+
+def test_checkpoint_does_not_resurrect_deleted_chat():
+    async def scenario():
+        gate = asyncio.Event()
+        store = CopyingSessionStore()
+        service = _service(store, gate)
+        chat_id = await _create_chat(service)
+
+        for text in ("first " * 20, "second " * 20):
+            await asgi_request(service, "POST", f"/chats/{chat_id}/messages", {"text": text})
+        task = service.summarizer._tasks[chat_id]
+        status, _ = await asgi_request(service, "DELETE", f"/chats/{chat_id}")
+        assert status == 204
+        gate.set()
+        await task
+        assert await store.get(chat_id) is None
+
+    asyncio.run(scenario())
@@ -0,0 +1,154 @@
+import re
+import json
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from models.openai.deepseek import DeepseekChat
+from utils.tool_runner import apply_result_policy, read_tool_result, run_tool, arun_tool
+from utils.tool_runner.tool_runner import asset_type_from_mime
+
+from fakes import chat_with, text_message
+
+
+def test_asset_type_from_mime_falls_back_to_document():
+    assert asset_type_from_mime("image/png") == "image"
+    assert asset_type_from_mime("video/mp4") == "video"
+    assert asset_type_from_mime("audio/ogg") == "audio"
+    assert asset_type_from_mime("application/pdf") == "document"
+    assert asset_type_from_mime("model/gltf-binary") == "document"
+    assert asset_type_from_mime("chemical/x-pdb") == "document"
+
+
+def _read_all(note: str, limit: int) -> str:
+    """Дочитывает результат по приписке, как это делала бы модель"""
+    handle, offset = re.search(r"handle='(\w+)', offset=(\d+)", note).groups()
+    parts = []
+    while True:
+        page = read_tool_result(handle, int(offset), limit)
+        if page.endswith("\n(System: end of result.)"):
+            parts.append(page.removesuffix("\n(System: end of result.)"))
+            return "".join(parts)
+        chunk, offset = re.fullmatch(r"(.*)\n\(System: \d+ bytes left\. Next offset: (\d+)\.\)", page, re.S).groups()
+        assert len(chunk) == limit
+        parts.append(chunk)
+
+
+@pytest.mark.parametrize("limit", [1, 7, 4000])
+def test_spilled_result_pages_back_exactly(limit):
+    tool = SimpleNamespace(max_inline_chars=10, spill_to_asset=True)
+    text = "начало-ok " + "ёжик🦔 and ascii, " * 50
+    preview, asset = apply_result_policy(tool, text)
+    assert preview.startswith(text[:10]) and asset is not None
+    assert text[:10] + _read_all(preview, limit) == text
+
+
+def test_offset_inside_a_character_skips_to_the_next_one():
+    tool = SimpleNamespace(max_inline_chars=1, spill_to_asset=True)
+    _, asset = apply_result_policy(tool, "яяя")
+    assert read_tool_result(asset.id, 1, 10) == "яя\n(System: end of result.)"
+    assert read_tool_result(asset.id, 100, 10) == "\n(System: end of result.)"
+    with pytest.raises(ValueError):
+        read_tool_result("../etc", 0, 10)
+
+
+async def async_tool(value: int) -> dict:
+    """
+    Корутина-инструмент.
+
+    :param value: Значение.
+    """
+    await asyncio.sleep(0)
+    return {"value": value, "loop": id(asyncio.get_running_loop()), "thread": threading.get_ident()}
+
+
+def sync_tool(value: int) -> dict:
+    """
+    Обычный инструмент.
+
+    :param value: Значение.
+    """
+    return {"value": value, "thread": threading.get_ident()}
+
+
+def _result(content) -> dict:
+    assert not content.tool_result.is_error, content.tool_result.text_content
+    return json.loads(content.tool_result.text_content)
+
+
+def test_run_tool_bridges_coroutines_to_background_loop():
+    tools = {"async_tool": async_tool, "sync_tool": sync_tool}
+    result = _result(run_tool(tools, "async_tool", {"value": 1}, "c1"))
+    assert result["value"] == 1 and result["thread"] != threading.get_ident()
+    assert _result(run_tool(tools, "sync_tool", {"value": 2}, "c2"))["thread"] == threading.get_ident()
+
+    async def inside_loop():
+        # Синхронный generate, вызванный из event loop, не должен запускать корутину в занятом loop
+        return _result(run_tool(tools, "async_tool", {"value": 3}, "c3")), id(asyncio.get_running_loop())
+
+    result, caller_loop = asyncio.run(inside_loop())
+    assert result["value"] == 3 and result["loop"] != caller_loop
+
+
+def test_arun_tool_awaits_coroutines_and_threads_sync_tools():
+    tools = {"async_tool": async_tool, "sync_tool": sync_tool}
+
+    async def scenario():
+        loop = id(asyncio.get_running_loop())
+        async_result = _result(await arun_tool(tools, "async_tool", {"value": 1}, "c1"))
+        sync_result = _result(await arun_tool(tools, "sync_tool", {"value": 2}, "c2"))
+        return loop, async_result, sync_result
+
+    loop, async_result, sync_result = asyncio.run(scenario())
+    assert async_result["loop"] == loop and async_result["thread"] == threading.get_ident()
+    assert sync_result["thread"] != threading.get_ident()
+
+
+def test_agenerate_runs_one_round_of_tools_concurrently():
+    barrier = threading.Barrier(2, timeout=10)
+    started = []
+
+    async def async_waiter(value: int) -> int:
+        """
+        Ждёт, пока запустятся все инструменты раунда.
+
+        :param value: Значение.
+        """
+        started.append(value)
+        while len(started) < 4:
+            await asyncio.sleep(0.001)
+        return value
+
+    def sync_waiter(value: int) -> int:
+        """
+        Ждёт второй синхронный инструмент в соседнем потоке.
+
+        :param value: Значение.
+        """
+        started.append(value)
+        barrier.wait()
+        return value
+
+    calls = [("async_waiter", 1), ("async_waiter", 2), ("sync_waiter", 3), ("sync_waiter", 4)]
+    message = SimpleNamespace(content=None, reasoning_content=None, tool_calls=[
+        SimpleNamespace(id=f"call{value}", function=SimpleNamespace(name=name, arguments=json.dumps({"value": value})))
+        for name, value in calls
+    ])
+
+    async def create(**request):
+        return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="tool_calls")],
+                               usage=None, model="deepseek-chat")
+
+    model = DeepseekChat(api_key="test")
+    model.coalesce_requests = False
+    model.async_client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    history = chat_with(text_message("u", "user", "run all"))
+    tools = {"async_waiter": async_waiter, "sync_waiter": sync_waiter}
+
+    _, delta = asyncio.run(asyncio.wait_for(model.agenerate(history, None, tools), 10))
+    results = [content.tool_result for content in delta[-1].content]
+    assert [(result.id, result.text_content, result.is_error) for result in results] == [
+        (f"call{value}", str(value), False) for _, value in calls
+    ]
@@ -0,0 +1,190 @@
+import dataclasses
+from enum import Enum
+from typing import Literal, Optional
+
+import pytest
+from google.genai import types
+from pydantic import BaseModel, Field
+
+from utils.tools_parser import ToolsParser
+
+"""
+Схемы OpenAI и Gemini строятся двумя разными функциями из одних аннотаций. Тесты приводят обе схемы
+к общему виду (_canonical_*) и проверяют, что они описывают одно и то же.
+"""
+
+
+class Color(Enum):
+    RED = "red"
+    GREEN = "green"
+
+
+class TreeNode(BaseModel):
+    """Рекурсивная pydantic-модель"""
+    name: str = Field(description="Node name")
+    weight: float | None = None
+    children: list["TreeNode"] = []
+
+
+@dataclasses.dataclass
+class Address:
+    city: str
+    tags: dict[str, int]
+    previous: Optional["Address"] = None
+    point: tuple[float, float] = (0.0, 0.0)
+
+
+def rich_tool(tree: TreeNode, address: Address, mode: Literal["fast", "full"], color: Color,
+              limit: int | None = None, level: Literal[1, 2, 3] = 1, ids: list[int] | None = None,
+              *extra: str) -> str:
+    """
+    Tool with nested, recursive and optional parameters.
+
+    :param tree: Tree to walk.
+    :param address: Where to go.
+    :param mode: Search mode.
+    :param color: Color filter.
+    :param limit: Maximum number of results.
+    :param level: Nesting level.
+    :param ids: Explicit ids.
+    :param extra: Extra words.
+    """
+    return ""
+
+
+def kwargs_tool(query: str, **kwargs: float) -> str:
+    """
+    Tool with arbitrary keyword arguments.
+
+    :param query: Search query.
+    :param kwargs: Weights.
+    """
+    return query
+
+
+_GENAI_TYPES = {value: value.value.lower() for value in types.Type}
+
+
+def _canonical_openai(schema: dict) -> dict:
+    """Схема OpenAI в общем виде: тип, nullable, enum строк, элементы, поля, обязательные поля"""
+    result = {"nullable": False}
+    if "anyOf" in schema:
+        variants = [variant for variant in schema["anyOf"] if variant != {"type": "null"}]
+        result["nullable"] = len(variants) != len(schema["anyOf"])
+        if len(variants) == 1:
+            return {**_canonical_openai(variants[0]), "nullable": result["nullable"]}
+        result["any_of"] = [_canonical_openai(variant) for variant in variants]
+        return result
+    kind = schema.get("type")
+    if isinstance(kind, list):
+        result["nullable"] = "null" in kind
+        kind = [item for item in kind if item != "null"]
+        if len(kind) > 1:
+            result["any_of"] = [{"nullable": False, "type": item} for item in kind]
+            return result
+        kind = kind[0]
+    enum = [value for value in schema.get("enum", []) if value is not None]
+    if "enum" in schema and None in schema["enum"]:
+        result["nullable"] = True
+    result["type"] = kind or "string"
+    if enum and all(isinstance(value, str) for value in enum):
+        result["enum"] = enum
+    if "items" in schema:
+        result["items"] = _canonical_openai(schema["items"])
+    if "minItems" in schema:
+        result["length"] = (schema["minItems"], schema["maxItems"])
+    if "properties" in schema:
+        result["properties"] = {name: _canonical_openai(value) for name, value in schema["properties"].items()}
+        result["required"] = sorted(schema["required"])
+    if isinstance(schema.get("additionalProperties"), dict):
+        result["values"] = _canonical_openai(schema["additionalProperties"])
+    return result
+
+
+def _canonical_genai(schema: types.Schema | dict) -> dict:
+    """Схема Gemini в том же общем виде"""
+    if isinstance(schema, dict):
+        schema = types.Schema.model_validate(schema)
+    result = {"nullable": bool(schema.nullable)}
+    if schema.any_of:
+        result["any_of"] = [_canonical_genai(variant) for variant in schema.any_of]
+        return result
+    result["type"] = _GENAI_TYPES[schema.type] if schema.type else "string"
+    if schema.enum:
+        result["enum"] = schema.enum
+    if schema.items is not None:
+        result["items"] = _canonical_genai(schema.items)
+    if schema.min_items is not None:
+        result["length"] = (schema.min_items, schema.max_items)
+    if schema.properties is not None:
+        result["properties"] = {name: _canonical_genai(value) for name, value in schema.properties.items()}
+        result["required"] = sorted(schema.required or [])
+    if schema.additional_properties:
+        result["values"] = _canonical_genai(schema.additional_properties)
+    return result
+
+
+def _schemas(tool, strict_mode: bool = False) -> tuple[dict, types.FunctionDeclaration]:
+    openai = ToolsParser.get_json_schema_openai(strict_mode=strict_mode, tools=[tool])[0]["function"]
+    genai = ToolsParser.get_types_schema_genai(tools=[tool])[0].function_declarations[0]
+    return openai, genai
+
+
+def test_rich_tool_schemas_match():
+    openai, genai = _schemas(rich_tool)
+    assert openai["name"] == genai.name == "rich_tool"
+    assert openai["description"] == genai.description
+
+    openai_parameters = _canonical_openai(openai["parameters"])
+    genai_parameters = _canonical_genai(genai.parameters)
+    assert openai_parameters == genai_parameters
+    assert openai_parameters["required"] == ["address", "color", "mode", "tree"]
+
+    properties = openai_parameters["properties"]
+    assert properties["limit"] == {"nullable": True, "type": "integer"}
+    assert properties["color"]["enum"] == ["red", "green"]
+    assert properties["extra"] == {"nullable": False, "type": "array", "items": {"nullable": False, "type": "string"}}
+    # Рекурсия обрывается на втором уровне одинаково
+    children = properties["tree"]["properties"]["children"]["items"]
+    assert children == {"nullable": False, "type": "object"}
+    assert properties["address"]["properties"]["previous"] == {"nullable": True, "type": "object"}
+    assert properties["address"]["properties"]["point"]["length"] == (2, 2)
+    assert properties["address"]["properties"]["tags"]["values"] == {"nullable": False, "type": "integer"}
+
+
+def test_descriptions_and_defaults_reach_both_schemas():
+    openai, genai = _schemas(rich_tool)
+    for name in ("tree", "limit", "ids"):
+        openai_description = openai["parameters"]["properties"][name]["description"]
+        genai_description = genai.parameters.properties[name].description
+        assert openai_description.split(" (System")[0] == genai_description.split(" (System")[0]
+    assert openai["parameters"]["properties"]["tree"]["properties"]["name"]["description"] == "Node name"
+    assert genai.parameters.properties["tree"].properties["name"].description == "Node name"
+    # Gemini не принимает enum чисел: значения уходят в описание
+    assert "One of: 1, 2, 3." in genai.parameters.properties["level"].description
+    assert openai["parameters"]["properties"]["level"]["enum"] == [1, 2, 3]
+    assert genai.parameters.properties["level"].default == 1
+
+
+def test_strict_mode_requires_everything_and_allows_null_defaults():
+    openai, genai = _schemas(rich_tool, strict_mode=True)
+    parameters = _canonical_openai(openai["parameters"])
+    assert parameters["required"] == sorted(genai.parameters.properties)
+    assert parameters["properties"]["level"]["nullable"] is True
+    assert parameters["properties"]["ids"] == _canonical_genai(genai.parameters.properties["ids"])
+    assert openai["parameters"]["additionalProperties"] is False
+    nested = openai["parameters"]["properties"]["tree"]
+    assert nested["additionalProperties"] is False and sorted(nested["required"]) == ["children", "name", "weight"]
+
+
+def test_kwargs_tool():
+    openai, genai = _schemas(kwargs_tool)
+    assert openai["parameters"]["additionalProperties"] is True
+    assert list(openai["parameters"]["properties"]) == ["query"]
+    kwargs = _canonical_genai(genai.parameters.properties["kwargs"])
+    assert kwargs == {"nullable": False, "type": "object", "values": {"nullable": False, "type": "number"}}
+    assert genai.parameters.required == ["query"]
+
+    with pytest.raises(ValueError):
+        ToolsParser.get_json_schema_openai(strict_mode=True, tools=[kwargs_tool])
+    assert ToolsParser.get_json_schema_openai(strict_mode=True, ignore_kwarg_funcs=True, tools=[kwargs_tool]) == []
@@ -0,0 +1,148 @@
+import json
+import base64
+import asyncio
+
+from utils.documents import document_extractor
+from utils.scheduler import ReactScheduler
+from utils.search import ChatSearchIndex
+from web_api_wrapper import ChatService, InMemorySessionStore
+
+from fakes import FakeModel, asgi_request
+
+
+def _service(model: FakeModel, store=None, search_index=None) -> ChatService:
+    scheduler = ReactScheduler(max_workers=4, tools_definition=lambda model, history: None)
+    return ChatService({"fake": model}, store=store, scheduler=scheduler, search_index=search_index)
+
+
+def _events(body: bytes) -> list[tuple[str, str]]:
+    events = []
+    for block in body.decode("utf-8").split("\n\n"):
+        if block:
+            name, data = block.split("\n", 1)
+            events.append((name.removeprefix("event: "), data.removeprefix("data: ")))
+    return events
+
+
+async def _create_chat(service: ChatService) -> str:
+    status, body = await asgi_request(service, "POST", "/chats", {"model": "fake"})
+    assert status == 201
+    return json.loads(body)["chat_id"]
+
+
+def test_chat_lifecycle():
+    async def scenario():
+        service = _service(FakeModel(reply="hello"))
+        chat_id = await _create_chat(service)
+
+        status, body = await asgi_request(service, "POST", f"/chats/{chat_id}/messages", {"text": "hi"})
+        assert status == 200
+        events = _events(body)
+        assert [name for name, _ in events] == ["message", "done"]
+        assert json.loads(events[0][1])["content"][0]["text"] == "hello"
+
+        status, body = await asgi_request(service, "GET", f"/chats/{chat_id}")
+        assert status == 200
+        assert [message["role"] for message in json.loads(body)["messages"]] == ["user", "assistant"]
+
+        assert (await asgi_request(service, "DELETE", f"/chats/{chat_id}"))[0] == 204
+        assert (await asgi_request(service, "GET", f"/chats/{chat_id}"))[0] == 404
+        assert (await asgi_request(service, "DELETE", f"/chats/{chat_id}"))[0] == 404
+
+    asyncio.run(scenario())
+
+
+def test_request_errors():
+    async def scenario():
+        service = _service(FakeModel())
+        assert (await asgi_request(service, "POST", "/chats", {"model": "missing"}))[0] == 400
+        assert (await asgi_request(service, "GET", "/chats"))[0] == 405
+        assert (await asgi_request(service, "GET", "/nowhere"))[0] == 404
+        chat_id = await _create_chat(service)
+        assert (await asgi_request(service, "POST", f"/chats/{chat_id}/messages", {}))[0] == 400
+
+        data = base64.b64encode(b"payload").decode("ascii")
+        invalid = ({"data_base64": data, "mime_type": 123}, {"data_base64": "not base64!"}, {"mime_type": "text/plain"})
+        for asset in invalid:
+            status, body = await asgi_request(service, "POST", f"/chats/{chat_id}/messages", {"assets": [asset]})
+            assert status == 400, body
+        assert (await service.store.get(chat_id)).messages == []
+
+        # Неизвестный тип принимается как документ
+        status, _ = await asgi_request(service, "POST", f"/chats/{chat_id}/messages", {
+            "assets": [{"data_base64": data, "mime_type": "chemical/x-pdb"}],
+        })
+        assert status == 200
+        asset = (await service.store.get(chat_id)).messages[0].content[0].assets[0]
+        assert (asset.type, asset.mime_type) == ("document", "chemical/x-pdb")
+
+    asyncio.run(scenario())
+
+
+def test_delete_during_turn_is_rejected_and_chat_is_not_resurrected():
+    async def scenario():
+        gate = asyncio.Event()
+        service = _service(FakeModel(gate=gate))
+        chat_id = await _create_chat(service)
+
+        turn = asyncio.create_task(asgi_request(service, "POST", f"/chats/{chat_id}/messages", {"text": "hi"}))
+        while not (lock := service._chat_locks.get(chat_id)) or not lock.locked():
+            await asyncio.sleep(0)
+        assert (await asgi_request(service, "DELETE", f"/chats/{chat_id}"))[0] == 409
+        assert (await asgi_request(service, "POST", f"/chats/{chat_id}/messages", {"text": "again"}))[0] == 409
+
+        gate.set()
+        assert (await turn)[0] == 200
+        assert (await asgi_request(service, "DELETE", f"/chats/{chat_id}"))[0] == 204
+        assert await service.store.get(chat_id) is None
+
+    asyncio.run(scenario())
+
+
+def test_unexpected_error_becomes_500():
+    class BrokenStore(InMemorySessionStore):
+        async def get(self, chat_id):
+            raise RuntimeError("database is down")
+
+    async def scenario():
+        service = _service(FakeModel(), store=BrokenStore())
+        status, body = await asgi_request(service, "GET", "/chats/abc")
+        assert status == 500
+        assert json.loads(body) == {"error": "Internal server error"}
+
+    asyncio.run(scenario())
+
+
+class ExtractingModel(FakeModel):
+    """Как текстовые OpenAI-модели: текст документов извлекается при конвертации истории"""
+
+    async def agenerate(self, history, tools_definition=None, tools_executable=None, extra_body=None):
+        for message in history.messages:
+            for content in message.content:
+                for asset in content.assets or [] if content.type == "media" else []:
+                    await asyncio.to_thread(document_extractor.extract, asset)
+        return await super().agenerate(history, tools_definition, tools_executable, extra_body)
+
+
+def test_uploaded_document_text_is_searchable(tmp_path):
+    async def scenario():
+        index = ChatSearchIndex(tmp_path / "search.sqlite")
+        service = _service(ExtractingModel(reply="read it"), search_index=index)
+        chat_id = await _create_chat(service)
+        document = base64.b64encode("квартальный отчёт по складу".encode("utf-8")).decode("ascii")
+        status, _ = await asgi_request(service, "POST", f"/chats/{chat_id}/messages", {
+            "text": "посмотри файл", "assets": [{"data_base64": document, "mime_type": "text/plain"}],
+        })
+        assert status == 200
+        assert await asyncio.to_thread(index.flush, 10)
+
+        status, body = await asgi_request(service, "GET", "/search", query_string="q=складу&kind=document".encode())
+        hits = json.loads(body)["hits"]
+        assert status == 200 and len(hits) == 1
+        assert (hits[0]["chat_id"], hits[0]["kind"], hits[0]["role"]) == (chat_id, "document", "user")
+
+        status, body = await asgi_request(service, "GET", "/search", query_string="q=файл".encode())
+        assert [hit["kind"] for hit in json.loads(body)["hits"]] == ["text"]
+        index.close()
+
+    asyncio.run(scenario())
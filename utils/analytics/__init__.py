@@ -0,0 +1 @@
+from .columnar_export import ColumnarExporter, ExportFormat, TABLES, export_chats
@@ -0,0 +1,340 @@
+import os
+import json
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterable, Iterator, Literal
+
+import utils.types as t
+from utils.tracing import tracer
+from utils.umf_loader import iter_messages, load_metadata, load_summaries
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow - необязательная зависимость, нужна только для экспорта
+    pa = None
+    pq = None
+
+"""
+Колоночный экспорт историй УФС для аналитики.
+
+ChatData - вложенный JSON на чат, и любой подсчёт (какие инструменты вызываются, сколько стоят токены, какая
+задержка у моделей) превращается в цикл по объектам Python. Экспорт раскладывает историю по плоским таблицам
+Arrow, которые читаются векторно (pyarrow, polars, DuckDB, pandas):
+
+    chats         - чат: версия УФС, настройки, число сообщений и сводок, время первого и последнего сообщения;
+    messages      - сообщение: роль, время, модель, причина остановки, задержка, токены;
+    contents      - элемент содержимого сообщения: тип, текст, длина текста;
+    tool_calls    - вызов инструмента: имя и аргументы (JSON);
+    tool_results  - результат инструмента: имя, ошибка, длина и текст результата;
+    assets        - ассет: откуда он (media, tool_result, overflow), тип, размер, ссылки на загрузки;
+    summaries     - сводки чата (см. utils.summarizer).
+
+Ключи для соединения таблиц:
+    chat_id                                  - задаётся при экспорте (по умолчанию имя файла без расширения);
+    (chat_id, message_id)                    - сообщение, message_position - его номер в чате;
+    (chat_id, message_id, content_position)  - элемент содержимого;
+    (chat_id, call_id)                       - вызов инструмента и его результат.
+
+Чаты читаются потоково (iter_messages, data_base64 не загружаются), строки копятся в буферах таблиц и
+сбрасываются группами по row_group_size строк, поэтому память не зависит от числа чатов.
+
+Пример:
+    with ColumnarExporter("export/") as exporter:
+        for path in Path("chats").glob("*.json"):
+            exporter.add_file(path)
+"""
+
+ExportFormat = Literal["parquet", "arrow"]
+
+# Таблица -> колонки (имя, тип). Типы переводятся в типы Arrow в _schema, чтобы модуль импортировался без pyarrow
+_COLUMNS: dict[str, list[tuple[str, str]]] = {
+    "chats": [
+        ("chat_id", "string"), ("source", "string"), ("version", "string"), ("provider", "string"),
+        ("model", "string"), ("thinking_mode", "string"), ("messages", "int64"), ("summaries", "int32"),
+        ("first_timestamp", "timestamp"), ("last_timestamp", "timestamp"),
+    ],
+    "messages": [
+        ("chat_id", "string"), ("message_id", "string"), ("message_position", "int64"), ("timestamp", "timestamp"),
+        ("role", "string"), ("name", "string"), ("model", "string"), ("model_class", "string"),
+        ("finish_reason", "string"), ("latency_ms", "int64"), ("input_tokens", "int64"), ("output_tokens", "int64"),
+        ("total_tokens", "int64"), ("cache_hit_tokens", "int64"), ("cache_miss_tokens", "int64"),
+        ("contents", "int32"), ("text_chars", "int64"),
+    ],
+    "contents": [
+        ("chat_id", "string"), ("message_id", "string"), ("content_position", "int32"), ("type", "string"),
+        ("text", "string"), ("text_chars", "int64"), ("has_signature", "bool"), ("call_id", "string"),
+        ("assets", "int32"),
+    ],
+    "tool_calls": [
+        ("chat_id", "string"), ("message_id", "string"), ("content_position", "int32"), ("call_id", "string"),
+        ("name", "string"), ("args_json", "string"),
+    ],
+    "tool_results": [
+        ("chat_id", "string"), ("message_id", "string"), ("content_position", "int32"), ("call_id", "string"),
+        ("name", "string"), ("is_error", "bool"), ("text", "string"), ("text_chars", "int64"),
+        ("overflow_asset_id", "string"), ("assets", "int32"),
+    ],
+    "assets": [
+        ("chat_id", "string"), ("message_id", "string"), ("content_position", "int32"), ("asset_id", "string"),
+        ("origin", "string"), ("type", "string"), ("mime_type", "string"), ("size_bytes", "int64"),
+        ("local_path", "string"), ("has_ocr_text", "bool"), ("openai_file_id", "string"),
+        ("genai_filename", "string"), ("genai_expires_at", "timestamp"),
+    ],
+    "summaries": [
+        ("chat_id", "string"), ("summary_id", "string"), ("timestamp", "timestamp"), ("until_message_id", "string"),
+        ("messages_count", "int64"), ("text", "string"), ("text_chars", "int64"), ("model", "string"),
+        ("input_tokens", "int64"), ("output_tokens", "int64"),
+    ],
+}
+
+TABLES = tuple(_COLUMNS)
+
+
+def _schema(table: str) -> "pa.Schema":
+    types = {
+        "string": pa.string(), "int32": pa.int32(), "int64": pa.int64(), "bool": pa.bool_(),
+        "timestamp": pa.timestamp("us", tz="UTC"),
+    }
+    return pa.schema([(name, types[kind]) for name, kind in _COLUMNS[table]])
+
+
+def _utc(value: datetime | None) -> datetime | None:
+    """Время в UTC; время без зоны считается UTC"""
+    if value is None:
+        return None
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+class _TableWriter:
+    """Буфер строк одной таблицы и файл, куда он сбрасывается группами строк"""
+
+    def __init__(self, table: str, path: str, export_format: ExportFormat, compression: str | None):
+        self.schema = _schema(table)
+        self.columns: dict[str, list] = {name: [] for name in self.schema.names}
+        self.pending = 0
+        self.rows = 0
+        if export_format == "parquet":
+            self._writer = pq.ParquetWriter(path, self.schema, compression=compression)
+        else:
+            self._sink = pa.OSFile(path, "wb")
+            self._writer = pa.ipc.new_file(self._sink, self.schema, options=pa.ipc.IpcWriteOptions(
+                compression=compression))
+
+    def append(self, **row) -> None:
+        for name, values in self.columns.items():
+            values.append(row.get(name))
+        self.pending += 1
+
+    def flush(self) -> None:
+        if not self.pending:
+            return
+        batch = pa.RecordBatch.from_pydict(self.columns, schema=self.schema)
+        self._writer.write_batch(batch)
+        self.rows += self.pending
+        self.pending = 0
+        for values in self.columns.values():
+            values.clear()
+
+    def close(self) -> None:
+        self.flush()
+        self._writer.close()
+        if hasattr(self, "_sink"):
+            self._sink.close()
+
+
+class ColumnarExporter:
+    """Потоковая запись чатов в таблицы Parquet или Arrow IPC (по файлу на таблицу в output_dir)"""
+
+    def __init__(self, output_dir: str | os.PathLike, export_format: ExportFormat = "parquet",
+                 row_group_size: int = 64 * 1024, include_text: bool = True, compression: str | None = "zstd"):
+        """
+        :param output_dir: папка для файлов <таблица>.parquet или <таблица>.arrow
+        :param export_format: "parquet" или "arrow" (Arrow IPC, читается без разбора через memory map)
+        :param row_group_size: столько строк таблицы копится в памяти перед записью группы строк
+        :param include_text: записывать тексты сообщений, результатов инструментов и сводок
+            (без них таблицы в разы меньше, длины текстов записываются всегда)
+        :param compression: сжатие колонок ("zstd", "lz4", None; для Parquet также "snappy", "gzip")
+        """
+        if pa is None:
+            raise RuntimeError("Для колоночного экспорта установите пакет pyarrow")
+        if export_format not in ("parquet", "arrow"):
+            raise ValueError(f"Неизвестный формат экспорта: {export_format}")
+        self.output_dir = Path(output_dir)
+        self.row_group_size = row_group_size
+        self.include_text = include_text
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        extension = "parquet" if export_format == "parquet" else "arrow"
+        self._tables = {table: _TableWriter(table, str(self.output_dir / f"{table}.{extension}"), export_format,
+                                            compression)
+                        for table in TABLES}
+        self._closed = False
+
+    @property
+    def rows(self) -> dict[str, int]:
+        """Сколько строк записано (и ждёт записи) в каждую таблицу"""
+        return {table: writer.rows + writer.pending for table, writer in self._tables.items()}
+
+    # --- Чаты ---
+
+    def add_chat(self, chat_id: str, chat: t.ChatData, source: str | None = None) -> int:
+        """
+        Добавляет загруженный чат
+        :return: число сообщений
+        """
+        return self._add(chat_id, chat.chat_metadata, chat.summaries, iter(chat.messages), source)
+
+    def add_file(self, path: str | os.PathLike, chat_id: str | None = None) -> int:
+        """
+        Добавляет чат из файла УФС, читая сообщения по одному (data_base64 не загружаются)
+        :param chat_id: по умолчанию имя файла без расширения
+        :return: число сообщений
+        """
+        path = os.fspath(path)
+        chat_id = chat_id or Path(path).stem
+        return self._add(chat_id, load_metadata(path), load_summaries(path), iter_messages(path, data_mode="skip"),
+                         path)
+
+    def _add(self, chat_id: str, metadata: t.ChatMetadata, summaries: list[t.SummaryCheckpoint],
+             messages: Iterator[t.Message], source: str | None) -> int:
+        if self._closed:
+            raise RuntimeError("Экспорт уже завершён")
+        with tracer.span("analytics.export_chat") as span:
+            count = 0
+            first = last = None
+            for message in messages:
+                self._add_message(chat_id, count, message)
+                first = first or message.timestamp
+                last = message.timestamp
+                count += 1
+            for summary in summaries:
+                self._add_summary(chat_id, summary)
+            config = metadata.config
+            self._append("chats", chat_id=chat_id, source=source, version=metadata.version,
+                         provider=config.provider, model=config.model, thinking_mode=config.thinking_mode,
+                         messages=count, summaries=len(summaries), first_timestamp=_utc(first),
+                         last_timestamp=_utc(last))
+            span.set(messages=count)
+        return count
+
+    # --- Строки ---
+
+    def _append(self, table: str, **row) -> None:
+        writer = self._tables[table]
+        writer.append(**row)
+        if writer.pending >= self.row_group_size:
+            writer.flush()
+
+    def _text(self, text: str | None) -> str | None:
+        return text if self.include_text else None
+
+    def _add_message(self, chat_id: str, position: int, message: t.Message) -> None:
+        text_chars = 0
+        for content_position, content in enumerate(message.content):
+            text_chars += self._add_content(chat_id, message.id, content_position, content)
+
+        metadata = message.metadata
+        usage = metadata.usage if metadata else None
+        self._append(
+            "messages", chat_id=chat_id, message_id=message.id, message_position=position,
+            timestamp=_utc(message.timestamp), role=message.role, name=message.name,
+            model=metadata.model if metadata else None, model_class=metadata.model_class if metadata else None,
+            finish_reason=metadata.finish_reason if metadata else None,
+            latency_ms=metadata.latency_ms if metadata else None,
+            input_tokens=usage.input_tokens if usage else None, output_tokens=usage.output_tokens if usage else None,
+            total_tokens=usage.total_tokens if usage else None,
+            cache_hit_tokens=usage.cache_hit_tokens if usage else None,
+            cache_miss_tokens=usage.cache_miss_tokens if usage else None,
+            contents=len(message.content), text_chars=text_chars,
+        )
+
+    def _add_content(self, chat_id: str, message_id: str, position: int, content: t.ContentItem) -> int:
+        """:return: длина текста элемента (для messages.text_chars)"""
+        key = {"chat_id": chat_id, "message_id": message_id, "content_position": position}
+        text = None
+        call_id = None
+        assets: list[t.Asset] = []
+        if content.type in ("text", "thought"):
+            text = content.text
+        elif content.type == "media":
+            assets = content.assets
+            for asset in assets:
+                self._add_asset(key, asset, "media")
+        elif content.type == "tool_call":
+            call = content.tool_call
+            call_id = call.id
+            self._append("tool_calls", **key, call_id=call.id, name=call.name,
+                         args_json=json.dumps(call.args, ensure_ascii=False, default=str))
+        elif content.type == "tool_result":
+            result = content.tool_result
+            call_id = result.id
+            text = result.text_content
+            assets = content.assets or []
+            for asset in assets:
+                self._add_asset(key, asset, "tool_result")
+            if result.overflow_asset is not None:
+                self._add_asset(key, result.overflow_asset, "overflow")
+            self._append("tool_results", **key, call_id=result.id, name=result.name, is_error=result.is_error,
+                         text=self._text(text), text_chars=len(text),
+                         overflow_asset_id=result.overflow_asset.id if result.overflow_asset else None,
+                         assets=len(assets))
+
+        self._append("contents", **key, type=content.type, text=self._text(text),
+                     text_chars=len(text) if text is not None else None,
+                     has_signature=bool(content.signature) if content.type == "thought" else None,
+                     call_id=call_id, assets=len(assets))
+        return len(text) if text is not None else 0
+
+    def _add_asset(self, key: dict, asset: t.Asset, origin: str) -> None:
+        refs = asset.cloud_refs
+        openai_ref = refs.openai if refs else None
+        genai_ref = refs.genai if refs else None
+        self._append(
+            "assets", **key, asset_id=asset.id, origin=origin, type=asset.type, mime_type=asset.mime_type,
+            size_bytes=asset.size_bytes, local_path=asset.local_path, has_ocr_text=asset.ocr_text is not None,
+            openai_file_id=openai_ref.id if openai_ref else None,
+            genai_filename=genai_ref.filename if genai_ref else None,
+            genai_expires_at=_utc(genai_ref.expires_at) if genai_ref else None,
+        )
+
+    def _add_summary(self, chat_id: str, summary: t.SummaryCheckpoint) -> None:
+        usage = summary.usage
+        self._append(
+            "summaries", chat_id=chat_id, summary_id=summary.id, timestamp=_utc(summary.timestamp),
+            until_message_id=summary.until_message_id, messages_count=summary.messages_count,
+            text=self._text(summary.text), text_chars=len(summary.text), model=summary.model,
+            input_tokens=usage.input_tokens if usage else None, output_tokens=usage.output_tokens if usage else None,
+        )
+
+    # --- Завершение ---
+
+    def close(self) -> None:
+        """Записывает остатки буферов и закрывает файлы. Без вызова файлы Parquet останутся без футера"""
+        if self._closed:
+            return
+        self._closed = True
+        for writer in self._tables.values():
+            writer.close()
+
+    def __enter__(self) -> "ColumnarExporter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def export_chats(sources: Iterable[str | os.PathLike | tuple[str, t.ChatData]], output_dir: str | os.PathLike,
+                 **options) -> dict[str, int]:
+    """
+    Экспортирует чаты в колоночные таблицы
+    :param sources: пути к файлам УФС или пары (chat_id, ChatData)
+    :param options: параметры ColumnarExporter
+    :return: число строк в каждой таблице
+    """
+    with ColumnarExporter(output_dir, **options) as exporter:
+        for source in sources:
+            if isinstance(source, tuple):
+                exporter.add_chat(*source)
+            else:
+                exporter.add_file(source)
+    return exporter.rows
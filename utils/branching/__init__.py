@@ -0,0 +1,7 @@
+from .branching import (
+    Branch,
+    ConversationTree,
+    ConversationTreeData,
+    MessageNode,
+    DEFAULT_BRANCH,
+)
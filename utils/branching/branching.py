@@ -0,0 +1,334 @@
+import os
+import threading
+from typing import Iterable, Iterator, Optional
+
+from pydantic import BaseModel, Field
+
+import utils.types as t
+from utils.converters import ConversionCache
+
+"""
+Ветки разговора с общим началом (copy-on-write).
+
+Перегенерация ответа, правка раннего сообщения пользователя или сравнение моделей на одном чате требовали
+глубокой копии ChatData: generate дописывает сообщения в history.messages на месте. Здесь история хранится
+неизменяемыми узлами (MessageNode: сообщение и ссылка на предыдущий узел), а ветка (Branch) - это ссылка
+на последний узел. Поэтому:
+
+    - fork - O(1): новая ветка указывает на тот же узел, сообщения не копируются;
+    - дописывание в ветку создаёт новые узлы и не меняет ни общие узлы, ни другие ветки;
+    - ветки одного дерева (ConversationTree) делят общий ConversionCache: сообщения общего начала
+      конвертируются в формат провайдера один раз для всех веток;
+    - при сохранении (save) каждый узел пишется один раз, общее начало веток на диске тоже не дублируется.
+
+Модели по-прежнему получают ChatData: Branch.history() собирает его из узлов (копируется только список ссылок
+на сообщения), а Branch.commit(history) переносит в ветку то, что модель или планировщик дописали в history.
+Branch.generate и Branch.agenerate делают и то и другое.
+
+Сообщения в дереве считаются неизменяемыми (кэш конвертации хранит их по объекту): правка - это новое
+сообщение в новой ветке (Branch.edit).
+
+Пример:
+    tree = ConversationTree.from_chat(chat)
+    main = tree["main"]
+    other = main.fork("gemini")                    # O(1)
+    main.generate(deepseek, tools, executables)
+    other.generate(gemini, tools, executables)     # начало истории уже сконвертировано
+    tree.save("chat.tree.json")
+"""
+
+DEFAULT_BRANCH = "main"
+
+
+class MessageNode:
+    """Неизменяемый узел истории: сообщение и предыдущий узел"""
+
+    __slots__ = ("message", "parent", "length")
+
+    def __init__(self, message: t.Message, parent: "MessageNode | None" = None):
+        self.message = message
+        self.parent = parent
+        self.length = parent.length + 1 if parent is not None else 1  # Число сообщений от корня до этого узла
+
+    def path(self) -> list["MessageNode"]:
+        """Узлы от корня до этого узла"""
+        nodes = []
+        node = self
+        while node is not None:
+            nodes.append(node)
+            node = node.parent
+        nodes.reverse()
+        return nodes
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Формат хранения
+# ══════════════════════════════════════════════════════════════════════════════
+
+
+class TreeNodeData(BaseModel):
+    parent: Optional[int] = None  # Индекс предыдущего узла в ConversationTreeData.nodes
+    message: t.Message
+
+
+class BranchData(BaseModel):
+    tip: Optional[int] = None  # Индекс последнего узла ветки, None - пустая ветка
+    summaries: list[t.SummaryCheckpoint] = Field(default_factory=list)
+
+
+class ConversationTreeData(BaseModel):
+    """Дерево веток на диске: узлы записываются один раз, родитель всегда раньше потомка"""
+
+    chat_metadata: t.ChatMetadata = Field(default_factory=t.ChatMetadata)
+    nodes: list[TreeNodeData] = Field(default_factory=list)
+    branches: dict[str, BranchData] = Field(default_factory=dict)
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Ветки
+# ══════════════════════════════════════════════════════════════════════════════
+
+
+class Branch:
+    """Ветка разговора. Создаётся через ConversationTree"""
+
+    def __init__(self, tree: "ConversationTree", name: str, tip: MessageNode | None,
+                 summaries: list[t.SummaryCheckpoint] | None = None):
+        self.tree = tree
+        self.name = name
+        self._tip = tip
+        self.summaries = summaries if summaries is not None else []  # Сводки ветки (см. utils.summarizer)
+        self._nodes: list[MessageNode] | None = None  # Путь от корня, собирается при первом обращении
+
+    def __repr__(self) -> str:
+        return f"Branch({self.name!r}, messages={len(self)})"
+
+    def __len__(self) -> int:
+        return self._tip.length if self._tip is not None else 0
+
+    @property
+    def tip(self) -> MessageNode | None:
+        return self._tip
+
+    @property
+    def nodes(self) -> list[MessageNode]:
+        """Узлы ветки от корня (кэшируется, дописывание обновляет кэш за O(1))"""
+        if self._nodes is None:
+            self._nodes = self._tip.path() if self._tip is not None else []
+        return self._nodes
+
+    @property
+    def messages(self) -> list[t.Message]:
+        """Новый список сообщений ветки. Сами сообщения общие с другими ветками, их нельзя менять"""
+        return [node.message for node in self.nodes]
+
+    def __iter__(self) -> Iterator[t.Message]:
+        return (node.message for node in self.nodes)
+
+    # --- Изменение ---
+
+    def append(self, message: t.Message) -> None:
+        self._tip = MessageNode(message, self._tip)
+        if self._nodes is not None:
+            self._nodes.append(self._tip)
+
+    def extend(self, messages: Iterable[t.Message]) -> None:
+        for message in messages:
+            self.append(message)
+
+    def _node_at(self, at: int | str | None) -> MessageNode | None:
+        """
+        Узел, на котором заканчивается начало ветки
+        :param at: сколько сообщений оставить (отрицательное - сколько убрать с конца),
+            id сообщения (оно остаётся последним) или None - вся ветка
+        """
+        if at is None:
+            return self._tip
+        if isinstance(at, str):
+            for node in reversed(self.nodes):
+                if node.message.id == at:
+                    return node
+            raise KeyError(f"В ветке {self.name} нет сообщения {at}")
+        length = len(self)
+        keep = at if at >= 0 else length + at
+        if not 0 <= keep <= length:
+            raise IndexError(f"В ветке {self.name} {length} сообщений, нельзя оставить {at}")
+        if keep == 0:
+            return None
+        if self._nodes is not None:
+            return self._nodes[keep - 1]
+        node = self._tip
+        for _ in range(length - keep):
+            node = node.parent
+        return node
+
+    def fork(self, name: str | None = None, at: int | str | None = None) -> "Branch":
+        """
+        Новая ветка с общим началом, O(1) при at=None
+        :param name: имя ветки (по умолчанию - имя этой ветки с номером)
+        :param at: где отделиться: сколько сообщений оставить, id последнего общего сообщения или None - в конце
+        """
+        return self.tree.fork(self, name, at)
+
+    def edit(self, message_id: str, message: t.Message, name: str | None = None) -> "Branch":
+        """
+        Ветка, в которой сообщение message_id заменено на message, а всё после него отброшено
+        (например, пользователь исправил свой вопрос). Эта ветка не меняется
+        """
+        node = self._node_at(message_id)
+        branch = self.tree.fork(self, name, node.length - 1)
+        branch.append(message)
+        return branch
+
+    # --- Модели ---
+
+    def history(self) -> t.ChatData:
+        """
+        ChatData для моделей и планировщика: собственный список сообщений (его можно дописывать),
+        сводки ветки и общий кэш конвертации. Дописанное переносится в ветку через commit
+        """
+        history = t.ChatData.model_construct(
+            chat_metadata=self.tree.chat_metadata, summaries=self.summaries, messages=self.messages
+        )
+        history._conversion_cache = self.tree.conversion_cache
+        return history
+
+    def commit(self, history: t.ChatData) -> list[t.Message]:
+        """
+        Переносит в ветку сообщения, дописанные в history после history()
+        :return: новые сообщения
+        """
+        length = len(self)
+        if len(history.messages) < length or (length and history.messages[length - 1] is not self._tip.message):
+            raise ValueError(f"История не продолжает ветку {self.name}: ветка изменилась или начало истории переписано")
+        delta = history.messages[length:]
+        self.extend(delta)
+        return delta
+
+    def generate(self, model, tools_definition, tools_executable, extra_body: dict = None) -> list[t.Message]:
+        """
+        model.generate на истории ветки с дописыванием ответа в ветку
+        :return: новые сообщения (ответ модели и результаты инструментов)
+        """
+        history = self.history()
+        model.generate(history, tools_definition, tools_executable, extra_body)
+        return self.commit(history)
+
+    async def agenerate(self, model, tools_definition, tools_executable, extra_body: dict = None) -> list[t.Message]:
+        """Асинхронная версия generate"""
+        history = self.history()
+        await model.agenerate(history, tools_definition, tools_executable, extra_body)
+        return self.commit(history)
+
+    def to_chat(self) -> t.ChatData:
+        """Ветка как обычный чат УФС (например, для SessionStore или экспорта)"""
+        return t.ChatData(chat_metadata=self.tree.chat_metadata, summaries=list(self.summaries),
+                          messages=self.messages)
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Дерево
+# ══════════════════════════════════════════════════════════════════════════════
+
+
+class ConversationTree:
+    """Ветки одного чата: общие метаданные, общий кэш конвертации, сохранение без дублирования узлов"""
+
+    def __init__(self, chat_metadata: t.ChatMetadata | None = None):
+        self.chat_metadata = chat_metadata or t.ChatMetadata()
+        self.branches: dict[str, Branch] = {}
+        self.conversion_cache = ConversionCache()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_chat(cls, chat: t.ChatData, name: str = DEFAULT_BRANCH) -> "ConversationTree":
+        """Дерево с одной веткой из чата. Сообщения не копируются"""
+        tree = cls(chat.chat_metadata)
+        branch = tree.branches[name] = Branch(tree, name, None, list(chat.summaries))
+        branch.extend(chat.messages)
+        return tree
+
+    def __getitem__(self, name: str) -> Branch:
+        return self.branches[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.branches
+
+    def _free_name(self, base: str) -> str:
+        index = 2
+        while f"{base}-{index}" in self.branches:
+            index += 1
+        return f"{base}-{index}"
+
+    def fork(self, source: Branch | str, name: str | None = None, at: int | str | None = None) -> Branch:
+        """
+        Новая ветка от source (см. Branch.fork)
+        :raises ValueError: ветка с таким именем уже есть
+        """
+        source = self.branches[source] if isinstance(source, str) else source
+        if source.tree is not self:
+            raise ValueError(f"Ветка {source.name} из другого дерева")
+        tip = source._node_at(at)
+        # Сводки, которые покрывают сообщения после точки ветвления, новой ветке не подходят
+        summaries = [summary for summary in source.summaries if summary.messages_count <= (tip.length if tip else 0)]
+        with self._lock:
+            name = name or self._free_name(source.name)
+            if name in self.branches:
+                raise ValueError(f"Ветка {name} уже есть")
+            branch = self.branches[name] = Branch(self, name, tip, summaries)
+        return branch
+
+    def delete_branch(self, name: str) -> None:
+        """Удаляет ветку и записи кэша конвертации, которые остались только у неё"""
+        with self._lock:
+            del self.branches[name]
+            self.conversion_cache.retain(
+                node.message for branch in self.branches.values() for node in branch.nodes
+            )
+
+    # --- Хранение ---
+
+    def to_data(self) -> ConversationTreeData:
+        indexes: dict[int, int] = {}  # id(узла) -> индекс в nodes
+        nodes: list[TreeNodeData] = []
+        branches = {}
+        for name, branch in self.branches.items():
+            for node in branch.nodes:
+                if id(node) not in indexes:
+                    parent = indexes[id(node.parent)] if node.parent is not None else None
+                    indexes[id(node)] = len(nodes)
+                    nodes.append(TreeNodeData.model_construct(parent=parent, message=node.message))
+            tip = indexes[id(branch.tip)] if branch.tip is not None else None
+            branches[name] = BranchData.model_construct(tip=tip, summaries=branch.summaries)
+        return ConversationTreeData.model_construct(chat_metadata=self.chat_metadata, nodes=nodes, branches=branches)
+
+    @classmethod
+    def from_data(cls, data: ConversationTreeData) -> "ConversationTree":
+        tree = cls(data.chat_metadata)
+        nodes: list[MessageNode] = []
+        for item in data.nodes:
+            if item.parent is not None and not 0 <= item.parent < len(nodes):
+                raise ValueError("Узел ссылается на узел, записанный после него")
+            nodes.append(MessageNode(item.message, nodes[item.parent] if item.parent is not None else None))
+        for name, item in data.branches.items():
+            tip = nodes[item.tip] if item.tip is not None else None
+            tree.branches[name] = Branch(tree, name, tip, list(item.summaries))
+        return tree
+
+    def save(self, path: str | os.PathLike) -> None:
+        """Сохраняет дерево в JSON (через временный файл, читатель не увидит половину файла)"""
+        path = os.fspath(path)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(self.to_data().model_dump_json())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path: str | os.PathLike) -> "ConversationTree":
+        with open(path, "rb") as f:
+            return cls.from_data(ConversationTreeData.model_validate_json(f.read()))
@@ -1 +1,2 @@
-from .converters import *
\ No newline at end of file
+from .converters import *
+from .openai_request import *
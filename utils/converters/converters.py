@@ -1 +1,772 @@
-"""Здесь содержатся конвертеры из УФС в формат, совместимый с разными библиотеками"""
+import os
+import json
+import base64
+import binascii
+import threading
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, Executor
+from functools import partial
+from itertools import islice
+from typing import Any, Callable, Iterable, Iterator, TYPE_CHECKING
+
+from config import settings
+import utils.types as t
+from utils.small_utils import message_helper, generate_timestamp, string_to_bytes, bytes_to_string
+
+if TYPE_CHECKING:
+    from google.genai import types
+
+"""
+Здесь содержатся конвертеры из УФС в формат, совместимый с разными библиотеками, и обратно.
+
+Чистые конвертеры УФС <-> OpenAI Chat Completions <-> Google GenAI.
+
+Функции не хранят состояния и не обращаются к API: всё, что требует клиента (загрузка файлов к провайдеру,
+нормализация изображений), передаётся колбэками. Модели используют эти функции в _convert_history_from_umf,
+передавая свои методы в качестве колбэков, а без колбэков функции подходят для офлайн-обработки архивов:
+медиа, которые нельзя представить без провайдера, пропускаются.
+
+Для больших архивов есть convert_batch, который раскладывает конвертацию по пулу процессов.
+
+SDK google-genai импортируется только внутри функций GenAI, чтобы работа с OpenAI его не загружала.
+"""
+
+__all__ = [
+    "umf_to_openai",
+    "umf_to_genai",
+    "openai_to_umf",
+    "genai_to_umf",
+    "parse_openai_tool_arguments",
+    "save_imported_media",
+    "convert_batch",
+    "ConversionCache",
+]
+
+OpenAiAssetProcessor = Callable[[t.Asset], dict | None]
+DocumentText = Callable[[t.Asset], str | None]
+GenaiInlinePayload = Callable[[t.Asset], tuple[bytes, str] | None]
+GenaiUploader = Callable[[t.Asset], str | None]
+MediaImporter = Callable[[bytes | None, str | None, str | None], t.Asset | None]
+
+
+class ConversionCache:
+    """
+    Уже сконвертированные сообщения УФС, общие для историй с одним префиксом (ветки utils.branching).
+    Ключ - пространство (формат и настройки конвертации) и сам объект сообщения, поэтому сообщения в кэше
+    нельзя менять на месте: изменённое сообщение - это новое сообщение.
+
+    Сообщения с медиа не кэшируются: их представление зависит от загрузок провайдера (ссылки обновляются,
+    пропавшие файлы загружаются заново), а системные сообщения зависят от сводки.
+
+    Кэш ограничен max_entries записями и вытесняет давно не использованные (LRU), поэтому сообщения, которые
+    больше не отправляются (ушли в сводку, остались в удалённой ветке), со временем освобождаются.
+    max_entries должен быть больше числа сообщений одного запроса, умноженного на число форматов
+    (моделей с разными настройками конвертации): иначе записи вытесняются раньше, чем понадобятся снова.
+
+    Кэш потокобезопасен: ветки одного дерева конвертируются одновременно (agenerate выполняет конвертацию
+    в asyncio.to_thread), пока другая ветка удаляется (retain). Сама конвертация идёт вне блокировки
+    """
+
+    def __init__(self, max_entries: int = 4096):
+        """:param max_entries: максимум записей (сообщение в одном пространстве - одна запись)"""
+        if max_entries < 1:
+            raise ValueError("max_entries должен быть положительным")
+        self.max_entries = max_entries
+        # (пространство, id сообщения) -> (сообщение, результат), от давно использованных к недавним
+        self._entries: OrderedDict[tuple, tuple[t.Message, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def cacheable(message: t.Message) -> bool:
+        if message.role == "system":
+            return False
+        return not any(content.type == "media" or (content.type == "tool_result" and content.assets)
+                       for content in message.content)
+
+    def get(self, namespace: tuple, message: t.Message) -> Any | None:
+        key = (namespace, id(message))
+        with self._lock:
+            entry = self._entries.get(key)
+            # Сообщение хранится в записи, поэтому его id не может достаться другому объекту
+            if entry is None or entry[0] is not message:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, namespace: tuple, message: t.Message, native: Any) -> None:
+        key = (namespace, id(message))
+        with self._lock:
+            self._entries[key] = (message, native)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def convert(self, namespace: tuple, message: t.Message, convert: Callable[..., Any], *args) -> Any:
+        """convert(message, *args) из кэша, если сообщение можно кэшировать"""
+        if not self.cacheable(message):
+            return convert(message, *args)
+        native = self.get(namespace, message)
+        if native is None:
+            native = convert(message, *args)
+            self.put(namespace, message, native)
+        return native
+
+    def retain(self, messages: Iterable[t.Message]) -> int:
+        """
+        Оставляет только записи этих сообщений (например, после удаления ветки)
+        :return: сколько записей удалено
+        """
+        keep = {id(message) for message in messages}
+        with self._lock:
+            stale = [key for key in self._entries if key[1] not in keep]
+            for key in stale:
+                del self._entries[key]
+        return len(stale)
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# УФС -> OpenAI
+# ══════════════════════════════════════════════════════════════════════════════
+
+
+def _with_summary(system_prompt: str | None, summary: str | None) -> str | None:
+    """Системный промпт со сводкой начала чата (см. utils.summarizer)"""
+    if not summary:
+        return system_prompt
+    block = f"Summary of the earlier part of this conversation:\n<conversation_summary>\n{summary}\n</conversation_summary>"
+    return f"{system_prompt}\n\n{block}" if system_prompt else block
+
+
+def _document_text_part(asset: t.Asset, text: str) -> dict:
+    """Текст документа как часть сообщения для моделей, которые не принимают файлы"""
+    return {"type": "text", "text": f'<document id="{asset.id}" mime_type="{asset.mime_type}">\n{text}\n</document>'}
+
+
+def _openai_media_parts(
+        assets: list[t.Asset],
+        process_asset: OpenAiAssetProcessor | None,
+        document_text: DocumentText | None,
+) -> list[dict]:
+    parts = []
+    for asset in assets:
+        if asset.type == "document" and document_text:
+            text = document_text(asset)
+            if text is not None:
+                parts.append(_document_text_part(asset, text))
+                continue
+        if process_asset:
+            media_asset = process_asset(asset)
+            if media_asset:
+                parts.append(media_asset)
+    return parts
+
+
+def _openai_message(
+        message: t.Message,
+        is_thinking: bool,
+        process_asset: OpenAiAssetProcessor | None,
+        document_text: DocumentText | None,
+) -> list[dict]:
+    """Сообщение УФС (кроме системного) в сообщения OpenAI: результаты инструментов - по сообщению на результат"""
+    if message.role == "assistant":
+        thought = ""
+        tool_calls = []
+        native_content = []
+        for content in message.content:
+            if is_thinking and content.type == "thought":
+                thought = content.text
+            elif content.type == "text":
+                native_content.append({"type": "text", "text": content.text})
+            elif content.type == "tool_call":
+                tool_calls.append(
+                    {
+                        "id": content.tool_call.id,
+                        "type": "function",
+                        "function": {
+                            "name": content.tool_call.name,
+                            "arguments": json.dumps(content.tool_call.args),
+                        },
+                    }
+                )
+            elif content.type == "media":
+                native_content.extend(_openai_media_parts(content.assets, process_asset, document_text))
+
+        native_message = {"role": "assistant", "content": native_content}
+        if thought:
+            native_message["reasoning_content"] = thought
+        if tool_calls:
+            native_message["tool_calls"] = tool_calls
+        return [native_message]
+    elif message.role == "user":
+        native_content = []
+        for content in message.content:
+            if content.type == "text":
+                native_content.append({"type": "text", "text": content.text})
+            elif content.type == "media":
+                native_content.extend(_openai_media_parts(content.assets, process_asset, document_text))
+        return [{"role": "user", "content": native_content}]
+    elif message.role == "tool":
+        return [
+            {
+                "role": "tool",
+                "content": content.tool_result.text_content
+                if not content.tool_result.is_error
+                else f"Error: {content.tool_result.text_content}",
+                "tool_call_id": content.tool_result.id,
+            }
+            for content in message.content
+        ]
+    return []
+
+
+def umf_to_openai(
+        history: t.ChatData,
+        is_thinking: bool = False,
+        process_asset: OpenAiAssetProcessor | None = None,
+        system_prompt: str | None = None,
+        document_text: DocumentText | None = None,
+        summary: str | None = None,
+        cache: ConversionCache | None = None,
+) -> list[dict]:
+    """
+    Конвертирует историю из УФС в список сообщений OpenAI Chat Completions.
+    Результат зависит только от аргументов, а сообщение - только от себя самого: уже отправленные сообщения
+    на следующих ходах дают те же байты, и провайдер может взять префикс запроса из кэша.
+    Поэтому пустые поля (reasoning_content, tool_calls) не передаются вовсе, а не передаются как None
+    :param history: история в УФС
+    :param is_thinking: передавать ли мысли ассистента в reasoning_content
+    :param process_asset: превращает ассет в элемент content (image_url, video_url...) или возвращает None.
+    Без него медиа не передаются
+    :param system_prompt: системный промпт, если в истории нет system-сообщения
+    :param document_text: возвращает текст документа (см. utils.documents) или None. Текст передаётся
+    частью сообщения вместо файла, а документы, для которых он None, уходят в process_asset
+    :param summary: сводка начала чата (utils.summarizer.summarized_view), добавляется к первому системному сообщению
+    :param cache: кэш уже сконвертированных сообщений (общий для веток одного чата, см. utils.branching).
+    Сообщения из кэша нельзя менять
+    :return: список сообщений
+    """
+    native_history = []
+    has_system = any(message.role == "system" for message in history.messages)
+    if not has_system and (system_prompt or summary):
+        native_history.append({"role": "system", "content": _with_summary(system_prompt, summary)})
+
+    namespace = ("openai", is_thinking)
+    for message in history.messages:
+        if message.role == "system":
+            text = message.content[0].text
+            if summary and not any(native["role"] == "system" for native in native_history):
+                text = _with_summary(text, summary)
+            native_history.append({"role": "system", "content": text})
+        elif cache is None:
+            native_history.extend(_openai_message(message, is_thinking, process_asset, document_text))
+        else:
+            native_history.extend(
+                cache.convert(namespace, message, _openai_message, is_thinking, process_asset, document_text)
+            )
+    return native_history
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# УФС -> GenAI
+# ══════════════════════════════════════════════════════════════════════════════
+
+
+def _stored_inline_payload(asset: t.Asset) -> tuple[bytes, str] | None:
+    """Инлайн-данные, которые уже лежат в УФС (data_base64). Используется, когда колбэк не передан"""
+    if asset.data_base64:
+        return string_to_bytes(asset.data_base64), asset.mime_type
+    return None
+
+
+def _stored_genai_uri(asset: t.Asset) -> str | None:
+    """Ссылка на уже загруженный в Google Files API файл. Используется, когда колбэк не передан"""
+    if asset.cloud_refs and asset.cloud_refs.genai:
+        return asset.cloud_refs.genai.uri
+    return None
+
+
+def _genai_media_part(
+        asset: t.Asset, inline_payload: GenaiInlinePayload, upload: GenaiUploader, function_response: bool = False
+):
+    """
+    Превращает ассет в Part (или FunctionResponsePart для результатов инструментов).
+    Файлы меньше 20 Мб посылаются inline, остальные - ссылкой на Google Files API
+    """
+    from google.genai import types
+
+    payload = inline_payload(asset)
+    if payload:
+        raw_bytes, mime_type = payload
+        if function_response:
+            return types.FunctionResponsePart(
+                inline_data=types.FunctionResponseBlob(data=raw_bytes, mime_type=mime_type)
+            )
+        return types.Part(inline_data=types.Blob(data=raw_bytes, mime_type=mime_type))
+
+    uri = upload(asset)
+    if not uri:
+        return None
+    if function_response:
+        return types.FunctionResponsePart(
+            file_data=types.FunctionResponseFileData(file_uri=uri, mime_type=asset.mime_type)
+        )
+    return types.Part(file_data=types.FileData(file_uri=uri, mime_type=asset.mime_type))
+
+
+def _genai_message(
+        message: t.Message, send_thoughts: bool, inline_payload: GenaiInlinePayload, upload: GenaiUploader
+) -> "types.Content":
+    """Сообщение УФС (кроме системного) в types.Content"""
+    from google.genai import types
+
+    native_parts = []
+    if message.role == "assistant":
+        preserved_thought_signature = None
+        for content in message.content:
+            if send_thoughts and content.type == "thought":
+                if content.signature:  # Если ответ от модели genai, то есть подпись, и эту CoT можно подать на вход.
+                    # Если мысли не подписаны, то API вернет ошибку
+                    # --- ПРОБЛЕМА --- Начиная с Gemini 3 если не вернуть мысли в цикле ReAct, то API вернёт ошибку 400
+                    # https://ai.google.dev/gemini-api/docs/thought-signatures?hl=ru#model-behavior
+                    preserved_thought_signature = string_to_bytes(content.signature)
+                    native_parts.append(
+                        types.Part(
+                            thought=True,
+                            thought_signature=preserved_thought_signature,
+                            text=content.text,
+                        )
+                    )
+            elif content.type == "text":
+                native_parts.append(types.Part(text=content.text))
+            elif content.type == "tool_call":
+                native_parts.append(
+                    types.Part(
+                        function_call=types.FunctionCall(
+                            id=content.tool_call.id,
+                            args=content.tool_call.args,
+                            name=content.tool_call.name,
+                        ),
+                        thought_signature=preserved_thought_signature,
+                    )
+                )
+            elif content.type == "media":
+                for asset in content.assets:
+                    media_part = _genai_media_part(asset, inline_payload, upload)
+                    if media_part:
+                        native_parts.append(media_part)
+
+        return types.Content(role="model", parts=native_parts)
+
+    elif message.role == "tool":
+        for content in message.content:
+            tool_part = types.Part(
+                function_response=types.FunctionResponse(
+                    id=content.tool_result.id,
+                    name=content.tool_result.name,
+                    response={
+                        "output": content.tool_result.text_content,
+                        "error": str(content.tool_result.is_error),
+                    },
+                )
+            )
+            media_parts = []
+            for asset in content.assets or []:
+                media_part = _genai_media_part(asset, inline_payload, upload, function_response=True)
+                if media_part:
+                    media_parts.append(media_part)
+            tool_part.function_response.parts = media_parts
+            native_parts.append(tool_part)
+
+        return types.Content(role="user", parts=native_parts)
+
+    for content in message.content:
+        if content.type == "text":
+            native_parts.append(types.Part(text=content.text))
+        elif content.type == "media":  # Если пользователь приложил медиафайл к своему сообщению
+            for asset in content.assets:
+                media_part = _genai_media_part(asset, inline_payload, upload)
+                if media_part:
+                    native_parts.append(media_part)
+    return types.Content(role="user", parts=native_parts)
+
+
+def umf_to_genai(
+        history: t.ChatData,
+        send_thoughts: bool = True,
+        inline_payload: GenaiInlinePayload | None = None,
+        upload: GenaiUploader | None = None,
+        system_prompt: str | None = None,
+        summary: str | None = None,
+        cache: ConversionCache | None = None,
+) -> tuple[list["types.Content"], str | None]:
+    """
+    Конвертирует историю из УФС в список types.Content
+    :param history: история в УФС
+    :param send_thoughts: передавать ли подписанные мысли модели (нужно для моделей с включённым ризонингом)
+    :param inline_payload: возвращает (байты, mime_type) для отправки ассета inline или None, если он слишком большой.
+    По умолчанию используется data_base64 из УФС
+    :param upload: загружает ассет в Google Files API и возвращает его uri.
+    По умолчанию используется уже сохранённый cloud_refs.genai.uri, а ассеты без него пропускаются
+    :param system_prompt: системный промпт, если в истории нет system-сообщения
+    :param summary: сводка начала чата (utils.summarizer.summarized_view), добавляется к системному промпту
+    :param cache: кэш уже сконвертированных сообщений (общий для веток одного чата, см. utils.branching).
+    Сообщения из кэша нельзя менять
+    :return: (история, системный промпт из истории (или переданный) со сводкой, или None)
+    """
+    inline_payload = inline_payload or _stored_inline_payload
+    upload = upload or _stored_genai_uri
+    native_history = []
+    default_system_prompt = system_prompt
+    system_prompt = None
+
+    namespace = ("genai", send_thoughts)
+    for message in history.messages:
+        if message.role == "system":
+            system_prompt = message.content[0].text
+        elif cache is None:
+            native_history.append(_genai_message(message, send_thoughts, inline_payload, upload))
+        else:
+            native_history.append(
+                cache.convert(namespace, message, _genai_message, send_thoughts, inline_payload, upload)
+            )
+
+    if system_prompt is None:
+        system_prompt = default_system_prompt
+    return native_history, _with_summary(system_prompt, summary)
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# OpenAI -> УФС
+# ══════════════════════════════════════════════════════════════════════════════
+
+
+def parse_openai_tool_arguments(name: str, arguments: str | None) -> tuple[dict, str | None]:
+    """
+    Разбирает JSON с аргументами вызова.
+    :return: (аргументы, текст ошибки для модели или None)
+    """
+    try:
+        args = json.loads(arguments or "{}")
+    except json.JSONDecodeError as e:
+        return {}, f"Invalid arguments for {name}: arguments are not valid JSON ({e}). Fix the arguments and call the tool again."
+    if not isinstance(args, dict):
+        return {}, f"Invalid arguments for {name}: expected a JSON object, got {type(args).__name__}. Fix the arguments and call the tool again."
+    return args, None
+
+
+def save_imported_media(data: bytes | None, uri: str | None, mime_type: str | None) -> t.Asset | None:
+    """
+    Колбэк для openai_to_umf и genai_to_umf: сохраняет встроенные в лог файлы в MEDIA_FOLDER.
+    Внешние ссылки не скачиваются и пропускаются
+    """
+    if data is None:
+        return None
+    from utils.tool_runner import save_media_asset
+    try:
+        return save_media_asset(data, mime_type or "application/octet-stream")
+    except TypeError:  # Тип файла не поддерживается УФС
+        return None
+
+
+def _as_dict(item: Any) -> dict:
+    """Объекты SDK (pydantic) приводятся к словарям, словари возвращаются как есть"""
+    if isinstance(item, dict):
+        return item
+    if hasattr(item, "model_dump"):
+        return item.model_dump(exclude_none=True)
+    raise TypeError(f"Не удалось прочитать сообщение типа {type(item).__name__}")
+
+
+def _split_data_url(url: str) -> tuple[bytes | None, str | None]:
+    """data:image/png;base64,... -> (байты, mime_type). Для обычных ссылок возвращает (None, None)"""
+    if not url.startswith("data:") or "," not in url:
+        return None, None
+    header, data = url[5:].split(",", 1)
+    mime_type = header.split(";")[0] or None
+    try:
+        return base64.b64decode(data), mime_type
+    except (binascii.Error, ValueError):
+        return None, None
+
+
+def _openai_content_to_umf(content: Any, import_media: MediaImporter | None) -> list:
+    """content сообщения OpenAI (строка или список частей) -> список элементов УФС"""
+    if content is None:
+        return []
+    if isinstance(content, str):
+        return [t.TextContent(text=content)] if content else []
+
+    result = []
+    assets = []
+    for part in content:
+        part = _as_dict(part)
+        if part.get("type") == "text":
+            result.append(t.TextContent(text=part.get("text", "")))
+        elif import_media and part.get("type") in ("image_url", "video_url", "input_audio"):
+            if part["type"] == "input_audio":
+                audio = part["input_audio"]
+                data, uri, mime_type = base64.b64decode(audio["data"]), None, f"audio/{audio.get('format', 'wav')}"
+            else:
+                uri = part[part["type"]]["url"]
+                data, mime_type = _split_data_url(uri)
+                if data is not None:
+                    uri = None
+            asset = import_media(data, uri, mime_type)
+            if asset:
+                assets.append(asset)
+    if assets:
+        result.append(t.MediaContent(assets=assets))
+    return result
+
+
+def _new_message(role: str, content: list, timestamp: str | None) -> t.Message:
+    return t.Message(
+        id=message_helper.generate_id(settings.MESSAGE_ID_LEN),
+        timestamp=timestamp or generate_timestamp(),
+        role=role,
+        content=content,
+    )
+
+
+def openai_to_umf(
+        messages: Iterable[dict | Any],
+        import_media: MediaImporter | None = None,
+        timestamp: str | None = None,
+) -> t.ChatData:
+    """
+    Конвертирует список сообщений OpenAI Chat Completions (словари или объекты SDK) в УФС.
+    Подряд идущие сообщения role="tool" собираются в одно сообщение УФС, как это делают модели
+    :param messages: сообщения
+    :param import_media: сохраняет медиа из сообщений (data URL или ссылка) и возвращает Asset. Без него медиа пропускаются
+    :param timestamp: время, которое проставляется сообщениям (в логах OpenAI его нет). По умолчанию - текущее
+    :return: история в УФС
+    """
+    umf_messages = []
+    tool_names = {}  # id вызова -> имя функции, в сообщениях role="tool" имени нет
+
+    for item in messages:
+        message = _as_dict(item)
+        role = message.get("role")
+        if role == "system" or role == "developer":
+            text = message.get("content")
+            if not isinstance(text, str):
+                text = "".join(_as_dict(part).get("text", "") for part in text or [])
+            umf_messages.append(_new_message("system", [t.TextContent(text=text)], timestamp))
+        elif role == "user":
+            umf_messages.append(_new_message("user", _openai_content_to_umf(message.get("content"), import_media), timestamp))
+        elif role == "assistant":
+            content = []
+            if message.get("reasoning_content"):
+                content.append(t.ThoughtContent(text=message["reasoning_content"]))
+            content.extend(_openai_content_to_umf(message.get("content"), import_media))
+            for tool_call in message.get("tool_calls") or []:
+                tool_call = _as_dict(tool_call)
+                function = tool_call.get("function", {})
+                args, _ = parse_openai_tool_arguments(function.get("name", ""), function.get("arguments"))
+                call_id = tool_call.get("id") or message_helper.generate_id(9)
+                tool_names[call_id] = function.get("name", "")
+                content.append(t.ToolCallContent(tool_call=t.ToolCall(id=call_id, name=function.get("name", ""), args=args)))
+            umf_messages.append(_new_message("assistant", content, timestamp))
+        elif role == "tool":
+            text = message.get("content") or ""
+            if not isinstance(text, str):
+                text = "".join(_as_dict(part).get("text", "") for part in text)
+            is_error = text.startswith("Error: ")
+            call_id = message.get("tool_call_id", "")
+            result = t.ToolResultContent(
+                tool_result=t.ToolResult(
+                    id=call_id,
+                    name=message.get("name") or tool_names.get(call_id, ""),
+                    text_content=text[len("Error: "):] if is_error else text,
+                    is_error=is_error,
+                )
+            )
+            if umf_messages and umf_messages[-1].role == "tool":
+                umf_messages[-1].content.append(result)
+            else:
+                umf_messages.append(_new_message("tool", [result], timestamp))
+
+    return t.ChatData(
+        chat_metadata=t.ChatMetadata(config=t.ChatConfig(provider="openai")),
+        messages=umf_messages,
+    )
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# GenAI -> УФС
+# ══════════════════════════════════════════════════════════════════════════════
+
+
+def _genai_media_to_umf(part: "types.Part", import_media: MediaImporter | None) -> t.Asset | None:
+    if import_media is None:
+        return None
+    if part.inline_data:
+        return import_media(part.inline_data.data, None, part.inline_data.mime_type)
+    if part.file_data:
+        return import_media(None, part.file_data.file_uri, part.file_data.mime_type)
+    return None
+
+
+def genai_to_umf(
+        contents: Iterable["types.Content | dict"],
+        system_instruction: str | None = None,
+        import_media: MediaImporter | None = None,
+        timestamp: str | None = None,
+) -> t.ChatData:
+    """
+    Конвертирует историю GenAI (types.Content или словари) в УФС.
+    Сообщения пользователя с function_response становятся сообщениями role="tool"
+    :param contents: история
+    :param system_instruction: системный промпт (в GenAI он передаётся отдельно от истории)
+    :param import_media: сохраняет медиа из частей inline_data/file_data и возвращает Asset. Без него медиа пропускаются
+    :param timestamp: время, которое проставляется сообщениям. По умолчанию - текущее
+    :return: история в УФС
+    """
+    from google.genai import types
+
+    umf_messages = []
+    if system_instruction:
+        umf_messages.append(_new_message("system", [t.TextContent(text=system_instruction)], timestamp))
+
+    for item in contents:
+        native = item if isinstance(item, types.Content) else types.Content.model_validate(item)
+        parts = native.parts or []
+
+        if native.role == "model":
+            content = []
+            assets = []
+            for part in parts:
+                signature = bytes_to_string(part.thought_signature) if part.thought_signature else None
+                if part.thought:
+                    content.append(t.ThoughtContent(text=part.text or "", signature=signature))
+                elif part.text:
+                    content.append(t.TextContent(text=part.text))
+                elif part.function_call:
+                    # Подпись вызова хранится в предшествующей мысли, как это делает GenaiBaseModel._parse_response
+                    if signature:
+                        if content and content[-1].type == "thought":
+                            content[-1].signature = signature
+                        else:
+                            content.append(t.ThoughtContent(text="", signature=signature))
+                    content.append(
+                        t.ToolCallContent(
+                            tool_call=t.ToolCall(
+                                id=part.function_call.id or message_helper.generate_id(9),
+                                name=part.function_call.name or "",
+                                args=part.function_call.args or {},
+                            )
+                        )
+                    )
+                elif asset := _genai_media_to_umf(part, import_media):
+                    assets.append(asset)
+            if assets:
+                content.append(t.MediaContent(assets=assets))
+            umf_messages.append(_new_message("assistant", content, timestamp))
+
+        elif any(part.function_response for part in parts):
+            results = []
+            for part in parts:
+                if not part.function_response:
+                    continue
+                response = part.function_response.response or {}
+                if "output" in response:  # Формат umf_to_genai: {"output": ..., "error": "True" | "False"}
+                    output = response["output"]
+                    is_error = str(response.get("error")) == "True"
+                else:  # Соглашение GenAI: {"error": ...} для ошибок
+                    output = response.get("error", response)
+                    is_error = "error" in response
+                assets = []
+                for response_part in part.function_response.parts or []:
+                    asset = _genai_media_to_umf(response_part, import_media)
+                    if asset:
+                        assets.append(asset)
+                results.append(
+                    t.ToolResultContent(
+                        tool_result=t.ToolResult(
+                            id=part.function_response.id or "",
+                            name=part.function_response.name or "",
+                            text_content=output if isinstance(output, str) else json.dumps(output, ensure_ascii=False),
+                            is_error=is_error,
+                        ),
+                        assets=assets or None,
+                    )
+                )
+            umf_messages.append(_new_message("tool", results, timestamp))
+
+        else:
+            content = []
+            assets = []
+            for part in parts:
+                if part.text:
+                    content.append(t.TextContent(text=part.text))
+                elif asset := _genai_media_to_umf(part, import_media):
+                    assets.append(asset)
+            if assets:
+                content.append(t.MediaContent(assets=assets))
+            umf_messages.append(_new_message("user", content, timestamp))
+
+    return t.ChatData(
+        chat_metadata=t.ChatMetadata(config=t.ChatConfig(provider="genai")),
+        messages=umf_messages,
+    )
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Пакетная конвертация
+# ══════════════════════════════════════════════════════════════════════════════
+
+
+def _convert_chunk(converter: Callable, chunk: list) -> list:
+    """Выполняется в процессе-воркере"""
+    return [converter(item) for item in chunk]
+
+
+def convert_batch(
+        converter: Callable,
+        items: Iterable,
+        workers: int | None = None,
+        chunk_size: int = 256,
+        executor: Executor | None = None,
+        **kwargs,
+) -> Iterator:
+    """
+    Конвертирует много историй в пуле процессов, сохраняя порядок.
+
+    Входные данные читаются лениво, и в работе одновременно не больше двух пачек на воркер,
+    поэтому архив на миллионы сообщений не загружается в память целиком.
+    Конвертер и колбэки в kwargs передаются в воркеры через pickle, поэтому они должны быть объявлены
+    на верхнем уровне модуля (например, save_imported_media, но не методы моделей)
+    :param converter: одна из функций этого модуля (umf_to_openai, openai_to_umf...)
+    :param items: истории для конвертации
+    :param workers: число процессов (по умолчанию - по числу ядер)
+    :param chunk_size: сколько историй отправлять воркеру за раз
+    :param executor: готовый пул, если его нужно переиспользовать между вызовами
+    :param kwargs: дополнительные аргументы конвертера
+    :return: итератор результатов в порядке входных данных
+    """
+    func = partial(converter, **kwargs) if kwargs else converter
+    items = iter(items)
+    first_chunk = list(islice(items, chunk_size))
+    if len(first_chunk) < chunk_size and executor is None:  # Маленький пакет быстрее сконвертировать на месте
+        yield from (func(item) for item in first_chunk)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        pending = deque()
+        chunk = first_chunk
+        while chunk or pending:
+            while chunk and len(pending) < workers * 2:
+                pending.append(executor.submit(_convert_chunk, func, chunk))
+                chunk = list(islice(items, chunk_size))
+            yield from pending.popleft().result()
+    finally:
+        if own_executor:
+            executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,133 @@
+import json
+from typing import Any, NamedTuple
+
+"""
+Канонический запрос OpenAI Chat Completions для кэша префиксов.
+
+DeepSeek, Kimi и другие OpenAI-совместимые провайдеры автоматически кэшируют префикс запроса и берут за него
+меньше, но только если байты префикса совпадают с прошлым запросом. build_openai_request собирает тело запроса
+детерминированно: ключи в постоянном порядке, инструменты отсортированы по имени, пустые параметры не передаются.
+Сообщения собирает umf_to_openai, который не меняет уже отправленные сообщения от хода к ходу.
+
+serialize_openai_request даёт байты в том виде, в каком их сравнивает кэш, а find_prefix_divergence
+показывает, где два запроса (например, соседние ходы одного чата) разошлись, если кэш перестал попадать.
+"""
+
+__all__ = [
+    "build_openai_request",
+    "serialize_openai_request",
+    "find_prefix_divergence",
+    "PrefixDivergence",
+]
+
+
+def _tool_sort_key(tool: dict) -> str:
+    function = tool.get("function") or {}
+    return function.get("name") or tool.get("name") or ""
+
+
+def build_openai_request(
+        model: str,
+        messages: list[dict],
+        tools: list[dict] | None = None,
+        extra_body: dict | None = None,
+) -> dict:
+    """
+    Собирает тело запроса chat.completions.create
+    :param model: имя модели
+    :param messages: сообщения из umf_to_openai
+    :param tools: схемы инструментов в любом порядке (например, из ToolsParser.select_tools)
+    :param extra_body: параметры провайдера, передаются с отсортированными ключами
+    :return: {"model", "messages", "tools"?, "extra_body"?} - аргументы chat.completions.create
+    """
+    request = {"model": model, "messages": messages}
+    if tools:
+        request["tools"] = sorted(tools, key=_tool_sort_key)
+    if extra_body:
+        request["extra_body"] = {key: extra_body[key] for key in sorted(extra_body)}
+    return request
+
+
+def serialize_openai_request(request: dict) -> bytes:
+    """
+    Тело запроса в том виде, в каком провайдер видит его префикс: инструменты, затем сообщения.
+    extra_body влияет на ответ, но не на кэшируемый промпт, поэтому в сериализацию не входит
+    """
+    prompt = {"model": request.get("model"), "tools": request.get("tools") or [], "messages": request["messages"]}
+    return json.dumps(prompt, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+class PrefixDivergence(NamedTuple):
+    """Первое место, где запросы разошлись"""
+    path: str  # Путь в запросе, например messages[3].tool_calls[0].function.arguments
+    offset: int  # Длина общего префикса сериализованных запросов в байтах
+    previous: Any  # Значение по этому пути в прошлом запросе (None, если его не было)
+    current: Any  # Значение в новом запросе
+
+
+def _first_difference(previous: Any, current: Any, path: str) -> tuple[str, Any, Any] | None:
+    """
+    Рекурсивно ищет первое различие: словари по ключам в порядке прошлого запроса, списки по индексам
+    :return: (путь, прошлое значение, новое значение) или None
+    """
+    if type(previous) is not type(current):
+        return path, previous, current
+    if isinstance(previous, dict):
+        for key in list(previous) + [key for key in current if key not in previous]:
+            if key not in previous or key not in current:
+                return f"{path}.{key}", previous.get(key), current.get(key)
+            difference = _first_difference(previous[key], current[key], f"{path}.{key}")
+            if difference:
+                return difference
+        if list(previous) != list(current):
+            return f"{path} (порядок ключей)", list(previous), list(current)
+        return None
+    if isinstance(previous, list):
+        for index, (old, new) in enumerate(zip(previous, current)):
+            difference = _first_difference(old, new, f"{path}[{index}]")
+            if difference:
+                return difference
+        # В конец можно только дописывать сообщения, любой другой список должен совпасть целиком
+        if len(previous) > len(current) or (len(previous) != len(current) and path != "messages"):
+            index = min(len(previous), len(current))
+            return (
+                f"{path}[{index}]",
+                previous[index] if index < len(previous) else None,
+                current[index] if index < len(current) else None,
+            )
+        return None
+    return None if previous == current else (path, previous, current)
+
+
+def _common_prefix_length(first: bytes, second: bytes, chunk_size: int = 4096) -> int:
+    """Длина общего префикса: сначала сравниваются блоки (запросы с медиа весят мегабайты), затем байты"""
+    length = min(len(first), len(second))
+    start = 0
+    while start < length and first[start:start + chunk_size] == second[start:start + chunk_size]:
+        start += chunk_size
+    for index in range(start, min(start + chunk_size, length)):
+        if first[index] != second[index]:
+            return index
+    return min(start + chunk_size, length)
+
+
+def find_prefix_divergence(previous: dict, current: dict) -> PrefixDivergence | None:
+    """
+    Находит, где новый запрос перестал повторять прошлый. Новый запрос, который только дописывает сообщения
+    в конец, расходиться не должен: иначе кэш префикса теряется с этого места
+    :param previous: запрос прошлого хода (build_openai_request)
+    :param current: запрос нового хода
+    :return: PrefixDivergence или None, если прошлый запрос целиком является префиксом нового
+    """
+    old_bytes, new_bytes = serialize_openai_request(previous), serialize_openai_request(current)
+    # Прошлые сообщения без закрывающих скобок - префикс нового запроса, если ничего не менялось
+    old_prefix = old_bytes[:-2]
+    if new_bytes.startswith(old_prefix):
+        return None
+
+    offset = _common_prefix_length(old_prefix, new_bytes)
+    for section in ("model", "tools", "messages"):
+        difference = _first_difference(previous.get(section), current.get(section), section)
+        if difference:
+            return PrefixDivergence(difference[0], offset, difference[1], difference[2])
+    return PrefixDivergence("messages", offset, None, None)
@@ -0,0 +1 @@
+from .document_extractor import DocumentExtractor, DocumentExtractionError, document_extractor
@@ -0,0 +1,205 @@
+import io
+import os
+import re
+import hashlib
+import zipfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable
+from xml.etree import ElementTree
+
+from config import settings
+import utils.types as t
+from utils.media import asset_bytes
+from utils.small_utils import single_flight
+from utils.tracing import tracer
+
+"""
+Извлечение текста из документов для моделей, которые не принимают файлы.
+
+Два способа:
+    провайдер - модель передаёт функцию, которая загружает файл к провайдеру и получает текст
+                (Kimi: files.create(purpose="file-extract"));
+    локально  - PDF (нужен пакет pypdf, страницы разбираются параллельно в пуле процессов),
+                DOCX (стандартная библиотека), текстовые форматы.
+
+Результат кэшируется на диске по SHA-256 содержимого ({MEDIA_FOLDER}/.documents/<hash>.txt) и сохраняется
+в Asset.ocr_text, поэтому один и тот же документ извлекается один раз: повторная отправка, другой чат или
+перезапуск процесса берут готовый текст. Одновременные извлечения одного документа объединяются (single_flight).
+"""
+
+PDF_PAGES_PER_TASK = 16  # Столько страниц PDF разбирает один процесс за задачу
+
+_TEXT_MIME_TYPES = {
+    "application/json", "application/xml", "application/x-yaml", "application/yaml",
+    "application/javascript", "application/x-sh", "application/sql", "application/csv",
+}
+_DOCX_MIME_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+_WORD_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+class DocumentExtractionError(Exception):
+    """Текст документа не удалось получить (неподдерживаемый формат, нет pypdf, ошибка провайдера)"""
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Локальный разбор
+# ══════════════════════════════════════════════════════════════════════════════
+
+
+def _pdf_pages_text(data: bytes, start: int, stop: int) -> list[str]:
+    """Текст страниц [start, stop). Выполняется в процессе-воркере"""
+    import pypdf
+    reader = pypdf.PdfReader(io.BytesIO(data))
+    return [reader.pages[index].extract_text() or "" for index in range(start, stop)]
+
+
+def _docx_text(data: bytes) -> str:
+    """Абзацы основного текста DOCX (word/document.xml), таблицы - построчно через табуляцию"""
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        root = ElementTree.fromstring(archive.read("word/document.xml"))
+    lines = []
+    for paragraph in root.iter(f"{_WORD_NS}p"):
+        parts = []
+        for node in paragraph.iter():
+            if node.tag == f"{_WORD_NS}t" and node.text:
+                parts.append(node.text)
+            elif node.tag == f"{_WORD_NS}tab":
+                parts.append("\t")
+            elif node.tag in (f"{_WORD_NS}br", f"{_WORD_NS}cr"):
+                parts.append("\n")
+        lines.append("".join(parts))
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+
+def _decode_text(data: bytes) -> str:
+    for encoding in ("utf-8-sig", "cp1251"):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode("utf-8", errors="replace")
+
+
+class DocumentExtractor:
+    """Извлекает и кэширует текст документов. Используется общий экземпляр document_extractor"""
+
+    def __init__(self, cache_folder: str | None = None, max_workers: int | None = None):
+        """
+        :param cache_folder: папка кэша (по умолчанию {MEDIA_FOLDER}/.documents)
+        :param max_workers: процессов для разбора страниц PDF (по умолчанию - число ядер)
+        """
+        self._cache_folder = cache_folder
+        self.max_workers = max_workers
+        self._executor: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def cache_folder(self) -> str:
+        return self._cache_folder or f"{settings.MEDIA_FOLDER}/.documents"
+
+    # --- Кэш ---
+
+    @staticmethod
+    def content_hash(asset: t.Asset) -> str:
+        with asset_bytes.open(asset) as data:
+            return hashlib.sha256(data).hexdigest()
+
+    def _cache_path(self, digest: str) -> str:
+        return os.path.join(self.cache_folder, f"{digest}.txt")
+
+    def cached_text(self, digest: str) -> str | None:
+        try:
+            with open(self._cache_path(digest), encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _store(self, digest: str, text: str) -> None:
+        os.makedirs(self.cache_folder, exist_ok=True)
+        path = self._cache_path(digest)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)  # Читатели видят либо старый файл, либо полный новый
+
+    # --- Извлечение ---
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    def _extract_pdf(self, data: bytes) -> str:
+        # pypdf импортируется здесь, а не в начале модуля: импорт долгий, а модуль загружается вместе с моделями
+        try:
+            import pypdf
+        except ImportError:  # pypdf - необязательная зависимость, без неё PDF извлекаются только провайдером
+            raise DocumentExtractionError("Для разбора PDF установите пакет pypdf") from None
+        try:
+            page_count = len(pypdf.PdfReader(io.BytesIO(data)).pages)
+        except pypdf.errors.PdfReadError as e:
+            raise DocumentExtractionError(f"Не удалось прочитать PDF: {e}") from None
+        ranges = [(start, min(start + PDF_PAGES_PER_TASK, page_count))
+                  for start in range(0, page_count, PDF_PAGES_PER_TASK)]
+        if len(ranges) <= 1:
+            pages = _pdf_pages_text(data, 0, page_count)
+        else:
+            executor = self._get_executor()
+            futures = [executor.submit(_pdf_pages_text, data, start, stop) for start, stop in ranges]
+            pages = [page for future in futures for page in future.result()]
+        return "\n\n".join(f"--- {number} ---\n{text.strip()}" for number, text in enumerate(pages, start=1))
+
+    def extract_local(self, data: bytes, mime_type: str) -> str:
+        """
+        Разбирает документ без провайдера
+        :raises DocumentExtractionError: формат не поддерживается
+        """
+        if mime_type == "application/pdf":
+            return self._extract_pdf(data)
+        if mime_type == _DOCX_MIME_TYPE:
+            try:
+                return _docx_text(data)
+            except (zipfile.BadZipFile, KeyError, ElementTree.ParseError) as e:
+                raise DocumentExtractionError(f"Не удалось прочитать DOCX: {e}") from None
+        if mime_type.startswith("text/") or mime_type in _TEXT_MIME_TYPES:
+            return _decode_text(data)
+        raise DocumentExtractionError(f"Извлечение текста из {mime_type} не поддерживается")
+
+    def extract(self, asset: t.Asset, provider_extract: Callable[[t.Asset], str] | None = None) -> str:
+        """
+        Текст документа: из Asset.ocr_text, из кэша или извлечённый заново. Результат записывается в asset.ocr_text,
+        поэтому сохраняется вместе с историей
+        :param asset: ассет документа
+        :param provider_extract: извлечение силами провайдера; без него документ разбирается локально
+        :raises DocumentExtractionError: текст получить не удалось
+        """
+        if asset.ocr_text is not None:
+            return asset.ocr_text
+        digest = self.content_hash(asset)
+        text = self.cached_text(digest)
+        if text is None:
+            def extract():
+                # Пока ждали очереди, документ мог извлечь другой поток
+                cached = self.cached_text(digest)
+                if cached is not None:
+                    return cached
+                with tracer.span("document.extract", mime_type=asset.mime_type, bytes=asset.size_bytes,
+                                 mode="provider" if provider_extract else "local"):
+                    if provider_extract is not None:
+                        extracted = provider_extract(asset)
+                    else:
+                        extracted = self.extract_local(asset_bytes.read(asset), asset.mime_type)
+                self._store(digest, extracted)
+                return extracted
+
+            text, _ = single_flight.do(f"document:{digest}", extract)
+        asset.ocr_text = text
+        return text
+
+
+document_extractor = DocumentExtractor()
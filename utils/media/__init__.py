@@ -0,0 +1,10 @@
+from .image_normalizer import (
+    ImageProfile,
+    GENAI_IMAGE_PROFILE,
+    OPENAI_IMAGE_PROFILE,
+    normalize_image,
+)
+from .media_writer import MediaWriter, media_writer
+from .asset_bytes import AssetBytesProvider, asset_bytes
+from .media_gc import MediaGarbageCollector, MediaReferences, SweepReport, collect_references
+from .genai_uploads import GenaiUploadRegistry, GenaiUpload, genai_uploads
@@ -0,0 +1,158 @@
+import os
+import mmap
+import base64
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterator
+
+import utils.types as t
+from utils.small_utils import string_to_bytes
+from utils.umf_loader import read_data_ref
+from .image_normalizer import ImageProfile, normalize_image
+from .media_writer import media_writer
+
+"""
+Ленивый доступ к байтам ассетов.
+
+Без кэша каждый ход чата заново читает каждый файл (или декодирует data_base64), а затем заново кодирует
+его в base64 для запроса. Здесь готовые к отправке байты и base64-строки хранятся в ограниченном по размеру
+LRU-кэше, а для хэширования и кодирования файл открывается через mmap на время блока with (open). Пока ассет не изменился (путь, размер, mtime), повторные
+ходы не делают ни чтения, ни декодирования, ни кодирования.
+
+Если файла ассета нет на диске, но история загружена лениво (utils.umf_loader), данные читаются из архива по DataRef.
+Файл, который ещё пишется в фоне (media_writer), сначала дожидается записи. Ассеты с data_base64 не ждут.
+"""
+
+
+class AssetBytesProvider:
+    """Ограниченный по суммарному размеру LRU-кэш байтов и base64-представлений ассетов."""
+
+    def __init__(self, max_cache_bytes: int = 256 * 1024 * 1024):
+        self.max_cache_bytes = max_cache_bytes
+        self._cache: OrderedDict[tuple, tuple[bytes | str, str]] = OrderedDict()
+        self._cache_bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _archived_ref(asset: t.Asset) -> t.DataRef | None:
+        """Ссылка на data_base64 в архиве, если данные нужно брать оттуда"""
+        if asset.data_base64 is not None:
+            return None
+        media_writer.wait(asset.local_path)  # Файл мог ещё не дописаться в фоне
+        if asset._data_ref is not None and not os.path.exists(asset.local_path):
+            return asset._data_ref
+        return None
+
+    @classmethod
+    def _asset_key(cls, asset: t.Asset) -> tuple:
+        """Ключ, меняющийся при изменении содержимого ассета"""
+        if asset.data_base64:
+            return asset.id, "inline", len(asset.data_base64)
+        if data_ref := cls._archived_ref(asset):
+            return asset.id, "archive", data_ref.path, data_ref.offset, data_ref.length
+        stat = os.stat(asset.local_path)
+        return asset.id, asset.local_path, stat.st_size, stat.st_mtime_ns
+
+    def _get_cached(self, key: tuple) -> tuple[bytes | str, str] | None:
+        with self._lock:
+            value = self._cache.get(key)
+            if value is not None:
+                self._cache.move_to_end(key)
+            return value
+
+    def _put_cached(self, key: tuple, value: tuple[bytes | str, str]) -> None:
+        size = len(value[0])
+        if size > self.max_cache_bytes:
+            return
+        with self._lock:
+            if key in self._cache:
+                return
+            self._cache[key] = value
+            self._cache_bytes += size
+            while self._cache_bytes > self.max_cache_bytes:
+                _, (evicted, _) = self._cache.popitem(last=False)
+                self._cache_bytes -= len(evicted)
+
+    @contextmanager
+    def open(self, asset: t.Asset) -> Iterator[memoryview]:
+        """
+        Содержимое ассета без копирования файла в память (mmap). Отображение закрывается при выходе из блока with,
+        поэтому view (и срезы из него) нельзя использовать после блока - нужные байты копируются внутри.
+        Для inline-ассетов декодирует data_base64.
+
+            with asset_bytes.open(asset) as data:
+                digest = hashlib.sha256(data).hexdigest()
+        """
+        if asset.data_base64:
+            yield memoryview(string_to_bytes(asset.data_base64))
+            return
+        if data_ref := self._archived_ref(asset):
+            yield memoryview(string_to_bytes(read_data_ref(data_ref)))
+            return
+        with open(asset.local_path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                yield memoryview(b"")
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+                yield view
+
+    def read(self, asset: t.Asset) -> bytes:
+        """Содержимое ассета целиком в памяти - для тех, кому байты нужны после работы с файлом"""
+        if asset.data_base64:
+            return string_to_bytes(asset.data_base64)
+        if data_ref := self._archived_ref(asset):
+            return string_to_bytes(read_data_ref(data_ref))
+        with open(asset.local_path, "rb") as f:
+            return f.read()
+
+    def get_bytes(self, asset: t.Asset, profile: ImageProfile | None = None) -> tuple[bytes, str]:
+        """
+        Возвращает байты ассета в том виде, в котором они уйдут провайдеру, и их MIME тип.
+        Изображения приводятся к профилю provider'а, если он передан. Байты остаются в кэше, поэтому это копия
+        содержимого, а не отображение файла.
+        :return: (байты, mime_type)
+        """
+        key = (*self._asset_key(asset), profile.name if profile else None, "bytes")
+        cached = self._get_cached(key)
+        if cached is not None:
+            return cached
+
+        if asset.type == "image" and profile:
+            with self.open(asset) as raw_bytes:
+                value = normalize_image(asset, profile, raw_bytes=raw_bytes)
+        else:
+            value = self.read(asset), asset.mime_type
+        self._put_cached(key, value)
+        return value
+
+    def get_base64(self, asset: t.Asset, profile: ImageProfile | None = None) -> tuple[str, str]:
+        """
+        Возвращает base64-строку ассета, готовую для вставки в запрос, и её MIME тип.
+        Для inline-ассетов без профиля используется уже имеющийся data_base64.
+        :return: (base64-строка, mime_type)
+        """
+        if asset.data_base64 and not (asset.type == "image" and profile):
+            return asset.data_base64, asset.mime_type
+
+        key = (*self._asset_key(asset), profile.name if profile else None, "base64")
+        cached = self._get_cached(key)
+        if cached is not None:
+            return cached
+
+        if asset.type == "image" and profile:
+            raw_bytes, mime_type = self.get_bytes(asset, profile)
+            value = base64.b64encode(raw_bytes).decode("ascii"), mime_type
+        else:
+            with self.open(asset) as raw_bytes:
+                value = base64.b64encode(raw_bytes).decode("ascii"), asset.mime_type
+        self._put_cached(key, value)
+        return value
+
+    def get_data_url(self, asset: t.Asset, profile: ImageProfile | None = None) -> str:
+        """Возвращает data URL (data:<mime>;base64,...) для OpenAI-совместимых API"""
+        data, mime_type = self.get_base64(asset, profile)
+        return f"data:{mime_type};base64,{data}"
+
+
+asset_bytes = AssetBytesProvider()
@@ -0,0 +1,202 @@
+import time
+import base64
+import hashlib
+import logging
+import binascii
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple
+
+import utils.types as t
+from utils.tracing import tracer
+from .asset_bytes import asset_bytes
+
+"""
+Реестр загрузок Google Files API на весь процесс.
+
+Без него модель на каждом ходе для каждого загруженного ассета делала files.get, чтобы убедиться, что файл
+ещё существует: блокирующий запрос к API на ассет на ход, хотя cloud_refs.genai.expires_at показывает,
+что загрузка проживёт ещё двое суток. Теперь:
+
+    - ссылке ассета доверяем без запросов, пока до expires_at остаётся больше safety_margin;
+    - загрузки запоминаются по SHA-256 содержимого, поэтому один и тот же файл из разных чатов и ассетов
+      загружается один раз;
+    - раз в reconcile_interval список файлов проекта (files.list) сверяется с реестром в фоновом потоке:
+      удалённые файлы забываются, а загрузки других процессов (и до перезапуска) берутся по sha256_hash;
+    - если запрос всё же упал из-за отсутствующего файла, модель проверяет свои ассеты через files.get
+      и загружает заново только те, на которые API ответил 404 (forget).
+
+Загрузки разных проектов не пересекаются, поэтому реестр делится по account - хэшу ключа API.
+"""
+
+logger = logging.getLogger("ai_chat.media")
+
+_MAX_MISSING = 10000  # Сколько имён удалённых файлов помнить
+
+
+class GenaiUpload(NamedTuple):
+    """Загруженный файл, который можно переиспользовать"""
+    filename: str  # files/...
+    uri: str
+    expires_at: datetime
+
+
+def account_key(api_key: str) -> str:
+    """Идентификатор проекта для реестра, не раскрывающий ключ"""
+    return hashlib.sha256(api_key.encode()).hexdigest()[:16]
+
+
+def content_hash(asset: t.Asset) -> str:
+    """SHA-256 содержимого ассета (hex)"""
+    with asset_bytes.open(asset) as data:
+        return hashlib.sha256(data).hexdigest()
+
+
+def _hex_sha256(value: str | None) -> str | None:
+    """sha256_hash из Files API (base64 от хэша или от его hex-записи) в hex"""
+    if not value:
+        return None
+    if len(value) == 64:
+        return value.lower()
+    try:
+        raw = base64.b64decode(value, validate=True)
+    except binascii.Error:
+        return None
+    if len(raw) == 32:
+        return raw.hex()
+    if len(raw) == 64:
+        return raw.decode("ascii", errors="replace").lower()
+    return None
+
+
+def _utc(value: datetime | None) -> datetime | None:
+    return value.astimezone(timezone.utc) if value is not None else None
+
+
+class GenaiUploadRegistry:
+    """Известные загрузки Google Files API. Используется общий экземпляр genai_uploads"""
+
+    def __init__(self, safety_margin: timedelta = timedelta(hours=1),
+                 reconcile_interval: timedelta = timedelta(minutes=10)):
+        """
+        :param safety_margin: загрузке, которая истекает раньше чем через это время, не доверяем
+            (иначе она может исчезнуть посреди запроса)
+        :param reconcile_interval: как часто сверять реестр со списком файлов проекта
+        """
+        self.safety_margin = safety_margin
+        self.reconcile_interval = reconcile_interval
+        self._lock = threading.Lock()
+        self._uploads: dict[tuple[str, str], GenaiUpload] = {}  # (account, хэш) -> загрузка
+        self._hashes: dict[str, tuple[str, str]] = {}  # Имя файла -> (account, хэш)
+        self._seen: dict[str, tuple[str, float]] = {}  # Имя файла -> (account, когда впервые доверились)
+        self._missing: OrderedDict[str, None] = OrderedDict()  # Имена файлов, которых точно нет
+        self._reconciled_at: dict[str, float] = {}
+        self._reconciling: set[str] = set()
+
+    def is_fresh(self, expires_at: datetime | None, now: datetime | None = None) -> bool:
+        if expires_at is None:
+            return False
+        return _utc(expires_at) - (now or datetime.now(timezone.utc)) > self.safety_margin
+
+    # --- Проверки без запросов ---
+
+    def is_usable(self, account: str, filename: str, expires_at: datetime | None) -> bool:
+        """Можно ли отправить ссылку на файл без проверки: файл не пропадал и истечёт не скоро"""
+        if not self.is_fresh(expires_at):
+            return False
+        with self._lock:
+            if filename in self._missing:
+                return False
+            self._seen.setdefault(filename, (account, time.monotonic()))
+        return True
+
+    def is_missing(self, filename: str) -> bool:
+        return filename in self._missing
+
+    def lookup(self, account: str, digest: str) -> GenaiUpload | None:
+        """Уже загруженный файл с таким содержимым, которому можно доверять"""
+        with self._lock:
+            upload = self._uploads.get((account, digest))
+        if upload is None or upload.filename in self._missing or not self.is_fresh(upload.expires_at):
+            return None
+        return upload
+
+    # --- Изменения ---
+
+    def remember(self, account: str, digest: str | None, file) -> None:
+        """
+        Запоминает загруженный (или проверенный через files.get) файл
+        :param digest: SHA-256 содержимого; если неизвестен, файл только отмечается как существующий
+        """
+        with self._lock:
+            self._missing.pop(file.name, None)
+            self._seen.setdefault(file.name, (account, time.monotonic()))
+            digest = digest or _hex_sha256(getattr(file, "sha256_hash", None))
+            if digest and file.expiration_time is not None:
+                self._uploads[(account, digest)] = GenaiUpload(file.name, file.uri, _utc(file.expiration_time))
+                self._hashes[file.name] = (account, digest)
+
+    def forget(self, filename: str) -> None:
+        """Файла больше нет (404, удалён сборщиком мусора или истёк)"""
+        with self._lock:
+            self._forget(filename)
+
+    def _forget(self, filename: str) -> None:
+        key = self._hashes.pop(filename, None)
+        upload = self._uploads.get(key) if key is not None else None
+        if upload is not None and upload.filename == filename:
+            del self._uploads[key]
+        self._seen.pop(filename, None)
+        self._missing[filename] = None
+        while len(self._missing) > _MAX_MISSING:
+            self._missing.popitem(last=False)
+
+    # --- Сверка ---
+
+    def maybe_reconcile(self, account: str, client) -> None:
+        """Запускает сверку в фоне, если с прошлой прошло больше reconcile_interval. Не блокирует"""
+        now = time.monotonic()
+        with self._lock:
+            last = self._reconciled_at.get(account)
+            if account in self._reconciling or (
+                    last is not None and now - last < self.reconcile_interval.total_seconds()):
+                return
+            self._reconciling.add(account)
+        threading.Thread(target=self._reconcile_in_background, args=(account, client),
+                         name="genai-uploads-reconcile", daemon=True).start()
+
+    def _reconcile_in_background(self, account: str, client) -> None:
+        try:
+            self.reconcile(account, client)
+        except Exception as e:
+            logger.warning("Не удалось сверить загрузки Google Files API: %s", e)
+        finally:
+            with self._lock:
+                self._reconciling.discard(account)
+                self._reconciled_at[account] = time.monotonic()
+
+    def reconcile(self, account: str, client) -> int:
+        """
+        Сверяет реестр со списком файлов проекта
+        :return: сколько известных файлов не нашлось
+        """
+        started = time.monotonic()
+        with tracer.span("genai_uploads.reconcile") as span:
+            files = list(client.files.list())
+            listed = {file.name for file in files}
+            for file in files:
+                state = getattr(file.state, "name", None)
+                if state in (None, "ACTIVE"):
+                    self.remember(account, None, file)
+            with self._lock:
+                # Файлы, которым начали доверять уже после запроса списка, могли в него не попасть
+                gone = [filename for filename, (owner, seen_at) in self._seen.items()
+                        if owner == account and seen_at < started and filename not in listed]
+                for filename in gone:
+                    self._forget(filename)
+            span.set(files=len(files), missing=len(gone))
+        return len(gone)
+
+
+genai_uploads = GenaiUploadRegistry()
@@ -0,0 +1,148 @@
+import io
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+from pydantic import BaseModel, ConfigDict
+
+from config import settings
+import utils.types as t
+from utils.small_utils import string_to_bytes, file_to_bytes
+from .media_writer import media_writer
+
+"""
+Нормализация изображений перед отправкой провайдеру.
+
+Провайдеры всё равно уменьшают изображения до своего максимального разрешения, поэтому отправлять оригинал
+бессмысленно: это лишние мегабайты base64 в каждом запросе. Здесь изображение уменьшается и перекодируется
+под профиль провайдера, а результат кэшируется на диске рядом с оригиналом по ключу (хэш содержимого, профиль).
+Поворот из EXIF применяется к пикселям, потому что в перекодированном файле EXIF уже нет. PNG, которые
+не нужно ни уменьшать, ни поворачивать (например, скриншоты), отправляются как есть: JPEG размыл бы текст.
+
+Pillow - необязательная зависимость. Если он не установлен, изображения отправляются как есть.
+"""
+
+
+class ImageProfile(BaseModel):
+    """Параметры, под которые приводятся изображения для конкретного провайдера."""
+
+    name: str  # Используется в имени закэшированного варианта
+    max_side: int  # Максимальный размер большей стороны в пикселях
+    quality: int = 85  # Качество JPEG
+    model_config = ConfigDict(frozen=True)
+
+
+# Gemini масштабирует изображения до 3072x3072, OpenAI-совместимые API - до 2048x2048
+GENAI_IMAGE_PROFILE = ImageProfile(name="genai", max_side=3072)
+OPENAI_IMAGE_PROFILE = ImageProfile(name="openai", max_side=2048)
+
+_MAX_VARIANTS = 4096  # Сколько путей к вариантам помнить в памяти; остальные находятся на диске
+
+# (хэш оригинала, профиль) -> путь к варианту. Пустая строка - оригинал не нуждается в перекодировании
+_variants_cache: OrderedDict[tuple[str, str], str] = OrderedDict()
+_variants_lock = threading.Lock()
+
+
+def _get_variant(key: tuple[str, str]) -> str | None:
+    with _variants_lock:
+        path = _variants_cache.get(key)
+        if path is not None:
+            _variants_cache.move_to_end(key)
+        return path
+
+
+def _put_variant(key: tuple[str, str], path: str) -> None:
+    with _variants_lock:
+        _variants_cache[key] = path
+        _variants_cache.move_to_end(key)
+        while len(_variants_cache) > _MAX_VARIANTS:
+            _variants_cache.popitem(last=False)
+
+
+def _read_original(asset: t.Asset) -> bytes:
+    if asset.data_base64:
+        return string_to_bytes(asset.data_base64)
+    media_writer.wait(asset.local_path)
+    return file_to_bytes(asset.local_path)
+
+
+def _variant_path(asset: t.Asset, content_hash: str, profile: ImageProfile, ext: str) -> str:
+    folder = os.path.dirname(asset.local_path) or settings.MEDIA_FOLDER
+    return f"{folder}/{content_hash[:32]}.{profile.name}{ext}"
+
+
+def _reencode(raw_bytes: bytes | memoryview, profile: ImageProfile) -> tuple[bytes, str, bool] | None:
+    """
+    Поворачивает по EXIF, уменьшает и перекодирует изображение. Возвращает None, если Pillow недоступен
+    или изображение не удалось (или не нужно) перекодировать.
+    :return: (байты, mime_type, изменилась ли геометрия). Если геометрия изменилась, оригинал отправлять нельзя
+    """
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return None
+
+    try:
+        with Image.open(io.BytesIO(raw_bytes)) as original:
+            if getattr(original, "n_frames", 1) > 1:  # Анимацию не трогаем
+                return None
+            rotated = original.getexif().get(0x0112, 1) != 1  # Тег Orientation
+            resized = max(original.size) > profile.max_side
+            if original.format == "PNG" and not (rotated or resized):
+                return None
+            image = ImageOps.exif_transpose(original)
+            image.thumbnail((profile.max_side, profile.max_side))
+            buffer = io.BytesIO()
+            if image.mode in ("RGBA", "LA") or "transparency" in image.info:
+                image.save(buffer, format="PNG", optimize=True)
+                return buffer.getvalue(), "image/png", rotated or resized
+            image.convert("RGB").save(buffer, format="JPEG", quality=profile.quality, optimize=True)
+            return buffer.getvalue(), "image/jpeg", rotated or resized
+    except (OSError, ValueError):
+        return None
+
+
+def normalize_image(
+        asset: t.Asset, profile: ImageProfile, raw_bytes: bytes | memoryview | None = None
+) -> tuple[bytes, str]:
+    """
+    Возвращает байты изображения, приведённого к профилю провайдера, и их MIME тип.
+
+    Для не-изображений, а также если перекодирование не уменьшило и не повернуло изображение, возвращается оригинал.
+    :param asset: ассет изображения
+    :param profile: профиль провайдера
+    :param raw_bytes: уже прочитанное содержимое ассета (например, mmap из AssetBytesProvider)
+    :return: (байты, mime_type)
+    """
+    if raw_bytes is None:
+        raw_bytes = _read_original(asset)
+    if asset.type != "image":
+        return bytes(raw_bytes), asset.mime_type
+
+    content_hash = hashlib.sha256(raw_bytes).hexdigest()
+    key = (content_hash, profile.name)
+    cached_path = _get_variant(key)
+    if cached_path == "":
+        return bytes(raw_bytes), asset.mime_type
+    if cached_path:
+        media_writer.wait(cached_path)
+    if cached_path and os.path.exists(cached_path):
+        return file_to_bytes(cached_path), "image/png" if cached_path.endswith(".png") else "image/jpeg"
+
+    for ext, mime_type in ((".jpg", "image/jpeg"), (".png", "image/png")):
+        path = _variant_path(asset, content_hash, profile, ext)
+        if os.path.exists(path):
+            _put_variant(key, path)
+            return file_to_bytes(path), mime_type
+
+    reencoded = _reencode(raw_bytes, profile)
+    if reencoded is None or (not reencoded[2] and len(reencoded[0]) >= len(raw_bytes)):
+        _put_variant(key, "")
+        return bytes(raw_bytes), asset.mime_type
+
+    variant_bytes, mime_type, _ = reencoded
+    path = _variant_path(asset, content_hash, profile, ".png" if mime_type == "image/png" else ".jpg")
+    media_writer.save(path, variant_bytes)  # Байты уже есть, запись на диск не задерживает запрос
+    _put_variant(key, path)
+    return variant_bytes, mime_type
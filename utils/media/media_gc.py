@@ -0,0 +1,311 @@
+import os
+import re
+import time
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, NamedTuple
+
+import utils.types as t
+from utils.tracing import tracer
+from utils.umf_loader import iter_message_assets, iter_messages
+from .media_writer import media_writer
+from .genai_uploads import genai_uploads
+
+"""
+Сборка мусора медиафайлов: локальных файлов в MEDIA_FOLDER и загрузок в Google Files API.
+
+Сами по себе файлы никогда не удаляются: ассеты копятся в MEDIA_FOLDER, а загрузки Gemini живут до истечения
+срока (48 часов) и всё это время занимают квоту хранилища проекта. MediaGarbageCollector.sweep за один проход:
+
+    1. Считает ссылки на ассеты во всех сохранённых чатах (ChatData или файлы УФС).
+    2. Удаляет локальные файлы, на которые не ссылается ни один чат. Файлы моложе min_age и файлы, которые ещё
+       пишутся (media_writer), не трогаются: чат с новым ассетом мог ещё не сохраниться. Варианты изображений
+       (image_normalizer) лежат рядом с оригиналом и удаляются, когда в папке не осталось нужных оригиналов.
+       Служебные папки (.documents, .tmp) не разбираются, в .tmp удаляются только старые файлы.
+    3. Если загрузки Gemini занимают больше remote_high_watermark квоты, удаляет их, пока занятое место
+       не опустится до remote_low_watermark: сначала те, на которые не ссылается ни один чат, затем давно
+       не использованные (CloudRef.last_used_at). Удалённую загрузку модель при необходимости загрузит заново.
+    4. Ассеты активных чатов (последнее сообщение не старше active_within), загрузка которых истечёт в ближайшие
+       refresh_before, загружает заново заранее, чтобы повторная загрузка не случилась посреди запроса.
+       Изменённые чаты возвращаются в SweepReport.refreshed_chats, сохранить их должен вызывающий.
+
+Сборщику нужно передавать ВСЕ чаты, которые используют этот MEDIA_FOLDER: файл ассета из непереданного чата
+будет удалён. Для проверки есть dry_run.
+
+Пример:
+    gc = MediaGarbageCollector()
+    report = gc.sweep(chats, genai_model=Gemini3_1FlashLite())
+"""
+
+GENAI_STORAGE_QUOTA_BYTES = 20 * 1024 ** 3  # Лимит хранилища Google Files API на проект
+
+_VARIANT_NAME = re.compile(r"^[0-9a-f]{32}\.\w+\.(jpg|png)$")  # Варианты image_normalizer: <хэш>.<профиль>.<ext>
+_MIN_DATETIME = datetime.min.replace(tzinfo=timezone.utc)
+
+logger = logging.getLogger("ai_chat.media")
+
+
+class SweepReport(NamedTuple):
+    """Итог прохода сборщика"""
+    deleted_files: list[str]  # Удалённые локальные файлы (при dry_run - которые были бы удалены)
+    freed_bytes: int  # Освобождено на диске
+    evicted_uploads: list[str]  # Удалённые загрузки Google Files API (имена files/...)
+    refreshed_assets: int  # Сколько загрузок обновлено заранее
+    refreshed_chats: list[t.ChatData]  # Чаты, в которых изменились cloud_refs (их нужно сохранить)
+
+
+def _utc(value: datetime | None) -> datetime | None:
+    """Время без часового пояса считается местным"""
+    if value is None:
+        return None
+    return value.astimezone(timezone.utc)
+
+
+class _RemoteUse:
+    """Использование одной загрузки Gemini в чатах"""
+
+    __slots__ = ("last_used_at", "expires_at")
+
+    def __init__(self):
+        self.last_used_at: datetime | None = None
+        self.expires_at: datetime | None = None
+
+
+class MediaReferences:
+    """Ссылки чатов на локальные файлы и загрузки Gemini"""
+
+    def __init__(self):
+        self.local: dict[str, int] = {}  # Абсолютный путь -> число ссылок
+        self.remote: dict[str, _RemoteUse] = {}  # Имя загрузки (files/...) -> последнее использование
+
+    def add(self, asset: t.Asset) -> None:
+        path = os.path.abspath(asset.local_path)
+        self.local[path] = self.local.get(path, 0) + 1
+        ref = asset.cloud_refs.genai if asset.cloud_refs else None
+        if ref is None or not ref.filename:
+            return
+        use = self.remote.setdefault(ref.filename, _RemoteUse())
+        last_used_at = _utc(ref.last_used_at)
+        if last_used_at and (use.last_used_at is None or last_used_at > use.last_used_at):
+            use.last_used_at = last_used_at
+        use.expires_at = _utc(ref.expires_at) or use.expires_at
+
+
+def _iter_assets(chat: t.ChatData | str | os.PathLike):
+    """Ассеты чата. Файлы УФС читаются по одному сообщению без data_base64 (utils.umf_loader)"""
+    messages = chat.messages if isinstance(chat, t.ChatData) else iter_messages(chat, data_mode="skip")
+    for message in messages:
+        yield from iter_message_assets(message)
+
+
+def collect_references(chats: Iterable[t.ChatData | str | os.PathLike]) -> MediaReferences:
+    """
+    Считает ссылки на ассеты
+    :param chats: чаты в УФС или пути к файлам УФС
+    """
+    references = MediaReferences()
+    for chat in chats:
+        for asset in _iter_assets(chat):
+            references.add(asset)
+    return references
+
+
+class MediaGarbageCollector:
+    """Удаляет ненужные медиафайлы и загрузки, обновляет истекающие загрузки активных чатов"""
+
+    def __init__(
+            self,
+            root: str | None = None,
+            min_age: timedelta = timedelta(hours=1),
+            remote_quota_bytes: int = GENAI_STORAGE_QUOTA_BYTES,
+            remote_high_watermark: float = 0.9,
+            remote_low_watermark: float = 0.75,
+            active_within: timedelta = timedelta(hours=48),
+            refresh_before: timedelta = timedelta(hours=6),
+    ):
+        """
+        :param root: папка медиафайлов (по умолчанию - папка media_writer, то есть MEDIA_FOLDER)
+        :param min_age: локальные файлы моложе этого возраста не удаляются
+        :param remote_quota_bytes: квота хранилища Google Files API
+        :param remote_high_watermark: доля квоты, после которой начинается вытеснение загрузок
+        :param remote_low_watermark: до какой доли квоты освобождается место
+        :param active_within: чат активен, если его последнее сообщение не старше этого
+        :param refresh_before: за сколько до истечения загрузки активных чатов загружаются заново
+        """
+        if not 0 < remote_low_watermark <= remote_high_watermark <= 1:
+            raise ValueError("Нужно 0 < remote_low_watermark <= remote_high_watermark <= 1")
+        self._root = root
+        self.min_age = min_age
+        self.remote_quota_bytes = remote_quota_bytes
+        self.remote_high_watermark = remote_high_watermark
+        self.remote_low_watermark = remote_low_watermark
+        self.active_within = active_within
+        self.refresh_before = refresh_before
+
+    @property
+    def root(self) -> str:
+        return self._root or media_writer.root
+
+    # --- Локальные файлы ---
+
+    def _is_protected(self, path: str, mtime: float, now: float, pending: set[str]) -> bool:
+        """Файл нельзя удалять, даже если на него никто не ссылается"""
+        return now - mtime < self.min_age.total_seconds() or path in pending
+
+    @staticmethod
+    def _delete(path: str, size: int, deleted: list[str], dry_run: bool) -> int:
+        if not dry_run:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                return 0
+        deleted.append(path)
+        return size
+
+    def sweep_local(self, references: MediaReferences, dry_run: bool = False) -> tuple[list[str], int]:
+        """
+        Удаляет файлы MEDIA_FOLDER, на которые не ссылается ни один чат
+        :return: (удалённые файлы, освобождено байт)
+        """
+        root = os.path.abspath(self.root)
+        now = time.time()
+        pending = media_writer.pending_paths()
+        deleted: list[str] = []
+        freed = 0
+        for folder, dirs, files in os.walk(root):
+            if folder == root:
+                dirs[:] = [name for name in dirs if not name.startswith(".")]
+            keep_variants = False
+            variants = []
+            for name in files:
+                path = os.path.join(folder, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if _VARIANT_NAME.match(name):
+                    variants.append((path, stat))
+                    continue
+                if path in references.local or self._is_protected(path, stat.st_mtime, now, pending):
+                    keep_variants = True
+                    continue
+                freed += self._delete(path, stat.st_size, deleted, dry_run)
+            # Вариант изображения нельзя сопоставить с оригиналом без хэширования, поэтому он живёт,
+            # пока в его папке есть хоть один нужный оригинал
+            for path, stat in variants:
+                if not keep_variants and not self._is_protected(path, stat.st_mtime, now, pending):
+                    freed += self._delete(path, stat.st_size, deleted, dry_run)
+
+        # Временные файлы воркеров инструментов, оставшиеся после сбоев
+        tmp_folder = os.path.join(root, ".tmp")
+        if os.path.isdir(tmp_folder):
+            for entry in os.scandir(tmp_folder):
+                if entry.is_file() and not self._is_protected(entry.path, entry.stat().st_mtime, now, pending):
+                    freed += self._delete(entry.path, entry.stat().st_size, deleted, dry_run)
+        return deleted, freed
+
+    # --- Загрузки Gemini ---
+
+    def evict_remote(self, client, references: MediaReferences, dry_run: bool = False) -> list[str]:
+        """
+        Освобождает квоту Google Files API, если она почти заполнена
+        :param client: genai.Client
+        :return: имена удалённых загрузок
+        """
+        from google.genai import errors
+
+        files = list(client.files.list())
+        used = sum(file.size_bytes or 0 for file in files)
+        if used < self.remote_quota_bytes * self.remote_high_watermark:
+            return []
+
+        def eviction_order(file):
+            use = references.remote.get(file.name)
+            created = _utc(file.create_time) or _MIN_DATETIME
+            if use is None:
+                return 0, created  # Ни один чат не ссылается - удаляются первыми
+            return 1, use.last_used_at or created
+
+        target = self.remote_quota_bytes * self.remote_low_watermark
+        evicted = []
+        for file in sorted(files, key=eviction_order):
+            if used <= target:
+                break
+            if not dry_run:
+                try:
+                    client.files.delete(name=file.name)
+                except errors.APIError as e:
+                    if e.code != 404:
+                        raise
+                genai_uploads.forget(file.name)
+            used -= file.size_bytes or 0
+            evicted.append(file.name)
+        return evicted
+
+    def is_active(self, chat: t.ChatData, now: datetime | None = None) -> bool:
+        if not chat.messages:
+            return False
+        now = now or datetime.now(timezone.utc)
+        return now - _utc(chat.messages[-1].timestamp) <= self.active_within
+
+    def refresh_expiring(self, genai_model, chats: Iterable[t.ChatData]) -> tuple[int, list[t.ChatData]]:
+        """
+        Заранее загружает заново ассеты активных чатов, загрузка которых скоро истечёт
+        :param genai_model: модель GenaiBaseModel, через клиент которой загружаются файлы
+        :return: (обновлено загрузок, изменённые чаты)
+        """
+        now = datetime.now(timezone.utc)
+        deadline = now + self.refresh_before
+        renewed: dict[str, t.CloudRef] = {}  # Старое имя загрузки -> новая ссылка (ассет бывает в нескольких чатах)
+        changed_chats = []
+        for chat in chats:
+            if not self.is_active(chat, now):
+                continue
+            changed = False
+            for asset in _iter_assets(chat):
+                ref = asset.cloud_refs.genai if asset.cloud_refs else None
+                if ref is None or not ref.filename or ref.expires_at is None or _utc(ref.expires_at) > deadline:
+                    continue
+                if ref.filename not in renewed:
+                    if not os.path.exists(asset.local_path):
+                        continue
+                    old_filename = ref.filename
+                    try:
+                        genai_model.refresh_upload(asset)
+                    except Exception as e:
+                        logger.warning("Не удалось заново загрузить %s: %s", asset.local_path, e)
+                        continue
+                    renewed[old_filename] = asset.cloud_refs.genai
+                else:
+                    new_ref = renewed[ref.filename]
+                    asset.cloud_refs.genai = new_ref.model_copy(update={"last_used_at": ref.last_used_at})
+                changed = True
+            if changed:
+                changed_chats.append(chat)
+        return len(renewed), changed_chats
+
+    # --- Полный проход ---
+
+    def sweep(self, chats: Iterable[t.ChatData | str | os.PathLike], genai_model=None,
+              dry_run: bool = False) -> SweepReport:
+        """
+        Полный проход сборщика
+        :param chats: все сохранённые чаты (ChatData или пути к файлам УФС)
+        :param genai_model: модель GenaiBaseModel для работы с Google Files API; без неё загрузки не трогаются
+        :param dry_run: только посчитать, что было бы удалено (загрузки при этом не обновляются)
+        """
+        chats = list(chats)
+        with tracer.span("media.gc", chats=len(chats), dry_run=dry_run) as span:
+            references = collect_references(chats)
+            deleted, freed = self.sweep_local(references, dry_run)
+            evicted, refreshed, refreshed_chats = [], 0, []
+            if genai_model is not None:
+                evicted = self.evict_remote(genai_model.client, references, dry_run)
+                if not dry_run:
+                    loaded = [chat for chat in chats if isinstance(chat, t.ChatData)]
+                    refreshed, refreshed_chats = self.refresh_expiring(genai_model, loaded)
+            span.set(deleted=len(deleted), freed_bytes=freed, evicted=len(evicted), refreshed=refreshed)
+        if deleted or evicted or refreshed:
+            logger.info("Сборка мусора: удалено файлов %d (%d байт), загрузок %d, обновлено загрузок %d",
+                        len(deleted), freed, len(evicted), refreshed)
+        return SweepReport(deleted, freed, evicted, refreshed, refreshed_chats)
@@ -0,0 +1,167 @@
+import os
+import hashlib
+import logging
+import mimetypes
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Literal
+
+from config import settings
+
+"""
+Фоновая запись медиафайлов.
+
+Файлы, которые появляются во время generate (изображения Gemini, медиа и длинные результаты инструментов),
+не пишутся на пути запроса: save/move сразу возвращают путь, а запись идёт в пуле потоков. Asset можно отдавать
+клиенту и класть в историю сразу, а читатели, которым нужны байты (asset_bytes, загрузка к провайдеру),
+вызывают wait(path) и ждут только свой файл.
+
+Файл пишется во временный файл рядом с целевым и переименовывается (os.replace), поэтому читатель никогда
+не увидит половину файла. Файлы раскладываются по подпапкам по хэшу id: MEDIA_FOLDER/ab/cd/<id>.<ext>,
+чтобы в одной папке не копились миллионы файлов.
+
+Политика fsync (MEDIA_FSYNC):
+    "never"  - без fsync, быстрее всего; при сбое питания последние файлы могут потеряться;
+    "file"   - fsync файла перед переименованием: файл либо целый, либо его нет;
+    "always" - ещё и fsync папки после переименования: запись переживает сбой питания.
+"""
+
+FsyncPolicy = Literal["never", "file", "always"]
+
+logger = logging.getLogger("ai_chat.media")
+
+
+class MediaWriter:
+    """Пул фоновой записи. Используется общий экземпляр media_writer"""
+
+    def __init__(self, root: str | None = None, workers: int | None = None, fsync: FsyncPolicy | None = None,
+                 shard_depth: int = 2):
+        """
+        Незаданные параметры берутся из настроек (MEDIA_FOLDER, MEDIA_WRITE_WORKERS, MEDIA_FSYNC) при первом использовании
+        :param shard_depth: уровней подпапок (по два hex-символа хэша на уровень)
+        """
+        self._root = root
+        self._workers = workers
+        self._fsync = fsync
+        self.shard_depth = shard_depth
+        self._executor: ThreadPoolExecutor | None = None
+        self._lock = threading.Lock()
+        self._pending: dict[str, Future] = {}
+
+    @property
+    def root(self) -> str:
+        return self._root or settings.MEDIA_FOLDER
+
+    @property
+    def fsync(self) -> FsyncPolicy:
+        return self._fsync or settings.MEDIA_FSYNC
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self._workers or settings.MEDIA_WRITE_WORKERS, thread_name_prefix="media-writer"
+                )
+            return self._executor
+
+    # --- Пути ---
+
+    def path_for(self, asset_id: str, mime_type: str) -> str:
+        """Путь файла ассета: MEDIA_FOLDER/ab/cd/<id>.<ext>. Зависит только от id и типа"""
+        digest = hashlib.sha1(asset_id.encode()).hexdigest()
+        shards = [digest[level * 2:level * 2 + 2] for level in range(self.shard_depth)]
+        ext = mimetypes.guess_extension(mime_type) or ".bin"
+        return os.path.join(self.root, *shards, f"{asset_id}{ext}")
+
+    # --- Запись ---
+
+    def _fsync_dir(self, folder: str) -> None:
+        fd = os.open(folder, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _write(self, path: str, data: bytes | memoryview) -> None:
+        folder = os.path.dirname(path)
+        os.makedirs(folder, exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+                if self.fsync != "never":
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        if self.fsync == "always":
+            self._fsync_dir(folder)
+
+    def _move(self, path: str, src_path: str) -> None:
+        # Порядок аргументов как у _write: _submit передаёт целевой путь первым
+        folder = os.path.dirname(path)
+        os.makedirs(folder, exist_ok=True)
+        if self.fsync != "never":
+            with open(src_path, "rb") as f:
+                os.fsync(f.fileno())
+        os.replace(src_path, path)
+        if self.fsync == "always":
+            self._fsync_dir(folder)
+
+    def _submit(self, path: str, fn, *args) -> Future:
+        def done(future: Future):
+            with self._lock:
+                if self._pending.get(path) is future:
+                    del self._pending[path]
+            if future.exception() is not None:
+                logger.error("Не удалось записать %s: %s", path, future.exception())
+
+        executor = self._get_executor()
+        with self._lock:
+            future = executor.submit(fn, path, *args)
+            self._pending[path] = future
+        future.add_done_callback(done)
+        return future
+
+    def save(self, path: str, data: bytes | memoryview) -> Future:
+        """
+        Ставит запись байтов в очередь и сразу возвращает управление. Объект data не должен меняться до конца записи
+        :return: Future записи (результат - None или исключение)
+        """
+        return self._submit(path, self._write, data)
+
+    def move(self, src_path: str, path: str) -> Future:
+        """Переносит готовый файл (на той же файловой системе) в path в фоне"""
+        return self._submit(path, self._move, src_path)
+
+    # --- Чтение ---
+
+    def is_pending(self, path: str) -> bool:
+        return path in self._pending
+
+    def pending_paths(self) -> set[str]:
+        """Абсолютные пути файлов, запись которых ещё идёт"""
+        with self._lock:
+            return {os.path.abspath(path) for path in self._pending}
+
+    def wait(self, path: str, timeout: float | None = None) -> None:
+        """
+        Дожидается записи файла, если она ещё идёт. Для уже записанных и чужих файлов возвращается сразу
+        :raises: исключение записи, если она не удалась
+        """
+        future = self._pending.get(path)
+        if future is not None:
+            future.result(timeout)
+
+    def flush(self, timeout: float | None = None) -> None:
+        """Дожидается всех начатых записей (например, перед завершением процесса или в тестах)"""
+        with self._lock:
+            futures = list(self._pending.values())
+        for future in futures:
+            future.exception(timeout)
+
+
+media_writer = MediaWriter()
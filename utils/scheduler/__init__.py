@@ -0,0 +1 @@
+from .scheduler import ReactScheduler, TurnResult, SchedulerOverloaded, default_tools_definition
@@ -0,0 +1,274 @@
+import asyncio
+from collections import deque
+from typing import Callable, Awaitable, Literal, NamedTuple, Any
+
+import utils.types as t
+from models import BaseModel
+from utils.tools_parser import ToolsParser
+from utils.tracing import tracer
+
+"""
+Планировщик циклов ReAct для многих сессий поверх ограниченного числа воркеров.
+
+Цикл ReAct - это generate, пока последним сообщением дельты идёт результат инструмента. Планировщик выполняет
+такие циклы для многих чатов сразу, но воркер занимается только на один шаг (запрос к модели + инструменты).
+После шага сессия встаёт в конец очереди своей полосы, поэтому сессии чередуются по кругу: агент, который
+вызывает инструменты без конца, получает один шаг за круг и не может занять все воркеры. Кроме того, ход
+ограничен max_steps шагами.
+
+Полосы приоритета:
+    interactive - пользователь ждёт ответа (веб-сервис, чат);
+    batch - фоновые задачи. Пока есть interactive-шаги, batch получает один воркер на interactive_weight
+            interactive-шагов, поэтому фоновые задачи замедляются, но не голодают.
+
+Лимиты провайдеров (provider_limits) ограничивают число одновременных шагов к одному API. Ключ - model.vendor
+(кто обслуживает API), а если он не задан - model.provider. Шаг, упёршийся в лимит, пропускается,
+и воркер получает следующая сессия с другим провайдером.
+
+Пример:
+    scheduler = ReactScheduler(max_workers=32, provider_limits={"deepseek": 16, "google": 8})
+    result = await scheduler.run_turn(chat_id, model, chat, lane="batch")
+"""
+
+Lane = Literal["interactive", "batch"]
+
+StepCallback = Callable[[list[t.Message]], Awaitable[bool | None]]
+ToolsDefinition = Callable[[BaseModel, t.ChatData], Any]
+
+
+class TurnResult(NamedTuple):
+    """Итог одного хода: новые сообщения, число шагов и закончила ли модель ход сама (а не по max_steps или on_step)"""
+    messages: list[t.Message]
+    steps: int
+    finished: bool
+
+
+class SchedulerOverloaded(Exception):
+    """Очередь ожидающих шагов заполнена (max_waiting). Ход не начат"""
+
+
+class _Waiter:
+    """Шаг сессии, ожидающий воркера"""
+
+    __slots__ = ("session_id", "provider", "future")
+
+    def __init__(self, session_id: str, provider: str, future: asyncio.Future):
+        self.session_id = session_id
+        self.provider = provider
+        self.future = future
+
+
+def default_tools_definition(model: BaseModel, history: t.ChatData, k: int = 10):
+    """
+    Схемы k самых подходящих к истории инструментов в формате провайдера модели.
+    Набор меняется от хода к ходу, что ломает кэш префикса (см. ToolsParser.select_tools)
+    """
+    tools = ToolsParser.select_tools(history, k=k)
+    if model.provider == "genai":
+        return ToolsParser.get_types_schema_genai(tools=tools)
+    return ToolsParser.get_json_schema_openai(tools=tools)
+
+
+class ReactScheduler:
+    """
+    Справедливый планировщик шагов ReAct. Работает внутри одного event loop,
+    все методы нужно вызывать из него.
+    """
+
+    def __init__(
+            self,
+            max_workers: int = 64,
+            provider_limits: dict[str, int] | None = None,
+            max_steps: int = 10,
+            max_waiting: int | None = None,
+            interactive_weight: int = 4,
+            tools_definition: ToolsDefinition | None = None,
+    ):
+        """
+        :param max_workers: сколько шагов выполняется одновременно
+        :param provider_limits: максимум одновременных шагов на провайдера (model.vendor или model.provider)
+        :param max_steps: максимум шагов на ход по умолчанию
+        :param max_waiting: сколько шагов может ждать воркера; при переполнении новые ходы получают
+            SchedulerOverloaded (None - без ограничения)
+        :param interactive_weight: сколько interactive-шагов приходится на один batch-шаг, когда заняты обе полосы
+        :param tools_definition: функция (model, history) -> схемы инструментов на шаг
+            (по умолчанию - default_tools_definition)
+        """
+        if max_workers < 1 or interactive_weight < 1:
+            raise ValueError("max_workers и interactive_weight должны быть положительными")
+        self.max_workers = max_workers
+        self.provider_limits = dict(provider_limits or {})
+        self.max_steps = max_steps
+        self.max_waiting = max_waiting
+        self.interactive_weight = interactive_weight
+        self.tools_definition = tools_definition or default_tools_definition
+
+        self._lanes: dict[str, deque[_Waiter]] = {"interactive": deque(), "batch": deque()}
+        self._active = 0
+        self._in_flight: dict[str, int] = {}
+        self._interactive_streak = 0
+        self._session_locks: dict[str, asyncio.Lock] = {}
+        self._session_users: dict[str, int] = {}
+
+    # --- Состояние ---
+
+    @property
+    def active(self) -> int:
+        """Сколько шагов выполняется сейчас"""
+        return self._active
+
+    @property
+    def waiting(self) -> int:
+        """Сколько шагов ждёт воркера"""
+        return sum(len(lane) for lane in self._lanes.values())
+
+    def stats(self) -> dict:
+        return {
+            "active": self._active,
+            "waiting": {name: len(lane) for name, lane in self._lanes.items()},
+            "in_flight": dict(self._in_flight),
+            "max_workers": self.max_workers,
+        }
+
+    def is_overloaded(self) -> bool:
+        return self.max_waiting is not None and self.waiting >= self.max_waiting
+
+    @staticmethod
+    def provider_key(model: BaseModel) -> str:
+        return model.vendor or model.provider
+
+    # --- Воркеры ---
+
+    def _has_capacity(self, provider: str) -> bool:
+        limit = self.provider_limits.get(provider)
+        return limit is None or self._in_flight.get(provider, 0) < limit
+
+    def _pop_eligible(self, lane: deque[_Waiter]) -> _Waiter | None:
+        """Первый по кругу шаг, провайдер которого не упёрся в лимит"""
+        for index, waiter in enumerate(lane):
+            if self._has_capacity(waiter.provider):
+                del lane[index]
+                return waiter
+        return None
+
+    def _next_waiter(self) -> _Waiter | None:
+        interactive, batch = self._lanes["interactive"], self._lanes["batch"]
+        prefer_batch = bool(batch) and self._interactive_streak >= self.interactive_weight
+        order = (batch, interactive) if prefer_batch else (interactive, batch)
+        for lane in order:
+            waiter = self._pop_eligible(lane)
+            if waiter is not None:
+                if lane is interactive:
+                    self._interactive_streak += 1
+                else:
+                    self._interactive_streak = 0
+                return waiter
+        return None
+
+    def _dispatch(self) -> None:
+        """Раздаёт свободные воркеры ожидающим шагам"""
+        while self._active < self.max_workers:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            if waiter.future.done():  # Шаг отменили, пока он стоял в очереди
+                continue
+            self._active += 1
+            self._in_flight[waiter.provider] = self._in_flight.get(waiter.provider, 0) + 1
+            waiter.future.set_result(None)
+
+    def _release(self, provider: str) -> None:
+        self._active -= 1
+        self._in_flight[provider] -= 1
+        if not self._in_flight[provider]:
+            del self._in_flight[provider]
+        self._dispatch()
+
+    async def _acquire(self, session_id: str, provider: str, lane: Lane) -> None:
+        waiter = _Waiter(session_id, provider, asyncio.get_running_loop().create_future())
+        self._lanes[lane].append(waiter)
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Воркер уже выдан, но шаг отменили - возвращаем его
+                self._release(provider)
+            elif waiter in self._lanes[lane]:
+                self._lanes[lane].remove(waiter)
+            raise
+
+    # --- Ходы ---
+
+    async def step(self, session_id: str, model: BaseModel, chat: t.ChatData, lane: Lane = "interactive",
+                   tools_definition=None, tools_executable: dict | None = None) -> list[t.Message]:
+        """
+        Один шаг ReAct в воркере планировщика. Новые сообщения добавляются в chat моделью
+        :return: дельта шага
+        """
+        provider = self.provider_key(model)
+        with tracer.span("scheduler.wait", lane=lane, provider=provider):
+            await self._acquire(session_id, provider, lane)
+        try:
+            if tools_definition is None:
+                tools_definition = self.tools_definition(model, chat)
+            if tools_executable is None:
+                tools_executable = ToolsParser.get_tools_callables()
+            _, delta = await model.agenerate(chat, tools_definition, tools_executable)
+            return delta
+        finally:
+            self._release(provider)
+
+    async def run_turn(
+            self,
+            session_id: str,
+            model: BaseModel,
+            chat: t.ChatData,
+            lane: Lane = "interactive",
+            max_steps: int | None = None,
+            on_step: StepCallback | None = None,
+            tools_definition=None,
+            tools_executable: dict | None = None,
+    ) -> TurnResult:
+        """
+        Выполняет ход ReAct: шаги, пока последним сообщением дельты идёт результат инструмента.
+        Ходы одной сессии выполняются по очереди.
+        :param session_id: идентификатор сессии (чата) для справедливого чередования
+        :param model: модель хода
+        :param chat: история в УФС, дополняется на месте
+        :param lane: полоса приоритета
+        :param max_steps: максимум шагов (по умолчанию - из планировщика)
+        :param on_step: корутина, получающая дельту после каждого шага (стриминг, сохранение истории).
+            Выполняется вне воркера. Если она вернёт False, ход прекращается (например, клиент отключился)
+        :param tools_definition: фиксированные схемы инструментов (по умолчанию подбираются на каждом шаге)
+        :param tools_executable: словарь инструментов (по умолчанию - все из ToolsParser)
+        :raises SchedulerOverloaded: если очередь ожидающих шагов заполнена
+        """
+        if lane not in self._lanes:
+            raise ValueError(f"Неизвестная полоса {lane}")
+        if self.is_overloaded():
+            raise SchedulerOverloaded("Слишком много ожидающих шагов")
+        max_steps = max_steps or self.max_steps
+
+        self._session_users[session_id] = self._session_users.get(session_id, 0) + 1
+        lock = self._session_locks.setdefault(session_id, asyncio.Lock())
+        try:
+            async with lock:
+                messages: list[t.Message] = []
+                steps = 0
+                while steps < max_steps:
+                    delta = await self.step(session_id, model, chat, lane, tools_definition, tools_executable)
+                    steps += 1
+                    messages.extend(delta)
+                    if not delta or delta[-1].role != "tool":
+                        if on_step is not None:
+                            await on_step(delta)
+                        return TurnResult(messages, steps, True)
+                    if on_step is not None and await on_step(delta) is False:
+                        break
+                return TurnResult(messages, steps, False)
+        finally:
+            self._session_users[session_id] -= 1
+            if not self._session_users[session_id]:
+                del self._session_users[session_id]
+                del self._session_locks[session_id]
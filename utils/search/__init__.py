@@ -0,0 +1 @@
+from .search_index import ChatSearchIndex, SearchHit, fts_query
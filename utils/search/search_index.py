@@ -0,0 +1,346 @@
+import os
+import queue
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Iterable, NamedTuple
+
+import utils.types as t
+from utils.tracing import tracer
+from utils.umf_loader import iter_messages
+
+"""
+Полнотекстовый поиск по сохранённым чатам (SQLite FTS5).
+
+Индекс пополняется дельтами: сервис передаёт новые сообщения (submit) сразу после того, как добавил их в историю,
+и ничего не ждёт - сообщения кладутся в очередь, а пишет их в базу один фоновый поток, по несколько дельт
+в одной транзакции. Поэтому индексация не задерживает ответ и остаётся инкрементальной: каждое сообщение
+индексируется один раз (повторно переданные сообщения пропускаются по (chat_id, message_id)).
+
+Что индексируется:
+    text         - TextContent;
+    thought      - ThoughtContent, только при include_thoughts=True;
+    tool_result  - ToolResult.text_content, имя инструмента ищется отдельной колонкой;
+    document     - Asset.ocr_text ассетов сообщений и результатов инструментов.
+
+Поиск (search) фильтрует по чатам, ролям, видам записей, модели и времени, сортирует по bm25 и возвращает
+фрагменты с подсвеченными совпадениями. Чтение идёт своими соединениями (WAL), поэтому не ждёт записи.
+
+Уже существующие чаты добавляются index_file: файл УФС читается потоково, сообщения, которые уже есть в индексе,
+пропускаются, поэтому повторный запуск дописывает только новое.
+
+Пример:
+    index = ChatSearchIndex("data/search.sqlite")
+    index.submit(chat_id, delta, model="deepseek-chat")
+    hits = index.search("счёт фактура", roles=["user"], since=datetime(2026, 1, 1))
+"""
+
+logger = logging.getLogger("ai_chat.search")
+
+_SCHEMA = """
+PRAGMA journal_mode = WAL;
+CREATE TABLE IF NOT EXISTS messages (
+    chat_id TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    PRIMARY KEY (chat_id, message_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    chat_id TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    part TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    role TEXT NOT NULL,
+    model TEXT,
+    ts REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_chat ON entries (chat_id, ts);
+CREATE INDEX IF NOT EXISTS entries_role ON entries (role, ts);
+CREATE INDEX IF NOT EXISTS entries_model ON entries (model, ts);
+CREATE INDEX IF NOT EXISTS entries_ts ON entries (ts);
+CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5 (text, name, tokenize = 'unicode61 remove_diacritics 2');
+"""
+
+SNIPPET_TOKENS = 16  # Длина фрагмента в результатах поиска
+_BATCH = 256  # Столько заданий очереди пишется одной транзакцией
+
+
+class SearchHit(NamedTuple):
+    """Найденная запись"""
+    chat_id: str
+    message_id: str
+    part: str  # Номер элемента содержимого, для документов - "<номер>:<id ассета>"
+    kind: str  # text, thought, tool_result, document
+    role: str
+    model: str | None
+    name: str | None  # Имя инструмента (tool_result) или id ассета (document)
+    timestamp: datetime
+    snippet: str  # Фрагмент текста, совпадения обрамлены highlight
+    rank: float  # bm25, меньше - лучше
+
+
+class _Entry(NamedTuple):
+    part: str
+    kind: str
+    text: str
+    name: str | None
+
+
+def _epoch(value: datetime) -> float:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def fts_query(text: str) -> str:
+    """
+    Запрос FTS5 из пользовательского ввода: все слова должны встретиться, спецсимволы не работают.
+    Слово с * на конце ищется как префикс
+    """
+    terms = []
+    for word in text.split():
+        prefix = word.endswith("*") and len(word) > 1
+        word = word.rstrip("*") if prefix else word
+        terms.append('"' + word.replace('"', '""') + '"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+
+class ChatSearchIndex:
+    """Поисковый индекс чатов в файле SQLite с фоновой записью"""
+
+    def __init__(self, path: str | os.PathLike, include_thoughts: bool = False):
+        """
+        :param path: файл базы (создаётся при необходимости)
+        :param include_thoughts: индексировать мысли моделей. Влияет только на сообщения, проиндексированные позже
+        """
+        self.path = os.fspath(path)
+        self.include_thoughts = include_thoughts
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        connection = self._connect()
+        try:
+            connection.executescript(_SCHEMA)
+        finally:
+            connection.close()
+        self._queue: queue.Queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._writer: threading.Thread | None = None
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute("PRAGMA busy_timeout = 30000")
+        return connection
+
+    # --- Очередь записи ---
+
+    def _put(self, task: tuple) -> None:
+        with self._lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._write_loop, name="search-index-writer", daemon=True)
+                self._writer.start()
+            self._queue.put(task)
+
+    def submit(self, chat_id: str, messages: Iterable[t.Message], model: str | None = None) -> None:
+        """
+        Ставит новые сообщения чата в очередь индексации и сразу возвращает управление.
+        В очередь попадают копии: вызывающий продолжает менять сообщения (например, ocr_text), пока индекс их читает
+        :param model: модель чата - для сообщений без metadata (пользователь, инструменты)
+        """
+        self._put(("messages", chat_id, [message.model_copy(deep=True) for message in messages], model))
+
+    def index_file(self, path: str | os.PathLike, chat_id: str, model: str | None = None) -> None:
+        """Ставит в очередь чат из файла УФС: проиндексированы будут только сообщения, которых ещё нет в индексе"""
+        self._put(("file", chat_id, os.fspath(path), model))
+
+    def delete_chat(self, chat_id: str) -> None:
+        """Ставит в очередь удаление чата из индекса"""
+        self._put(("delete", chat_id))
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """
+        Дожидается записи всего, что было поставлено в очередь до вызова
+        :return: False, если не дождались за timeout
+        """
+        done = threading.Event()
+        self._put(("flush", done))
+        return done.wait(timeout)
+
+    def _write_loop(self) -> None:
+        connection = self._connect()
+        connection.isolation_level = None  # Транзакции пачек задаются явно, см. _write
+        try:
+            while True:
+                tasks = [self._queue.get()]
+                while len(tasks) < _BATCH:
+                    try:
+                        tasks.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                try:
+                    self._write(connection, tasks)
+                except Exception as e:  # Например, диск заполнен: пачка теряется, но индексация продолжается
+                    logger.error("Не удалось записать пачку поискового индекса: %s", e)
+        finally:
+            connection.close()
+
+    def _write(self, connection: sqlite3.Connection, tasks: list[tuple]) -> None:
+        waiting = []
+        with tracer.span("search_index.write", tasks=len(tasks)) as span:
+            indexed = 0
+            connection.execute("BEGIN")
+            try:
+                for task in tasks:
+                    kind = task[0]
+                    if kind == "flush":
+                        waiting.append(task[1])
+                        continue
+                    # Сбой одного задания откатывает только его, остальные задания пачки записываются
+                    connection.execute("SAVEPOINT task")
+                    try:
+                        if kind == "messages":
+                            indexed += self._index_messages(connection, task[1], task[2], task[3])
+                        elif kind == "file":
+                            indexed += self._index_file(connection, task[1], task[2], task[3])
+                        elif kind == "delete":
+                            self._delete_chat(connection, task[1])
+                    except Exception as e:
+                        connection.execute("ROLLBACK TO task")
+                        logger.error("Не удалось обновить поисковый индекс чата %s: %s", task[1], e)
+                    connection.execute("RELEASE task")
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            finally:
+                span.set(messages=indexed)
+                for done in waiting:
+                    done.set()
+
+    # --- Запись ---
+
+    def _entries(self, message: t.Message) -> list[_Entry]:
+        entries = []
+        for position, content in enumerate(message.content):
+            if content.type == "text":
+                entries.append(_Entry(str(position), "text", content.text, None))
+            elif content.type == "thought" and self.include_thoughts:
+                entries.append(_Entry(str(position), "thought", content.text, None))
+            elif content.type == "tool_result":
+                result = content.tool_result
+                entries.append(_Entry(str(position), "tool_result", result.text_content, result.name))
+            if content.type in ("media", "tool_result"):
+                for asset in content.assets or []:
+                    if asset.ocr_text:
+                        entries.append(_Entry(f"{position}:{asset.id}", "document", asset.ocr_text, asset.id))
+        return [entry for entry in entries if entry.text]
+
+    def _index_messages(self, connection: sqlite3.Connection, chat_id: str, messages: Iterable[t.Message],
+                        model: str | None) -> int:
+        """:return: сколько сообщений добавлено (уже проиндексированные пропускаются)"""
+        count = 0
+        for message in messages:
+            cursor = connection.execute(
+                "INSERT OR IGNORE INTO messages (chat_id, message_id) VALUES (?, ?)", (chat_id, message.id)
+            )
+            if not cursor.rowcount:
+                continue
+            count += 1
+            message_model = message.metadata.model if message.metadata else model
+            ts = _epoch(message.timestamp)
+            for entry in self._entries(message):
+                cursor = connection.execute(
+                    "INSERT INTO entries (chat_id, message_id, part, kind, role, model, ts) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (chat_id, message.id, entry.part, entry.kind, message.role, message_model, ts),
+                )
+                connection.execute("INSERT INTO entries_fts (rowid, text, name) VALUES (?, ?, ?)",
+                                   (cursor.lastrowid, entry.text, entry.name))
+        return count
+
+    def _index_file(self, connection: sqlite3.Connection, chat_id: str, path: str, model: str | None) -> int:
+        # Уже проиндексированные сообщения (в том числе переданные submit в любом порядке) пропускает _index_messages
+        return self._index_messages(connection, chat_id, iter_messages(path, data_mode="skip"), model)
+
+    @staticmethod
+    def _delete_chat(connection: sqlite3.Connection, chat_id: str) -> None:
+        connection.execute("DELETE FROM entries_fts WHERE rowid IN (SELECT id FROM entries WHERE chat_id = ?)",
+                           (chat_id,))
+        connection.execute("DELETE FROM entries WHERE chat_id = ?", (chat_id,))
+        connection.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
+
+    # --- Поиск ---
+
+    def _reader(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = self._connect()
+        return connection
+
+    def search(
+            self,
+            query: str,
+            chat_ids: Iterable[str] | None = None,
+            roles: Iterable[str] | None = None,
+            kinds: Iterable[str] | None = None,
+            model: str | None = None,
+            since: datetime | None = None,
+            until: datetime | None = None,
+            limit: int = 20,
+            raw: bool = False,
+            highlight: tuple[str, str] = ("[", "]"),
+    ) -> list[SearchHit]:
+        """
+        Ищет записи, лучшие совпадения первыми
+        :param query: слова, которые должны встретиться (слово* - префикс); при raw=True - синтаксис FTS5
+        :param chat_ids: только эти чаты
+        :param roles: только сообщения этих ролей (user, assistant, tool)
+        :param kinds: только эти виды записей (text, thought, tool_result, document)
+        :param model: только сообщения этой модели
+        :param since: не раньше этого времени
+        :param until: раньше этого времени
+        :param highlight: чем обрамлять совпадения во фрагменте
+        """
+        match = query if raw else fts_query(query)
+        if not match:
+            return []
+        conditions = ["entries_fts MATCH ?"]
+        params: list = [match]
+        for column, values in (("chat_id", chat_ids), ("role", roles), ("kind", kinds)):
+            if values is not None:
+                values = list(values)
+                conditions.append(f"e.{column} IN ({', '.join('?' * len(values))})")
+                params += values
+        if model is not None:
+            conditions.append("e.model = ?")
+            params.append(model)
+        if since is not None:
+            conditions.append("e.ts >= ?")
+            params.append(_epoch(since))
+        if until is not None:
+            conditions.append("e.ts < ?")
+            params.append(_epoch(until))
+
+        sql = (
+            "SELECT e.chat_id, e.message_id, e.part, e.kind, e.role, e.model, entries_fts.name, e.ts, "
+            f"snippet(entries_fts, 0, ?, ?, '…', {SNIPPET_TOKENS}), bm25(entries_fts) AS rank "
+            "FROM entries_fts JOIN entries e ON e.id = entries_fts.rowid "
+            f"WHERE {' AND '.join(conditions)} ORDER BY rank LIMIT ?"
+        )
+        with tracer.span("search_index.search") as span:
+            rows = self._reader().execute(sql, [*highlight, *params, limit]).fetchall()
+            span.set(hits=len(rows))
+        return [
+            SearchHit(chat_id, message_id, part, kind, role, model_name, name,
+                      datetime.fromtimestamp(ts, timezone.utc), snippet, rank)
+            for chat_id, message_id, part, kind, role, model_name, name, ts, snippet, rank in rows
+        ]
+
+    def close(self, timeout: float | None = None) -> None:
+        """Дописывает очередь и закрывает соединение чтения текущего потока"""
+        self.flush(timeout)
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
@@ -1,3 +1,5 @@
 from .messages_helper import message_helper, generate_timestamp
 from .bytes_converter import string_to_bytes, bytes_to_string
-from .file_tools import file_to_base64, file_to_bytes, count_file_size
\ No newline at end of file
+from .file_tools import file_to_base64, file_to_bytes, count_file_size
+from .background_loop import background_loop, run_coroutine_sync
+from .single_flight import SingleFlight, single_flight, canonical_hash
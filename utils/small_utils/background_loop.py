@@ -0,0 +1,35 @@
+import asyncio
+import threading
+from typing import Coroutine, Any
+
+
+class BackgroundLoop:
+    """
+    Общий для всего процесса event loop в отдельном потоке.
+    Нужен, чтобы синхронный код мог выполнять корутины, не создавая новый loop (и поток) на каждый вызов.
+    """
+
+    def __init__(self):
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._lock = threading.Lock()
+
+    def get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._loop.run_forever, name="background-loop", daemon=True
+                ).start()
+            return self._loop
+
+    def run(self, coro: Coroutine) -> Any:
+        """Выполняет корутину в фоновом loop и ждёт результат"""
+        return asyncio.run_coroutine_threadsafe(coro, self.get_loop()).result()
+
+
+background_loop = BackgroundLoop()
+
+
+def run_coroutine_sync(coro: Coroutine) -> Any:
+    """Выполняет корутину из синхронного кода в общем фоновом event loop"""
+    return background_loop.run(coro)
@@ -0,0 +1,111 @@
+import json
+import asyncio
+import hashlib
+import threading
+import dataclasses
+from concurrent.futures import Future
+from typing import Any, Callable, Awaitable
+
+from pydantic import BaseModel as PydanticBaseModel
+
+from utils.tracing import tracer
+
+"""
+Объединение одинаковых запросов, выполняющихся одновременно (single-flight).
+
+Пока первый вызов с ключом выполняется, остальные вызовы с тем же ключом не делают свою работу, а ждут его
+результат (или исключение). После завершения ключ удаляется: это не кэш, повторный запрос выполнится заново.
+Таблица общая для синхронного и асинхронного путей и для всех потоков и event loop'ов процесса.
+
+Ключ - canonical_hash от того, что действительно уходит к провайдеру (нативная история, схемы инструментов,
+параметры), поэтому одинаковые запросы из разных чатов совпадают, а любое отличие даёт другой ключ.
+"""
+
+
+def _canonical_default(value):
+    """Приводит к JSON то, что json.dumps не умеет сам. Байты заменяются их хэшем, чтобы не копировать данные"""
+    if isinstance(value, PydanticBaseModel):
+        return value.model_dump(exclude_none=True)
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return dataclasses.asdict(value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {"$sha256": hashlib.sha256(value).hexdigest()}
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=repr)
+    return repr(value)
+
+
+def canonical_hash(value: Any) -> str:
+    """SHA-256 канонического JSON значения: ключи словарей отсортированы, pydantic-модели без None-полей"""
+    data = json.dumps(value, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=_canonical_default)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """Таблица выполняющихся вызовов: ключ -> Future с их общим результатом"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[str, Future] = {}
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    def _join(self, key: str) -> tuple[Future, bool]:
+        """:return: (future вызова, стал ли вызывающий ведущим)"""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                return future, False
+            future = self._calls[key] = Future()
+            return future, True
+
+    def _finish(self, key: str, future: Future, result=None, error: BaseException | None = None) -> None:
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key: str, fn: Callable[[], Any]) -> tuple[Any, bool]:
+        """
+        Выполняет fn или дожидается уже выполняющегося вызова с тем же ключом
+        :return: (результат, выполнил ли fn этот вызов). Ведомые получают тот же объект,
+            поэтому изменяемый результат им нужно копировать
+        """
+        future, leader = self._join(key)
+        if not leader:
+            with tracer.span("single_flight.wait", key=key[:16]):
+                return future.result(), False
+        try:
+            result = fn()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result, True
+
+    async def ado(self, key: str, fn: Callable[[], Awaitable]) -> tuple[Any, bool]:
+        """
+        Асинхронная версия do. Запрос ведущего выполняется отдельной задачей, поэтому отмена ведущего
+        не обрывает ожидание остальных
+        """
+        future, leader = self._join(key)
+        if leader:
+            asyncio.ensure_future(self._arun(key, future, fn))
+            return await asyncio.shield(asyncio.wrap_future(future)), True
+        with tracer.span("single_flight.wait", key=key[:16]):
+            return await asyncio.shield(asyncio.wrap_future(future)), False
+
+    async def _arun(self, key: str, future: Future, fn: Callable[[], Awaitable]) -> None:
+        try:
+            result = await fn()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+        else:
+            self._finish(key, future, result)
+
+
+single_flight = SingleFlight()
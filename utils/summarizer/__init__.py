@@ -0,0 +1 @@
+from .summarizer import HistorySummarizer, summarized_view, find_checkpoint, estimate_tokens, render_transcript
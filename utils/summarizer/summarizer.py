@@ -0,0 +1,305 @@
+import json
+import asyncio
+import logging
+from typing import Awaitable, Callable, TYPE_CHECKING
+
+import utils.types as t
+from config import settings
+from utils.small_utils import message_helper, generate_timestamp
+from utils.tracing import tracer
+
+if TYPE_CHECKING:
+    from models import BaseModel
+
+"""
+Скользящая сводка длинных чатов.
+
+В многодневном чате отправлять всю историю медленно и дорого, а окно последних сообщений теряет важное начало.
+HistorySummarizer время от времени сжимает старые ходы в сводку (SummaryCheckpoint) дешёвой моделью
+(например, DeepseekChat или Gemini3_1FlashLite). Сводка хранится в УФС рядом с сообщениями (ChatData.summaries),
+сами сообщения не удаляются. Каждая новая сводка составляется из предыдущей и сообщений после неё, поэтому
+объём работы на сводку не растёт вместе с чатом.
+
+Модели при конвертации (summarized_view) отправляют системный промпт со сводкой и сообщения после неё,
+поэтому вход длинного чата ограничен примерно trigger_tokens + размером сводки.
+
+Сводка составляется, когда сообщения после последней сводки занимают больше trigger_tokens (оценка - символы / 4).
+Последние keep_recent_tokens остаются как есть, граница сводки всегда проходит перед сообщением пользователя,
+чтобы не разрывать вызовы инструментов и их результаты.
+
+Сводка не задерживает ответ: schedule запускает её в фоне после хода, а пока она не готова, модели получают
+прежнюю сводку и все сообщения после неё.
+
+Сводка составляется по снимку истории на момент schedule, а сохраняется колбэком on_checkpoint: он получает
+новую сводку и должен сам добавить её (apply_checkpoint) в актуальную версию чата из хранилища - пока сводка
+составлялась, в чат могли добавиться ходы, или его могли удалить.
+
+Пример:
+    summarizer = HistorySummarizer(DeepseekChat())
+
+    async def save_checkpoint(checkpoint):
+        chat = await store.get(chat_id)
+        if chat is not None and summarizer.apply_checkpoint(chat, checkpoint):
+            await store.save(chat_id, chat)
+
+    summarizer.schedule(chat_id, chat, on_checkpoint=save_checkpoint)
+"""
+
+ASSET_TOKENS = 300  # Оценка ассета без текста (изображение, аудио, видео)
+TOOL_ARGS_LIMIT = 500  # Столько символов аргументов инструмента попадает в текст для сводки
+TOOL_RESULT_LIMIT = 2000  # Столько символов результата инструмента попадает в текст для сводки
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a long conversation between a user and an AI assistant. "
+    "You receive the previous summary (if any) and the messages that followed it. Write an updated summary that "
+    "replaces both. Keep everything needed to continue the conversation: the user's goals, preferences and "
+    "constraints, facts, decisions, names, numbers, code and file identifiers, results of tool calls, "
+    "and open questions. Drop small talk and repetition. Write in the language of the conversation. "
+    "Reply with the summary only."
+)
+
+logger = logging.getLogger("ai_chat.summarizer")
+
+
+def estimate_tokens(message: t.Message) -> int:
+    """Грубая оценка числа токенов сообщения: символы / 4, ассеты - по ASSET_TOKENS или по тексту документа"""
+    chars = 0
+    tokens = 0
+    for content in message.content:
+        if content.type in ("text", "thought"):
+            chars += len(content.text)
+        elif content.type == "tool_call":
+            chars += len(content.tool_call.name) + len(json.dumps(content.tool_call.args, ensure_ascii=False))
+        elif content.type == "tool_result":
+            chars += len(content.tool_result.text_content or "")
+            tokens += ASSET_TOKENS * len(content.assets or [])
+        elif content.type == "media":
+            for asset in content.assets:
+                if asset.ocr_text is not None:
+                    chars += len(asset.ocr_text)
+                else:
+                    tokens += ASSET_TOKENS
+    return tokens + chars // 4
+
+
+def find_checkpoint(history: t.ChatData) -> tuple[t.SummaryCheckpoint, int] | None:
+    """
+    Последняя сводка, которую можно применить к истории
+    :return: (сводка, индекс первого сообщения после неё) или None
+    """
+    messages = history.messages
+    for checkpoint in reversed(history.summaries):
+        index = checkpoint.messages_count - 1
+        if 0 <= index < len(messages) and messages[index].id == checkpoint.until_message_id:
+            return checkpoint, index + 1
+        # История могла быть загружена не с начала (load_chat(last=...)) - ищем сообщение по id
+        for index in range(min(index, len(messages) - 1), -1, -1):
+            if messages[index].id == checkpoint.until_message_id:
+                return checkpoint, index + 1
+    return None
+
+
+def summarized_view(history: t.ChatData) -> tuple[t.ChatData, str | None]:
+    """
+    История, которую нужно отправить модели: системные сообщения, затем сообщения после последней сводки
+    :return: (история, текст сводки или None, если сводки нет)
+    """
+    found = find_checkpoint(history)
+    if found is None:
+        return history, None
+    checkpoint, start = found
+    system = [message for message in history.messages[:start] if message.role == "system"]
+    view = t.ChatData.model_construct(
+        chat_metadata=history.chat_metadata, summaries=[], messages=system + history.messages[start:]
+    )
+    view._conversion_cache = history._conversion_cache
+    return view, checkpoint.text
+
+
+def _clip(text: str, limit: int) -> str:
+    return text if len(text) <= limit else f"{text[:limit]}... ({len(text) - limit} characters omitted)"
+
+
+def render_transcript(messages: list[t.Message]) -> str:
+    """Сообщения в виде текста для модели, составляющей сводку. Мысли не передаются, медиа - заглушками"""
+    lines = []
+    for message in messages:
+        if message.role == "system":
+            continue
+        parts = []
+        for content in message.content:
+            if content.type == "text":
+                parts.append(content.text)
+            elif content.type == "tool_call":
+                args = json.dumps(content.tool_call.args, ensure_ascii=False)
+                parts.append(f"[calls tool {content.tool_call.name}({_clip(args, TOOL_ARGS_LIMIT)})]")
+            elif content.type == "tool_result":
+                status = "error" if content.tool_result.is_error else "result"
+                text = _clip(content.tool_result.text_content or "", TOOL_RESULT_LIMIT)
+                parts.append(f"[tool {content.tool_result.name} {status}: {text}]")
+            elif content.type == "media":
+                for asset in content.assets:
+                    parts.append(f"[{asset.type} {asset.id}, {asset.mime_type}]")
+        if parts:
+            lines.append(f"{message.role.upper()}: " + "\n".join(parts))
+    return "\n\n".join(lines)
+
+
+class HistorySummarizer:
+    """Составляет сводки длинных чатов дешёвой моделью"""
+
+    def __init__(
+            self,
+            model: "BaseModel",
+            trigger_tokens: int = 32000,
+            keep_recent_tokens: int = 8000,
+            min_messages: int = 4,
+    ):
+        """
+        :param model: модель для сводок (дешёвая: DeepseekChat, Gemini3_1FlashLite)
+        :param trigger_tokens: сводка составляется, когда сообщения после прошлой сводки занимают больше
+        :param keep_recent_tokens: столько последних токенов всегда отправляется без сжатия
+        :param min_messages: меньше этого числа сообщений в сводку не сжимается
+        """
+        if keep_recent_tokens >= trigger_tokens:
+            raise ValueError("keep_recent_tokens должен быть меньше trigger_tokens")
+        self.model = model
+        self.trigger_tokens = trigger_tokens
+        self.keep_recent_tokens = keep_recent_tokens
+        self.min_messages = min_messages
+        self._tasks: dict[str, asyncio.Task] = {}
+
+    # --- Граница сводки ---
+
+    def find_cut(self, history: t.ChatData) -> tuple[int, int] | None:
+        """
+        Какие сообщения пора сжать
+        :return: (начало, конец) - индексы сообщений для новой сводки, или None, если сводка не нужна
+        """
+        messages = history.messages
+        found = find_checkpoint(history)
+        start = found[1] if found else 0
+        tokens = [estimate_tokens(message) for message in messages[start:]]
+        if sum(tokens) <= self.trigger_tokens:
+            return None
+
+        cut = None
+        tail = 0
+        for index in range(len(messages) - 1, start, -1):
+            tail += tokens[index - start]
+            if messages[index].role == "user":
+                # Если последний ход сам больше keep_recent_tokens, граница проходит перед ним
+                if cut is None or tail <= self.keep_recent_tokens:
+                    cut = index
+            if tail > self.keep_recent_tokens and cut is not None:
+                break
+        if cut is None or cut - start < self.min_messages:
+            return None
+        return start, cut
+
+    # --- Сводка ---
+
+    def _build_request(self, history: t.ChatData, start: int, cut: int) -> t.ChatData:
+        found = find_checkpoint(history)
+        previous = found[0].text if found and found[1] == start else None
+        text = ""
+        if previous:
+            text += f"<previous_summary>\n{previous}\n</previous_summary>\n\n"
+        text += f"<new_messages>\n{render_transcript(history.messages[start:cut])}\n</new_messages>"
+        return t.ChatData(messages=[
+            t.Message(id=message_helper.generate_id(settings.MESSAGE_ID_LEN), timestamp=generate_timestamp(),
+                      role="system", content=[t.TextContent(text=SUMMARY_PROMPT)]),
+            t.Message(id=message_helper.generate_id(settings.MESSAGE_ID_LEN), timestamp=generate_timestamp(),
+                      role="user", content=[t.TextContent(text=text)]),
+        ])
+
+    def _checkpoint(self, history: t.ChatData, cut: int, delta: list[t.Message]) -> t.SummaryCheckpoint | None:
+        reply = delta[0] if delta else None
+        text = "\n".join(content.text for content in reply.content if content.type == "text").strip() if reply else ""
+        if not text:
+            logger.warning("Модель %s вернула пустую сводку", getattr(self.model, "model_name", None))
+            return None
+        return t.SummaryCheckpoint(
+            id=message_helper.generate_id(settings.MESSAGE_ID_LEN),
+            timestamp=generate_timestamp(),
+            until_message_id=history.messages[cut - 1].id,
+            messages_count=cut,
+            text=text,
+            model=getattr(self.model, "model_name", None),
+            usage=reply.metadata.usage if reply.metadata else None,
+        )
+
+    @staticmethod
+    def apply_checkpoint(history: t.ChatData, checkpoint: t.SummaryCheckpoint) -> bool:
+        """
+        Добавляет сводку в историю, если история содержит её последнее сообщение и более полной сводки ещё нет
+        :return: True, если сводка добавлена
+        """
+        if not any(message.id == checkpoint.until_message_id for message in history.messages):
+            return False
+        found = find_checkpoint(history)
+        if found and found[1] >= checkpoint.messages_count:
+            return False  # Пока сводка составлялась, появилась более полная
+        history.summaries.append(checkpoint)
+        return True
+
+    def summarize(self, history: t.ChatData) -> t.SummaryCheckpoint | None:
+        """
+        Составляет сводку, если она нужна, и добавляет её в history.summaries
+        :return: новая сводка или None
+        """
+        cut = self.find_cut(history)
+        if cut is None:
+            return None
+        start, cut = cut
+        with tracer.span("summarizer.summarize", messages=cut - start):
+            _, delta = self.model.generate(self._build_request(history, start, cut), None, {})
+        checkpoint = self._checkpoint(history, cut, delta)
+        if checkpoint is not None:
+            self.apply_checkpoint(history, checkpoint)
+        return checkpoint
+
+    async def asummarize(self, history: t.ChatData, apply: bool = True) -> t.SummaryCheckpoint | None:
+        """
+        Асинхронная версия summarize
+        :param apply: добавить сводку в history.summaries. Без этого сводка только возвращается
+        """
+        cut = self.find_cut(history)
+        if cut is None:
+            return None
+        start, cut = cut
+        with tracer.span("summarizer.summarize", messages=cut - start):
+            _, delta = await self.model.agenerate(self._build_request(history, start, cut), None, {})
+        checkpoint = self._checkpoint(history, cut, delta)
+        if checkpoint is not None and apply:
+            self.apply_checkpoint(history, checkpoint)
+        return checkpoint
+
+    # --- Фон ---
+
+    def schedule(self, chat_id: str, history: t.ChatData,
+                 on_checkpoint: Callable[[t.SummaryCheckpoint], Awaitable[None]] | None = None
+                 ) -> asyncio.Task | None:
+        """
+        Запускает сводку в фоне текущего event loop, если она нужна и ещё не составляется для этого чата
+        :param history: снимок истории, по которому составляется сводка
+        :param on_checkpoint: корутина, которой передаётся новая сводка, чтобы добавить её в актуальный чат
+            (см. apply_checkpoint). Если передана, history не меняется. Вызывается без блокировок,
+            синхронизация с ходами чата - на вызывающем
+        :return: задача или None
+        """
+        if chat_id in self._tasks or self.find_cut(history) is None:
+            return None
+
+        async def run():
+            try:
+                checkpoint = await self.asummarize(history, apply=on_checkpoint is None)
+                if checkpoint is not None and on_checkpoint is not None:
+                    await on_checkpoint(checkpoint)
+            except Exception as e:  # Без сводки чат продолжает работать, просто с более длинным входом
+                logger.error("Не удалось составить сводку чата %s: %s", chat_id, e)
+            finally:
+                self._tasks.pop(chat_id, None)
+
+        task = self._tasks[chat_id] = asyncio.get_running_loop().create_task(run())
+        return task
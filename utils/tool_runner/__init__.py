@@ -0,0 +1,12 @@
+from .tool_runner import (
+    run_tool,
+    arun_tool,
+    serialize_tool_output,
+    unpack_media_result,
+    save_media_asset,
+    apply_result_policy,
+    adopt_media_file,
+    INLINE_MEDIA_LIMIT,
+)
+from .process_pool import ToolProcessPool, tool_process_pool
+from .builtin_tools import read_tool_result
@@ -0,0 +1,43 @@
+# Встроенные инструменты, которые регистрируются автоматически, когда они нужны другим инструментам.
+
+import os
+
+from config import settings
+from utils.media import media_writer
+
+
+def read_tool_result(handle: str, offset: int = 0, limit: int = 4000) -> str:
+    """
+    Читает часть полного результата инструмента, который не поместился в ответ.
+
+    Используй, когда результат инструмента был усечён и в нём указан handle.
+    :param handle: Идентификатор сохранённого результата из служебной приписки.
+    :param offset: Позиция, с которой продолжать чтение (значение Next offset из служебной приписки).
+    :param limit: Сколько символов прочитать.
+    :return: Запрошенный фрагмент и информация о том, сколько осталось.
+    """
+    if not handle.isalnum():
+        raise ValueError(f"Некорректный handle: {handle}")
+    path = media_writer.path_for(handle, "text/plain")
+    media_writer.wait(path)
+    if not os.path.exists(path):
+        path = f"{settings.MEDIA_FOLDER}/{handle}.txt"  # Результаты, сохранённые до раскладки по подпапкам
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Результат с handle '{handle}' не найден")
+
+    # offset - позиция в байтах UTF-8: файл читается с нужного места, а не с начала
+    size = os.path.getsize(path)
+    offset = min(max(int(offset or 0), 0), size)
+    limit = max(int(limit or 4000), 1)
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read(limit * 4)  # В UTF-8 символ занимает не больше 4 байт
+    while data and data[0] & 0xC0 == 0x80:  # offset попал в середину символа
+        data = data[1:]
+        offset += 1
+    chunk = data.decode("utf-8", errors="ignore")[:limit]  # Обрезанный в конце символ отбрасывается
+    next_offset = offset + len(chunk.encode("utf-8"))
+
+    if next_offset < size:
+        return chunk + f"\n(System: {size - next_offset} bytes left. Next offset: {next_offset}.)"
+    return chunk + "\n(System: end of result.)"
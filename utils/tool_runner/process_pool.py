@@ -0,0 +1,146 @@
+import os
+import sys
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, Future
+from typing import Callable, NamedTuple, Any
+
+from config import settings
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+"""
+Пул процессов для CPU-тяжёлых инструментов (register_tool(executor="process")).
+
+Такие инструменты не держат GIL вызывающего потока: функция и аргументы передаются в процесс-воркер через pickle
+(функция передаётся по ссылке на модуль, поэтому она должна быть объявлена на верхнем уровне модуля).
+Медиафайлы, которые возвращает инструмент, не передаются обратно через pickle: воркер пишет их во временный файл
+рядом с MEDIA_FOLDER, а основной процесс только переносит этот файл на место.
+
+Воркеры перезапускаются после max_calls_per_worker вызовов (max_tasks_per_child), а весь пул пересоздаётся,
+если какой-то воркер превысил max_worker_memory_mb.
+"""
+
+
+class SpilledMedia(NamedTuple):
+    """Результат медиа-инструмента, байты которого лежат во временном файле."""
+
+    text: str
+    path: str
+    mime_type: str | None
+
+
+def _peak_rss_mb() -> float:
+    if resource is None:
+        return 0.0
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":  # На macOS ru_maxrss в байтах, на Linux и BSD - в килобайтах
+        return max_rss / (1024 * 1024)
+    return max_rss / 1024
+
+
+def _run_in_worker(
+        func: Callable, args: tuple, kwargs: dict, returns_media: bool, tmp_folder: str
+) -> tuple[Any, float]:
+    """Выполняется в процессе-воркере. Возвращает (результат, пиковая память воркера в Мб)"""
+    result = func(*args, **kwargs)
+    if returns_media:
+        from .tool_runner import unpack_media_result
+        text, media_bytes, mime_type = unpack_media_result(result)
+        os.makedirs(tmp_folder, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=tmp_folder)
+        with os.fdopen(fd, "wb") as f:
+            f.write(media_bytes)
+        result = SpilledMedia(text=text, path=path, mime_type=mime_type)
+    return result, _peak_rss_mb()
+
+
+class ToolProcessPool:
+    """Лениво создаваемый пул процессов с перезапуском воркеров по числу вызовов и по памяти."""
+
+    def __init__(self, max_workers: int | None = None, max_calls_per_worker: int | None = None,
+                 max_worker_memory_mb: int | None = None):
+        """Незаданные параметры берутся из настроек (TOOL_PROCESS_*) при первом использовании пула"""
+        self._max_workers = max_workers
+        self._max_calls_per_worker = max_calls_per_worker
+        self._max_worker_memory_mb = max_worker_memory_mb
+        self._executor: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def max_workers(self) -> int | None:
+        return self._max_workers if self._max_workers is not None else settings.TOOL_PROCESS_WORKERS
+
+    @property
+    def max_calls_per_worker(self) -> int:
+        return self._max_calls_per_worker or settings.TOOL_PROCESS_MAX_CALLS
+
+    @property
+    def max_worker_memory_mb(self) -> int:
+        return self._max_worker_memory_mb or settings.TOOL_PROCESS_MAX_MEMORY_MB
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    max_tasks_per_child=self.max_calls_per_worker,
+                )
+            return self._executor
+
+    def _recycle(self, executor: ProcessPoolExecutor) -> None:
+        """Заменяет пул на новый. Уже отправленные в старый пул задачи доработают в нём"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        # Вызывается и из колбэка задачи, то есть из управляющего потока пула. shutdown(wait=False) обнулил бы
+        # список воркеров, пока этот поток ещё заменяет воркер (max_tasks_per_child), поэтому пул останавливается
+        # с ожиданием, но в отдельном потоке
+        threading.Thread(target=executor.shutdown, name="tool-pool-shutdown", daemon=True).start()
+
+    def submit(self, func: Callable, args: tuple, kwargs: dict) -> Future:
+        """
+        Отправляет вызов инструмента в пул.
+        Future возвращает результат функции, а для медиа-инструментов - SpilledMedia
+        """
+        tmp_folder = f"{settings.MEDIA_FOLDER}/.tmp"
+        task = (_run_in_worker, func, args, kwargs, getattr(func, "returns_media", False), tmp_folder)
+        executor = self._get_executor()
+        try:
+            inner = executor.submit(*task)
+        except RuntimeError:  # Пул только что был остановлен при пересоздании
+            self._recycle(executor)
+            executor = self._get_executor()
+            inner = executor.submit(*task)
+        outer = Future()
+
+        def _done(done: Future):
+            try:
+                result, rss_mb = done.result()
+            except BaseException as e:
+                outer.set_exception(e)
+                return
+            if rss_mb > self.max_worker_memory_mb:
+                self._recycle(executor)
+            outer.set_result(result)
+
+        inner.add_done_callback(_done)
+        return outer
+
+    def call(self, func: Callable, args: tuple, kwargs: dict):
+        """Выполняет инструмент в пуле и ждёт результат"""
+        return self.submit(func, args, kwargs).result()
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=wait)
+
+
+tool_process_pool = ToolProcessPool()
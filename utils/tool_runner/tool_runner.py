@@ -0,0 +1,350 @@
+import json
+import os
+import asyncio
+import inspect
+from typing import Callable, Dict, Any
+
+import filetype
+
+from config import settings
+import utils.types as t
+from utils.small_utils import (
+    message_helper, bytes_to_string, file_to_base64, run_coroutine_sync, single_flight, canonical_hash,
+)
+from utils.tools_parser.args_validator import ToolArgumentsError, get_args_validator
+from utils.tracing import tracer
+from utils.media import media_writer
+from .process_pool import SpilledMedia, tool_process_pool
+
+"""
+Общий для всех моделей код выполнения инструментов.
+
+Модели только достают из ответа провайдера имя функции и аргументы, а дальше вызывают run_tool (или arun_tool),
+который выполняет функцию, распаковывает медиа, сериализует результат и применяет политику
+инструмента (см. register_tool): ограничение размера, усечение и вынос полного результата в ассет.
+
+Инструменты выполняются отдельно для каждого вызова. Только чистые функции (register_tool(pure=True)) с одинаковыми
+аргументами, вызванные одновременно (например, в разных чатах), выполняются один раз с общим результатом.
+"""
+
+INLINE_MEDIA_LIMIT = 20 * 1024 * 1024  # Файлы меньше 20 Мб дублируются в data_base64
+
+DEFAULT_MEDIA_RESULT_TEXT = "Медиафайл успешно сгенерирован"
+
+
+def serialize_tool_output(output: Any, result_format: str = "json") -> str:
+    """
+    Превращает результат функции в строку, которая будет подана модели.
+
+    В режиме "json" строки передаются как есть, а остальные объекты сериализуются компактным JSON
+    (без пробелов, без экранирования кириллицы). Несериализуемые объекты приводятся к str.
+    В режиме "str" используется старое поведение - str(output).
+    :param output: результат функции
+    :param result_format: "json" или "str"
+    :return: строка для ToolResult.text_content
+    """
+    if result_format == "str" or isinstance(output, str):
+        return str(output)
+    try:
+        return json.dumps(output, ensure_ascii=False, separators=(",", ":"), default=str)
+    except (TypeError, ValueError):
+        return str(output)
+
+
+def unpack_media_result(tool_result) -> tuple[str, bytes, str | None]:
+    """
+    Распаковывает результат функции с returns_media=True.
+
+    Поддерживаемые форматы: bytes, (bytes, mime_type), (text, bytes), (text, bytes, mime_type)
+    :return: (текст для модели, байты медиа, mime_type или None)
+    """
+    tool_result_str = DEFAULT_MEDIA_RESULT_TEXT
+    media_bytes = b""
+    mime_type_str = None
+    if isinstance(tool_result, tuple):
+        if len(tool_result) == 3:
+            tool_result_str, media_bytes, mime_type_str = tool_result
+        elif len(tool_result) == 2:
+            # Предположим, вернули (bytes, mime_type) или (text, bytes)
+            if isinstance(tool_result[0], bytes):
+                media_bytes, mime_type_str = tool_result
+            else:
+                tool_result_str, media_bytes = tool_result
+    elif isinstance(tool_result, bytes):
+        media_bytes = tool_result
+    return tool_result_str, media_bytes, mime_type_str
+
+
+def asset_type_from_mime(mime_type: str) -> str:
+    """Определяет Asset.type по MIME типу"""
+    if mime_type.startswith("image/"):
+        return "image"
+    elif mime_type.startswith("video/"):
+        return "video"
+    elif mime_type.startswith("audio/"):
+        return "audio"
+    return "document"  # Всё остальное (text/*, application/*, неизвестные типы) передаётся как документ
+
+
+def _new_media_path(mime_type: str) -> tuple[str, str]:
+    """Генерирует id ассета и путь к его файлу в MEDIA_FOLDER (см. media_writer.path_for)"""
+    asset_id = message_helper.generate_id(settings.ASSET_ID_LEN)
+    return asset_id, media_writer.path_for(asset_id, mime_type)
+
+
+def save_media_asset(media_bytes: bytes, mime_type: str) -> t.Asset:
+    """
+    Сохраняет байты в MEDIA_FOLDER и возвращает описывающий их Asset.
+    Запись идёт в фоне (media_writer): Asset возвращается сразу, а читатели файла дожидаются записи сами
+    :param media_bytes: содержимое файла
+    :param mime_type: MIME тип файла
+    :return: Asset
+    """
+    asset_type = asset_type_from_mime(mime_type)
+    asset_id, asset_local_path = _new_media_path(mime_type)
+    with tracer.span("media.write", bytes=len(media_bytes)):
+        media_writer.save(asset_local_path, media_bytes)
+
+    return t.Asset(
+        id=asset_id,
+        type=asset_type,
+        local_path=asset_local_path,
+        mime_type=mime_type,
+        size_bytes=len(media_bytes),
+        data_base64=bytes_to_string(media_bytes) if len(media_bytes) < INLINE_MEDIA_LIMIT else None
+    )
+
+
+def adopt_media_file(tmp_path: str, mime_type: str) -> t.Asset:
+    """
+    Переносит уже записанный файл (например, из процесса-воркера) в MEDIA_FOLDER и возвращает Asset.
+    Содержимое читается в память только для небольших файлов, которые дублируются в data_base64
+    :param tmp_path: путь к временному файлу на той же файловой системе, что и MEDIA_FOLDER
+    :param mime_type: MIME тип файла
+    :return: Asset
+    """
+    asset_type = asset_type_from_mime(mime_type)
+    asset_id, asset_local_path = _new_media_path(mime_type)
+    with tracer.span("media.write", moved=True) as span:
+        size_bytes = os.path.getsize(tmp_path)
+        data_base64 = file_to_base64(tmp_path) if size_bytes < INLINE_MEDIA_LIMIT else None
+        media_writer.move(tmp_path, asset_local_path)
+        span.set(bytes=size_bytes)
+
+    return t.Asset(
+        id=asset_id,
+        type=asset_type,
+        local_path=asset_local_path,
+        mime_type=mime_type,
+        size_bytes=size_bytes,
+        data_base64=data_base64,
+    )
+
+
+def _guess_mime_type(tool: Callable, mime_type_str: str | None, head: bytes) -> str:
+    """Угадывает MIME тип результата: явно заданный в register_tool, возвращённый функцией или по сигнатуре файла"""
+    kind = filetype.guess(head)
+    return getattr(tool, "mime_type", None) or mime_type_str or (
+        kind.mime if kind else "application/octet-stream")
+
+
+def _invoke(tool: Callable, args: tuple, kwargs: dict):
+    """Вызывает функцию в текущем потоке или в пуле процессов, в зависимости от register_tool(executor=...)"""
+    if getattr(tool, "executor", "inline") == "process":
+        return tool_process_pool.call(tool, args, kwargs)
+    if inspect.iscoroutinefunction(tool):
+        return run_coroutine_sync(tool(*args, **kwargs))
+    return tool(*args, **kwargs)
+
+
+async def _ainvoke(tool: Callable, args: tuple, kwargs: dict):
+    """Асинхронный аналог _invoke, не блокирующий event loop"""
+    if getattr(tool, "executor", "inline") == "process":
+        return await asyncio.wrap_future(tool_process_pool.submit(tool, args, kwargs))
+    if inspect.iscoroutinefunction(tool):
+        return await tool(*args, **kwargs)
+    return await asyncio.to_thread(tool, *args, **kwargs)
+
+
+def apply_result_policy(tool: Callable, text: str) -> tuple[str, t.Asset | None]:
+    """
+    Применяет к тексту результата политику инструмента (max_inline_chars, spill_to_asset).
+
+    Если текст длиннее max_inline_chars, модели отдаётся только начало и служебная приписка.
+    При spill_to_asset=True полный текст сохраняется в ассет, и в приписке указывается его id,
+    по которому модель может дочитать результат инструментом read_tool_result.
+    :return: (текст для модели, ассет с полным результатом или None)
+    """
+    max_inline_chars = getattr(tool, "max_inline_chars", None)
+    if max_inline_chars is None or len(text) <= max_inline_chars:
+        return text, None
+
+    preview = text[:max_inline_chars]
+    if not getattr(tool, "spill_to_asset", True):
+        note = f"\n(System: result truncated, {max_inline_chars} of {len(text)} characters shown.)"
+        return preview + note, None
+
+    overflow_asset = save_media_asset(text.encode("utf-8"), "text/plain")
+    overflow_asset.data_base64 = None  # Полный результат не должен попадать в историю целиком
+    note = (
+        f"\n(System: result truncated, {max_inline_chars} of {len(text)} characters shown. "
+        f"Full result is stored with handle '{overflow_asset.id}'. "
+        f"Call read_tool_result(handle='{overflow_asset.id}', offset={len(preview.encode('utf-8'))}) to read the rest.)"
+    )
+    return preview + note, overflow_asset
+
+
+def _process_output(tool: Callable, tool_result) -> tuple[str, t.Asset | None, list[t.Asset] | None]:
+    """
+    Общая для синхронного и асинхронного путей обработка результата функции:
+    распаковка медиа, сериализация и политика размера.
+    :return: (текст для модели, ассет с полным результатом или None, медиа-ассеты или None)
+    """
+    tool_result_asset = None
+    # Если функция выполнялась в процессе-воркере, медиа уже лежит во временном файле
+    if isinstance(tool_result, SpilledMedia):
+        with open(tool_result.path, "rb") as f:
+            head = f.read(262)  # filetype смотрит только на первые 261 байт
+        mime_type = _guess_mime_type(tool, tool_result.mime_type, head)
+        tool_result_str = tool_result.text
+        tool_result_asset = [adopt_media_file(tool_result.path, mime_type)]
+    # Если функция возвращает медиа
+    elif getattr(tool, "returns_media", False):
+        tool_result_str, media_bytes, mime_type_str = unpack_media_result(tool_result)
+        mime_type = _guess_mime_type(tool, mime_type_str, media_bytes)
+        tool_result_asset = [save_media_asset(media_bytes, mime_type)]
+    else:
+        tool_result_str = tool_result
+
+    result_text = serialize_tool_output(tool_result_str, getattr(tool, "result_format", "json"))
+    result_text, overflow_asset = apply_result_policy(tool, result_text)
+    return result_text, overflow_asset, tool_result_asset
+
+
+def _pure_call_key(tool: Callable, call_args: tuple, call_kwargs: dict) -> str:
+    return canonical_hash(("tool", tool.__module__, tool.__qualname__, call_args, call_kwargs))
+
+
+def _copy_output(output: tuple[str, t.Asset | None, list[t.Asset] | None]):
+    """Копия общего результата чистой функции: ассеты попадут в разные истории"""
+    result_text, overflow_asset, tool_result_asset = output
+    return (
+        result_text,
+        overflow_asset.model_copy(deep=True) if overflow_asset else None,
+        [asset.model_copy(deep=True) for asset in tool_result_asset] if tool_result_asset else None,
+    )
+
+
+def _execute(tool: Callable, call_args: tuple, call_kwargs: dict) -> tuple[str, t.Asset | None, list[t.Asset] | None]:
+    """Вызов и обработка результата. Одинаковые одновременные вызовы чистой функции объединяются"""
+    def execute():
+        return _process_output(tool, _invoke(tool, call_args, call_kwargs))
+
+    if not getattr(tool, "pure", False):
+        return execute()
+    output, leader = single_flight.do(_pure_call_key(tool, call_args, call_kwargs), execute)
+    return output if leader else _copy_output(output)
+
+
+async def _aexecute(tool: Callable, call_args: tuple, call_kwargs: dict):
+    async def execute():
+        return _process_output(tool, await _ainvoke(tool, call_args, call_kwargs))
+
+    if not getattr(tool, "pure", False):
+        return await execute()
+    output, leader = await single_flight.ado(_pure_call_key(tool, call_args, call_kwargs), execute)
+    return output if leader else _copy_output(output)
+
+
+def _trace_result(span, content: t.ToolResultContent) -> None:
+    """Размеры результата инструмента для спана"""
+    if span.recording:
+        span.set(
+            result_chars=len(content.tool_result.text_content),
+            media_bytes=sum(asset.size_bytes for asset in content.assets or []),
+            is_error=content.tool_result.is_error,
+        )
+
+
+def _make_result_content(
+        name: str,
+        call_id: str,
+        result_text: str,
+        is_error: bool = False,
+        overflow_asset: t.Asset | None = None,
+        tool_result_asset: list[t.Asset] | None = None,
+) -> t.ToolResultContent:
+    return t.ToolResultContent(
+        type="tool_result",
+        tool_result=t.ToolResult(
+            id=call_id,
+            name=name,
+            text_content=result_text,
+            is_error=is_error,
+            overflow_asset=overflow_asset,
+        ),
+        assets=tool_result_asset
+    )
+
+
+def _prepare_call(
+        tools_executable: Dict[str, Callable], name: str, args: dict, args_error: str | None
+) -> tuple[Callable, tuple, dict]:
+    """Находит функцию и проверяет аргументы её скомпилированным валидатором"""
+    current_tool = tools_executable[name]
+    if args_error:
+        raise ToolArgumentsError(args_error)
+    call_args, call_kwargs = get_args_validator(current_tool).validate(args)
+    return current_tool, call_args, call_kwargs
+
+
+def run_tool(
+        tools_executable: Dict[str, Callable],
+        name: str,
+        args: dict,
+        call_id: str,
+        args_error: str | None = None,
+) -> t.ToolResultContent:
+    """
+    Выполняет инструмент и собирает ToolResultContent для УФС.
+    Любое исключение внутри функции (в том числе ошибка валидации аргументов) превращается в результат с is_error=True.
+    Корутины выполняются в общем фоновом event loop (см. run_coroutine_sync)
+    :param tools_executable: словарь доступных функций
+    :param name: имя вызываемой функции
+    :param args: аргументы вызова
+    :param call_id: id вызова (должен совпадать с ToolCall.id)
+    :param args_error: ошибка разбора аргументов, если модель вернула некорректный JSON
+    :return: ToolResultContent
+    """
+    with tracer.span("tool.run", tool=name) as span:
+        try:
+            current_tool, call_args, call_kwargs = _prepare_call(tools_executable, name, args, args_error)
+            result_text, overflow_asset, tool_result_asset = _execute(current_tool, call_args, call_kwargs)
+            content = _make_result_content(name, call_id, result_text, False, overflow_asset, tool_result_asset)
+        except Exception as e:
+            content = _make_result_content(name, call_id, str(e), is_error=True)
+        _trace_result(span, content)
+        return content
+
+
+async def arun_tool(
+        tools_executable: Dict[str, Callable],
+        name: str,
+        args: dict,
+        call_id: str,
+        args_error: str | None = None,
+) -> t.ToolResultContent:
+    """
+    Асинхронная версия run_tool.
+    Корутины ожидаются напрямую, обычные функции выполняются в потоке (asyncio.to_thread),
+    функции с executor="process" - в пуле процессов.
+    """
+    with tracer.span("tool.run", tool=name) as span:
+        try:
+            current_tool, call_args, call_kwargs = _prepare_call(tools_executable, name, args, args_error)
+            result_text, overflow_asset, tool_result_asset = await _aexecute(current_tool, call_args, call_kwargs)
+            content = _make_result_content(name, call_id, result_text, False, overflow_asset, tool_result_asset)
+        except Exception as e:
+            content = _make_result_content(name, call_id, str(e), is_error=True)
+        _trace_result(span, content)
+        return content
@@ -17,7 +17,7 @@ def foo_func(first: int, second: float=2) -> float:
     """
     return first + second
 
-@register_tool
+@register_tool(pure=True)
 def bar_func(first: float, second: float) -> float:
     """
     Функция складывает два числа
@@ -1,3 +1,4 @@
 from .tools_parser import ToolsParser, register_tool
+from .args_validator import ArgsValidator, ToolArgumentsError, get_args_validator
 
-__all__ = [ToolsParser, register_tool]
\ No newline at end of file
+__all__ = [ToolsParser, register_tool, ArgsValidator, ToolArgumentsError, get_args_validator]
\ No newline at end of file
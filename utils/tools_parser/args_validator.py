@@ -0,0 +1,110 @@
+from inspect import signature, Parameter
+from typing import Any, Callable
+
+from pydantic import ConfigDict, Field, ValidationError, create_model
+
+"""
+Валидаторы аргументов инструментов.
+
+Для каждой функции при регистрации один раз собирается pydantic-модель по её сигнатуре. Аргументы, которые вернула
+нейросеть, проверяются и приводятся к нужным типам до вызова функции, а ошибка валидации сразу возвращается модели
+в виде понятного сообщения, а не падает где-то внутри инструмента.
+
+null для необязательного параметра означает "использовать значение по умолчанию" (см. strict_mode в ToolsParser).
+"""
+
+
+class ToolArgumentsError(ValueError):
+    """Аргументы, которые передала модель, не соответствуют сигнатуре инструмента."""
+
+
+class ArgsValidator:
+    """Скомпилированный валидатор аргументов одной функции."""
+
+    def __init__(self, func: Callable):
+        self.func_name = func.__name__
+        self._fields: dict[str, str] = {}  # имя поля pydantic-модели -> имя параметра функции
+        self._positional: list[str] = []  # параметры, которые нужно передать позиционно
+        self._var_positional: str | None = None  # имя *args
+        self._defaults: set[str] = set()  # параметры со значением по умолчанию
+        self._var_keyword: str | None = None  # имя **kwargs
+
+        sig = signature(func)
+        has_var_positional = any(p.kind == Parameter.VAR_POSITIONAL for p in sig.parameters.values())
+        accepts_kwargs = False
+        fields = {}
+        # Поля называются p0, p1..., а имя параметра задаётся alias'ом,
+        # чтобы параметры вроде `json` или `schema` не конфликтовали с атрибутами pydantic.BaseModel
+        for index, (name, param) in enumerate(sig.parameters.items()):
+            annotation = Any if param.annotation is Parameter.empty else param.annotation
+            field_name = f"p{index}"
+            if param.kind == Parameter.VAR_KEYWORD:
+                accepts_kwargs = True
+                self._var_keyword = name
+                continue
+            if param.kind == Parameter.VAR_POSITIONAL:
+                self._var_positional = name
+                fields[field_name] = (list[annotation], Field(default_factory=list, alias=name))
+            elif param.default is Parameter.empty:
+                fields[field_name] = (annotation, Field(alias=name))
+            else:
+                self._defaults.add(name)
+                fields[field_name] = (annotation, Field(default=param.default, alias=name))
+            self._fields[field_name] = name
+
+            if param.kind == Parameter.POSITIONAL_ONLY or (
+                    param.kind == Parameter.POSITIONAL_OR_KEYWORD and has_var_positional
+            ):
+                self._positional.append(name)
+
+        self._model = create_model(
+            f"{func.__name__}_args",
+            __config__=ConfigDict(
+                extra="allow" if accepts_kwargs else "forbid",
+                arbitrary_types_allowed=True,
+            ),
+            **fields,
+        )
+
+    def _format_error(self, error: ValidationError) -> str:
+        details = []
+        for item in error.errors():
+            location = ".".join(str(part) for part in item["loc"]) or "arguments"
+            details.append(f"{location}: {item['msg']} (got {item['input']!r})")
+        return f"Invalid arguments for {self.func_name}: " + "; ".join(details) + ". Fix the arguments and call the tool again."
+
+    def validate(self, args: dict) -> tuple[tuple, dict]:
+        """
+        Проверяет и приводит аргументы к типам из сигнатуры
+        :param args: аргументы, которые вернула модель
+        :return: (позиционные аргументы, именованные аргументы) для вызова функции
+        :raises ToolArgumentsError: если аргументы не подходят
+        """
+        args = {key: value for key, value in args.items() if not (value is None and key in self._defaults)}
+        # Схема genai описывает **kwargs как отдельный объект, а openai - как дополнительные поля верхнего уровня
+        if self._var_keyword and isinstance(args.get(self._var_keyword), dict):
+            nested_kwargs = args.pop(self._var_keyword)
+            args.update(nested_kwargs)
+        try:
+            validated = self._model.model_validate(args)
+        except ValidationError as e:
+            raise ToolArgumentsError(self._format_error(e)) from None
+
+        values = {name: getattr(validated, field) for field, name in self._fields.items()}
+        positional = [values.pop(name) for name in self._positional]
+        if self._var_positional:
+            positional.extend(values.pop(self._var_positional))
+        values.update(validated.model_extra or {})
+        return tuple(positional), values
+
+
+def get_args_validator(func: Callable) -> ArgsValidator:
+    """Возвращает валидатор, собранный при регистрации, или собирает его для незарегистрированной функции"""
+    validator = getattr(func, "args_validator", None)
+    if validator is None:
+        validator = ArgsValidator(func)
+        try:
+            func.args_validator = validator
+        except AttributeError:
+            pass
+    return validator
@@ -0,0 +1,80 @@
+import re
+import math
+from collections import Counter
+from inspect import signature
+from typing import Callable
+
+from docstring_parser import parse
+
+"""
+Поисковый индекс по инструментам (BM25).
+
+Когда инструментов сотни, их схемы занимают большую часть каждого запроса. Индекс строится при регистрации
+по имени функции, её описанию, именам и описаниям параметров, и позволяет отдать модели только те инструменты,
+которые относятся к текущему запросу (см. ToolsParser.select_tools).
+
+Морфология не учитывается, вместо неё слова длиннее STEM_LEN обрезаются до STEM_LEN символов:
+"конвертирует", "конвертация" и "конвертер" дают один и тот же токен.
+"""
+
+STEM_LEN = 6
+
+_word_pattern = re.compile(r"[^\W_]+")
+_camel_pattern = re.compile(r"(?<=[a-zа-яё])(?=[A-ZА-ЯЁ])")
+
+
+def tokenize(text: str) -> list[str]:
+    """Разбивает текст на токены: snake_case и camelCase делятся на слова, слова приводятся к нижнему регистру"""
+    text = _camel_pattern.sub(" ", text or "")
+    return [word.lower()[:STEM_LEN] for word in _word_pattern.findall(text)]
+
+
+def tool_document(tool: Callable) -> str:
+    """Собирает текст, по которому индексируется инструмент"""
+    docstring = parse(tool.__doc__ or "")
+    parts = [tool.__name__, docstring.description or ""]
+    for name in signature(tool).parameters:
+        parts.append(name)
+    for param in docstring.params:
+        parts.append(param.description or "")
+    return " ".join(parts)
+
+
+class ToolIndex:
+    """Инвертированный индекс BM25 по инструментам. Документы добавляются по одному при регистрации."""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._tools: list[Callable] = []
+        self._lengths: list[int] = []
+        self._postings: dict[str, list[tuple[int, int]]] = {}  # токен -> [(номер документа, частота)]
+
+    def add(self, tool: Callable) -> None:
+        tokens = tokenize(tool_document(tool))
+        doc_id = len(self._tools)
+        self._tools.append(tool)
+        self._lengths.append(len(tokens))
+        for token, frequency in Counter(tokens).items():
+            self._postings.setdefault(token, []).append((doc_id, frequency))
+
+    def search(self, query: str, k: int) -> list[tuple[Callable, float]]:
+        """
+        Возвращает до k инструментов с наибольшей релевантностью запросу (только с ненулевой оценкой)
+        :return: [(функция, оценка)] в порядке убывания оценки
+        """
+        if not self._tools:
+            return []
+        doc_count = len(self._tools)
+        avg_length = sum(self._lengths) / doc_count or 1
+        scores: dict[int, float] = {}
+        for token in set(tokenize(query)):
+            postings = self._postings.get(token)
+            if not postings:
+                continue
+            idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, frequency in postings:
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[doc_id] / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self._tools[doc_id], score) for doc_id, score in best]
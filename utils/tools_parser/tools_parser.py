@@ -1,7 +1,19 @@
+import inspect
+import dataclasses
+from enum import Enum
 from inspect import signature, Parameter
-from typing import get_origin, get_args
+from types import UnionType
+from typing import get_origin, get_args, get_type_hints, Literal, Union, Annotated, Any, TYPE_CHECKING
 from docstring_parser import parse
-from google.genai import types
+from pydantic import BaseModel as PydanticBaseModel
+
+import utils.types as t
+from utils.tracing import tracer
+from .args_validator import ArgsValidator
+from .tool_index import ToolIndex
+
+if TYPE_CHECKING:
+    from google.genai import types
 
 """
 В этом файле находится парсер функций, который превращает их в описание для моделей openai и genai. 
@@ -13,6 +25,8 @@ from google.genai import types
 
 class ToolsParser:
     _registry = []
+    _index = ToolIndex()  # BM25-индекс для select_tools, пополняется при регистрации
+    _schema_cache = {}  # Схемы отдельных инструментов, они не меняются после регистрации
 
     @classmethod
     def get_tools(cls) -> list:
@@ -21,18 +35,65 @@ class ToolsParser:
 
     @classmethod
     def register_tool(cls, func):
-        cls._registry.append(func)
+        if func not in cls._registry:
+            cls._registry.append(func)
+            cls._index.add(func)
 
     @classmethod
     def get_tools_callables(cls):
         """Возвращает словарь функций, которые можно вызвать"""
         return {tool.__name__: tool for tool in cls.get_tools()}
 
+    @staticmethod
+    def _unwrap_annotation(annotation):
+        """Снимает Annotated[X, ...] и возвращает X"""
+        while get_origin(annotation) is Annotated:
+            annotation = get_args(annotation)[0]
+        return annotation
+
+    @staticmethod
+    def _literal_values(annotation) -> list | None:
+        """Возвращает список допустимых значений для Literal и Enum, иначе None"""
+        if get_origin(annotation) is Literal:
+            return [value.value if isinstance(value, Enum) else value for value in get_args(annotation)]
+        if isinstance(annotation, type) and issubclass(annotation, Enum):
+            return [member.value for member in annotation]
+        return None
+
+    @staticmethod
+    def _object_fields(annotation) -> list[tuple[str, object, bool, str | None]] | None:
+        """
+        Для dataclass и pydantic-моделей возвращает список полей (имя, аннотация, обязательное, описание),
+        для остальных типов - None
+        """
+        if isinstance(annotation, type) and issubclass(annotation, PydanticBaseModel):
+            return [
+                (field.alias or name, field.annotation, field.is_required(), field.description)
+                for name, field in annotation.model_fields.items()
+            ]
+        if isinstance(annotation, type) and dataclasses.is_dataclass(annotation):
+            hints = get_type_hints(annotation)
+            return [
+                (
+                    field.name,
+                    hints.get(field.name, field.type),
+                    field.default is dataclasses.MISSING and field.default_factory is dataclasses.MISSING,
+                    None,
+                )
+                for field in dataclasses.fields(annotation)
+            ]
+        return None
+
     @classmethod
-    def _get_annotation_schema_openai(cls, annotation):
-        """Рекурсивно преобразует аннотацию типа в часть JSON-схемы"""
-        if annotation == Parameter.empty:
+    def _get_annotation_schema_openai(cls, annotation, strict_mode=False, _seen=()):
+        """Рекурсивно преобразует аннотацию типа в часть JSON-схемы
+
+        Поддерживаются примитивы, list/tuple/set, dict[str, X], Optional/Union, Literal, Enum, dataclass и pydantic-модели.
+        В strict_mode вложенные объекты получают additionalProperties: false и все поля в required (требование OpenAI).
+        """
+        if annotation == Parameter.empty or annotation is Any:
             return {"type": "string"}
+        annotation = cls._unwrap_annotation(annotation)
 
         origin = get_origin(annotation)
         args = get_args(annotation)
@@ -43,10 +104,51 @@ class ToolsParser:
             bool: "boolean",
             str: "string",
             list: "array",
+            tuple: "array",
+            set: "array",
             dict: "object",
             type(None): "null",
+            None: "null",
         }
 
+        # Перечисления: Literal[...] и Enum
+        values = cls._literal_values(annotation)
+        if values is not None:
+            schema = {"enum": values}
+            value_types = {types_mapping_openai.get(type(value)) for value in values}
+            if len(value_types) == 1 and None not in value_types:
+                schema["type"] = value_types.pop()
+            return schema
+
+        # Optional[X], X | Y, Union[X, Y]
+        if origin is Union or origin is UnionType:
+            variants = [cls._get_annotation_schema_openai(arg, strict_mode, _seen) for arg in args]
+            simple_types = [variant.get("type") for variant in variants if set(variant) == {"type"}]
+            if len(simple_types) == len(variants) and all(isinstance(x, str) for x in simple_types):
+                return {"type": simple_types}
+            return {"anyOf": variants}
+
+        # dataclass и pydantic-модели
+        fields = cls._object_fields(annotation)
+        if fields is not None:
+            if annotation in _seen:  # Рекурсивная структура
+                return {"type": "object"}
+            properties = {}
+            required = []
+            for name, field_annotation, is_required, description in fields:
+                field_schema = cls._get_annotation_schema_openai(field_annotation, strict_mode, _seen + (annotation,))
+                if description:
+                    field_schema["description"] = description
+                properties[name] = field_schema
+                if is_required or strict_mode:
+                    required.append(name)
+            return {
+                "type": "object",
+                "properties": properties,
+                "required": required,
+                "additionalProperties": False,
+            }
+
         # Если это простой тип (не Generic)
         if origin is None:
             # Проверяем, есть ли тип в маппинге
@@ -55,18 +157,52 @@ class ToolsParser:
             return {"type": schema_type}
 
         # Если это Generic
-        if origin is list:
-            item_schema = cls._get_annotation_schema_openai(args[0]) if args else {}
+        if origin in (list, set, frozenset, tuple):
+            if origin is tuple and args and args[-1] is not Ellipsis:
+                item_schemas = [cls._get_annotation_schema_openai(arg, strict_mode, _seen) for arg in args]
+                item_schema = item_schemas[0] if len(set(map(str, item_schemas))) == 1 else {"anyOf": item_schemas}
+                return {"type": "array", "items": item_schema, "minItems": len(args), "maxItems": len(args)}
+            item_schema = cls._get_annotation_schema_openai(args[0], strict_mode, _seen) if args else {}
             return {"type": "array", "items": item_schema}
 
+        if origin is dict:
+            schema = {"type": "object"}
+            if len(args) == 2:
+                schema["additionalProperties"] = cls._get_annotation_schema_openai(args[1], strict_mode, _seen)
+            return schema
+
         # Обработка других generics при необходимости
         return {"type": "object"}
 
+    @staticmethod
+    def _make_nullable_openai(schema: dict) -> dict:
+        """Разрешает значение null в JSON-схеме (для необязательных параметров в strict_mode)"""
+        if "anyOf" in schema:
+            if {"type": "null"} not in schema["anyOf"]:
+                schema["anyOf"].append({"type": "null"})
+            return schema
+        if "enum" in schema and None not in schema["enum"]:
+            schema["enum"] = schema["enum"] + [None]
+        current_type = schema.get("type")
+        if isinstance(current_type, list):
+            if "null" not in current_type:
+                schema["type"] = current_type + ["null"]
+        elif current_type:
+            schema["type"] = [current_type, "null"]
+        return schema
+
     @classmethod
-    def _get_annotation_type_genai(cls, annotation):
-        """Рекурсивно преобразует аннотацию типа в types.Type"""
-        if annotation == Parameter.empty:
-            return types.Type.STRING
+    def _get_annotation_schema_genai(cls, annotation, _seen=()) -> "types.Schema":
+        """Рекурсивно преобразует аннотацию типа в types.Schema
+
+        Поддерживает те же типы, что и _get_annotation_schema_openai. Optional передаётся через nullable,
+        остальные Union - через any_of. Gemini принимает enum только для строк, поэтому у Literal/Enum
+        с нестроковыми значениями перечисление попадает в описание.
+        """
+        from google.genai import types  # SDK загружается только при работе с genai-моделями
+        if annotation == Parameter.empty or annotation is Any:
+            return types.Schema(type=types.Type.STRING)
+        annotation = cls._unwrap_annotation(annotation)
 
         origin = get_origin(annotation)
         args = get_args(annotation)
@@ -77,23 +213,86 @@ class ToolsParser:
             bool: types.Type.BOOLEAN,
             str: types.Type.STRING,
             list: types.Type.ARRAY,
+            tuple: types.Type.ARRAY,
+            set: types.Type.ARRAY,
             dict: types.Type.OBJECT,
             type(None): types.Type.NULL,
+            None: types.Type.NULL,
         }
 
+        values = cls._literal_values(annotation)
+        if values is not None:
+            if all(isinstance(value, str) for value in values):
+                return types.Schema(type=types.Type.STRING, enum=values, format="enum")
+            value_types = {types_mapping_genai.get(type(value)) for value in values}
+            schema_type = value_types.pop() if len(value_types) == 1 else types.Type.STRING
+            return types.Schema(type=schema_type, description=f"One of: {', '.join(map(repr, values))}.")
+
+        if origin is Union or origin is UnionType:
+            non_null = [arg for arg in args if arg is not type(None)]
+            if len(non_null) == 1:
+                schema = cls._get_annotation_schema_genai(non_null[0], _seen)
+            else:
+                schema = types.Schema(any_of=[cls._get_annotation_schema_genai(arg, _seen) for arg in non_null])
+            if len(non_null) != len(args):
+                schema.nullable = True
+            return schema
+
+        fields = cls._object_fields(annotation)
+        if fields is not None:
+            if annotation in _seen:
+                return types.Schema(type=types.Type.OBJECT)
+            properties = {}
+            required = []
+            for name, field_annotation, is_required, description in fields:
+                field_schema = cls._get_annotation_schema_genai(field_annotation, _seen + (annotation,))
+                if description:
+                    field_schema.description = description
+                properties[name] = field_schema
+                if is_required:
+                    required.append(name)
+            return types.Schema(
+                type=types.Type.OBJECT,
+                properties=properties,
+                required=required,
+                property_ordering=list(properties),
+            )
+
         if origin is None:
-            return types_mapping_genai.get(annotation, types.Type.STRING)
+            return types.Schema(type=types_mapping_genai.get(annotation, types.Type.STRING))
+
+        if origin in (list, set, frozenset, tuple):
+            if origin is tuple and args and args[-1] is not Ellipsis:
+                item_schemas = [cls._get_annotation_schema_genai(arg, _seen) for arg in args]
+                distinct = {schema.model_dump_json() for schema in item_schemas}
+                item_schema = item_schemas[0] if len(distinct) == 1 else types.Schema(any_of=item_schemas)
+                return types.Schema(type=types.Type.ARRAY, items=item_schema, min_items=len(args), max_items=len(args))
+            item_schema = cls._get_annotation_schema_genai(args[0], _seen) if args else types.Schema(type=types.Type.STRING)
+            return types.Schema(type=types.Type.ARRAY, items=item_schema)
+
+        if origin is dict:
+            schema = types.Schema(type=types.Type.OBJECT)
+            if len(args) == 2:
+                schema.additional_properties = cls._get_annotation_schema_genai(args[1], _seen).model_dump(
+                    mode="json", exclude_none=True
+                )
+            return schema
 
-        if origin is list:
-            item_type = (
-                cls._get_annotation_type_genai(args[0]) if args else types.Type.STRING
-            )
-            return item_type
+        return types.Schema(type=types.Type.OBJECT)
 
-        return types.Type.OBJECT
+    @staticmethod
+    def _json_default(value):
+        """Приводит значение по умолчанию к JSON-совместимому виду"""
+        if isinstance(value, Enum):
+            return value.value
+        if isinstance(value, PydanticBaseModel):
+            return value.model_dump(mode="json")
+        if dataclasses.is_dataclass(value) and not isinstance(value, type):
+            return dataclasses.asdict(value)
+        return value
 
     @classmethod
-    def get_json_schema_openai(cls, strict_mode=True, ignore_kwarg_funcs=False):
+    def get_json_schema_openai(cls, strict_mode=True, ignore_kwarg_funcs=False, tools=None):
         """Возвращает JSON Schema для openai-совместимых моделей
 
         additionalProperties: false — это правило: "Нельзя иметь лишние поля"
@@ -108,163 +307,264 @@ class ToolsParser:
 
         Сейчас значение strict_mode едино для всех функций, хотя его передают с каждой функцией отдельно.
         В strict_mode, если параметр необязательный (имеет значение по умолчанию), он обозначается как обязательный, но с возможностью использовать значение по умолчанию (если модель вернёт 'null' в качестве значения)
+
+        :param tools: подмножество инструментов (например, из select_tools). По умолчанию - все зарегистрированные
         """
         res = []
-        for tool in cls.get_tools():
-            ignore_this_function = False
-            function_json = {}
-            docstring = parse(tool.__doc__)
-            sig = signature(tool)
-            additional_properties = False
-
-            # Заполняем JSON параметров
-            function_properties = {}
-            required_properties = []
-            for index, (name, param) in enumerate(sig.parameters.items()):
-                try:
-                    param_description = docstring.params[index].description
-                except IndexError:
-                    param_description = "No description."
-
-                if param.default != Parameter.empty:
+        with tracer.span("tools_parser.schema", provider="openai") as span:
+            for tool in cls.get_tools() if tools is None else tools:
+                key = ("openai", tool, strict_mode, ignore_kwarg_funcs)
+                if key not in cls._schema_cache:
+                    cls._schema_cache[key] = cls._tool_schema_openai(tool, strict_mode, ignore_kwarg_funcs)
+                if cls._schema_cache[key] is not None:
+                    res.append(cls._schema_cache[key])
+            span.set(tools=len(res))
+        return res
+
+    @classmethod
+    def _tool_schema_openai(cls, tool, strict_mode, ignore_kwarg_funcs) -> dict | None:
+        """Собирает JSON Schema одного инструмента. None - функцию нужно пропустить (см. ignore_kwarg_funcs)"""
+        ignore_this_function = False
+        function_json = {}
+        docstring = parse(tool.__doc__)
+        sig = signature(tool)
+        additional_properties = False
+
+        # Заполняем JSON параметров
+        function_properties = {}
+        required_properties = []
+        for index, (name, param) in enumerate(sig.parameters.items()):
+            try:
+                param_description = docstring.params[index].description
+            except IndexError:
+                param_description = "No description."
+
+            if param.default != Parameter.empty:
+                param_description += (
+                    f" (System: Optional. Default value: {param.default}"
+                )
+                if strict_mode:  # Отдельная обработка для strict_mode
                     param_description += (
-                        f" (System: Optional. Default value: {param.default}"
+                        " Pass null if you want to use default value."
                     )
-                    if strict_mode:  # Отдельная обработка для strict_mode
-                        param_description += (
-                            " Pass null if you want to use default value."
-                        )
-                    param_description += ")."
+                param_description += ")."
+            if (
+                param.kind in (Parameter.POSITIONAL_OR_KEYWORD, Parameter.KEYWORD_ONLY)
+            ):  # Обрабатываем обычные аргументы
                 if param.default == Parameter.empty or strict_mode:
                     required_properties.append(name)
 
-                if (
-                    param.kind == Parameter.POSITIONAL_OR_KEYWORD
-                ):  # Обрабатываем обычные аргументы
-                    schema_part = cls._get_annotation_schema_openai(param.annotation)
-
-                    if param.default != Parameter.empty and strict_mode:
-                        # Если strict_mode и есть дефолтное значение, разрешаем null
-                        current_type = schema_part.get("type")
-                        if isinstance(current_type, list):
-                            if "null" not in current_type:
-                                schema_part["type"] = current_type + ["null"]
-                        else:
-                            schema_part["type"] = [current_type, "null"]
-
-                    schema_part["description"] = param_description
-                    function_properties[name] = schema_part
-
-                elif param.kind == Parameter.VAR_POSITIONAL:  # Обрабатываем *args
-                    # args - это всегда список, элементы которого имеют тип param.annotation
-                    # Например, если *args: int, то args это [int, int, ...]
-                    # Если *args: list[int], то args это [[int], [int], ...]
-
-                    item_schema = cls._get_annotation_schema_openai(param.annotation)
-
-                    function_properties[name] = {
-                        "type": "array",
-                        "items": item_schema,
-                        "description": param_description
-                        + " (System: this variable is an array of positional arguments (*args)).",
-                    }
-                elif param.kind == Parameter.VAR_KEYWORD:  # Обрабатываем **kwargs
-                    if strict_mode:
-                        if not ignore_kwarg_funcs:
-                            raise ValueError(
-                                f"Функция {tool.__name__} имеет параметр **kwargs, который не разрешен в строгом режиме"
-                            )
-                        else:
-                            ignore_this_function = True
-                            break
-                    additional_properties = True
-                    # Не добавляем здесь никакого объекта, в который будут класться **kwargs, модель просто предоставит их в генерации
-
-            if ignore_this_function:
-                continue
-
-            function_json["name"] = tool.__name__
-            function_json["description"] = docstring.description
-            function_json["strict"] = strict_mode
-            function_json["parameters"] = {
-                "type": "object",
-                "properties": function_properties,
-                "required": required_properties,
-                "additionalProperties": additional_properties,
-            }
-            res.append({"type": "function", "function": function_json})
-        return res
+                schema_part = cls._get_annotation_schema_openai(param.annotation, strict_mode)
 
-    @classmethod
-    def get_types_schema_genai(cls):
-        """Собирает типизированную схему представления инструментов для genai-совместимых моделей"""
-        res = []
+                if param.default != Parameter.empty and strict_mode:
+                    # Если strict_mode и есть дефолтное значение, разрешаем null
+                    schema_part = cls._make_nullable_openai(schema_part)
 
-        for tool in cls.get_tools():
-            docstring = parse(tool.__doc__)
-            sig = signature(tool)
+                schema_part["description"] = param_description
+                function_properties[name] = schema_part
 
-            function_properties = {}
-            required_properties = []
-            for index, (name, param) in enumerate(sig.parameters.items()):
-                try:
-                    param_description = docstring.params[index].description
-                except IndexError:
-                    param_description = "No description."
+            elif param.kind == Parameter.VAR_POSITIONAL:  # Обрабатываем *args
+                # args - это всегда список, элементы которого имеют тип param.annotation
+                # Например, если *args: int, то args это [int, int, ...]
+                # Если *args: list[int], то args это [[int], [int], ...]
 
-                if param.default == Parameter.empty:
+                item_schema = cls._get_annotation_schema_openai(param.annotation, strict_mode)
+                if strict_mode:
                     required_properties.append(name)
 
-                param_type = cls._get_annotation_type_genai(
-                    param.annotation
-                )  # Либо тип самой переменной, либо тип переменных, содержащихся в массиве (Максимальная поддерживаемая вложенность list[int], более глубокая вложенность list[list[int]] будет сведена к list[int])
-
-                param_schema = types.Schema(
-                    description=param_description, type=param_type
-                )
-
-                if param.default != Parameter.empty:
-                    param_schema.default = param.default
+                function_properties[name] = {
+                    "type": "array",
+                    "items": item_schema,
+                    "description": param_description
+                    + " (System: this variable is an array of positional arguments (*args)).",
+                }
+            elif param.kind == Parameter.VAR_KEYWORD:  # Обрабатываем **kwargs
+                if strict_mode:
+                    if not ignore_kwarg_funcs:
+                        raise ValueError(
+                            f"Функция {tool.__name__} имеет параметр **kwargs, который не разрешен в строгом режиме"
+                        )
+                    else:
+                        ignore_this_function = True
+                        break
+                additional_properties = True
+                # Не добавляем здесь никакого объекта, в который будут класться **kwargs, модель просто предоставит их в генерации
+
+        if ignore_this_function:
+            return None
+
+        function_json["name"] = tool.__name__
+        function_json["description"] = docstring.description
+        function_json["strict"] = strict_mode
+        function_json["parameters"] = {
+            "type": "object",
+            "properties": function_properties,
+            "required": required_properties,
+            "additionalProperties": additional_properties,
+        }
+        return {"type": "function", "function": function_json}
 
-                if get_origin(param.annotation) is list:
-                    param_schema.type = types.Type.ARRAY
-                    param_schema.items = types.Schema(type=param_type)
+    @classmethod
+    def get_types_schema_genai(cls, tools=None):
+        """Собирает типизированную схему представления инструментов для genai-совместимых моделей
 
-                if param.kind == Parameter.VAR_POSITIONAL:
-                    param_schema.description += " (System: this variable is an array of positional arguments (*args))."
-                    param_schema.type = types.Type.ARRAY
-                    param_schema.items = types.Schema(type=param_type)
-                if param.kind == Parameter.VAR_KEYWORD:
-                    param_schema.description += " (System: this variable is a dictionary of keyword arguments (**kwargs))."
-                    param_schema.type = types.Type.OBJECT
+        :param tools: подмножество инструментов (например, из select_tools). По умолчанию - все зарегистрированные
+        """
+        from google.genai import types
 
-                function_properties[name] = param_schema
+        res = []
 
-            # Собираем вместе
-            parameters_schema = types.Schema(
-                type=types.Type.OBJECT,
-                properties=function_properties,
-                required=required_properties,
-            )
-            res.append(
-                types.FunctionDeclaration(
-                    name=tool.__name__,
-                    description=docstring.description,
-                    parameters=parameters_schema,
-                )
-            )
+        with tracer.span("tools_parser.schema", provider="genai") as span:
+            for tool in cls.get_tools() if tools is None else tools:
+                key = ("genai", tool)
+                if key not in cls._schema_cache:
+                    cls._schema_cache[key] = cls._tool_declaration_genai(tool)
+                res.append(cls._schema_cache[key])
+            span.set(tools=len(res))
 
         res = [types.Tool(function_declarations=res)]
 
         return res
 
+    @classmethod
+    def _tool_declaration_genai(cls, tool) -> "types.FunctionDeclaration":
+        """Собирает FunctionDeclaration одного инструмента"""
+        from google.genai import types
+
+        docstring = parse(tool.__doc__)
+        sig = signature(tool)
+
+        function_properties = {}
+        required_properties = []
+        for index, (name, param) in enumerate(sig.parameters.items()):
+            try:
+                param_description = docstring.params[index].description
+            except IndexError:
+                param_description = "No description."
+
+            if param.default == Parameter.empty and param.kind not in (
+                    Parameter.VAR_POSITIONAL, Parameter.VAR_KEYWORD
+            ):
+                required_properties.append(name)
+
+            param_schema = cls._get_annotation_schema_genai(param.annotation)
+
+            if param.kind == Parameter.VAR_POSITIONAL:
+                param_schema = types.Schema(type=types.Type.ARRAY, items=param_schema)
+                param_description += " (System: this variable is an array of positional arguments (*args))."
+            elif param.kind == Parameter.VAR_KEYWORD:
+                param_schema = types.Schema(
+                    type=types.Type.OBJECT,
+                    additional_properties=param_schema.model_dump(mode="json", exclude_none=True),
+                )
+                param_description += " (System: this variable is a dictionary of keyword arguments (**kwargs))."
+
+            # Описание из docstring дополняет описание, полученное из типа (например, значения Literal)
+            if param_schema.description:
+                param_description += f" {param_schema.description}"
+            param_schema.description = param_description
+            if param.default != Parameter.empty:
+                param_schema.default = cls._json_default(param.default)
+
+            function_properties[name] = param_schema
+
+        # Собираем вместе
+        parameters_schema = types.Schema(
+            type=types.Type.OBJECT,
+            properties=function_properties,
+            required=required_properties,
+        )
+        return types.FunctionDeclaration(
+            name=tool.__name__,
+            description=docstring.description,
+            parameters=parameters_schema,
+        )
+
+    @classmethod
+    def select_tools(cls, history: t.ChatData, k: int = 10) -> list:
+        """
+        Выбирает инструменты, относящиеся к текущему запросу, чтобы не отправлять схемы всех инструментов.
+
+        Запрос - текст последнего сообщения пользователя и ответов ассистента после него.
+        Инструменты, которые уже вызывались в текущем цикле ReAct (после последнего сообщения пользователя),
+        добавляются всегда, как и read_tool_result, если какой-то результат в цикле был усечён.
+
+        Набор инструментов меняется от хода к ходу вместе с запросом, поэтому префикс запроса со схемами
+        перестаёт быть побайтово стабильным и кэш префикса у провайдера не срабатывает. Если попадания в кэш
+        важнее размера запроса, передавайте фиксированный tools_definition (например, в ReactScheduler).
+        Результат передаётся в get_json_schema_openai(tools=...) или get_types_schema_genai(tools=...)
+        :param history: история в УФС
+        :param k: сколько инструментов выбирать по релевантности (без учёта закреплённых)
+        :return: список функций в порядке регистрации
+        """
+        registry = cls.get_tools()
+        if len(registry) <= k:
+            return list(registry)
+
+        last_user_index = max(
+            (index for index, message in enumerate(history.messages) if message.role == "user"), default=0
+        )
+        query_parts = []
+        pinned_names = set()
+        for message in history.messages[last_user_index:]:
+            for content in message.content:
+                if content.type == "text":
+                    query_parts.append(content.text)
+                elif content.type == "tool_call":
+                    pinned_names.add(content.tool_call.name)
+                elif content.type == "tool_result" and content.tool_result.overflow_asset:
+                    pinned_names.add("read_tool_result")
+
+        with tracer.span("tools_parser.select_tools", registered=len(registry)) as span:
+            selected = {tool for tool, _ in cls._index.search(" ".join(query_parts), k)}
+            selected.update(tool for tool in registry if tool.__name__ in pinned_names)
+            span.set(selected=len(selected))
+        return [tool for tool in registry if tool in selected]
+
 
 # Декоратор для регистрации инструментов. Добавляет в пул сами объекты
-def register_tool(func=None, *, returns_media: bool = False, mime_type: str | None = None):
+def register_tool(
+        func=None,
+        *,
+        returns_media: bool = False,
+        mime_type: str | None = None,
+        max_inline_chars: int | None = None,
+        result_format: Literal["json", "str"] = "json",
+        spill_to_asset: bool = True,
+        executor: Literal["inline", "process"] = "inline",
+        pure: bool = False,
+):
+    """
+    Регистрирует функцию как инструмент. Функция может быть корутиной (async def): в agenerate она ожидается
+    напрямую, а в синхронном generate выполняется в общем фоновом event loop.
+
+    :param returns_media: функция возвращает медиафайл (см. utils.tool_runner.unpack_media_result)
+    :param mime_type: MIME тип возвращаемого медиафайла, если он известен заранее
+    :param max_inline_chars: максимальная длина результата, которая попадёт в историю. None - без ограничений
+    :param result_format: "json" - компактный JSON для не-строковых результатов, "str" - str(result)
+    :param spill_to_asset: сохранять ли полный результат, не поместившийся в max_inline_chars, в ассет.
+        Модель сможет дочитать его встроенным инструментом read_tool_result
+    :param executor: "inline" - выполнять в вызывающем потоке, "process" - в пуле процессов
+        (для CPU-тяжёлых функций; функция должна быть объявлена на верхнем уровне модуля)
+    :param pure: результат зависит только от аргументов и вызов не имеет побочных эффектов. Одинаковые
+        одновременные вызовы такой функции (в том числе из разных чатов) выполняются один раз
+    """
     def decorator(f):
+        if executor == "process" and inspect.iscoroutinefunction(f):
+            raise ValueError(f"Асинхронная функция {f.__name__} не может выполняться в пуле процессов")
         f.returns_media = returns_media
         f.mime_type = mime_type
+        f.max_inline_chars = max_inline_chars
+        f.result_format = result_format
+        f.spill_to_asset = spill_to_asset
+        f.executor = executor
+        f.pure = pure
+        f.args_validator = ArgsValidator(f)
         ToolsParser.register_tool(f)
+        if max_inline_chars is not None and spill_to_asset:
+            from utils.tool_runner import read_tool_result
+            if read_tool_result not in ToolsParser.get_tools():
+                register_tool(read_tool_result)
         return f
     if func is None:
         return decorator
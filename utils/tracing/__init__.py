@@ -0,0 +1,2 @@
+from .tracing import Span, TraceHook, Tracer, tracer
+from .hooks import LoggingHook, OpenTelemetryHook, HistogramCollector
@@ -0,0 +1,128 @@
+import bisect
+import logging
+import threading
+
+from .tracing import Span, TraceHook
+
+try:
+    from opentelemetry import trace as otel_trace, context as otel_context
+except ImportError:  # OpenTelemetry - необязательная зависимость
+    otel_trace = None
+    otel_context = None
+
+"""
+Готовые хуки для tracer: логирование, OpenTelemetry и сбор гистограмм в памяти.
+"""
+
+
+class LoggingHook(TraceHook):
+    """Пишет каждый законченный спан одной строкой в logging."""
+
+    def __init__(self, logger: logging.Logger | None = None, level: int = logging.DEBUG):
+        self.logger = logger or logging.getLogger("ai_chat.tracing")
+        self.level = level
+
+    def on_end(self, span: Span) -> None:
+        if not self.logger.isEnabledFor(self.level):
+            return
+        attributes = " ".join(f"{key}={value}" for key, value in span.attributes.items())
+        status = f" error={type(span.error).__name__}" if span.error else ""
+        self.logger.log(self.level, "%s %.1fms %s%s", span.name, span.duration_ms, attributes, status)
+
+
+class OpenTelemetryHook(TraceHook):
+    """
+    Передаёт спаны в OpenTelemetry (нужен пакет opentelemetry-api и настроенный TracerProvider).
+    Спаны вкладываются в текущий контекст OpenTelemetry, поэтому видны внутри трассировки веб-запроса.
+    """
+
+    def __init__(self, otel_tracer=None):
+        if otel_trace is None:
+            raise ImportError("Для OpenTelemetryHook установите пакет opentelemetry-api")
+        self.otel_tracer = otel_tracer or otel_trace.get_tracer("ai_chat")
+
+    def on_start(self, span: Span) -> None:
+        otel_span = self.otel_tracer.start_span(span.name)
+        span.hook_data["otel_span"] = otel_span
+        span.hook_data["otel_token"] = otel_context.attach(otel_trace.set_span_in_context(otel_span))
+
+    def on_end(self, span: Span) -> None:
+        otel_span = span.hook_data.pop("otel_span", None)
+        if otel_span is None:
+            return
+        for key, value in span.attributes.items():
+            if isinstance(value, (str, bool, int, float)):
+                otel_span.set_attribute(key, value)
+        if span.error:
+            otel_span.record_exception(span.error)
+            otel_span.set_status(otel_trace.Status(otel_trace.StatusCode.ERROR, str(span.error)))
+        otel_span.end()
+        otel_context.detach(span.hook_data.pop("otel_token"))
+
+
+class HistogramCollector(TraceHook):
+    """
+    Копит в памяти гистограммы длительностей по именам спанов и суммы числовых атрибутов
+    (байты, токены). Границы корзин в миллисекундах растут примерно вдвое.
+    """
+
+    DEFAULT_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000)
+
+    def __init__(self, bounds_ms: tuple[float, ...] = DEFAULT_BOUNDS_MS):
+        self.bounds_ms = tuple(bounds_ms)
+        self._lock = threading.Lock()
+        self._stats: dict[str, dict] = {}
+
+    def on_end(self, span: Span) -> None:
+        duration = span.duration_ms
+        with self._lock:
+            stats = self._stats.get(span.name)
+            if stats is None:
+                stats = self._stats[span.name] = {
+                    "count": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0,
+                    "buckets": [0] * (len(self.bounds_ms) + 1), "sums": {},
+                }
+            stats["count"] += 1
+            stats["errors"] += span.error is not None
+            stats["total_ms"] += duration
+            stats["max_ms"] = max(stats["max_ms"], duration)
+            stats["buckets"][bisect.bisect_left(self.bounds_ms, duration)] += 1
+            for key, value in span.attributes.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    stats["sums"][key] = stats["sums"].get(key, 0) + value
+
+    def _percentile(self, stats: dict, q: float) -> float:
+        """Верхняя граница корзины, в которую попадает q-й перцентиль (не больше максимума)"""
+        rank = q * stats["count"]
+        seen = 0
+        for index, bucket_count in enumerate(stats["buckets"]):
+            seen += bucket_count
+            if seen >= rank:
+                break
+        bound = self.bounds_ms[index] if index < len(self.bounds_ms) else stats["max_ms"]
+        return min(bound, stats["max_ms"])
+
+    def summary(self) -> dict[str, dict]:
+        """
+        Сводка по каждому имени спана
+        :return: {имя: {count, errors, avg_ms, p50_ms, p95_ms, p99_ms, max_ms, sums}}
+        """
+        with self._lock:
+            result = {}
+            for name, stats in self._stats.items():
+                count = stats["count"]
+                result[name] = {
+                    "count": count,
+                    "errors": stats["errors"],
+                    "avg_ms": stats["total_ms"] / count,
+                    "p50_ms": self._percentile(stats, 0.5),
+                    "p95_ms": self._percentile(stats, 0.95),
+                    "p99_ms": self._percentile(stats, 0.99),
+                    "max_ms": stats["max_ms"],
+                    "sums": dict(stats["sums"]),
+                }
+            return result
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
@@ -0,0 +1,133 @@
+import time
+import contextvars
+from typing import Any
+
+"""
+Лёгкие спаны для профилирования конвейера generate.
+
+Каждая фаза хода (конвертация истории, загрузка ассетов, запрос, разбор ответа, инструменты, запись медиа,
+сборка схем инструментов) оборачивается в tracer.span(...). Пока не подключено ни одного хука, span возвращает
+общий пустой объект, и накладные расходы сводятся к одной проверке. Поэтому атрибуты, которые дорого считать,
+вычисляются только при span.recording.
+
+Хуки получают законченные спаны (и начало спана, если им это нужно): LoggingHook пишет в logging,
+OpenTelemetryHook передаёт спаны в OpenTelemetry, HistogramCollector копит распределения длительностей в памяти.
+
+Пример:
+    from utils.tracing import tracer, HistogramCollector
+    collector = HistogramCollector()
+    tracer.add_hook(collector)
+    ...
+    print(collector.summary())
+"""
+
+
+class Span:
+    """Один замер. Атрибуты - числа и строки (байты, токены, имя модели...)."""
+
+    recording = True
+
+    __slots__ = ("name", "attributes", "parent", "start_time", "end_time", "error", "hook_data", "_token")
+
+    def __init__(self, name: str, attributes: dict[str, Any], parent: "Span | None"):
+        self.name = name
+        self.attributes = attributes
+        self.parent = parent
+        self.start_time = 0.0
+        self.end_time = 0.0
+        self.error: BaseException | None = None
+        self.hook_data: dict = {}  # Хуки хранят здесь своё состояние (например, спан OpenTelemetry)
+        self._token = None
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_time - self.start_time) * 1000
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+
+class _NoopSpan:
+    """Спан, который ничего не делает. Возвращается, когда трассировка выключена"""
+
+    recording = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attributes) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+_current_span: contextvars.ContextVar[Span | None] = contextvars.ContextVar("current_span", default=None)
+
+
+class TraceHook:
+    """Получатель спанов. Наследники переопределяют нужные методы"""
+
+    def on_start(self, span: Span) -> None:
+        pass
+
+    def on_end(self, span: Span) -> None:
+        pass
+
+
+class _ActiveSpan:
+    """Контекстный менеджер записываемого спана"""
+
+    __slots__ = ("_tracer", "_span")
+
+    def __init__(self, tracer: "Tracer", span: Span):
+        self._tracer = tracer
+        self._span = span
+
+    def __enter__(self) -> Span:
+        span = self._span
+        span._token = _current_span.set(span)
+        for hook in self._tracer.hooks:
+            hook.on_start(span)
+        span.start_time = time.perf_counter()
+        return span
+
+    def __exit__(self, exc_type, exc, tb):
+        span = self._span
+        span.end_time = time.perf_counter()
+        span.error = exc
+        _current_span.reset(span._token)
+        for hook in self._tracer.hooks:
+            hook.on_end(span)
+        return False
+
+
+class Tracer:
+    """Точка подключения хуков. Используется глобальный экземпляр tracer"""
+
+    def __init__(self):
+        self.hooks: tuple[TraceHook, ...] = ()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.hooks)
+
+    def add_hook(self, hook: TraceHook) -> None:
+        self.hooks = (*self.hooks, hook)
+
+    def remove_hook(self, hook: TraceHook) -> None:
+        self.hooks = tuple(h for h in self.hooks if h is not hook)
+
+    def span(self, name: str, **attributes):
+        """
+        Открывает спан: with tracer.span("model.request", model=...) as span: ...
+        Вложенные спаны получают родителя из контекста (в том числе через asyncio и asyncio.to_thread)
+        """
+        if not self.hooks:
+            return _NOOP_SPAN
+        return _ActiveSpan(self, Span(name, attributes, _current_span.get()))
+
+
+tracer = Tracer()
@@ -7,7 +7,7 @@ Pydantic-модели для хранения истории чата в уни
 
 from typing import Optional, Literal, Any
 from datetime import datetime
-from pydantic import BaseModel, Field, ConfigDict
+from pydantic import BaseModel, Field, ConfigDict, PrivateAttr
 
 
 # ══════════════════════════════════════════════════════════════════════════════
@@ -25,6 +25,7 @@ class CloudRef(BaseModel):
     uri: Optional[str] = None  # https://... (GenAI)
     expires_at: Optional[datetime] = None  # Время истечения срока жизни (GenAI)
     filename: Optional[str] = None  # Имя файла в Google Files API (GenAI)
+    last_used_at: Optional[datetime] = None  # Последняя отправка в запросе (GenAI, для вытеснения давно не нужных)
     file_object: Optional[Any] = Field(default=None, exclude=True)  # Объект File в памяти (GenAI)
     # Разрешаем любые дополнительные поля для специфичных провайдеров
     model_config = ConfigDict(extra="allow", arbitrary_types_allowed=True)
@@ -48,6 +49,19 @@ class CloudRefs(BaseModel):
 # ══════════════════════════════════════════════════════════════════════════════
 
 
+class DataRef(BaseModel):
+    """
+    Ссылка на data_base64, который остался в файле архива и не загружен в память (см. utils.umf_loader).
+    Указывает на содержимое JSON-строки без кавычек.
+    """
+
+    model_config = ConfigDict(frozen=True)
+
+    path: str
+    offset: int
+    length: int
+
+
 class Asset(BaseModel):
     """
     Универсальная модель для медиа-файлов и документов.
@@ -66,6 +80,8 @@ class Asset(BaseModel):
     ocr_text: Optional[str] = None # Для документов, распознанных OCR (для переиспользования)
     cloud_refs: Optional[CloudRefs] = None  # Ссылки на загруженные копии
 
+    _data_ref: Optional[DataRef] = PrivateAttr(default=None)  # data_base64, оставшийся в архиве (не сериализуется)
+
 
 # ══════════════════════════════════════════════════════════════════════════════
 # TOOL CALL / TOOL RESULT
@@ -85,8 +101,9 @@ class ToolResult(BaseModel):
 
     id: str  # Должен совпадать с id из ToolCall
     name: str  # Имя функции
-    text_content: str  # Текстовый результат
+    text_content: str  # Текстовый результат (может быть усечён политикой инструмента)
     is_error: bool = False
+    overflow_asset: Optional[Asset] = None  # Полный результат, если он не поместился в text_content
 
 
 # ══════════════════════════════════════════════════════════════════════════════
@@ -151,6 +168,8 @@ class UsageStats(BaseModel):
     input_tokens: int = 0
     output_tokens: int = 0
     total_tokens: int = 0
+    cache_hit_tokens: Optional[int] = None  # Токены промпта, взятые из кэша префиксов провайдера
+    cache_miss_tokens: Optional[int] = None  # Токены промпта, обработанные заново
 
 
 class MessageMetadata(BaseModel):
@@ -188,6 +207,28 @@ class Message(BaseModel):
     metadata: Optional[MessageMetadata] = None  # Только для assistant
 
 
+# ══════════════════════════════════════════════════════════════════════════════
+# SUMMARY CHECKPOINT (сводка начала чата)
+# ══════════════════════════════════════════════════════════════════════════════
+
+
+class SummaryCheckpoint(BaseModel):
+    """
+    Сжатое содержание первых сообщений чата (см. utils.summarizer).
+
+    Сообщения остаются в истории, а модели вместо них получают текст сводки и сообщения после неё.
+    Каждая следующая сводка включает в себя предыдущую.
+    """
+
+    id: str
+    timestamp: datetime  # Время создания
+    until_message_id: str  # Последнее сообщение, вошедшее в сводку
+    messages_count: int  # Сколько первых сообщений покрывает сводка
+    text: str
+    model: Optional[str] = None  # Модель, которая составила сводку
+    usage: Optional[UsageStats] = None
+
+
 # ══════════════════════════════════════════════════════════════════════════════
 # CHAT METADATA (настройки чата)
 # ══════════════════════════════════════════════════════════════════════════════
@@ -198,7 +239,8 @@ class ChatConfig(BaseModel):
 
     thinking_mode: Literal["interleaved", "preserved"] = "interleaved"
     provider: Literal["openai", "genai"] = "openai"
-    # Можно расширять: model, temperature, max_tokens и т.д.
+    model: Optional[str] = None  # Имя модели, которой ведётся чат (веб-сервис)
+    # Можно расширять: temperature, max_tokens и т.д.
 
 
 class ChatMetadata(BaseModel):
@@ -236,4 +278,8 @@ class ChatData(BaseModel):
     """
 
     chat_metadata: ChatMetadata = Field(default_factory=ChatMetadata)
+    summaries: list[SummaryCheckpoint] = Field(default_factory=list)  # Сводки по порядку, действует последняя
     messages: list[Message] = Field(default_factory=list)
+
+    # Кэш сконвертированных сообщений, общий для веток одного чата (utils.branching). Не сериализуется
+    _conversion_cache: Optional[Any] = PrivateAttr(default=None)
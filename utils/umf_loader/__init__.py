@@ -0,0 +1,12 @@
+from .umf_loader import (
+    UmfFormatError,
+    iter_messages,
+    iter_last_messages,
+    iter_message_assets,
+    load_chat,
+    load_metadata,
+    load_summaries,
+    scan_message_offsets,
+    read_data_ref,
+    resolve_data_base64,
+)
@@ -0,0 +1,405 @@
+import os
+import re
+import json
+import threading
+from collections import OrderedDict, deque
+from typing import BinaryIO, Iterator, Literal, NamedTuple
+
+from pydantic import TypeAdapter
+
+import utils.types as t
+
+"""
+Потоковая загрузка больших архивов УФС.
+
+ChatData.model_validate_json требует держать в памяти весь документ и его разобранную копию, а в истории с
+data_base64 это сотни мегабайт. Здесь документ читается кусками, и сканер по границам JSON (без разбора значений)
+находит сообщения из массива "messages". Каждое сообщение разбирается отдельно, поэтому в памяти
+одновременно находится только одно сообщение.
+
+Значения data_base64 в режиме "lazy" вырезаются ещё при чтении: в ассете остаётся только ссылка DataRef на место
+в файле (Asset._data_ref), и байты читаются из архива лишь тогда, когда они действительно нужны
+(asset_bytes, resolve_data_base64). В режиме "skip" они просто отбрасываются, в режиме "keep" загружаются как есть.
+
+Источник - путь к файлу или любой бинарный поток (файл, ответ HTTP, объект из хранилища), поэтому загрузчик
+подходит для любого хранилища истории. Ссылки DataRef возможны только для файлов на диске.
+"""
+
+DataMode = Literal["lazy", "skip", "keep"]
+
+CHUNK_SIZE = 1024 * 1024
+
+_REF_PREFIX = "@umf-ref:"  # Символа @ нет в алфавите base64, поэтому заглушка не спутается с данными
+_STRUCTURE = re.compile(rb'[{}\[\]"]')
+_STRING_END = re.compile(rb'["\\]')
+_OPEN = frozenset(b"{[")
+_CLOSE = frozenset(b"}]")
+_QUOTE = ord('"')
+_BACKSLASH = ord("\\")
+
+
+class UmfFormatError(ValueError):
+    """Документ не похож на корректную историю УФС."""
+
+
+class _Value(NamedTuple):
+    """Значение из документа, найденное сканером"""
+
+    kind: Literal["message", "metadata", "summaries"]
+    raw: bytes  # JSON значения, data_base64 заменены заглушками
+    start: int  # Смещение первого байта в источнике
+    end: int  # Смещение после последнего байта
+    refs: list[tuple[int, int]]  # (смещение, длина) вырезанных data_base64
+
+
+def _scan(stream: BinaryIO, excise: bool, base: int | None = None, in_messages: bool = False,
+          chunk_size: int = CHUNK_SIZE) -> Iterator[_Value]:
+    """
+    Находит в потоке chat_metadata, массив summaries и элементы массива messages, не разбирая их.
+    :param stream: бинарный поток, прочитанный с позиции base
+    :param excise: вырезать ли значения data_base64
+    :param base: смещение начала потока в источнике (для DataRef). По умолчанию - текущая позиция потока
+    :param in_messages: поток начинается внутри массива messages (чтение по известному смещению)
+    """
+    if base is None:
+        base = stream.tell() if stream.seekable() else 0
+    buf = bytearray()
+    i = 0
+    eof = False
+    depth = 2 if in_messages else 0
+    messages_depth = 1 if in_messages else None  # Глубина, на которой открыт массив messages
+    last_key = None  # Последняя строка на верхнем уровне документа
+    in_string = False
+    string_start = 0
+
+    capture = None  # Тип значения, которое сейчас собирается
+    capture_depth = 0
+    capture_start = 0  # Абсолютное смещение начала значения
+    part_start = 0  # Начало ещё не перенесённой в parts части значения в buf
+    parts: list[bytes] = []
+    refs: list[tuple[int, int]] = []
+    key_end = None  # Позиция сразу после ключа "data_base64" в buf
+    excising = False
+    excise_start = 0
+
+    while True:
+        if excising:
+            match = _STRING_END.search(buf, i)
+            if match is None or (buf[match.start()] == _BACKSLASH and match.start() + 1 >= len(buf)):
+                # Вырезанные данные не нужны, поэтому буфер можно очистить, оставив только незавершённое экранирование
+                keep_from = match.start() if match is not None else len(buf)
+                base += keep_from
+                del buf[:keep_from]
+                i = 0
+                if eof:
+                    raise UmfFormatError("Документ оборвался внутри строки")
+                chunk = stream.read(chunk_size)
+                eof = not chunk
+                buf += chunk
+                continue
+            j = match.start()
+            if buf[j] == _BACKSLASH:
+                i = j + 2
+                continue
+            refs.append((excise_start, base + j - excise_start))
+            parts.append(f'"{_REF_PREFIX}{len(refs) - 1}"'.encode())
+            part_start = i = j + 1
+            excising = False
+            continue
+
+        if in_string:
+            match = _STRING_END.search(buf, i)
+            if match is None or (buf[match.start()] == _BACKSLASH and match.start() + 1 >= len(buf)):
+                if eof:
+                    raise UmfFormatError("Документ оборвался внутри строки")
+                i = match.start() if match is not None else len(buf)  # Уже просмотренное не сканируем повторно
+                chunk = stream.read(chunk_size)
+                eof = not chunk
+                buf += chunk
+                continue
+            j = match.start()
+            if buf[j] == _BACKSLASH:
+                i = j + 2
+                continue
+            in_string = False
+            i = j + 1
+            if depth == 1:
+                last_key = bytes(buf[string_start + 1:j]) if j - string_start < 64 else None
+            key_end = i if capture == "message" and buf[string_start + 1:j] == b"data_base64" else None
+            continue
+
+        match = _STRUCTURE.search(buf, i)
+        if match is None:
+            if eof:
+                break
+            if capture is None:  # Вне собираемых значений прочитанное больше не нужно
+                base += len(buf)
+                buf.clear()
+            i = len(buf)
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buf += chunk
+            continue
+
+        j = match.start()
+        char = buf[j]
+        i = j + 1
+        if char == _QUOTE:
+            if excise and key_end is not None and buf[key_end:j].strip() == b":":
+                parts.append(bytes(buf[part_start:j]))
+                excising = True
+                excise_start = base + j + 1
+                i = j + 1
+            else:
+                in_string = True
+                string_start = j
+            key_end = None
+            continue
+
+        key_end = None
+        if char in _OPEN:
+            if capture is None:
+                kind = None
+                if depth == 1 and char == ord("{") and last_key == b"chat_metadata":
+                    kind = "metadata"
+                elif depth == 1 and char == ord("[") and last_key == b"summaries":
+                    kind = "summaries"
+                elif messages_depth is not None and depth == messages_depth + 1 and char == ord("{"):
+                    kind = "message"
+                if kind:
+                    capture, capture_depth, capture_start, part_start = kind, depth, base + j, j
+                elif depth == 1 and char == ord("[") and last_key == b"messages":
+                    messages_depth = depth
+            depth += 1
+        elif char in _CLOSE:
+            depth -= 1
+            if capture is not None and depth == capture_depth:
+                parts.append(bytes(buf[part_start:i]))
+                yield _Value(capture, b"".join(parts), capture_start, base + i, refs)
+                capture, parts, refs = None, [], []
+                base += i
+                del buf[:i]
+                i = 0
+            elif messages_depth is not None and depth == messages_depth:
+                messages_depth = None
+                if in_messages:  # Читали только массив сообщений
+                    return
+
+    if depth != 0 and not in_messages:
+        raise UmfFormatError("Документ оборвался до конца")
+
+
+def iter_message_assets(message: t.Message) -> Iterator[t.Asset]:
+    """Перебирает все ассеты сообщения, включая файлы и усечённые результаты инструментов"""
+    for content in message.content:
+        if content.type == "media":
+            yield from content.assets
+        elif content.type == "tool_result":
+            yield from content.assets or []
+            if content.tool_result.overflow_asset:
+                yield content.tool_result.overflow_asset
+
+
+def _build_message(value: _Value, data_mode: DataMode, path: str | None) -> t.Message:
+    message = t.Message.model_validate_json(value.raw)
+    if value.refs:
+        for asset in iter_message_assets(message):
+            if asset.data_base64 and asset.data_base64.startswith(_REF_PREFIX):
+                offset, length = value.refs[int(asset.data_base64[len(_REF_PREFIX):])]
+                asset.data_base64 = None
+                if data_mode == "lazy":
+                    asset._data_ref = t.DataRef(path=path, offset=offset, length=length)
+    return message
+
+
+def _source_path(source) -> str | None:
+    """Путь к файлу источника, если он есть (нужен для DataRef)"""
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.abspath(source)
+    name = getattr(source, "name", None)
+    if isinstance(name, str) and os.path.isfile(name):
+        return os.path.abspath(name)
+    return None
+
+
+class _Source:
+    """Открывает путь или использует переданный поток, не закрывая его"""
+
+    def __init__(self, source):
+        self.source = source
+        self._file = None
+
+    def __enter__(self) -> BinaryIO:
+        if isinstance(self.source, (str, os.PathLike)):
+            self._file = open(self.source, "rb")
+            return self._file
+        return self.source
+
+    def __exit__(self, *exc):
+        if self._file:
+            self._file.close()
+
+
+def _check_data_mode(data_mode: DataMode, path: str | None) -> None:
+    if data_mode == "lazy" and path is None:
+        raise ValueError('Режим "lazy" требует файла на диске, для потоков используйте "skip" или "keep"')
+
+
+def iter_messages(source, data_mode: DataMode = "lazy", chunk_size: int = CHUNK_SIZE) -> Iterator[t.Message]:
+    """
+    Читает сообщения по одному, не загружая весь документ
+    :param source: путь к файлу УФС или бинарный поток
+    :param data_mode: что делать с data_base64: "lazy" - оставить ссылку на файл, "skip" - отбросить, "keep" - загрузить
+    :param chunk_size: размер читаемых кусков
+    """
+    path = _source_path(source)
+    _check_data_mode(data_mode, path)
+    with _Source(source) as stream:
+        for value in _scan(stream, excise=data_mode != "keep", chunk_size=chunk_size):
+            if value.kind == "message":
+                yield _build_message(value, data_mode, path)
+
+
+def load_metadata(source) -> t.ChatMetadata:
+    """Читает chat_metadata, пропуская сообщения без разбора"""
+    with _Source(source) as stream:
+        for value in _scan(stream, excise=True):
+            if value.kind == "metadata":
+                return t.ChatMetadata.model_validate_json(value.raw)
+    return t.ChatMetadata()
+
+
+_summaries_adapter = TypeAdapter(list[t.SummaryCheckpoint])
+
+
+def load_summaries(source) -> list[t.SummaryCheckpoint]:
+    """
+    Читает сводки чата (см. utils.summarizer). Сводки записываются перед сообщениями,
+    поэтому чтение заканчивается на первом сообщении
+    """
+    with _Source(source) as stream:
+        for value in _scan(stream, excise=True):
+            if value.kind == "summaries":
+                return _summaries_adapter.validate_json(value.raw)
+            if value.kind == "message":
+                break
+    return []
+
+
+class _OffsetsCache:
+    """Смещения сообщений в файлах, чтобы не сканировать неизменившийся архив повторно"""
+
+    def __init__(self, max_files: int = 128):
+        self.max_files = max_files
+        self._cache: OrderedDict[tuple, list[tuple[int, int]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> list[tuple[int, int]]:
+        stat = os.stat(path)
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            offsets = self._cache.get(key)
+            if offsets is not None:
+                self._cache.move_to_end(key)
+                return offsets
+        with open(path, "rb") as f:
+            offsets = [
+                (value.start, value.end) for value in _scan(f, excise=True) if value.kind == "message"
+            ]
+        with self._lock:
+            self._cache[key] = offsets
+            while len(self._cache) > self.max_files:
+                self._cache.popitem(last=False)
+        return offsets
+
+
+_offsets_cache = _OffsetsCache()
+
+
+def scan_message_offsets(path: str | os.PathLike) -> list[tuple[int, int]]:
+    """
+    Возвращает смещения (начало, конец) всех сообщений в файле.
+    Результат кэшируется, пока у файла не изменились размер и mtime
+    """
+    return _offsets_cache.get(os.path.abspath(path))
+
+
+def iter_last_messages(source, n: int, data_mode: DataMode = "lazy") -> Iterator[t.Message]:
+    """
+    Читает только последние n сообщений. Для файлов разбираются только нужные сообщения по известным смещениям,
+    поток приходится просканировать целиком, но разбираются всё равно только последние n
+    """
+    if n <= 0:
+        return
+    path = _source_path(source)
+    _check_data_mode(data_mode, path)
+    excise = data_mode != "keep"
+
+    if isinstance(source, (str, os.PathLike)):
+        offsets = scan_message_offsets(path)[-n:]
+        with open(path, "rb") as f:
+            for start, _ in offsets:
+                f.seek(start)
+                value = next(_scan(f, excise=excise, base=start, in_messages=True))
+                yield _build_message(value, data_mode, path)
+        return
+
+    last_values = deque(maxlen=n)
+    for value in _scan(source, excise=excise):
+        if value.kind == "message":
+            last_values.append(value)
+    for value in last_values:
+        yield _build_message(value, data_mode, path)
+
+
+def load_chat(source, last: int | None = None, data_mode: DataMode = "lazy") -> t.ChatData:
+    """
+    Загружает историю целиком или только последние сообщения
+    :param source: путь к файлу УФС или бинарный поток
+    :param last: сколько последних сообщений загрузить (None - все)
+    :param data_mode: см. iter_messages
+    """
+    if last is None:
+        path = _source_path(source)
+        _check_data_mode(data_mode, path)
+        metadata = t.ChatMetadata()
+        summaries = []
+        messages = []
+        with _Source(source) as stream:
+            for value in _scan(stream, excise=data_mode != "keep"):
+                if value.kind == "metadata":
+                    metadata = t.ChatMetadata.model_validate_json(value.raw)
+                elif value.kind == "summaries":
+                    summaries = _summaries_adapter.validate_json(value.raw)
+                else:
+                    messages.append(_build_message(value, data_mode, path))
+        return t.ChatData(chat_metadata=metadata, summaries=summaries, messages=messages)
+
+    if not isinstance(source, (str, os.PathLike)):
+        raise ValueError("Чтение последних сообщений из потока возможно только через iter_last_messages")
+    return t.ChatData(
+        chat_metadata=load_metadata(source),
+        summaries=load_summaries(source),
+        messages=list(iter_last_messages(source, last, data_mode)),
+    )
+
+
+def read_data_ref(data_ref: t.DataRef) -> str:
+    """Читает из архива строку data_base64, на которую указывает ссылка"""
+    with open(data_ref.path, "rb") as f:
+        f.seek(data_ref.offset)
+        data = f.read(data_ref.length)
+    if b"\\" in data:  # Сериализатор мог экранировать символы (например, \/)
+        return json.loads(b'"' + data + b'"')
+    return data.decode("ascii")
+
+
+def resolve_data_base64(asset: t.Asset) -> str | None:
+    """
+    Возвращает data_base64 ассета, при необходимости дочитывая его из архива.
+    Перед сохранением лениво загруженной истории ссылки нужно разрешить, иначе данные не попадут в документ
+    """
+    if asset.data_base64 is None and asset._data_ref is not None:
+        asset.data_base64 = read_data_ref(asset._data_ref)
+        asset._data_ref = None
+    return asset.data_base64
@@ -0,0 +1,4 @@
+from .web_api_wrapper import ChatService, HttpError, create_app
+from .session_store import SessionStore, InMemorySessionStore
+
+__all__ = ['ChatService', 'HttpError', 'create_app', 'SessionStore', 'InMemorySessionStore']
@@ -0,0 +1,50 @@
+import asyncio
+from abc import ABC, abstractmethod
+
+import utils.types as t
+
+
+class SessionStore(ABC):
+    """
+    Хранилище чатов для веб-сервиса. Все методы асинхронные, чтобы реализации
+    поверх БД или Redis не блокировали event loop.
+    """
+
+    @abstractmethod
+    async def get(self, chat_id: str) -> t.ChatData | None:
+        pass
+
+    @abstractmethod
+    async def save(self, chat_id: str, chat: t.ChatData) -> None:
+        pass
+
+    @abstractmethod
+    async def delete(self, chat_id: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def list_ids(self) -> list[str]:
+        """Id всех чатов (нужен для обслуживания, например сборки мусора медиафайлов)"""
+        pass
+
+
+class InMemorySessionStore(SessionStore):
+    """Хранит чаты в памяти процесса. Подходит для одного воркера и для отладки."""
+
+    def __init__(self):
+        self._chats: dict[str, t.ChatData] = {}
+        self._lock = asyncio.Lock()
+
+    async def get(self, chat_id: str) -> t.ChatData | None:
+        return self._chats.get(chat_id)
+
+    async def save(self, chat_id: str, chat: t.ChatData) -> None:
+        async with self._lock:
+            self._chats[chat_id] = chat
+
+    async def delete(self, chat_id: str) -> bool:
+        async with self._lock:
+            return self._chats.pop(chat_id, None) is not None
+
+    async def list_ids(self) -> list[str]:
+        return list(self._chats)
@@ -1,2 +1,503 @@
 # Web API Wrapper
-# TODO: Реализовать обёртку для веб-интерфейсов нейросетей (aistudio.google.com, deepseek.com и др.)
+import re
+import json
+import base64
+import asyncio
+import logging
+import binascii
+import weakref
+from datetime import datetime
+from typing import Callable, Awaitable
+from urllib.parse import parse_qs
+
+import filetype
+
+import utils.types as t
+from config import settings
+from models import BaseModel
+from utils.small_utils import message_helper, generate_timestamp
+from utils.media import MediaGarbageCollector, SweepReport
+from utils.scheduler import ReactScheduler, SchedulerOverloaded, default_tools_definition
+from utils.search import ChatSearchIndex
+from utils.summarizer import HistorySummarizer
+from utils.tool_runner import save_media_asset
+from .session_store import SessionStore, InMemorySessionStore
+
+"""
+HTTP-сервис чатов поверх асинхронного пути моделей (agenerate). Это чистое ASGI-приложение без зависимостей,
+запускается любым ASGI-сервером, например:
+
+    uvicorn "web_api_wrapper:create_app" --factory
+
+Эндпоинты:
+    POST   /chats                  {"model": "..."} -> {"chat_id": "...", "model": "..."}
+    GET    /chats/{chat_id}        история в УФС
+    DELETE /chats/{chat_id}
+    POST   /chats/{chat_id}/messages
+           {"text": "...", "assets": [{"data_base64": "...", "mime_type": "image/png"}]}
+           -> text/event-stream: event "message" на каждое новое сообщение ассистента и инструментов
+              (Message в УФС), затем "done" или "error"
+    GET    /search?q=...           поиск по чатам (если передан search_index), необязательные фильтры:
+           chat_id, role, kind (можно повторять), model, since, until (ISO 8601), limit
+           -> {"hits": [{"chat_id", "message_id", "kind", "role", "model", "name", "timestamp", "snippet"}]}
+    GET    /health                 загрузка сервиса
+
+Циклы ReAct выполняет ReactScheduler (utils.scheduler): одновременно идёт не больше max_concurrent_generations
+шагов генерации, чаты чередуются по кругу, поэтому длинные цепочки вызовов не блокируют остальные чаты.
+Если в очереди уже max_waiting шагов, новые сообщения сразу получают 503 (Retry-After), а не копятся в памяти.
+В одном чате одновременно обрабатывается только одно сообщение (иначе 409); пока оно обрабатывается,
+чат нельзя и удалить (тоже 409).
+
+Если передан media_gc, сервис раз в media_gc_interval секунд удаляет медиафайлы и загрузки Gemini, на которые
+не ссылается ни один чат хранилища (SessionStore.list_ids), и заранее обновляет истекающие загрузки активных чатов
+(utils.media.media_gc).
+
+Если передан summarizer, после ответа длинные чаты в фоне сжимаются в сводку (utils.summarizer),
+и модели получают сводку и последние сообщения вместо всей истории.
+
+Если передан search_index, новые сообщения передаются в поисковый индекс (utils.search) сразу после сохранения.
+Индекс пишет их в фоновом потоке, поэтому ответ модели не ждёт индексации. Сообщение пользователя индексируется
+после хода: текст его документов (Asset.ocr_text) модель извлекает только при отправке.
+
+Системный промпт задаётся моделью: экземпляры моделей общие для всех чатов,
+поэтому system-сообщения от клиента не принимаются.
+"""
+
+CHAT_ID_LEN = 16
+
+logger = logging.getLogger("ai_chat.web")
+
+_chat_path = re.compile(r"^/chats/(?P<chat_id>[A-Za-z0-9]+)$")
+_messages_path = re.compile(r"^/chats/(?P<chat_id>[A-Za-z0-9]+)/messages$")
+
+
+class HttpError(Exception):
+    """Ошибка, которая возвращается клиенту с указанным статусом."""
+
+    def __init__(self, status: int, message: str, headers: list[tuple[bytes, bytes]] | None = None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or []
+
+
+class ChatService:
+    """ASGI-приложение сервиса чатов."""
+
+    def __init__(
+            self,
+            models: dict[str, BaseModel],
+            default_model: str | None = None,
+            store: SessionStore | None = None,
+            max_concurrent_generations: int = 64,
+            max_waiting: int = 1024,
+            max_steps: int = 10,
+            tools_k: int = 10,
+            max_body_bytes: int = 64 * 1024 * 1024,
+            scheduler: ReactScheduler | None = None,
+            media_gc: MediaGarbageCollector | None = None,
+            media_gc_interval: float = 3600,
+            summarizer: HistorySummarizer | None = None,
+            search_index: ChatSearchIndex | None = None,
+            max_search_results: int = 100,
+    ):
+        """
+        :param models: доступные модели по именам, которые клиент передаёт при создании чата
+        :param default_model: модель по умолчанию (по умолчанию - первая из models)
+        :param store: хранилище чатов (по умолчанию - в памяти процесса)
+        :param max_concurrent_generations: сколько шагов генерации выполняется одновременно
+        :param max_waiting: сколько запросов может ждать свободного слота, остальные получают 503
+        :param max_steps: максимум шагов ReAct на одно сообщение пользователя
+        :param tools_k: сколько инструментов отдавать модели на шаге (см. ToolsParser.select_tools)
+        :param max_body_bytes: максимальный размер тела запроса (вместе с ассетами в base64)
+        :param scheduler: общий планировщик ReAct (например, вместе с фоновыми batch-задачами).
+            Если передан, max_concurrent_generations, max_waiting, max_steps и tools_k берутся из него
+        :param media_gc: сборщик мусора медиафайлов; без него файлы не удаляются
+        :param media_gc_interval: период сборки мусора в секундах
+        :param summarizer: составитель сводок длинных чатов; без него модели получают всю историю
+        :param search_index: поисковый индекс чатов; без него /search недоступен
+        :param max_search_results: максимум результатов одного поиска
+        """
+        if not models:
+            raise ValueError("Нужна хотя бы одна модель")
+        self.models = models
+        self.default_model = default_model or next(iter(models))
+        self.store = store or InMemorySessionStore()
+        self.max_body_bytes = max_body_bytes
+        self.scheduler = scheduler or ReactScheduler(
+            max_workers=max_concurrent_generations,
+            max_steps=max_steps,
+            max_waiting=max_waiting,
+            tools_definition=lambda model, history: default_tools_definition(model, history, k=tools_k),
+        )
+
+        self.media_gc = media_gc
+        self.media_gc_interval = media_gc_interval
+        self.summarizer = summarizer
+        self.search_index = search_index
+        self.max_search_results = max_search_results
+
+        self._chat_locks: weakref.WeakValueDictionary[str, asyncio.Lock] = weakref.WeakValueDictionary()
+        self._gc_task: asyncio.Task | None = None
+
+    # --- ASGI ---
+
+    async def __call__(self, scope: dict, receive: Callable[[], Awaitable[dict]], send: Callable[[dict], Awaitable[None]]):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+        response = _Response(send)
+        try:
+            await self._route(scope, receive, response.send)
+        except HttpError as e:
+            await self._send_json(send, e.status, {"error": e.message}, e.headers)
+        except Exception:
+            logger.exception("Ошибка обработки запроса %s %s", scope["method"], scope["path"])
+            # Если ответ уже начат (поток событий), статус не поменять - остаётся только закрыть соединение
+            if not response.started:
+                await self._send_json(send, 500, {"error": "Internal server error"})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                if self.media_gc is not None:
+                    self._gc_task = asyncio.create_task(self._collect_garbage_periodically())
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self._gc_task is not None:
+                    self._gc_task.cancel()
+                    self._gc_task = None
+                if self.search_index is not None:
+                    await asyncio.to_thread(self.search_index.flush)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    # --- Сборка мусора ---
+
+    async def collect_garbage(self, dry_run: bool = False) -> SweepReport:
+        """Один проход сборщика мусора по всем чатам хранилища. Обновлённые чаты сохраняются"""
+        chats = {}
+        for chat_id in await self.store.list_ids():
+            chat = await self.store.get(chat_id)
+            if chat is not None:
+                chats[chat_id] = chat
+        genai_model = next((model for model in self.models.values() if model.provider == "genai"), None)
+        report = await asyncio.to_thread(self.media_gc.sweep, list(chats.values()), genai_model, dry_run)
+        refreshed = {id(chat) for chat in report.refreshed_chats}
+        for chat_id, chat in chats.items():
+            if id(chat) in refreshed:
+                await self.store.save(chat_id, chat)
+        return report
+
+    async def _collect_garbage_periodically(self):
+        while True:
+            await asyncio.sleep(self.media_gc_interval)
+            try:
+                await self.collect_garbage()
+            except Exception as e:  # Сбой сборки мусора не должен останавливать её следующие проходы
+                logger.error("Сборка мусора медиафайлов завершилась ошибкой: %s", e)
+
+    async def _route(self, scope, receive, send):
+        method, path = scope["method"], scope["path"].rstrip("/") or "/"
+
+        if path == "/health":
+            self._check_method(method, "GET")
+            await self._send_json(send, 200, {
+                "active": self.scheduler.active, "waiting": self.scheduler.waiting,
+                "max_waiting": self.scheduler.max_waiting,
+            })
+        elif path == "/search":
+            self._check_method(method, "GET")
+            await self._search(scope.get("query_string", b""), send)
+        elif path == "/chats":
+            self._check_method(method, "POST")
+            await self._create_chat(await self._read_json(receive), send)
+        elif match := _messages_path.match(path):
+            self._check_method(method, "POST")
+            await self._post_message(match["chat_id"], await self._read_json(receive), send)
+        elif match := _chat_path.match(path):
+            self._check_method(method, "GET", "DELETE")
+            if method == "GET":
+                chat = await self._get_chat(match["chat_id"])
+                await self._send_body(send, 200, chat.model_dump_json().encode("utf-8"), b"application/json")
+            else:
+                await self._delete_chat(match["chat_id"], send)
+        else:
+            raise HttpError(404, "Not found")
+
+    @staticmethod
+    def _check_method(method: str, *allowed: str) -> None:
+        if method not in allowed:
+            raise HttpError(405, "Method not allowed", [(b"allow", ", ".join(allowed).encode())])
+
+    async def _read_json(self, receive) -> dict:
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                raise HttpError(400, "Client disconnected")
+            body.extend(message.get("body", b""))
+            if len(body) > self.max_body_bytes:
+                raise HttpError(413, "Request body is too large")
+            if not message.get("more_body", False):
+                break
+        if not body:
+            return {}
+        try:
+            data = json.loads(body)
+        except ValueError:
+            raise HttpError(400, "Body must be valid JSON") from None
+        if not isinstance(data, dict):
+            raise HttpError(400, "Body must be a JSON object")
+        return data
+
+    @staticmethod
+    async def _send_body(send, status: int, body: bytes, content_type: bytes | None = None,
+                         headers: list[tuple[bytes, bytes]] | None = None):
+        response_headers = list(headers or [])
+        if content_type:
+            response_headers.append((b"content-type", content_type))
+        response_headers.append((b"content-length", str(len(body)).encode()))
+        await send({"type": "http.response.start", "status": status, "headers": response_headers})
+        await send({"type": "http.response.body", "body": body})
+
+    @classmethod
+    async def _send_json(cls, send, status: int, data: dict, headers: list[tuple[bytes, bytes]] | None = None):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        await cls._send_body(send, status, body, b"application/json", headers)
+
+    # --- Чаты ---
+
+    async def _get_chat(self, chat_id: str) -> t.ChatData:
+        chat = await self.store.get(chat_id)
+        if chat is None:
+            raise HttpError(404, "Chat not found")
+        return chat
+
+    def _get_model(self, chat: t.ChatData) -> BaseModel:
+        model = self.models.get(chat.chat_metadata.config.model or self.default_model)
+        if model is None:
+            raise HttpError(409, f"Model {chat.chat_metadata.config.model} is no longer available")
+        return model
+
+    async def _create_chat(self, data: dict, send):
+        model_name = data.get("model") or self.default_model
+        model = self.models.get(model_name)
+        if model is None:
+            raise HttpError(400, f"Unknown model {model_name}. Available: {', '.join(self.models)}")
+
+        chat_id = message_helper.generate_id(CHAT_ID_LEN)
+        chat = t.ChatData(
+            chat_metadata=t.ChatMetadata(config=t.ChatConfig(provider=model.provider, model=model_name)),
+            messages=[],
+        )
+        await self.store.save(chat_id, chat)
+        await self._send_json(send, 201, {"chat_id": chat_id, "model": model_name})
+
+    async def _delete_chat(self, chat_id: str, send):
+        # Под блокировкой чата: иначе идущий ход сохранил бы удалённый чат обратно
+        lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+        if lock.locked():
+            raise HttpError(409, "A message in this chat is still being processed")
+        async with lock:
+            if not await self.store.delete(chat_id):
+                raise HttpError(404, "Chat not found")
+            if self.search_index is not None:
+                self.search_index.delete_chat(chat_id)
+        await self._send_body(send, 204, b"")
+
+    @staticmethod
+    def _decode_asset(item: dict) -> t.Asset:
+        """Сохраняет загруженный клиентом файл в MEDIA_FOLDER"""
+        try:
+            media_bytes = base64.b64decode(item["data_base64"], validate=True)
+        except (KeyError, TypeError, binascii.Error):
+            raise HttpError(400, "Each asset must have a valid data_base64 field") from None
+        mime_type = item.get("mime_type")
+        if not isinstance(mime_type, (str, type(None))):
+            raise HttpError(400, "mime_type must be a string")
+        if not mime_type:
+            kind = filetype.guess(media_bytes)
+            mime_type = kind.mime if kind else "application/octet-stream"
+        return save_media_asset(media_bytes, mime_type)
+
+    async def _build_user_message(self, data: dict) -> t.Message:
+        text = data.get("text")
+        assets_data = data.get("assets") or []
+        if text is not None and not isinstance(text, str):
+            raise HttpError(400, "text must be a string")
+        if not isinstance(assets_data, list) or not all(isinstance(item, dict) for item in assets_data):
+            raise HttpError(400, "assets must be a list of objects")
+        if not text and not assets_data:
+            raise HttpError(400, "Message must contain text or assets")
+
+        content = []
+        if text:
+            content.append(t.TextContent(text=text))
+        if assets_data:
+            assets = await asyncio.gather(*(asyncio.to_thread(self._decode_asset, item) for item in assets_data))
+            content.append(t.MediaContent(assets=list(assets)))
+        return t.Message(
+            id=message_helper.generate_id(settings.MESSAGE_ID_LEN),
+            timestamp=generate_timestamp(),
+            role="user",
+            content=content,
+        )
+
+    async def _post_message(self, chat_id: str, data: dict, send):
+        # Отказываем до открытия потока, пока ещё можно вернуть нормальный статус
+        if self.scheduler.is_overloaded():
+            raise HttpError(503, "Service is overloaded, try again later", [(b"retry-after", b"1")])
+
+        lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+        if lock.locked():
+            raise HttpError(409, "Previous message in this chat is still being processed")
+
+        async with lock:
+            chat = await self._get_chat(chat_id)
+            model = self._get_model(chat)
+            user_message = await self._build_user_message(data)
+            chat.messages.append(user_message)
+            await self.store.save(chat_id, chat)
+
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/event-stream; charset=utf-8"),
+                    (b"cache-control", b"no-cache"),
+                    (b"x-accel-buffering", b"no"),
+                ],
+            })
+            stream = _EventStream(send)
+
+            async def on_step(delta: list[t.Message]) -> bool:
+                await self.store.save(chat_id, chat)
+                self._index(chat_id, chat, delta)
+                for message in delta:
+                    await stream.event("message", message.model_dump_json())
+                return stream.connected
+
+            try:
+                result = await self.scheduler.run_turn(chat_id, model, chat, lane="interactive", on_step=on_step)
+            except SchedulerOverloaded:
+                await stream.event("error", json.dumps({"error": "Service is overloaded, try again later"}))
+            except Exception as e:
+                await stream.event("error", json.dumps({"error": str(e)}, ensure_ascii=False))
+            else:
+                await stream.event("done", json.dumps({"chat_id": chat_id, "steps": result.steps}))
+                if self.summarizer is not None:
+                    self.summarizer.schedule(
+                        chat_id, chat, on_checkpoint=lambda checkpoint: self._save_checkpoint(chat_id, checkpoint)
+                    )
+            # Индекс пропускает уже проиндексированные сообщения, поэтому сообщение пользователя попадает в него
+            # один раз - после хода, когда у документов уже есть ocr_text
+            self._index(chat_id, chat, [user_message])
+            await stream.close()
+
+    async def _save_checkpoint(self, chat_id: str, checkpoint: t.SummaryCheckpoint) -> None:
+        """Добавляет готовую сводку в актуальную версию чата: пока она составлялась, чат мог измениться или удалиться"""
+        async with self._chat_locks.setdefault(chat_id, asyncio.Lock()):
+            chat = await self.store.get(chat_id)
+            if chat is not None and self.summarizer.apply_checkpoint(chat, checkpoint):
+                await self.store.save(chat_id, chat)
+
+    # --- Поиск ---
+
+    def _index(self, chat_id: str, chat: t.ChatData, messages: list[t.Message]) -> None:
+        if self.search_index is not None:
+            self.search_index.submit(chat_id, messages, model=chat.chat_metadata.config.model)
+
+    @staticmethod
+    def _parse_time(params: dict[str, list[str]], name: str) -> datetime | None:
+        if name not in params:
+            return None
+        try:
+            return datetime.fromisoformat(params[name][-1])
+        except ValueError:
+            raise HttpError(400, f"{name} must be an ISO 8601 timestamp") from None
+
+    async def _search(self, query_string: bytes, send):
+        if self.search_index is None:
+            raise HttpError(404, "Search is not enabled")
+        params = parse_qs(query_string.decode("utf-8", errors="replace"))
+        query = (params.get("q") or [""])[-1].strip()
+        if not query:
+            raise HttpError(400, "q must not be empty")
+        try:
+            limit = min(int((params.get("limit") or [20])[-1]), self.max_search_results)
+        except ValueError:
+            raise HttpError(400, "limit must be an integer") from None
+        hits = await asyncio.to_thread(
+            self.search_index.search, query,
+            chat_ids=params.get("chat_id"), roles=params.get("role"), kinds=params.get("kind"),
+            model=(params.get("model") or [None])[-1],
+            since=self._parse_time(params, "since"), until=self._parse_time(params, "until"),
+            limit=max(limit, 1),
+        )
+        await self._send_json(send, 200, {"hits": [
+            {"chat_id": hit.chat_id, "message_id": hit.message_id, "kind": hit.kind, "role": hit.role,
+             "model": hit.model, "name": hit.name, "timestamp": hit.timestamp.isoformat(), "snippet": hit.snippet}
+            for hit in hits
+        ]})
+
+
+class _Response:
+    """Обёртка send, которая запоминает, начат ли уже ответ"""
+
+    def __init__(self, send):
+        self._send = send
+        self.started = False
+
+    async def send(self, message: dict) -> None:
+        if message["type"] == "http.response.start":
+            self.started = True
+        await self._send(message)
+
+
+class _EventStream:
+    """Поток Server-Sent Events. После отключения клиента отправка молча прекращается"""
+
+    def __init__(self, send):
+        self._send = send
+        self.connected = True
+
+    async def event(self, name: str, data: str) -> None:
+        if not self.connected:
+            return
+        payload = f"event: {name}\ndata: {data}\n\n".encode("utf-8")
+        try:
+            await self._send({"type": "http.response.body", "body": payload, "more_body": True})
+        except OSError:
+            self.connected = False
+
+    async def close(self) -> None:
+        if not self.connected:
+            return
+        try:
+            await self._send({"type": "http.response.body", "body": b"", "more_body": False})
+        except OSError:
+            pass
+        self.connected = False
+
+
+def create_app(models: dict[str, BaseModel] | None = None, **kwargs) -> ChatService:
+    """
+    Создаёт приложение. Без аргументов поднимает все модели из пакета models с настройками по умолчанию
+    :param models: модели по именам
+    :param kwargs: параметры ChatService (лимиты, хранилище)
+    """
+    if models is None:
+        from models.genai.gemini import Gemini3_1FlashLite
+        from models.openai.deepseek import DeepseekChat, DeepseekReasoner
+        from models.openai.kimi import KimiK2p6
+        models = {
+            "deepseek-chat": DeepseekChat(),
+            "deepseek-reasoner": DeepseekReasoner(),
+            "gemini-3.1-flash-lite": Gemini3_1FlashLite(),
+            "kimi-k2.6": KimiK2p6(),
+        }
+    return ChatService(models, **kwargs)